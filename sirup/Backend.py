@@ -0,0 +1,234 @@
+"Interface shared by all tunnel backends"
+
+import logging
+import random
+import time
+import requests
+
+
+STATES = ("down", "starting", "up", "failed")
+
+
+class Backend():
+    """Base class for a tunnel to a single server.
+
+    A backend implements five operations: `start` launches the tunnel, `wait_ready` blocks until it carries traffic,
+    `stop` tears it down, `state` reports one of `STATES`, and `exit_ip` returns the IP address visible from the
+    internet. `connect` and `disconnect` combine them in the way `sirup.IPRotator.IPRotator` uses a backend, and record
+    the time of each phase in `phase_times`.
+
+    Subclasses set `requires_root` to `False` if they never call `sudo`, and may set `clock` to any object with
+    `time()` and `sleep(seconds)` methods; the default is the `time` module. Backends with a management interface,
+    such as `sirup.VPNConnector.VPNConnector`, override `open_management`; the others return `None` from it.
+
+    A tunnel can be verified in two ways after `wait_ready`: with `verify_routes`, `check_routes` reads the kernel's
+    routing table and interfaces, which costs no network round trip; with `track_ip`, `exit_ip` asks an external
+    service. When both are enabled, `ip_check_rate` makes the external check a random sample.
+
+    Args:
+        config_file (str): Full path and file name of the configuration file of the server.
+        track_ip (bool, optional): If True, `exit_ip` is queried after each `connect` and `disconnect`.
+        verify_routes (bool, optional): If True, `connect` checks with `check_routes` that traffic goes through the tunnel.
+        ip_check_rate (float, optional): Share of the IP address checks that are carried out when `track_ip` is True.
+            Skipped checks leave `current_ip` at `None`.
+
+    Attributes:
+        config_file (str): Full path and file name of the configuration file of the server.
+        current_ip (None or str): If `track_ip` is `True`, the IP address of the machine that is currently visible,
+            or `None` if the latest check was skipped.
+        base_ip (None or str): If `track_ip` is `True`, the IP address when no tunnel is active.
+        phase_times (dict): Times at which the latest `connect` reached each phase: `start`, `vpn_started`
+            (`start` returned), `tunnel_up` (`wait_ready` returned) and `verified` (the IP address was checked).
+        traffic_summary (None or dict): Summary of the traffic through the latest tunnel, if the backend records it.
+    """
+
+    requires_root = True
+    connect_timeout = 30
+    clock = time
+
+    def __init__(self, config_file, track_ip=True, verify_routes=False, ip_check_rate=1.0):
+        self.config_file = config_file
+        self.track_ip = track_ip
+        self.verify_routes = verify_routes
+        self.ip_check_rate = ip_check_rate
+        self.current_ip = None
+        self.base_ip = None
+        self.phase_times = {}
+        self.traffic_summary = None
+        if self._check_ip():
+            ip = self.exit_ip()
+            self.current_ip = ip
+            self.base_ip = ip
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.config_file!r}, track_ip={self.track_ip!r})"
+
+
+    def start(self, pwd):
+        """Launch the tunnel, without waiting until it is ready.
+
+        Args:
+            pwd (str): User root password.
+
+        Raises:
+            RuntimeError: or a subclass, when the tunnel cannot be launched.
+        """
+        raise NotImplementedError
+
+
+    def wait_ready(self, pwd, timeout):
+        """Block until the tunnel carries traffic.
+
+        Args:
+            pwd (str): User root password.
+            timeout (float): Maximum number of seconds to wait.
+
+        Raises:
+            TimeoutError: when the tunnel is not ready within `timeout` seconds.
+        """
+        raise NotImplementedError
+
+
+    def stop(self, pwd):
+        """Tear the tunnel down. Does nothing if no tunnel is active.
+
+        Args:
+            pwd (str): User root password.
+        """
+        raise NotImplementedError
+
+
+    def state(self):
+        """Report the state of the tunnel.
+
+        Returns:
+            str: one of `STATES`.
+        """
+        raise NotImplementedError
+
+
+    def exit_ip(self):
+        """Query the IP address that is visible from the internet.
+
+        Returns:
+            str: the IP address.
+
+        Raises:
+            requests.ConnectionError: when the IP address cannot be retrieved.
+        """
+        raise NotImplementedError
+
+
+    def check_routes(self):
+        """Check from the state of the kernel that traffic goes through the tunnel.
+
+        Returns:
+            None or str: `None` if the tunnel is in use, otherwise the reason why not.
+        """
+        raise NotImplementedError
+
+
+    def nameservers(self, pwd): # pylint: disable=unused-argument
+        """The DNS servers of the tunnel, as pushed by the server or set in the configuration file.
+
+        Args:
+            pwd (str): User root password.
+
+        Returns:
+            list: IP addresses; empty if the tunnel has none.
+        """
+        return []
+
+
+    def _check_ip(self):
+        "Decide whether to query the exit IP address this time."
+        if not self.track_ip:
+            return False
+        return self.ip_check_rate >= 1 or random.random() < self.ip_check_rate
+
+
+    def is_connected(self):
+        """Indicates whether a tunnel is active.
+
+        Returns:
+            bool: True if the tunnel is up.
+        """
+        return self.state() == "up"
+
+
+    def is_alive(self):
+        """Indicates whether the tunnel still exists, whether or not it is ready.
+
+        Returns:
+            bool: True if the tunnel is starting or up.
+        """
+        return self.state() in ("starting", "up")
+
+
+    def open_management(self):
+        """Open the management interface of the tunnel, if the backend has one.
+
+        Returns:
+            None or sirup.ManagementInterface.ManagementInterface: the client of the interface, or `None` for backends
+              without a management interface.
+        """
+        return None
+
+
+    def connect(self, pwd, timeout=None):
+        """Start the tunnel, wait until it is ready and, if `self.track_ip` is True, check the exit IP address.
+
+        Args:
+            pwd (str): User root password.
+            timeout (float, optional): Maximum number of seconds to wait until the tunnel is ready. Defaults to
+                `self.connect_timeout`.
+
+        Raises:
+            TimeoutError: when the tunnel is not ready within `timeout` seconds.
+            requests.ConnectionError: when the exit IP address cannot be retrieved, or when `self.verify_routes` is True
+                and traffic does not go through the tunnel.
+        """
+        if timeout is None:
+            timeout = self.connect_timeout
+        self.phase_times = {"start": self.clock.time()}
+        self.start(pwd)
+        self.phase_times["vpn_started"] = self.clock.time()
+        self.wait_ready(pwd, timeout)
+        self.phase_times["tunnel_up"] = self.clock.time()
+        logging.info("Connected with %s.", self.config_file)
+        self._verify()
+
+
+    def _verify(self):
+        "Check the routes and the exit IP address of a tunnel that is ready, as configured."
+        if self.verify_routes:
+            reason = self.check_routes()
+            if reason is not None:
+                raise requests.ConnectionError(f"The tunnel to {self.config_file} is not in use: {reason}")
+        if self._check_ip():
+            try:
+                self.current_ip = self.exit_ip()
+            except requests.ConnectionError as exc:
+                raise requests.ConnectionError("Cannot get IP address") from exc
+        else:
+            self.current_ip = None
+        if self.verify_routes or self.current_ip is not None:
+            self.phase_times["verified"] = self.clock.time()
+
+
+    def disconnect(self, pwd):
+        """Stop the tunnel. If `self.track_ip` is True, also get back the base IP.
+
+        Args:
+            pwd (str): User root password.
+
+        Raises:
+            RuntimeWarning: when the IP address after disconnecting differs from `self.base_ip`.
+        """
+        self.stop(pwd)
+        self.current_ip = None
+        if self._check_ip():
+            self.current_ip = self.exit_ip()
+            if self.base_ip is not None and self.current_ip != self.base_ip:
+                raise RuntimeWarning("Expected to go back to base IP address, but did not")
@@ -0,0 +1,262 @@
+"Watch a directory of configuration files with inotify"
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+
+def _load_libc():
+    "Load the C library, or raise `OSError` if it does not provide inotify, as on macOS and Windows."
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError(errno.ENOSYS, f"inotify is not available on {sys.platform}")
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def parse_events(buffer):
+    """Split the bytes read from an inotify file descriptor into events.
+
+    Args:
+        buffer (bytes): data read from the file descriptor.
+
+    Returns:
+        list: tuples `(mask, name)`, where `name` is the file name relative to the watched directory.
+    """
+    events = []
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(buffer):
+        _, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+        offset += _EVENT_HEADER.size
+        name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+        offset += length
+        events.append((mask, name))
+    return events
+
+
+class ConfigWatcher():
+    """Watch a directory with inotify and report added, removed and modified files.
+
+    Events are only reported for files that have been completely written (`IN_CLOSE_WRITE`) or moved into the
+    directory (`IN_MOVED_TO`), so a file that is being written is not reported until it is complete. Files that
+    are written again are reported as modified; all other written files as added. When the kernel drops events
+    because they were not read in time (`IN_Q_OVERFLOW`), the directory is scanned again with `rescan`.
+
+    When the directory itself is removed or moved away, its files are reported as removed, and the watcher checks
+    every `retry_interval` seconds whether it exists again. Once it does, it is watched again and its files are
+    reported as with `rescan`.
+
+    The callbacks run in the watcher thread and should return quickly, or events may be dropped.
+
+    Args:
+        directory (str): The directory to watch.
+        on_added (callable): Called with the full path of a file that appeared in the directory.
+        on_removed (callable): Called with the full path of a file that was removed from the directory.
+        on_modified (callable, optional): Called with the full path of a file that was written again.
+        rule (lambda, optional): Same as in `sirup.utils.list_files_with_full_path`. Only files for which
+            `rule` returns a file name are reported.
+        known_files (iterable, optional): Full paths of the files already in use, to tell additions from modifications.
+    """
+
+    retry_interval = 1.0
+
+    def __init__(self, # pylint: disable=too-many-arguments
+                 directory,
+                 on_added,
+                 on_removed,
+                 on_modified=None,
+                 rule=None,
+                 known_files=()):
+        self.directory = str(directory)
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.on_modified = on_modified
+        self.rule = rule
+        self._known = set(known_files)
+        self._libc = None
+        self._fd = None
+        self._wd = None
+        self._thread = None
+        self._stop_read, self._stop_write = None, None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.directory!r})"
+
+
+    def is_running(self):
+        """Indicates whether the watcher thread is running.
+
+        Returns:
+            bool: True if the thread is running.
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def start(self):
+        """Start watching the directory in a background thread.
+
+        Raises:
+            OSError: when inotify is not available, which is the case on other systems than Linux, or the directory
+                cannot be watched.
+        """
+        if self.is_running():
+            return
+        self._libc = _load_libc()
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        try:
+            self._add_watch()
+        except OSError:
+            os.close(fd)
+            self._fd = None
+            raise
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="sirup-config-watcher", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        "Stop watching the directory."
+        if self._thread is None:
+            return
+        os.write(self._stop_write, b"x")
+        self._thread.join()
+        for fd in (self._fd, self._stop_read, self._stop_write):
+            os.close(fd)
+        self._thread = None
+        self._fd = None
+        self._wd = None
+
+
+    def _add_watch(self):
+        "Watch the directory with the inotify file descriptor."
+        wd = self._libc.inotify_add_watch(self._fd, self.directory.encode(), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), self.directory)
+        self._wd = wd
+
+
+    def _run(self):
+        while True:
+            timeout = None if self._wd is not None else self.retry_interval
+            readable, _, _ = select.select([self._fd, self._stop_read], [], [], timeout)
+            if self._stop_read in readable:
+                return
+            if not readable:
+                self._watch_again()
+                continue
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    continue
+                raise
+            for mask, name in parse_events(buffer):
+                if mask & IN_Q_OVERFLOW:
+                    logging.info("Events for %s were dropped; scanning the directory again.", self.directory)
+                    self.rescan()
+                elif mask & IN_MOVE_SELF:
+                    self._libc.inotify_rm_watch(self._fd, self._wd) # the kernel confirms with `IN_IGNORED`
+                elif mask & IN_IGNORED:
+                    self._watch_lost()
+                elif not mask & IN_DELETE_SELF: # followed by `IN_IGNORED`
+                    self.handle_event(mask, name)
+
+
+    def _watch_lost(self):
+        "The directory was removed or moved away: report its files as removed and wait for it to reappear."
+        logging.info("%s was removed or moved; waiting for it to be created again.", self.directory)
+        self._wd = None
+        self.rescan()
+
+
+    def _watch_again(self):
+        "Watch the directory again if it was created again, and report its files."
+        try:
+            self._add_watch()
+        except OSError:
+            return
+        logging.info("Watching %s again.", self.directory)
+        self.rescan()
+
+
+    def rescan(self):
+        """Compare the directory with the files known so far, and report the differences.
+
+        Files that appeared are reported as added and files that disappeared as removed. Since changes to the other
+        files may have been missed, they are reported as modified. If the directory does not exist, all files are
+        reported as removed.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        except OSError as e:
+            logging.info("Cannot scan %s: %s", self.directory, e)
+            return
+        if self.rule is not None:
+            names = [self.rule(name) for name in names if self.rule(name)]
+        paths = {os.path.join(self.directory, name) for name in names}
+        for path in sorted(self._known - paths):
+            self.handle_event(IN_DELETE, os.path.basename(path), apply_rule=False)
+        for path in sorted(paths):
+            self.handle_event(IN_CLOSE_WRITE, os.path.basename(path), apply_rule=False)
+
+
+    def handle_event(self, mask, name, apply_rule=True):
+        """Translate an inotify event into a call of `on_added`, `on_removed` or `on_modified`.
+
+        Args:
+            mask (int): the inotify event mask.
+            name (str): the file name relative to the watched directory.
+            apply_rule (bool, optional): If False, `name` was already filtered with `rule`.
+        """
+        if apply_rule and self.rule is not None:
+            name = self.rule(name)
+            if not name:
+                return
+        path = os.path.join(self.directory, name)
+        try:
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                if path in self._known:
+                    self._known.discard(path)
+                    self.on_removed(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                if path in self._known:
+                    if self.on_modified is not None:
+                        self.on_modified(path)
+                else:
+                    self._known.add(path)
+                    self.on_added(path)
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Handling the change of %s failed: %s", path, e)
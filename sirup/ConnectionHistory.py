@@ -0,0 +1,251 @@
+"Keep a record of all connection attempts"
+
+import csv
+import os
+import threading
+from collections import deque
+from .utils import percentile
+
+
+FIELDS = ["config_file", "start", "vpn_started", "tunnel_up", "verified", "end",
+          "outcome", "exception", "exit_ip", "backoff"]
+_PHASES = ["vpn_started", "tunnel_up", "verified", "end"]
+
+
+class ServerRecord():
+    """Statistics of the connection attempts to one server.
+
+    Args:
+        max_samples (int, optional): Number of most recent connect times kept for the percentiles.
+
+    Attributes:
+        attempts (int): Number of connection attempts.
+        successes (int): Number of successful attempts.
+        backoff (float): Total number of seconds spent waiting after failed attempts.
+        connect_times (collections.deque): Seconds until the tunnel was up, for the most recent successful attempts.
+        exceptions (dict): Number of failed attempts by exception class.
+    """
+    def __init__(self, max_samples=1000):
+        self.attempts = 0
+        self.successes = 0
+        self.backoff = 0.0
+        self.connect_times = deque(maxlen=max_samples)
+        self.exceptions = {}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(attempts={self.attempts!r}, successes={self.successes!r})"
+
+    @property
+    def failure_rate(self):
+        "float: Share of failed attempts."
+        if self.attempts == 0:
+            return 0.0
+        return 1 - self.successes / self.attempts
+
+    def add(self, attempt):
+        "Add an attempt, as a dict with the keys in `FIELDS`."
+        self.attempts += 1
+        self.backoff += attempt.get("backoff") or 0.0
+        if attempt["outcome"] == "success":
+            self.successes += 1
+            connect_time = attempt.get("tunnel_up")
+            if connect_time is None:
+                connect_time = attempt.get("end")
+            if connect_time is not None:
+                self.connect_times.append(connect_time)
+        else:
+            name = attempt.get("exception") or attempt["outcome"]
+            self.exceptions[name] = self.exceptions.get(name, 0) + 1
+
+    def summary(self):
+        """Summarize the attempts.
+
+        Returns:
+            dict: with `attempts`, `successes`, `failure_rate`, `p50` and `p95` of the connect time in seconds
+              (`None` without successful attempts), and `backoff` in seconds.
+        """
+        times = list(self.connect_times)
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "failure_rate": self.failure_rate,
+            "p50": percentile(times, 50) if times else None,
+            "p95": percentile(times, 95) if times else None,
+            "backoff": self.backoff,
+        }
+
+
+class AdaptiveTimeout():
+    """Connect timeouts derived from the connect times observed for each server.
+
+    The timeout of a server is `multiple` times the 95th percentile of its connect times, limited to
+    `[floor, ceiling]`. Servers with fewer than `min_samples` successful connections get `fallback`.
+
+    Args:
+        multiple (float, optional): Factor applied to the 95th percentile.
+        floor (float, optional): Shortest timeout in seconds.
+        ceiling (float, optional): Longest timeout in seconds.
+        fallback (float, optional): Timeout in seconds for servers without enough observations.
+        min_samples (int, optional): Number of successful connections needed before the timeout adapts.
+    """
+
+    def __init__(self, multiple=3.0, floor=5.0, ceiling=60.0, fallback=30.0, min_samples=5): # pylint: disable=too-many-arguments
+        if not floor <= fallback <= ceiling:
+            raise ValueError("fallback must be between floor and ceiling")
+        self.multiple = multiple
+        self.floor = floor
+        self.ceiling = ceiling
+        self.fallback = fallback
+        self.min_samples = min_samples
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(multiple={self.multiple!r}, floor={self.floor!r}, "\
+            f"ceiling={self.ceiling!r}, fallback={self.fallback!r}, min_samples={self.min_samples!r})"
+
+
+    def timeout(self, record):
+        """Compute the timeout of a server.
+
+        Args:
+            record (None or ServerRecord): the attempts to the server so far.
+
+        Returns:
+            float: the timeout in seconds.
+        """
+        if record is None or len(record.connect_times) < self.min_samples:
+            return self.fallback
+        p95 = percentile(list(record.connect_times), 95)
+        return min(self.ceiling, max(self.floor, self.multiple * p95))
+
+
+class ConnectionHistory():
+    """Append-only record of connection attempts, with statistics per server.
+
+    Each attempt is one line of a CSV file: the configuration file, the start time (seconds since the epoch),
+    the seconds from the start until each phase of the connection (`vpn_started`, `tunnel_up`, `verified` and `end`),
+    the outcome (`success`, `timeout`, `connection_error` or `error`), the exception class, the exit IP address and
+    the seconds spent waiting before the next attempt. Phases that were not reached are empty.
+
+    Existing records are loaded when the history is created, so that statistics carry over between sessions.
+    The file stays open for appending from the first new attempt until `close`.
+
+    Args:
+        path (str, optional): The CSV file. If not given, the history is only kept in memory.
+        max_samples (int, optional): Number of most recent connect times kept per server.
+
+    Attributes:
+        servers (dict): Maps each configuration file to its `ServerRecord`.
+    """
+
+    def __init__(self, path=None, max_samples=1000):
+        self.path = path
+        self.max_samples = max_samples
+        self.servers = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer = None
+        if path is not None and os.path.exists(path):
+            for attempt in read_history(path):
+                self._add(attempt)
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r})"
+
+
+    def __len__(self):
+        return sum(record.attempts for record in self.servers.values())
+
+
+    def _add(self, attempt):
+        record = self.servers.get(attempt["config_file"])
+        if record is None:
+            record = self.servers[attempt["config_file"]] = ServerRecord(self.max_samples)
+        record.add(attempt)
+
+
+    def record(self, config_file, start, phase_times, outcome, exception=None, exit_ip=None, backoff=0.0): # pylint: disable=too-many-arguments
+        """Add a connection attempt.
+
+        Args:
+            config_file (str): the configuration file of the server.
+            start (float): the time at which the attempt started, in seconds since the epoch.
+            phase_times (dict): the times (seconds since the epoch) at which the phases `vpn_started`, `tunnel_up`,
+                `verified` and `end` were reached. Missing phases were not reached.
+            outcome (str): `"success"`, `"timeout"`, `"connection_error"` or `"error"`.
+            exception (str, optional): the class name of the exception that ended the attempt.
+            exit_ip (str, optional): the IP address visible through the tunnel.
+            backoff (float, optional): seconds spent waiting after the attempt.
+        """
+        attempt = {"config_file": config_file, "start": start, "outcome": outcome,
+                   "exception": exception, "exit_ip": exit_ip, "backoff": backoff}
+        for phase in _PHASES:
+            attempt[phase] = phase_times[phase] - start if phase in phase_times else None
+        with self._lock:
+            self._add(attempt)
+            if self.path is not None:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8", newline="") #pylint: disable=consider-using-with
+                    self._writer = csv.writer(self._file)
+                    if self._file.tell() == 0:
+                        self._writer.writerow(FIELDS)
+                self._writer.writerow([_format(attempt[field]) for field in FIELDS])
+                self._file.flush() # readers such as `sirup stats` see each attempt right away
+
+
+    def close(self):
+        "Close the history file. A further attempt opens it again."
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._writer = None
+
+
+    def timeout(self, config_file, policy):
+        """Compute the connect timeout of a server.
+
+        Args:
+            config_file (str): the configuration file of the server.
+            policy (AdaptiveTimeout): how the timeout follows from the observed connect times.
+
+        Returns:
+            float: the timeout in seconds.
+        """
+        return policy.timeout(self.servers.get(config_file))
+
+
+    def summarize(self):
+        """Summarize the attempts per server.
+
+        Returns:
+            dict: maps each configuration file to the summary of `ServerRecord.summary`.
+        """
+        return {config_file: record.summary() for config_file, record in self.servers.items()}
+
+
+def _format(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def read_history(path):
+    """Read the attempts of a history file one by one.
+
+    Args:
+        path (str): the CSV file written by `ConnectionHistory`.
+
+    Yields:
+        dict: one attempt, with the keys in `FIELDS`. Times are floats, missing values are `None`.
+    """
+    with open(path, encoding="utf-8", newline="") as file:
+        for row in csv.DictReader(file):
+            attempt = {field: (row.get(field) or None) for field in FIELDS}
+            for field in ["start", "backoff"] + _PHASES:
+                if attempt[field] is not None:
+                    attempt[field] = float(attempt[field])
+            yield attempt
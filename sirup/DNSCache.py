@@ -0,0 +1,338 @@
+"Cache DNS answers per tunnel, and resolve the host names of HTTP sessions with it"
+
+import ipaddress
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.connection import create_connection
+
+
+TYPE_A = 1
+TYPE_AAAA = 28
+_FLAG_RECURSION_DESIRED = 0x0100
+_FLAG_TRUNCATED = 0x0200
+_RCODE_NAME_ERROR = 3
+
+
+def build_query(host, rtype, query_id):
+    """Encode a DNS query.
+
+    Args:
+        host (str): the host name.
+        rtype (int): the record type, `TYPE_A` or `TYPE_AAAA`.
+        query_id (int): the ID of the query, which the answer repeats.
+
+    Returns:
+        bytes: the query.
+    """
+    header = struct.pack("!HHHHHH", query_id, _FLAG_RECURSION_DESIRED, 1, 0, 0, 0)
+    labels = host.rstrip(".").encode("idna").split(b".")
+    name = b"".join(bytes([len(label)]) + label for label in labels) + b"\0"
+    return header + name + struct.pack("!HH", rtype, 1)
+
+
+def _skip_name(message, offset):
+    "Return the offset after a (possibly compressed) name."
+    while True:
+        length = message[offset]
+        if length == 0:
+            return offset + 1
+        if length >= 0xC0: # pointer to an earlier name
+            return offset + 2
+        offset += length + 1
+
+
+def parse_response(message, query_id):
+    """Decode the answer section of a DNS response.
+
+    Args:
+        message (bytes): the response.
+        query_id (int): the ID of the query.
+
+    Returns:
+        tuple: `(rcode, truncated, records)`, where `records` is a list of tuples `(rtype, ttl, address)`. Only
+          addresses of A and AAAA records are decoded; the address of other records is `None`.
+
+    Raises:
+        ValueError: if the response does not answer the query.
+    """
+    response_id, flags, n_questions, n_answers = struct.unpack_from("!HHHH", message)
+    if response_id != query_id or not flags & 0x8000:
+        raise ValueError("The response does not answer the query")
+    offset = 12
+    for _ in range(n_questions):
+        offset = _skip_name(message, offset) + 4
+    records = []
+    for _ in range(n_answers):
+        offset = _skip_name(message, offset)
+        rtype, _, ttl, length = struct.unpack_from("!HHIH", message, offset)
+        offset += 10
+        rdata = message[offset:offset + length]
+        offset += length
+        address = None
+        if rtype == TYPE_A and length == 4:
+            address = str(ipaddress.IPv4Address(rdata))
+        elif rtype == TYPE_AAAA and length == 16:
+            address = str(ipaddress.IPv6Address(rdata))
+        records.append((rtype, ttl, address))
+    return flags & 0x000F, bool(flags & _FLAG_TRUNCATED), records
+
+
+class DNSCache():
+    """A small caching resolver that sends its queries to the nameservers of the active tunnel.
+
+    Answers are kept for their TTL, clamped between `min_ttl` and `max_ttl`; names that do not exist are kept for
+    `negative_ttl`. The least recently used entries are dropped beyond `max_entries`.
+
+    The nameservers are those pushed by the VPN server, so the queries go through the tunnel and do not leak to the
+    resolver of the local network. After a rotation, `rotate` switches to the nameservers of the new tunnel. When they
+    are the same, the cache is kept. Otherwise, only hot entries are kept, and for at most `carry_over_ttl`
+    seconds: the first requests on the new IP address skip the lookup, while the entries are soon refreshed
+    through the new tunnel, whose resolver may answer differently (for instance with servers near the new exit).
+
+    Args:
+        nameservers (list, optional): IP addresses of the nameservers, also used for tunnels without nameservers.
+        port (int, optional): Port of the nameservers.
+        timeout (float, optional): Seconds to wait for the answer of a nameserver.
+        max_entries (int, optional): Maximum number of cached names.
+        min_ttl (float, optional): Minimum number of seconds an answer is kept.
+        max_ttl (float, optional): Maximum number of seconds an answer is kept.
+        negative_ttl (float, optional): Number of seconds a name that does not exist is kept.
+        hot_hits (int, optional): Number of cache hits from which an entry is hot.
+        carry_over_ttl (float, optional): Maximum number of seconds a hot entry is kept after a change of nameservers.
+        clock (object, optional): Provides `time()`. Defaults to the `time` module.
+
+    Attributes:
+        nameservers (list): The current nameservers.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups sent to a nameserver.
+        generation (int): Number of calls to `rotate`, so that HTTP sessions can drop connections of earlier tunnels.
+    """
+
+    def __init__(self, nameservers=("1.1.1.1",), port=53, timeout=2.0, max_entries=10000, # pylint: disable=too-many-arguments
+                 min_ttl=0.0, max_ttl=3600.0, negative_ttl=30.0, hot_hits=3, carry_over_ttl=30.0, clock=None):
+        self.nameservers = list(nameservers)
+        self.default_nameservers = list(nameservers)
+        self.port = port
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.hot_hits = hot_hits
+        self.carry_over_ttl = carry_over_ttl
+        self.clock = clock if clock is not None else time
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict() # (host, rtype) -> [expires, addresses, hits]
+        self._lock = threading.Lock()
+        self._query_ids = itertools.count(random.randrange(1 << 16))
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(nameservers={self.nameservers!r}, max_entries={self.max_entries!r})"
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def lookup(self, host, rtype=TYPE_A):
+        """Look up the addresses of a host name, from the cache if possible.
+
+        Args:
+            host (str): the host name.
+            rtype (int, optional): `TYPE_A` for IPv4 or `TYPE_AAAA` for IPv6 addresses.
+
+        Returns:
+            list: the addresses; empty if the name does not exist or has no address of this type.
+
+        Raises:
+            OSError: if no nameserver answers, for instance `socket.timeout`.
+        """
+        key = (host.lower().rstrip("."), rtype)
+        now = self.clock.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                entry[2] += 1
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        addresses, ttl = self._query(key[0], rtype)
+        with self._lock:
+            self._entries[key] = [now + ttl, addresses, 0]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return addresses
+
+
+    def resolve(self, host):
+        """Resolve a host name to one IPv4 address, or to an IPv6 address if it has none.
+
+        Args:
+            host (str): the host name or an IP address, which is returned as it is.
+
+        Returns:
+            str: the address.
+
+        Raises:
+            socket.gaierror: if the name cannot be resolved.
+        """
+        try:
+            return str(ipaddress.ip_address(host))
+        except ValueError:
+            pass
+        try:
+            addresses = self.lookup(host, TYPE_A) or self.lookup(host, TYPE_AAAA)
+        except OSError as e:
+            raise socket.gaierror(socket.EAI_AGAIN, f"Cannot resolve {host}: {e}") from e
+        if not addresses:
+            raise socket.gaierror(socket.EAI_NONAME, f"Cannot resolve {host}")
+        return addresses[0]
+
+
+    def _query(self, host, rtype):
+        "Ask the nameservers in turn; returns the addresses and the number of seconds to keep them."
+        error = socket.timeout("No nameserver")
+        for nameserver in self.nameservers:
+            query_id = next(self._query_ids) & 0xFFFF
+            family = socket.AF_INET6 if ":" in nameserver else socket.AF_INET
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(self.timeout)
+                try:
+                    sock.sendto(build_query(host, rtype, query_id), (nameserver, self.port))
+                    while True:
+                        message, _ = sock.recvfrom(4096)
+                        try:
+                            rcode, _, records = parse_response(message, query_id)
+                        except (ValueError, struct.error, IndexError): # not the answer to this query
+                            continue
+                        break
+                except OSError as e:
+                    error = e
+                    continue
+            if rcode == _RCODE_NAME_ERROR:
+                return [], self.negative_ttl
+            if rcode != 0:
+                error = OSError(f"{nameserver} answered with error code {rcode}")
+                continue
+            addresses = [address for record_type, _, address in records if record_type == rtype]
+            if not addresses:
+                return [], self.negative_ttl
+            ttl = min(ttl for _, ttl, _ in records) # the shortest TTL along the CNAME chain
+            return addresses, min(max(ttl, self.min_ttl), self.max_ttl)
+        raise error
+
+
+    def rotate(self, nameservers):
+        """Switch to the nameservers of a new tunnel.
+
+        Args:
+            nameservers (list): IP addresses of the nameservers. If empty, the nameservers given at instantiation.
+        """
+        nameservers = list(nameservers) or self.default_nameservers
+        now = self.clock.time()
+        with self._lock:
+            if nameservers != self.nameservers:
+                for key, entry in list(self._entries.items()):
+                    if entry[2] >= self.hot_hits and entry[0] > now:
+                        entry[0] = min(entry[0], now + self.carry_over_ttl)
+                        entry[2] = 0
+                    else:
+                        del self._entries[key]
+            self.nameservers = nameservers
+            self.generation += 1
+
+
+    def clear(self):
+        "Remove all entries."
+        with self._lock:
+            self._entries.clear()
+
+
+def _resolving_pool(base, dns_cache):
+    "Make a connection pool class whose connections resolve host names with `dns_cache`."
+
+    class Connection(base.ConnectionCls):
+        def _new_conn(self):
+            # the name stays the host of TLS and of the `Host` header; only the socket uses the address
+            try:
+                return create_connection((dns_cache.resolve(self.host), self.port), self.timeout,
+                                         source_address=self.source_address, socket_options=self.socket_options)
+            except socket.timeout as e:
+                raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. "
+                                                f"(connect timeout={self.timeout})") from e
+            except OSError as e:
+                raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+    class Pool(base):
+        ConnectionCls = Connection
+
+    return Pool
+
+
+class ResolvingAdapter(HTTPAdapter):
+    """A `requests` transport adapter that resolves host names with a `DNSCache`.
+
+    When the cache switches to a new tunnel (see `DNSCache.rotate`), the adapter closes its pooled connections,
+    which went through the previous tunnel, before it sends the next request.
+
+    Args:
+        dns_cache (DNSCache): The cache.
+        **kwargs: Passed to `requests.adapters.HTTPAdapter`.
+    """
+
+    def __init__(self, dns_cache, **kwargs):
+        self.dns_cache = dns_cache
+        self._generation = dns_cache.generation
+        super().__init__(**kwargs)
+
+
+    def init_poolmanager(self, *args, **kwargs): # pylint: disable=arguments-differ
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _resolving_pool(HTTPConnectionPool, self.dns_cache),
+            "https": _resolving_pool(HTTPSConnectionPool, self.dns_cache),
+        }
+
+
+    def drop_stale_connections(self):
+        "Close the pooled connections if the cache switched to a new tunnel since they were opened."
+        if self.dns_cache.generation != self._generation:
+            self._generation = self.dns_cache.generation
+            self.poolmanager.clear()
+
+
+    def send(self, request, *args, **kwargs): # pylint: disable=arguments-differ
+        self.drop_stale_connections()
+        return super().send(request, *args, **kwargs)
+
+
+def make_session(dns_cache):
+    """Make a `requests.Session` that resolves host names with a `DNSCache`.
+
+    Args:
+        dns_cache (DNSCache): the cache.
+
+    Returns:
+        requests.Session: the session.
+    """
+    session = requests.Session()
+    adapter = ResolvingAdapter(dns_cache)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
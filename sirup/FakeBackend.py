@@ -0,0 +1,227 @@
+"In-process stand-in for VPN tunnels, to test and tune the rotator without root or network"
+
+import math
+from random import Random
+import requests
+from .Backend import Backend
+
+
+class VirtualClock():
+    """A clock that only advances when `sleep` is called.
+
+    Args:
+        start (float, optional): The initial time in seconds.
+
+    Attributes:
+        now (float): The current time in seconds.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(start={self.now!r})"
+
+
+    def time(self):
+        "Return the current time."
+        return self.now
+
+
+    def sleep(self, seconds):
+        "Advance the clock by `seconds` without waiting."
+        self.now += seconds
+
+
+def lognormal_connect_time(median=2.0, sigma=0.5):
+    """Make a connect time distribution for `FakeNetwork`.
+
+    Args:
+        median (float, optional): Median connect time in seconds.
+        sigma (float, optional): Standard deviation of the logarithm of the connect time.
+
+    Returns:
+        callable: draws a connect time from a `random.Random` and a configuration file.
+    """
+    mu = math.log(median)
+
+    def draw(randomizer, config_file): #pylint: disable=unused-argument
+        return randomizer.lognormvariate(mu, sigma)
+    return draw
+
+
+class FakeNetwork():
+    """Factory of `FakeBackend` tunnels that share one clock, one random number generator and one set of exit IPs.
+
+    Pass an instance as `backend` to `sirup.IPRotator.IPRotator` to run the rotator without root permission,
+    without network and without waiting: connecting and backing off advance a `VirtualClock` instead.
+    With the same `seed`, the same sequence of calls gives the same outcomes.
+
+    Args:
+        seed (int, optional): Seed of the random number generator.
+        connect_time (callable, optional): Draws the connect time in seconds from a `random.Random` and a
+            configuration file. Defaults to `lognormal_connect_time()`.
+        timeout_rate (float or dict, optional): Probability that a tunnel never comes up, for all servers or by
+            configuration file. Missing configuration files have probability 0.
+        connection_error_rate (float or dict, optional): Probability that a tunnel comes up, but the exit IP address
+            cannot be retrieved and `check_routes` finds that traffic does not go through it.
+        stop_time (float, optional): Number of seconds to tear a tunnel down.
+        clock (object, optional): Clock with `time()` and `sleep(seconds)`. Defaults to a new `VirtualClock`.
+
+    Attributes:
+        clock (object): The clock of all tunnels.
+        base_ip (str): The exit IP address when no tunnel is up.
+        n_started (int): Number of tunnels started.
+        n_active (int): Number of tunnels that are starting or up.
+    """
+
+    requires_root = False
+
+    def __init__(self, # pylint: disable=too-many-arguments
+                 seed=None,
+                 connect_time=None,
+                 timeout_rate=0.0,
+                 connection_error_rate=0.0,
+                 stop_time=0.0,
+                 clock=None):
+        self.randomizer = Random(seed)
+        self.connect_time = connect_time if connect_time is not None else lognormal_connect_time()
+        self.timeout_rate = timeout_rate
+        self.connection_error_rate = connection_error_rate
+        self.stop_time = stop_time
+        self.clock = clock if clock is not None else VirtualClock()
+        self.base_ip = "192.0.2.1"
+        self.n_started = 0
+        self.n_active = 0
+        self._exit_ips = {}
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(timeout_rate={self.timeout_rate!r}, "\
+            f"connection_error_rate={self.connection_error_rate!r}, stop_time={self.stop_time!r})"
+
+
+    def __call__(self, config_file, auth_file=None, track_ip=True, work_dir=None, # pylint: disable=too-many-arguments,unused-argument
+                 verify_routes=False, ip_check_rate=1.0):
+        "Create a tunnel to the server of `config_file`, with the signature of `sirup.VPNConnector.VPNConnector`."
+        return FakeBackend(config_file, self, track_ip=track_ip, verify_routes=verify_routes, ip_check_rate=ip_check_rate)
+
+
+    @staticmethod
+    def _rate(rate, config_file):
+        if isinstance(rate, dict):
+            return rate.get(config_file, 0.0)
+        return rate
+
+
+    def draw_outcome(self, config_file):
+        """Draw the outcome of a connection attempt.
+
+        Args:
+            config_file (str): The configuration file of the server.
+
+        Returns:
+            tuple: `(outcome, connect_time)`, where `outcome` is `"up"`, `"timeout"` or `"connection_error"`.
+        """
+        u = self.randomizer.random()
+        timeout_rate = self._rate(self.timeout_rate, config_file)
+        if u < timeout_rate:
+            outcome = "timeout"
+        elif u < timeout_rate + self._rate(self.connection_error_rate, config_file):
+            outcome = "connection_error"
+        else:
+            outcome = "up"
+        return outcome, self.connect_time(self.randomizer, config_file)
+
+
+    def exit_ip(self, config_file):
+        """The exit IP address of a server. Each configuration file gets its own address.
+
+        Args:
+            config_file (str): The configuration file of the server.
+
+        Returns:
+            str: the IP address.
+        """
+        ip = self._exit_ips.get(config_file)
+        if ip is None:
+            n = len(self._exit_ips) + 1
+            ip = self._exit_ips[config_file] = f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+        return ip
+
+
+class FakeBackend(Backend):
+    """A simulated tunnel to one server, created by `FakeNetwork`.
+
+    `wait_ready` advances the clock of the network by the drawn connect time, or by the full timeout if the
+    tunnel does not come up.
+
+    Args:
+        config_file (str): The configuration file of the server. The file is not read.
+        network (FakeNetwork): The network that determines outcomes, connect times and exit IPs.
+        track_ip (bool, optional): If True, the exit IP address is checked after each `connect` and `disconnect`.
+        verify_routes (bool, optional): If True, `connect` calls `check_routes`.
+        ip_check_rate (float, optional): Share of the IP address checks that are carried out when `track_ip` is True.
+    """
+
+    requires_root = False
+
+    def __init__(self, config_file, network, track_ip=True, verify_routes=False, ip_check_rate=1.0): # pylint: disable=too-many-arguments
+        self.network = network
+        self.clock = network.clock
+        self._state = "down"
+        self._outcome = None
+        self._connect_time = None
+        super().__init__(config_file, track_ip=track_ip, verify_routes=verify_routes, ip_check_rate=ip_check_rate)
+
+
+    def start(self, pwd):
+        if self._state != "down":
+            raise RuntimeError(f"The tunnel to {self.config_file} is already started")
+        self._outcome, self._connect_time = self.network.draw_outcome(self.config_file)
+        self.network.n_started += 1
+        self.network.n_active += 1
+        self._state = "starting"
+
+
+    def wait_ready(self, pwd, timeout):
+        if self._outcome == "timeout" or self._connect_time > timeout:
+            self.clock.sleep(timeout)
+            self._release()
+            self._state = "failed"
+            raise TimeoutError("Could not connect to vpn")
+        self.clock.sleep(self._connect_time)
+        self._state = "up"
+
+
+    def stop(self, pwd):
+        if self._state in ("starting", "up"):
+            self.clock.sleep(self.network.stop_time)
+            self._release()
+        self._state = "down"
+
+
+    def _release(self):
+        if self._state in ("starting", "up"):
+            self.network.n_active -= 1
+
+
+    def state(self):
+        return self._state
+
+
+    def check_routes(self):
+        if self._state != "up":
+            return f"tunnel is {self._state}"
+        if self._outcome == "connection_error":
+            return "traffic does not go through the tunnel"
+        return None
+
+
+    def exit_ip(self):
+        if self._state != "up":
+            return self.network.base_ip
+        if self._outcome == "connection_error":
+            raise requests.ConnectionError("Failed to get the IP address")
+        return self.network.exit_ip(self.config_file)
@@ -0,0 +1,276 @@
+"Validate configuration files with full connections in isolated network namespaces"
+
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import PIPE
+from .TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+from .utils import get_ip
+from .VPNConnector import VPNConnector
+
+
+IP_FORWARD_FILE = "/proc/sys/net/ipv4/ip_forward"
+_GET_IP = "import urllib.request; print(urllib.request.urlopen('https://ifconfig.me', timeout=5).read().decode())"
+
+
+class HealthCheck():
+    """Connect to every server once, check the exit IP address and disconnect, several servers at a time.
+
+    Each connection runs in its own network namespace, so the checks neither change the routes of the host nor
+    interfere with each other. A namespace reaches the internet through a veth pair and NAT on the host; the
+    namespaces are created by `setup` and removed by `teardown`, or by using the health check as a context manager.
+    `setup` turns on IP forwarding on the host and accepts the forwarded traffic of the namespaces even if the
+    `FORWARD` policy is `DROP`; `teardown` removes the rules and turns forwarding off again if it was off before.
+
+    Args:
+        auth_file (str): Full path and file name of the file with the authentication credentials for VPN connections.
+        pwd (str): User root password.
+        parallelism (int, optional): Number of servers that are checked at the same time, and of namespaces.
+        timeout (float, optional): Maximum number of seconds until a tunnel is established.
+        nameserver (str, optional): DNS server used inside the namespaces.
+        prefix (str, optional): Prefix of the names of the namespaces and interfaces.
+
+    Attributes:
+        results (dict): Maps each checked configuration file to a dict with `success`, `connect_time` (seconds until
+            the tunnel was established), `exit_ip`, `error` (the reason of a failure) and `checked_at`.
+    """
+
+    def __init__(self, auth_file, pwd, parallelism=4, timeout=30, nameserver="1.1.1.1", prefix="sirup"): # pylint: disable=too-many-arguments
+        if not 1 <= parallelism <= 64:
+            raise ValueError("parallelism must be between 1 and 64")
+        self.auth_file = auth_file
+        self.pwd = pwd
+        self.parallelism = parallelism
+        self.timeout = timeout
+        self.nameserver = nameserver
+        self.prefix = prefix
+        self.results = {}
+        self.base_ip = None
+        self._session_dir = TemporaryDirectoryWithRootPermission(password=pwd)
+        self._slots = queue.Queue()
+        self._ip_forward = None # the value before `setup`
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.auth_file!r}, pwd=<SECRET>, parallelism={self.parallelism!r}, "\
+            f"timeout={self.timeout!r})"
+
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.teardown()
+
+
+    def namespace(self, slot):
+        "Name of the network namespace of a slot."
+        return f"{self.prefix}-ns{slot}"
+
+
+    def _subnet(self, slot):
+        return f"10.231.{slot * 4 // 256}.{slot * 4 % 256}"
+
+
+    def _run_as_root(self, script):
+        "Run a shell script with root permission in a single `sudo` call."
+        return subprocess.run(["sudo", "-S", "sh", "-c", script], input=self.pwd.encode(),
+                              stdout=PIPE, stderr=PIPE, check=False)
+
+
+    def make_setup_script(self, slot):
+        """Compose the commands that create the namespace of a slot and connect it to the internet.
+
+        Args:
+            slot (int): the number of the slot.
+
+        Returns:
+            str: the commands, one per line.
+        """
+        ns = self.namespace(slot)
+        host, inner = f"{self.prefix}-v{slot}h", f"{self.prefix}-v{slot}n"
+        network = self._subnet(slot).rsplit(".", 1)
+        host_ip = f"{network[0]}.{int(network[1]) + 1}"
+        inner_ip = f"{network[0]}.{int(network[1]) + 2}"
+        return "\n".join([
+            "set -e",
+            f"ip netns add {ns}",
+            f"ip link add {host} type veth peer name {inner}",
+            f"ip link set {inner} netns {ns}",
+            f"ip address add {host_ip}/30 dev {host}",
+            f"ip link set {host} up",
+            f"ip netns exec {ns} ip address add {inner_ip}/30 dev {inner}",
+            f"ip netns exec {ns} ip link set {inner} up",
+            f"ip netns exec {ns} ip link set lo up",
+            f"ip netns exec {ns} ip route add default via {host_ip}",
+            "sysctl -qw net.ipv4.ip_forward=1",
+            f"iptables -t nat -A POSTROUTING -s {self._subnet(slot)}/30 -j MASQUERADE",
+            f"iptables -I FORWARD -s {self._subnet(slot)}/30 -j ACCEPT",
+            f"iptables -I FORWARD -d {self._subnet(slot)}/30 -m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT",
+            f"mkdir -p /etc/netns/{ns}",
+            f"echo 'nameserver {self.nameserver}' > /etc/netns/{ns}/resolv.conf",
+        ])
+
+
+    def make_teardown_script(self, slot):
+        """Compose the commands that remove the namespace of a slot. Failures are ignored.
+
+        Args:
+            slot (int): the number of the slot.
+
+        Returns:
+            str: the commands, one per line.
+        """
+        ns = self.namespace(slot)
+        commands = [f"ip netns pids {ns} | xargs -r kill", # daemons of attempts that timed out
+                    f"iptables -t nat -D POSTROUTING -s {self._subnet(slot)}/30 -j MASQUERADE",
+                    f"iptables -D FORWARD -s {self._subnet(slot)}/30 -j ACCEPT",
+                    f"iptables -D FORWARD -d {self._subnet(slot)}/30 -m conntrack --ctstate RELATED,ESTABLISHED "
+                    "-j ACCEPT",
+                    f"ip link del {self.prefix}-v{slot}h",
+                    f"ip netns del {ns}",
+                    f"rm -rf /etc/netns/{ns}"]
+        return "\n".join(f"{command} 2>/dev/null || true" for command in commands)
+
+
+    def setup(self):
+        """Create the namespaces.
+
+        Raises:
+            RuntimeError: when a namespace cannot be created.
+        """
+        try:
+            with open(IP_FORWARD_FILE, encoding="utf-8") as file:
+                self._ip_forward = file.read().strip()
+        except OSError as e:
+            logging.info("Cannot read %s: %s", IP_FORWARD_FILE, e)
+        for slot in range(self.parallelism):
+            self._run_as_root(self.make_teardown_script(slot)) # left over from an interrupted check
+            result = self._run_as_root(self.make_setup_script(slot))
+            if result.returncode != 0:
+                self.teardown()
+                raise RuntimeError(f"Cannot create {self.namespace(slot)}: {result.stderr.decode()}")
+            self._slots.put(slot)
+        try:
+            self.base_ip = get_ip()
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Cannot get the IP address of the host: %s", e)
+
+
+    def teardown(self):
+        "Remove the namespaces and the files written by `OpenVPN`, and restore IP forwarding."
+        for slot in range(self.parallelism):
+            self._run_as_root(self.make_teardown_script(slot))
+        if self._ip_forward == "0":
+            self._run_as_root("sysctl -qw net.ipv4.ip_forward=0")
+        self._ip_forward = None
+        self._session_dir.cleanup()
+
+
+    def exit_ip(self, slot):
+        """Query the exit IP address from inside the namespace of a slot.
+
+        Args:
+            slot (int): the number of the slot.
+
+        Returns:
+            None or str: the IP address, or `None` if it cannot be retrieved.
+        """
+        cmd = ["sudo", "-S", "ip", "netns", "exec", self.namespace(slot), sys.executable, "-c", _GET_IP]
+        result = subprocess.run(cmd, input=self.pwd.encode(), stdout=PIPE, stderr=PIPE, check=False)
+        ip = result.stdout.decode().strip()
+        return ip if result.returncode == 0 and ip else None
+
+
+    def check(self, config_file, slot):
+        """Connect to a server in the namespace of a slot, check the exit IP address and disconnect.
+
+        Args:
+            config_file (str): the configuration file of the server.
+            slot (int): the number of the slot.
+
+        Returns:
+            dict: the result, see `results`.
+        """
+        result = {"success": False, "connect_time": None, "exit_ip": None, "error": None, "checked_at": time.time()}
+        connector = VPNConnector(config_file, self.auth_file, track_ip=False,
+                                 work_dir=self._session_dir.tunnel_dir(f"probe{slot}"),
+                                 netns=self.namespace(slot))
+        try:
+            connector.connect(self.pwd, timeout=self.timeout)
+            result["connect_time"] = connector.phase_times["tunnel_up"] - connector.phase_times["start"]
+            result["exit_ip"] = self.exit_ip(slot)
+            if result["exit_ip"] is None:
+                result["error"] = "Cannot get IP address"
+            elif result["exit_ip"] == self.base_ip:
+                result["error"] = "Traffic does not go through the tunnel"
+            else:
+                result["success"] = True
+        except Exception as e: #pylint: disable=broad-except
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            try:
+                connector.disconnect(self.pwd)
+            except Exception as e: #pylint: disable=broad-except
+                logging.info("Disconnecting from %s failed: %s", config_file, e)
+            # an attempt that timed out leaves its daemon running
+            self._run_as_root(f"ip netns pids {self.namespace(slot)} | xargs -r kill 2>/dev/null || true")
+        return result
+
+
+    def _check_in_free_slot(self, config_file):
+        slot = self._slots.get()
+        try:
+            result = self.check(config_file, slot)
+        finally:
+            self._slots.put(slot)
+        self.results[config_file] = result
+        logging.info("%s: %s", config_file, "ok" if result["success"] else result["error"])
+        return result
+
+
+    def run(self, config_files):
+        """Check many configuration files, `parallelism` at a time. Call `setup` first.
+
+        Args:
+            config_files (list): the configuration files.
+
+        Returns:
+            dict: `results`.
+        """
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            list(executor.map(self._check_in_free_slot, config_files))
+        return self.results
+
+
+    def write_report(self, path):
+        """Write `results` to a JSON file, which `sirup.IPRotator.IPRotator.load_probe_report` reads.
+
+        Args:
+            path (str): the JSON file.
+        """
+        report = {"created": time.time(), "results": self.results}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=1)
+        os.replace(tmp_path, path)
+
+
+def read_report(path):
+    """Read a report written by `HealthCheck.write_report`.
+
+    Args:
+        path (str): the JSON file.
+
+    Returns:
+        dict: maps each configuration file to its result.
+    """
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)["results"]
@@ -1,15 +1,32 @@
-"Rotate IP address with OpenVPN"
+"Rotate IP address with OpenVPN or WireGuard"
 
 import getpass
 import logging
+import threading
 import time
+from collections import deque
 from random import Random
 import requests
+from .ConfigWatcher import ConfigWatcher
+from .ConnectionHistory import AdaptiveTimeout
+from .ConnectionHistory import ConnectionHistory
+from .DNSCache import ResolvingAdapter
+from .DNSCache import make_session
+from .HealthCheck import read_report
+from .ovpn_config import config_fingerprint
+from .RemoteProber import RemoteProber
+from .ServerSelection import ServerSelection
+from .SessionWarmer import SessionWarmer
+from .StatusBlock import StatusBlock
+from .TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+from .TunnelMonitor import TunnelMonitor
+from .TunnelOptions import TunnelOptions
 from .utils import RotationList
 from .utils import check_password
 from .utils import kill_all_connections
 from .utils import list_files_with_full_path
 from .VPNConnector import VPNConnector
+from .WireGuardConnector import WireGuardConnector
 
 
 class IPRotator():
@@ -19,6 +36,13 @@ class IPRotator():
         When the class is instantiated, any existing openvpn processes are killed. This is for reasons of safety, simplicity
         and making sure that the VPN connector works as intended. 
 
+        Configuration files ending in `.conf` are WireGuard configurations and are connected with
+        `sirup.WireGuardConnector.WireGuardConnector`; all other files are `OpenVPN` configurations.
+        Both kinds can be mixed in `config_location`.
+
+        The files written by `OpenVPN` are kept in a temporary directory that lives as long as the rotator.
+        Call `close` when the rotator is not needed anymore, or use the rotator as a context manager.
+
     Args:
         auth_file (str): Path to the file containing authentication credentials for VPN connections.
         config_location (str): Path to the directory where VPN configuration files are stored.
@@ -28,9 +52,38 @@ class IPRotator():
         track_ip (bool, optional): If True, the IP address is queried after each `connect` and `disconnect`.
             For long-running programs, it is better to set track_ip=False in order to respect the query limits 
             of the IP address API.
+        history_file (str, optional): CSV file to which every connection attempt is appended. Attempts already in the
+            file are loaded at instantiation, so that `rank_by_history` can use them right away.
+            Summarize the file with `sirup stats <history_file>`.
+        backend (callable, optional): Creates the tunnel for a configuration file; called like
+            `backend(config_file, auth_file, track_ip=..., work_dir=..., verify_routes=..., ip_check_rate=...)`
+            and returns a `sirup.Backend.Backend`.
+            By default, the tunnel depends on the extension of the configuration file (see the note above).
+            If `backend.requires_root` is `False`, no sudo password is asked for and no `openvpn` processes are killed;
+            for instance, `sirup.FakeBackend.FakeNetwork` simulates tunnels in-process. If the backend has a `clock`,
+            it is used for timing and backing off between attempts instead of the `time` module.
+        status_file (str, optional): File, preferably on `/dev/shm`, in which `status` is published so that other
+            processes can read it with `sirup.StatusBlock.StatusBlock.open`. Processes forked from this one can read
+            `status` without it.
+        dns_cache (sirup.DNSCache.DNSCache, optional): Resolver for the sessions made by `session`. After each
+            connection, it switches to the nameservers of the new tunnel and keeps hot entries where it is safe.
+        warm_up_targets (list, optional): URLs of the hosts that the application talks to. After each connection,
+            connections to them are opened in the background, TLS handshake included, in the session returned by
+            `session`, so that the first requests on the new tunnel do not pay for them.
+        tunnel_options (sirup.TunnelOptions.TunnelOptions, optional): How each tunnel is opened, verified and
+            accounted: connect timeouts, local route checks, throughput tracking, `OpenVPN` tuning, in-place switching,
+            log size, verbosity and CPU scheduling. Defaults to `TunnelOptions()`.
+        selection (sirup.ServerSelection.ServerSelection, optional): Variant selector, lease registry and load feed
+            that decide which server is tried next. Defaults to `ServerSelection()`, which takes the servers in the
+            order of `config_queue`.
+        session_dir (sirup.TemporaryDirectoryWithRootPermission.TemporaryDirectoryWithRootPermission, optional):
+            Session directory shared with other rotators, for instance those of a
+            `sirup.MultiProviderRotator.MultiProviderRotator`. Its owner kills the running `OpenVPN` processes before
+            the rotators start and removes the directory after they are closed, so the rotator does neither.
 
     Attributes:
-        config_queue (sirup.utils.RotationList): List of `OpenVPN` configuration files.
+        config_queue (sirup.utils.RotationList): Queue of `OpenVPN` configuration files. Config files can be
+            disabled, re-weighted, added and removed without rebuilding the queue.
 
         auth_file (str): `OpenVPN` authentication file with the user credentials.
 
@@ -42,8 +95,51 @@ class IPRotator():
 
         pwd (str): User root password to access the `OpenVPN` command-line interface.
 
-        connector (None or sirup.VPNConnector.VPNConnector): If a VPN tunnel is active, the `sirup.VPNConnector` object that is responsible 
-            for the connection.
+        connector (None or sirup.VPNConnector.VPNConnector or sirup.WireGuardConnector.WireGuardConnector): If a VPN tunnel
+            is active, the connector object that is responsible for the connection.
+
+        session_dir (sirup.TemporaryDirectoryWithRootPermission.TemporaryDirectoryWithRootPermission): Directory for the files 
+            written by `OpenVPN`. The same files are reused across connections.
+
+        lock (threading.RLock): Held while the rotator connects, disconnects or rotates.
+
+        monitor (None or sirup.TunnelMonitor.TunnelMonitor): If started with `start_monitor`, the monitor that watches
+            the tunnel in the background.
+
+        throughput (dict): For each configuration file with recorded traffic, a dict with the number of `connections`,
+            the total `seconds` and `bytes_in` across them, the `mean_rate_in` over those seconds and the highest
+            `peak_rate_in`, in bytes per second.
+
+        remote_prober (sirup.RemoteProber.RemoteProber): Measures the round-trip time to the servers for `rank_by_rtt`.
+
+        config_watcher (None or sirup.ConfigWatcher.ConfigWatcher): If started with `watch_config_location`, the watcher
+            that applies changes in `config_location` to `config_queue`.
+
+        rtt (dict): Lowest round-trip time in seconds to the remotes of each configuration file, or `None` if
+            the remotes were unreachable, as of the latest `rank_by_rtt`.
+
+        history (sirup.ConnectionHistory.ConnectionHistory): Connection attempts and statistics per server.
+
+        tunnel_options (sirup.TunnelOptions.TunnelOptions): The options of the tunnels.
+
+        backend (None or callable): Creates the tunnel for a configuration file, if not chosen by extension.
+
+        status (sirup.StatusBlock.StatusBlock): The state of the rotator in shared memory: a generation counter
+            that increases with each connection, the connection state, the index of the current configuration file in
+            `config_ids`, the exit IP address and timestamps. Readers do not need a lock.
+
+        config_ids (dict): Maps each configuration file to a stable index, in the order in which the files were added.
+
+        clock (object): Source of the time and of the waiting between connection attempts.
+
+        dns_cache (None or sirup.DNSCache.DNSCache): The resolver of the sessions made by `session`.
+
+        selection (sirup.ServerSelection.ServerSelection): Chooses the server of each connection attempt.
+
+        warmer (None or sirup.SessionWarmer.SessionWarmer): With `warm_up_targets`, opens the connections to them.
+
+        server_load (dict): Load between 0 and 1 of each configuration file, or `None` if it is not in the feed, as of
+            the latest `rank_by_load`.
     """
 
     def __init__(self, # pylint: disable=too-many-arguments
@@ -52,19 +148,53 @@ class IPRotator():
                  pwd=None,
                  seed=None,
                  config_file_rule=None,
-                 track_ip=True):
+                 track_ip=True,
+                 history_file=None,
+                 backend=None,
+                 status_file=None,
+                 dns_cache=None,
+                 warm_up_targets=None,
+                 tunnel_options=None,
+                 selection=None,
+                 session_dir=None):
         # TODO: how to deal with properties from the VPNconnector? ie IP, is connected, base IP, ...
-        config_files = list_files_with_full_path(config_location, config_file_rule)
-        self.config_queue = RotationList(config_files)
+        self.config_queue = RotationList(list_files_with_full_path(config_location, config_file_rule))
+        self.config_ids = {config_file: i for i, config_file in enumerate(self.config_queue)}
         self.auth_file = auth_file
         self.randomizer = Random(seed)
         self.track_ip = track_ip
-        if pwd is None:
-            pwd = getpass.getpass("Please enter your sudo password: ")
-        assert check_password(pwd), "Wrong sudo password provided"
+        self.tunnel_options = tunnel_options if tunnel_options is not None else TunnelOptions()
+        self.throughput = {}
+        self.remote_prober = RemoteProber()
+        self.rtt = {}
+        self.history = ConnectionHistory(history_file)
+        self.dns_cache = dns_cache
+        self.warmer = SessionWarmer(warm_up_targets) if warm_up_targets else None
+        self._session = None
+        self.server_load = {}
+        self._load_generation = None
+        self.selection = selection if selection is not None else ServerSelection()
+        self.selection.learn_from(self.config_ids, self.history)
+        self.backend = backend
+        self._requires_root = getattr(backend, "requires_root", True)
+        self.clock = getattr(backend, "clock", None) or time
+        if self._requires_root:
+            if pwd is None:
+                pwd = getpass.getpass("Please enter your sudo password: ")
+            assert check_password(pwd), "Wrong sudo password provided"
         self.pwd = pwd
         self.connector = None # TODO: better name?
-        kill_all_connections(pwd)     
+        self._owns_session_dir = session_dir is None
+        if session_dir is None:
+            session_dir = TemporaryDirectoryWithRootPermission(password=pwd)
+        self.session_dir = session_dir
+        self.lock = threading.RLock()
+        self.monitor = None
+        self.config_watcher = None
+        self._config_changes = deque() # changes in `config_location` that wait for `self.lock`
+        self.status = StatusBlock(status_file)
+        if self._requires_root and self._owns_session_dir:
+            kill_all_connections(pwd)
 
         self._other_inputs = {
             "config_location": config_location,
@@ -87,49 +217,554 @@ class IPRotator():
         return inputs 
 
 
-    def connect(self, shuffle=False, max_trials=2000):
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+    def connect(self, shuffle=False, max_trials=2000, weighted=False, waiting_time=10):
         """Connect to the server associated with the first configuration file in `self.config_queue`.
 
         Args:
             shuffle (bool, optional): If True, shuffle the config files before connecting.
-            max_trials (int, optional): Maximum number of connection attempts before raising an exception.
+            max_trials (int, optional): Maximum number of failed connection attempts before raising an exception.
+            weighted (bool, optional): If True, draw each config file at random with probability proportional to its
+                weight in `self.config_queue` instead of taking them in rotation order.
+            waiting_time (float, optional): Seconds to wait after an attempt timed out; after every 20th, 30 times as
+                long. 0 tries the next server right away, for callers that back off themselves.
+
+        Raises:
+            TimeoutError: when `max_trials` attempts failed and the last one timed out.
+            requests.ConnectionError: when `max_trials` attempts failed and the last tunnel could not be verified.
+        """
+        with self.lock:
+            self.status.update(state="connecting", config_index=-1, exit_ip="", now=self.clock.time())
+            load_feed = self.selection.load_feed
+            if load_feed is not None:
+                load_feed.loads() # fetches the feed if it is due
+                if load_feed.generation != self._load_generation:
+                    self.rank_by_load()
+            try:
+                self._connect(shuffle, max_trials, weighted, waiting_time)
+            except BaseException:
+                self.status.update(state="disconnected", now=self.clock.time())
+                raise
+            self.status.update(state="connected", config_index=self.config_ids.get(self.connector.config_file, -1),
+                               exit_ip=self.connector.current_ip or "", new_generation=True, now=self.clock.time())
+            if self.dns_cache is not None:
+                self._switch_nameservers()
+            if self.warmer is not None:
+                self._warm_up()
+
+
+    def _switch_nameservers(self):
+        "Point `self.dns_cache` at the nameservers of the current tunnel."
+        try:
+            nameservers = self.connector.nameservers(self.pwd)
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Cannot read the nameservers of %s: %s", self.connector.config_file, e)
+            nameservers = []
+        self.dns_cache.rotate(nameservers)
+
+
+    def session(self):
+        """Make a `requests.Session` for requests through the tunnels of the rotator.
+
+        With `dns_cache`, the session resolves host names with it, through the current tunnel, and drops its
+        connections of earlier tunnels after a rotation. The session can be used across rotations.
+
+        With `warm_up_targets`, all calls return the same session, which receives the warm connections.
+
+        Returns:
+            requests.Session: the session.
         """
-        n_trials = 0 
+        if self.warmer is not None and self._session is not None:
+            return self._session
+        if self.dns_cache is None:
+            session = requests.Session()
+        else:
+            session = make_session(self.dns_cache)
+        if self.warmer is not None:
+            self._session = session
+        return session
+
+
+    def _warm_up(self):
+        "Drop the connections of the previous tunnel from the session and open new ones to the warm-up targets."
+        session = self.session()
+        for adapter in set(session.adapters.values()):
+            if isinstance(adapter, ResolvingAdapter):
+                adapter.drop_stale_connections()
+            else:
+                adapter.close()
+        self.warmer.start(session)
+
+
+    def _connect(self, shuffle, max_trials, weighted, waiting_time):
+        "Try the config files until a connection succeeds."
+        n_trials = 0
+        tried = set()
         if shuffle:
             self.config_queue.shuffle(self.randomizer)
         # try to connect; if it fails, change the server and retry
         while True:
-            connector = VPNConnector(self.config_queue.pop_append(), self.auth_file, track_ip=self.track_ip)
+            config_file, n_waits = self._next_server(weighted, tried, max_trials - n_trials)
+            n_trials += n_waits
+            connector = self._make_connector(config_file)
+            attempt_start = self.clock.time()
             try:
-                connector.connect(pwd=self.pwd)
+                connector.connect(pwd=self.pwd, timeout=self.timeout_for(config_file))
             except TimeoutError as e:
                 n_trials += 1
                 if n_trials >= max_trials:
+                    self._record_attempt(connector, attempt_start, "timeout", e)
+                    self.selection.release(config_file)
                     raise TimeoutError(f"Failed to connect to {max_trials} different servers.") from e 
-                waiting_time = 10
+                backoff = waiting_time
                 if n_trials % 20 == 0:
-                    waiting_time = 300 # try to see whether this helps
-                    logging.info("Failed to connect %d times; waiting %d", n_trials, waiting_time)
-                time.sleep(waiting_time)
-            except requests.ConnectionError:
-                kill_all_connections(self.pwd)
-                time.sleep(5)
+                    backoff = 30 * waiting_time # try to see whether this helps
+                    logging.info("Failed to connect %d times; waiting %d", n_trials, backoff)
+                self._record_attempt(connector, attempt_start, "timeout", e, backoff=backoff)
+                if backoff > 0:
+                    self.clock.sleep(backoff)
+            except requests.ConnectionError as e:
+                n_trials += 1
+                last_attempt = n_trials >= max_trials
+                self._record_attempt(connector, attempt_start, "connection_error", e, backoff=0 if last_attempt else 5)
+                if self._requires_root:
+                    kill_all_connections(self.pwd)
+                else:
+                    connector.stop(self.pwd)
+                if last_attempt:
+                    self.selection.release(config_file)
+                    raise requests.ConnectionError(f"Failed to connect to {max_trials} different servers.") from e
+                self.clock.sleep(5)
+            except Exception as e:
+                self._record_attempt(connector, attempt_start, "error", e)
+                self.selection.release(config_file)
+                raise
+            else:
+                self._record_attempt(connector, attempt_start, "success")
             
             if connector.is_connected():
                 break
+            tried.add(config_file)
+            self.selection.release(config_file)
 
         self.connector = connector
+        self.selection.connected(config_file)
+
+
+    def _next_server(self, weighted, tried, max_waits):
+        """Take the next server from `self.config_queue` and lease it.
+
+        Another variant of the server of the previous connection is skipped, unless there is no other server. When
+        all servers are leased by other nodes, the rotator waits 10 seconds and tries again, at most `max_waits` times.
+
+        Returns:
+            tuple: the configuration file to connect with, and the number of times the rotator waited.
+        """
+        n_unavailable = 0
+        n_skipped = 0
+        n_waits = 0
+        while True:
+            self._apply_config_changes()
+            if weighted:
+                config_file = self.config_queue.sample(self.randomizer)
+            else:
+                config_file = self.config_queue.pop_append()
+            if self.selection.is_previous_server(config_file) and n_skipped < len(self.config_queue):
+                n_skipped += 1
+                continue
+            config_file = self.selection.choose(config_file, available=self.config_queue, exclude=tried)
+            if self.selection.acquire(config_file):
+                return config_file, n_waits
+            n_unavailable += 1
+            if n_unavailable >= len(self.config_queue):
+                n_unavailable = 0
+                n_waits += 1
+                if n_waits >= max_waits:
+                    raise TimeoutError("All servers are leased by other nodes or at the limit of their account.")
+                logging.info("All servers are leased by other nodes; waiting 10 seconds.")
+                self.clock.sleep(10)
+
+
+    def timeout_for(self, config_file):
+        """The connect timeout of a server under the `connect_timeout` of `self.tunnel_options`.
+
+        Args:
+            config_file (str): the configuration file of the server.
+
+        Returns:
+            None or float: the timeout in seconds, or `None` for the default of the connector.
+        """
+        connect_timeout = self.tunnel_options.connect_timeout
+        if isinstance(connect_timeout, AdaptiveTimeout):
+            return self.history.timeout(config_file, connect_timeout)
+        return connect_timeout
+
+
+    def _record_attempt(self, connector, start, outcome, exception=None, backoff=0.0): # pylint: disable=too-many-arguments
+        "Add a connection attempt to `self.history`."
+        phase_times = dict(connector.phase_times)
+        phase_times["end"] = self.clock.time()
+        exit_ip = connector.current_ip if outcome == "success" and self.track_ip else None
+        self.history.record(connector.config_file, start, phase_times, outcome,
+                            exception=type(exception).__name__ if exception is not None else None,
+                            exit_ip=exit_ip, backoff=backoff)
+        self.selection.record(connector.config_file, outcome)
+
+
+    def _make_connector(self, config_file):
+        "Create the connector for a configuration file with `self.backend`, or depending on its extension."
+        verification = self.tunnel_options.verification()
+        if self.backend is not None:
+            work_dir = self.session_dir.tunnel_dir("tunnel0") if self._requires_root else None
+            return self.backend(config_file, self.auth_file, track_ip=self.track_ip, work_dir=work_dir, **verification)
+        work_dir = self.session_dir.tunnel_dir("tunnel0")
+        if config_file.endswith(".conf"):
+            return WireGuardConnector(config_file, self.auth_file, track_ip=self.track_ip, work_dir=work_dir,
+                                      **verification)
+        return VPNConnector(config_file, self.auth_file, track_ip=self.track_ip, work_dir=work_dir,
+                            **self.tunnel_options.openvpn_arguments(config_file), **verification)
 
     
     def disconnect(self):
         """Disconnect from the current server.
         """
-        self.connector.disconnect(self.pwd)
-        self.connector = None
+        with self.lock:
+            self.status.update(state="disconnecting", now=self.clock.time())
+            try:
+                self.connector.disconnect(self.pwd)
+            finally:
+                self.selection.release(self.connector.config_file)
+                self._record_traffic(self.connector.traffic_summary)
+                self.status.update(state="disconnected", config_index=-1, exit_ip="", now=self.clock.time())
+            self.connector = None
+
+
+    def _record_traffic(self, summary):
+        "Add the traffic summary of a closed tunnel to `self.throughput`."
+        if summary is None:
+            return
+        stats = self.throughput.setdefault(summary["config_file"], {"connections": 0, "seconds": 0.0, "bytes_in": 0,
+                                                                    "mean_rate_in": 0.0, "peak_rate_in": 0.0})
+        delivered = stats["mean_rate_in"] * stats["seconds"] + summary["mean_rate_in"] * summary["seconds"]
+        stats["connections"] += 1
+        stats["seconds"] += summary["seconds"]
+        stats["bytes_in"] += summary["bytes_in"]
+        stats["mean_rate_in"] = delivered / stats["seconds"]
+        stats["peak_rate_in"] = max(stats["peak_rate_in"], summary["peak_rate_in"])
+
+
+    def rank_by_throughput(self):
+        """Reorder `self.config_queue` so that servers with the highest observed throughput come first.
+
+        Servers are ordered by the `mean_rate_in` recorded in `self.throughput`, the rate they delivered over whole
+        connections; a short burst does not lift a server that is slow otherwise. Servers without recorded traffic
+        keep their relative order and come after the ones with recorded traffic.
+        """
+        def throughput_key(config_file):
+            stats = self.throughput.get(config_file)
+            if stats is None:
+                return (1, 0.0)
+            return (0, -stats["mean_rate_in"])
+
+        with self.lock:
+            self.config_queue.sort(key=throughput_key)
 
 
     def rotate(self):
         """Rotate to the next server.
         """
-        self.disconnect()
-        self.connect()
\ No newline at end of file
+        with self.lock:
+            if self.tunnel_options.switch_in_place and self._switch_in_place():
+                return
+            self.disconnect()
+            self.connect()
+
+
+    def _switch_in_place(self):
+        "Move the current `OpenVPN` process to the next configuration file if they are compatible."
+        connector = self.connector
+        if not getattr(connector, "in_place", False) or len(self.config_queue) == 0:
+            return False
+        config_file = self.config_queue[0]
+        if config_file.endswith(".conf") or config_fingerprint(config_file) != config_fingerprint(connector.config_file):
+            return False
+        if self.selection.is_previous_server(config_file):
+            return False # another variant of the same server; `connect` moves on to another server
+        if not self.selection.acquire(config_file):
+            return False
+        previous_config_file = connector.config_file
+        self.config_queue.pop_append()
+        self.status.update(state="connecting", config_index=-1, exit_ip="", now=self.clock.time())
+        attempt_start = self.clock.time()
+        try:
+            connector.switch(config_file, timeout=self.timeout_for(config_file))
+        except (OSError, RuntimeError, ValueError) as e: # TimeoutError and the connection errors of requests are OSErrors
+            outcome = "timeout" if isinstance(e, TimeoutError) else "connection_error"
+            self._record_attempt(connector, attempt_start, outcome, e)
+            if connector.config_file != previous_config_file:
+                self.selection.release(previous_config_file) # the process left it; `disconnect` releases `config_file`
+            else:
+                self.selection.release(config_file)
+            logging.info("Switching to %s in place failed (%r); starting a new process.", config_file, e)
+            return False
+        finally:
+            self._record_traffic(connector.traffic_summary)
+        self._record_attempt(connector, attempt_start, "success")
+        self.selection.connected(config_file)
+        if previous_config_file != config_file:
+            self.selection.release(previous_config_file)
+        self.status.update(state="connected", config_index=self.config_ids.get(config_file, -1),
+                           exit_ip=connector.current_ip or "", new_generation=True, now=self.clock.time())
+        if self.dns_cache is not None:
+            self._switch_nameservers()
+        if self.warmer is not None:
+            self._warm_up()
+        return True
+
+
+    def reconnect(self):
+        """Reconnect to the server of the current connection. If that fails, connect to the next server instead.
+        """
+        with self.lock:
+            config_file = self.connector.config_file
+            try:
+                self.disconnect()
+            except RuntimeWarning as w: # the tunnel is gone, even if the base IP changed
+                logging.info("Disconnecting from %s: %s", config_file, w)
+                self.connector = None
+            if not self.selection.acquire(config_file):
+                logging.info("%s was leased by another node; connecting to the next server.", config_file)
+                self.connect()
+                return
+            connector = self._make_connector(config_file)
+            try:
+                connector.connect(pwd=self.pwd, timeout=self.timeout_for(config_file))
+            except (TimeoutError, requests.ConnectionError) as e:
+                self.selection.release(config_file)
+                logging.info("Reconnecting to %s failed (%r); connecting to the next server.", config_file, e)
+                self.connect()
+                return
+            self.connector = connector
+
+
+    def start_monitor(self, **kwargs):
+        """Watch the tunnel in a background thread, and reconnect or rotate when it fails.
+
+        Args:
+            **kwargs: passed on to `sirup.TunnelMonitor.TunnelMonitor`, for instance `stall_timeout`, `probe`,
+                `action`, `on_failure` and `on_recovery`.
+
+        Returns:
+            sirup.TunnelMonitor.TunnelMonitor: the running monitor, also available as `self.monitor`.
+        """
+        self.stop_monitor()
+        self.monitor = TunnelMonitor(self, **kwargs)
+        self.monitor.start()
+        return self.monitor
+
+
+    def stop_monitor(self):
+        """Stop watching the tunnel.
+        """
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
+
+
+    def watch_config_location(self):
+        """Apply changes in `config_location` to `self.config_queue` while the rotator is running.
+
+        New configuration files are added at the end of the rotation, removed ones are taken out of it. Edited files
+        keep their position and their statistics; `OpenVPN` reads them again at the next connection. An active tunnel
+        is not affected, also not when its configuration file is removed.
+
+        The watcher does not wait for `self.lock`: while the rotator holds it, for instance during the back-off of
+        `connect`, the changes are queued and applied before the next connection attempt.
+
+        Returns:
+            sirup.ConfigWatcher.ConfigWatcher: the running watcher, also available as `self.config_watcher`.
+        """
+        self.stop_watching_config_location()
+        known_files = list(self.config_queue) + self.config_queue.disabled
+        self.config_watcher = ConfigWatcher(self._other_inputs["config_location"],
+                                            on_added=lambda path: self._queue_config_change("added", path),
+                                            on_removed=lambda path: self._queue_config_change("removed", path),
+                                            on_modified=lambda path: self._queue_config_change("modified", path),
+                                            rule=self._other_inputs["config_file_rule"],
+                                            known_files=known_files)
+        self.config_watcher.start()
+        return self.config_watcher
+
+
+    def stop_watching_config_location(self):
+        """Stop applying changes in `config_location`.
+        """
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+            self.config_watcher = None
+
+
+    def _queue_config_change(self, change, config_file):
+        "Called by the watcher thread: queue a change and apply the queue unless the rotator holds `self.lock`."
+        self._config_changes.append((change, config_file))
+        # a `with` block cannot give up when the rotator is busy; the rotator applies the queue before its next attempt
+        if not self.lock.acquire(blocking=False): # pylint: disable=consider-using-with
+            return
+        try:
+            self._apply_config_changes()
+        finally:
+            self.lock.release()
+
+
+    def _apply_config_changes(self):
+        "Apply the queued changes in `config_location`. Called with `self.lock` held."
+        handlers = {"added": self._add_config_file, "removed": self._remove_config_file,
+                    "modified": self._config_file_modified}
+        while self._config_changes:
+            change, config_file = self._config_changes.popleft()
+            handlers[change](config_file)
+
+
+    def _add_config_file(self, config_file):
+        if config_file not in self.config_queue and config_file not in self.config_queue.disabled:
+            self.config_queue.append(config_file)
+            self.config_ids.setdefault(config_file, len(self.config_ids))
+            self.selection.add(config_file)
+            logging.info("Added %s to the rotation.", config_file)
+
+
+    def _remove_config_file(self, config_file):
+        if config_file in self.config_queue or config_file in self.config_queue.disabled:
+            self.config_queue.remove(config_file)
+            self.selection.remove(config_file)
+            logging.info("Removed %s from the rotation.", config_file)
+
+
+    def _config_file_modified(self, config_file):
+        logging.info("%s was modified; the new version is used at the next connection.", config_file)
+        self.selection.modified(config_file)
+
+
+    def close(self):
+        """Stop the monitor, disconnect if a tunnel is active and remove the temporary files written by `OpenVPN`
+        and the file of `status_file`, unless the session directory is shared. Processes that opened the status record keep their copy.
+        """
+        self.stop_monitor()
+        self.stop_watching_config_location()
+        with self.lock:
+            if self.connector is not None:
+                self.disconnect()
+            if self._owns_session_dir:
+                self.session_dir.cleanup()
+            self.status.unlink()
+            self.history.close()
+            self.selection.close()
+            if self._session is not None:
+                self.warmer.cancel()
+                self._session.close()
+                self._session = None
+
+
+    def rank_by_history(self):
+        """Reorder `self.config_queue` by the connection attempts in `self.history`.
+
+        Servers are ordered by their failure rate, and then by their median connect time. Servers without recorded
+        attempts keep their relative order and are ranked like servers with a failure rate of 50%.
+        """
+        summaries = self.history.summarize()
+
+        def history_key(config_file):
+            summary = summaries.get(config_file)
+            if summary is None:
+                return (0.5, float("inf"))
+            median = summary["p50"] if summary["p50"] is not None else float("inf")
+            return (summary["failure_rate"], median)
+
+        with self.lock:
+            self.config_queue.sort(key=history_key)
+
+
+    def rank_by_load(self, feed=None, max_load=0.9):
+        """Reorder `self.config_queue` by the server loads of a feed, least loaded first.
+
+        Servers with a load below `max_load` come first, least loaded first. Servers that are not in the feed keep their
+        relative order and come next, followed by the servers at `max_load` or above, least loaded first.
+
+        Args:
+            feed (sirup.LoadFeed.LoadFeed, optional): the feed. Defaults to the `load_feed` of `self.selection`.
+            max_load (float, optional): Load between 0 and 1 from which a server counts as overloaded.
+        """
+        if feed is None:
+            feed = self.selection.load_feed
+        with self.lock:
+            self.server_load = {config_file: feed.load_of(config_file) for config_file in self.config_queue}
+            self._load_generation = feed.generation
+
+            def load_key(config_file):
+                load = self.server_load.get(config_file)
+                if load is None:
+                    return (1, 0.0)
+                return (0 if load < max_load else 2, load)
+
+            self.config_queue.sort(key=load_key)
+
+
+    def rank_by_rtt(self, prober=None):
+        """Probe the remotes of all configuration files and reorder `self.config_queue` by round-trip time.
+
+        Reachable servers come first, closest first. Unreachable servers, and servers that cannot be probed
+        (for instance UDP servers with `tls-auth`), keep their relative order and come last. No tunnel is opened;
+        results are cached by the prober, so calling this again within the prober's `ttl` is cheap.
+
+        Args:
+            prober (sirup.RemoteProber.RemoteProber, optional): the prober to use. Defaults to `self.remote_prober`.
+        """
+        if prober is None:
+            prober = self.remote_prober
+        self.rtt = prober.probe_configs(list(self.config_queue))
+
+        def rtt_key(config_file):
+            rtt = self.rtt.get(config_file)
+            if rtt is None:
+                return (1, 0.0)
+            return (0, rtt)
+
+        with self.lock:
+            self.config_queue.sort(key=rtt_key)
+
+
+    def load_probe_report(self, path, disable_failed=True):
+        """Reorder `self.config_queue` by a report of `sirup probe` and take failed servers out of the rotation.
+
+        Servers that passed the check come first, fastest connection first, followed by servers that were not
+        checked, in their current order. Servers that failed the check are disabled, or come last if
+        `disable_failed` is False. Disabled servers can be enabled again with `self.config_queue.enable`.
+
+        Args:
+            path (str): the JSON report written by `sirup probe` or `sirup.HealthCheck.HealthCheck.write_report`.
+            disable_failed (bool, optional): If True, disable the servers that failed the check.
+        """
+        results = read_report(path)
+
+        def report_key(config_file):
+            result = results.get(config_file)
+            if result is None:
+                return (1, 0.0)
+            if result["success"]:
+                return (0, result["connect_time"])
+            return (2, 0.0)
+
+        with self.lock:
+            if disable_failed:
+                for config_file in list(self.config_queue):
+                    result = results.get(config_file)
+                    if result is not None and not result["success"]:
+                        self.config_queue.disable(config_file)
+            self.config_queue.sort(key=report_key)
@@ -0,0 +1,386 @@
+"Coordinate the servers used by several rotators with time-limited leases"
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import requests
+
+
+def server_key(config_file):
+    """The name under which a server is leased, so that nodes with the configuration files in different directories
+    agree on it.
+
+    Args:
+        config_file (str): Full path and file name of the configuration file.
+
+    Returns:
+        tuple: `(server, account)`, where `account` is the name of the directory of the file, that is the provider,
+          and `server` is `account/file name`.
+    """
+    account = os.path.basename(os.path.dirname(os.path.abspath(config_file)))
+    return f"{account}/{os.path.basename(config_file)}", account
+
+
+class LeaseRegistry():
+    """Base class for a registry of the servers that the nodes of a fleet are connected to.
+
+    A node leases a server before it connects to it. A lease expires after `ttl` seconds unless it is renewed; the
+    registry renews the leases of this node in a background thread, so that leases of nodes that crashed run out
+    while live nodes keep theirs. A server leased by another node cannot be leased, and a node cannot lease more
+    servers of an account than its entry in `limits` allows, counting the leases of all nodes.
+
+    Subclasses store the leases, atomically, in `_acquire`, `_renew`, `_release` and `_leases`.
+
+    Args:
+        node (str, optional): Name of this node. Defaults to `hostname:pid`.
+        ttl (float, optional): Number of seconds a lease lasts without renewal.
+        limits (dict, optional): Maximum number of concurrent sessions per account, for instance `{"provider": 10}`.
+            Accounts without an entry are not limited.
+
+    Attributes:
+        held (set): The servers leased by this node.
+    """
+
+    def __init__(self, node=None, ttl=300.0, limits=None):
+        self.node = node if node is not None else f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl
+        self.limits = dict(limits) if limits is not None else {}
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(node={self.node!r}, ttl={self.ttl!r}, limits={self.limits!r})"
+
+
+    def acquire(self, config_file):
+        """Lease the server of a configuration file for this node.
+
+        Args:
+            config_file (str): Full path and file name of the configuration file.
+
+        Returns:
+            bool: True if the server is leased to this node, False if another node holds it or the limit of the
+              account is reached.
+        """
+        server, account = server_key(config_file)
+        if not self._acquire(server, account, self.node, self.ttl, self.limits.get(account)):
+            return False
+        with self._lock:
+            self.held.add(server)
+        self._start_renewal()
+        return True
+
+
+    def release(self, config_file):
+        """End the lease of the server of a configuration file. Does nothing if this node does not hold it.
+
+        Args:
+            config_file (str): Full path and file name of the configuration file.
+        """
+        server, _ = server_key(config_file)
+        with self._lock:
+            self.held.discard(server)
+        self._release(server, self.node)
+
+
+    def held_elsewhere(self):
+        """The servers currently leased by other nodes.
+
+        Returns:
+            set: the servers, named as by `server_key`.
+        """
+        return {lease["server"] for lease in self.leases() if lease["node"] != self.node}
+
+
+    def leases(self):
+        """List the leases that have not expired.
+
+        Returns:
+            list: dicts with the `server`, its `account`, the `node` that holds it and the number of seconds until
+              the lease `expires`.
+        """
+        return self._leases()
+
+
+    def renew(self):
+        "Extend the leases of this node by `ttl` seconds. Leases that were lost in the meantime are dropped."
+        with self._lock:
+            held = list(self.held)
+        for server in held:
+            if not self._renew(server, self.node, self.ttl):
+                logging.info("The lease of %s expired.", server)
+                with self._lock:
+                    self.held.discard(server)
+
+
+    def _start_renewal(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="sirup-lease-renewal", daemon=True)
+            self._thread.start()
+
+
+    def _run(self):
+        while not self._stop_event.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except Exception as e: #pylint: disable=broad-except
+                logging.info("Cannot renew the leases: %s", e)
+
+
+    def close(self):
+        "Stop renewing and release all leases of this node."
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            held = list(self.held)
+            self.held.clear()
+        for server in held:
+            try:
+                self._release(server, self.node)
+            except Exception as e: #pylint: disable=broad-except
+                logging.info("Cannot release %s: %s", server, e)
+
+
+    def _acquire(self, server, account, node, ttl, limit): # pylint: disable=too-many-arguments
+        "Lease `server` to `node` for `ttl` seconds unless another node holds it or `account` has `limit` leases."
+        raise NotImplementedError
+
+
+    def _renew(self, server, node, ttl):
+        "Extend the lease of `node` on `server`; return False if it does not hold it anymore."
+        raise NotImplementedError
+
+
+    def _release(self, server, node):
+        "End the lease of `node` on `server`."
+        raise NotImplementedError
+
+
+    def _leases(self):
+        "Return the leases that have not expired."
+        raise NotImplementedError
+
+
+class SQLiteLeaseRegistry(LeaseRegistry):
+    """Leases in an SQLite database, for nodes that share a file system, or for the nodes on one host.
+
+    Each change runs in an exclusive transaction, so that two nodes never lease the same server. The clocks of the
+    nodes should be synchronized, for instance with NTP, as the expiry of the leases is stored as a time stamp.
+
+    Args:
+        path (str, optional): The database file, created if needed. `":memory:"` keeps the leases in this process,
+            which is useful behind `LeaseServer`.
+        clock (object, optional): Provides `time()`. Defaults to the `time` module.
+        **kwargs: Passed to `LeaseRegistry`.
+    """
+
+    def __init__(self, path=":memory:", clock=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.clock = clock if clock is not None else time
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._connection.execute("CREATE TABLE IF NOT EXISTS leases "
+                                 "(server TEXT PRIMARY KEY, account TEXT, node TEXT, expires REAL)")
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r}, node={self.node!r}, ttl={self.ttl!r})"
+
+
+    def _transaction(self, function):
+        "Run `function(cursor, now)` in an exclusive transaction and return its result."
+        with self._db_lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                now = self.clock.time()
+                cursor.execute("DELETE FROM leases WHERE expires <= ?", (now,))
+                result = function(cursor, now)
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            return result
+
+
+    def _acquire(self, server, account, node, ttl, limit): # pylint: disable=too-many-arguments
+        def acquire(cursor, now):
+            row = cursor.execute("SELECT node FROM leases WHERE server = ?", (server,)).fetchone()
+            if row is not None and row[0] != node:
+                return False
+            if row is None and limit is not None:
+                (count,) = cursor.execute("SELECT COUNT(*) FROM leases WHERE account = ?", (account,)).fetchone()
+                if count >= limit:
+                    return False
+            cursor.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)", (server, account, node, now + ttl))
+            return True
+        return self._transaction(acquire)
+
+
+    def _renew(self, server, node, ttl):
+        def renew(cursor, now):
+            cursor.execute("UPDATE leases SET expires = ? WHERE server = ? AND node = ?", (now + ttl, server, node))
+            return cursor.rowcount > 0
+        return self._transaction(renew)
+
+
+    def _release(self, server, node):
+        self._transaction(lambda cursor, now: cursor.execute("DELETE FROM leases WHERE server = ? AND node = ?",
+                                                             (server, node)))
+
+
+    def _leases(self):
+        def leases(cursor, now):
+            rows = cursor.execute("SELECT server, account, node, expires FROM leases ORDER BY server").fetchall()
+            return [{"server": server, "account": account, "node": node, "expires": expires - now}
+                    for server, account, node, expires in rows]
+        return self._transaction(leases)
+
+
+class HTTPLeaseRegistry(LeaseRegistry):
+    """Leases kept by a network service, for nodes on different hosts.
+
+    The service answers `POST` requests to `/acquire`, `/renew`, `/release` and `/leases` with JSON bodies, as
+    `LeaseServer` does. The expiry of the leases is computed by the service, so the clocks of the nodes do not matter.
+
+    Args:
+        url (str): Base URL of the service, for instance `http://leases.example.org:8700`.
+        timeout (float, optional): Maximum number of seconds to wait for the service.
+        **kwargs: Passed to `LeaseRegistry`.
+
+    Raises:
+        requests.RequestException: from the methods, when the service cannot be reached, does not answer within
+            `timeout` or answers with an HTTP error.
+        ValueError, KeyError: from the methods, when the answer is not the expected JSON.
+    """
+
+    def __init__(self, url, timeout=5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.url!r}, node={self.node!r}, ttl={self.ttl!r})"
+
+
+    def _post(self, operation, **body):
+        response = self._session.post(f"{self.url}/{operation}", json=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["result"]
+
+
+    def _acquire(self, server, account, node, ttl, limit): # pylint: disable=too-many-arguments
+        return self._post("acquire", server=server, account=account, node=node, ttl=ttl, limit=limit)
+
+
+    def _renew(self, server, node, ttl):
+        return self._post("renew", server=server, node=node, ttl=ttl)
+
+
+    def _release(self, server, node):
+        self._post("release", server=server, node=node)
+
+
+    def _leases(self):
+        return self._post("leases")
+
+
+class LeaseServer():
+    """Serve a registry over HTTP for `HTTPLeaseRegistry`.
+
+    This is a small stand-in for a network store: run it on one host, or on each test machine, with an
+    `SQLiteLeaseRegistry`. Requests are served by threads; the registry serializes the changes.
+
+    Args:
+        registry (LeaseRegistry, optional): The registry that stores the leases. Defaults to an in-memory
+            `SQLiteLeaseRegistry`.
+        host (str, optional): Address to listen on.
+        port (int, optional): Port to listen on; 0 picks a free port.
+
+    Attributes:
+        url (str): The base URL of the server, once started.
+    """
+
+    def __init__(self, registry=None, host="127.0.0.1", port=8700):
+        self.registry = registry if registry is not None else SQLiteLeaseRegistry()
+        self.host = host
+        self.port = port
+        self.url = None
+        self._server = None
+        self._thread = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(host={self.host!r}, port={self.port!r})"
+
+
+    def _handle(self, operation, body):
+        "Carry out an operation of the protocol."
+        registry = self.registry
+        if operation == "acquire":
+            return registry._acquire(body["server"], body["account"], body["node"], # pylint: disable=protected-access
+                                     body["ttl"], body.get("limit"))
+        if operation == "renew":
+            return registry._renew(body["server"], body["node"], body["ttl"]) # pylint: disable=protected-access
+        if operation == "release":
+            return registry._release(body["server"], body["node"]) # pylint: disable=protected-access
+        if operation == "leases":
+            return registry._leases() # pylint: disable=protected-access
+        raise KeyError(operation)
+
+
+    def start(self):
+        "Start serving in a background thread."
+        handle = self._handle
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self): # pylint: disable=invalid-name
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    payload = json.dumps({"result": handle(self.path.strip("/"), body)}).encode()
+                    status = 200
+                except (KeyError, ValueError, TypeError) as e:
+                    payload = json.dumps({"error": repr(e)}).encode()
+                    status = 400
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                logging.debug("Lease server: " + format, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{self.host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="sirup-lease-server", daemon=True)
+        self._thread.start()
+        logging.info("Serving leases at %s.", self.url)
+
+
+    def close(self):
+        "Stop serving."
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
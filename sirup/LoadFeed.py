@@ -0,0 +1,243 @@
+"Read the server load published by VPN providers, and map it to the configuration files"
+
+import functools
+import json
+import logging
+import threading
+import time
+import requests
+from .ovpn_config import read_remotes
+
+
+_HOST_KEYS = ("hostname", "host", "domain", "name", "station", "ip")
+_LOAD_KEYS = ("load", "load_percent", "utilization")
+
+
+def _as_fraction(value, percent):
+    value = float(value)
+    return value / 100 if percent else value
+
+
+def parse_loads(data, percent=True):
+    """Extract the load of each server from a provider feed.
+
+    Two shapes are understood: an object that maps host names to loads, and a list of objects (possibly under the
+    key `"servers"`) with a host name in one of the keys `hostname`, `host`, `domain`, `name`, `station` or `ip`, and
+    either a load in `load`, `load_percent` or `utilization`, or `sessions` (or `users`) and `capacity`
+    (or `max_sessions`). Entries without a host name or a load are skipped.
+
+    The unit cannot be told from the values: in a feed of integer percentages, a server at 1 % has the load 1.
+    `load_percent` is always a percentage and `sessions` over `capacity` always a ratio; `percent` gives the unit of
+    the other loads.
+
+    Args:
+        data (dict or list): the decoded JSON feed.
+        percent (bool, optional): If True, the loads are percentages from 0 to 100; otherwise fractions from 0 to 1.
+
+    Returns:
+        dict: maps each lower-case host name to its load between 0 and 1.
+    """
+    if isinstance(data, dict) and "servers" in data:
+        data = data["servers"]
+    loads = {}
+    if isinstance(data, dict):
+        for host, load in data.items():
+            try:
+                loads[str(host).lower()] = _as_fraction(load, percent)
+            except (TypeError, ValueError):
+                continue
+        return loads
+    for entry in data:
+        host = next((entry[key] for key in _HOST_KEYS if entry.get(key)), None)
+        if host is None:
+            continue
+        load_key = next((key for key in _LOAD_KEYS if entry.get(key) is not None), None)
+        try:
+            if load_key is not None:
+                loads[str(host).lower()] = _as_fraction(entry[load_key], percent or load_key == "load_percent")
+            else:
+                sessions = entry.get("sessions", entry.get("users"))
+                capacity = entry.get("capacity", entry.get("max_sessions"))
+                loads[str(host).lower()] = float(sessions) / float(capacity)
+        except (TypeError, ValueError, ZeroDivisionError):
+            continue
+    return loads
+
+
+class FileLoadSource():
+    """A load feed saved in a JSON file, for instance by a cron job, or for tests.
+
+    Args:
+        path (str): the JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r})"
+
+
+    def fetch(self):
+        """Read the feed.
+
+        Returns:
+            dict or list: the decoded JSON.
+        """
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+
+class HTTPLoadSource():
+    """A load feed published by a provider over HTTP.
+
+    Args:
+        url (str): the URL of the JSON feed.
+        timeout (float, optional): Maximum number of seconds to wait for the feed.
+        headers (dict, optional): Headers of the request, for instance an API token.
+    """
+
+    def __init__(self, url, timeout=10.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = headers
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.url!r})"
+
+
+    def fetch(self):
+        """Download the feed.
+
+        Returns:
+            dict or list: the decoded JSON.
+
+        Raises:
+            requests.RequestException: when the feed cannot be downloaded.
+        """
+        response = requests.get(self.url, timeout=self.timeout, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+
+class LoadFeed():
+    """Cache of the server loads of a feed, refreshed every `interval` seconds, and mapped to configuration files
+    through the host names of their remotes.
+
+    The feed is fetched when the cache is older than `interval`, or in a background thread after `start`. When a fetch
+    fails, the previous loads are kept until the next fetch is due.
+
+    Args:
+        source (object): Provides `fetch()`, which returns the decoded feed, for instance `FileLoadSource` or
+            `HTTPLoadSource`.
+        interval (float, optional): Seconds between two fetches.
+        parser (callable, optional): Turns the decoded feed into a dict of host names and loads. Defaults to
+            `parse_loads` with `percent`.
+        clock (object, optional): Provides `time()`. Defaults to the `time` module.
+        percent (bool, optional): If True, the loads in the feed are percentages from 0 to 100; otherwise fractions
+            from 0 to 1. Ignored with `parser`.
+
+    Attributes:
+        generation (int): Number of successful fetches, so that users can tell when the loads changed.
+        fetched_at (None or float): Time of the latest successful fetch.
+    """
+
+    def __init__(self, source, interval=300.0, parser=None, clock=None, percent=True): # pylint: disable=too-many-arguments
+        self.source = source
+        self.interval = interval
+        self.parser = parser if parser is not None else functools.partial(parse_loads, percent=percent)
+        self.clock = clock if clock is not None else time
+        self.generation = 0
+        self.fetched_at = None
+        self._attempted_at = None # failed fetches are not retried before `interval` either
+        self._loads = {}
+        self._remotes = {} # config file -> host names of its remotes
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.source!r}, interval={self.interval!r})"
+
+
+    def refresh(self):
+        """Fetch the feed now.
+
+        Returns:
+            bool: True if the feed was fetched and parsed.
+        """
+        self._attempted_at = self.clock.time()
+        try:
+            loads = self.parser(self.source.fetch())
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Cannot fetch the server loads from %r: %s", self.source, e)
+            return False
+        with self._lock:
+            self._loads = loads
+            self.fetched_at = self.clock.time()
+            self.generation += 1
+        return True
+
+
+    def loads(self):
+        """The loads of all servers in the feed, fetched again if they are older than `interval`.
+
+        Returns:
+            dict: maps each lower-case host name to its load between 0 and 1.
+        """
+        if self._thread is None and (self._attempted_at is None
+                                     or self.clock.time() - self._attempted_at >= self.interval):
+            self.refresh()
+        return self._loads
+
+
+    def load_of(self, config_file):
+        """The load of the server of a configuration file: that of its first remote listed in the feed.
+
+        Args:
+            config_file (str): path to the configuration file.
+
+        Returns:
+            None or float: the load between 0 and 1, or `None` if none of the remotes is in the feed.
+        """
+        loads = self.loads()
+        hosts = self._remotes.get(config_file)
+        if hosts is None:
+            try:
+                hosts = [host.lower() for host, _, _ in read_remotes(config_file)]
+            except OSError as e:
+                logging.info("Cannot read %s: %s", config_file, e)
+                hosts = []
+            self._remotes[config_file] = hosts
+        return next((loads[host] for host in hosts if host in loads), None)
+
+
+    def forget(self, config_file):
+        "Read the remotes of a configuration file again at the next `load_of`, for instance after it was edited."
+        self._remotes.pop(config_file, None)
+
+
+    def start(self):
+        "Fetch the feed now and then every `interval` seconds in a background thread."
+        if self._thread is not None:
+            return
+        self.refresh()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sirup-load-feed", daemon=True)
+        self._thread.start()
+
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.refresh()
+
+
+    def stop(self):
+        "Stop fetching in the background."
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
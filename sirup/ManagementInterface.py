@@ -0,0 +1,253 @@
+"Talk to a running OpenVPN process through its management interface"
+
+import logging
+import queue
+import socket
+import threading
+import time
+
+
+class ManagementInterface():
+    """Client for the management interface of an `OpenVPN` process listening on a unix domain socket.
+
+    `OpenVPN` is started with `--management <socket_path> unix`. The interface accepts one client at a time,
+    so a single `ManagementInterface` should be shared by everything that talks to the same process.
+
+    A background thread reads from the socket. Lines starting with `>` are real-time notifications; they are
+    stored in `notifications` and passed on to the handlers registered with `add_handler`. All other lines
+    are answers to commands sent with `command`.
+
+    Args:
+        socket_path (str): Path of the unix domain socket of the management interface.
+        timeout (float, optional): Number of seconds to wait for the answer to a command.
+
+    Attributes:
+        socket_path (str): Path of the unix domain socket of the management interface.
+        timeout (float): Number of seconds to wait for the answer to a command.
+        notifications (dict): Latest payload of each type of real-time notification, for instance
+            `{"BYTECOUNT": "1024,512"}`.
+        bytes_in (None or int): Bytes received by the tunnel, from the latest `BYTECOUNT` notification.
+        bytes_out (None or int): Bytes sent through the tunnel, from the latest `BYTECOUNT` notification.
+        bytecount_time (None or float): Time at which the latest `BYTECOUNT` notification was received.
+    """
+
+    def __init__(self, socket_path, timeout=5):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.notifications = {}
+        self.bytes_in = None
+        self.bytes_out = None
+        self.bytecount_time = None
+        self._handlers = {}
+        self._socket = None
+        self._reader = None
+        self._responses = queue.Queue()
+        self._command_lock = threading.Lock()
+        self._late_answers = 0 # answers to commands that timed out, which arrive before the next answers
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.socket_path!r}, timeout={self.timeout!r})"
+
+
+    def is_open(self):
+        """Indicates whether the client is connected to the management interface.
+
+        Returns:
+            bool: True if the socket is open and the reader thread is running.
+        """
+        return self._socket is not None and self._reader is not None and self._reader.is_alive()
+
+
+    def open(self, wait=10, waiting_time=0.1):
+        """Connect to the management interface.
+
+        `OpenVPN` creates the socket shortly after it starts, so the connection is retried until `wait` seconds have passed.
+
+        Args:
+            wait (float, optional): Maximum number of seconds to wait for the socket to accept connections.
+            waiting_time (float, optional): Number of seconds between consecutive attempts.
+
+        Raises:
+            ConnectionError: when the socket does not accept connections within `wait` seconds.
+        """
+        if self.is_open():
+            return
+        start_time = time.time()
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                break
+            except OSError as exc:
+                sock.close()
+                if time.time() - start_time >= wait:
+                    raise ConnectionError(f"Cannot connect to management interface at {self.socket_path}") from exc
+                time.sleep(waiting_time)
+        self._socket = sock
+        self._reader = threading.Thread(target=self._read_lines, name="sirup-management-reader", daemon=True)
+        self._reader.start()
+
+
+    def close(self):
+        "Close the connection to the management interface. The `OpenVPN` process keeps running."
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+        if self._reader is not None:
+            self._reader.join(timeout=self.timeout)
+            self._reader = None
+
+
+    def add_handler(self, notification_type, handler):
+        """Register a function that is called with the payload of each real-time notification of a given type.
+
+        Handlers run in the reader thread and should return quickly.
+
+        Args:
+            notification_type (str): type of the notification, for instance `"BYTECOUNT"` or `"STATE"`.
+            handler (callable): function that takes the payload of the notification as its only argument.
+        """
+        self._handlers.setdefault(notification_type, []).append(handler)
+
+
+    def command(self, cmd):
+        """Send a command and return the answer.
+
+        Args:
+            cmd (str): the command, for instance `"state"` or `"signal SIGUSR1"`.
+
+        Returns:
+            list: lines of the answer. For commands with a single-line answer, the list has one element, which starts
+              with `SUCCESS:`. For commands with a multi-line answer, the terminating `END` is not included.
+
+        Raises:
+            ConnectionError: when the client is not connected, or when no answer arrives within `self.timeout` seconds.
+              An answer that arrives later is discarded by the next command.
+            RuntimeError: when `OpenVPN` answers with `ERROR:`.
+        """
+        if not self.is_open():
+            raise ConnectionError("Management interface is not open")
+        with self._command_lock:
+            while self._late_answers:
+                try:
+                    self._read_answer()
+                except queue.Empty as exc:
+                    raise ConnectionError(f"Still no answer to an earlier command; cannot send {cmd!r}") from exc
+                self._late_answers -= 1
+            self._socket.sendall(f"{cmd}\n".encode())
+            try:
+                lines = self._read_answer()
+            except queue.Empty as exc:
+                self._late_answers += 1
+                raise ConnectionError(f"No answer to management command {cmd!r}") from exc
+            if len(lines) == 1 and lines[0].startswith("ERROR:"):
+                raise RuntimeError(f"Management command {cmd!r} failed: {lines[0]}")
+            return lines
+
+
+    def _read_answer(self):
+        """Read the lines of one answer. Single-line answers start with `SUCCESS:` or `ERROR:`, multi-line answers
+        end with `END`, which is dropped. Raises `queue.Empty` after `self.timeout` seconds without a line."""
+        lines = []
+        while True:
+            line = self._responses.get(timeout=self.timeout)
+            if line is None:
+                raise ConnectionError("Management interface closed the connection")
+            if not lines and (line.startswith("SUCCESS:") or line.startswith("ERROR:")):
+                return [line]
+            if line == "END":
+                return lines
+            lines.append(line)
+
+
+    def state(self):
+        """Query the current state of the `OpenVPN` process.
+
+        Returns:
+            dict: with the keys `time`, `state`, `description`, `local_ip`, `remote_ip` and `remote_port`.
+              The values are strings and can be empty. The `state` is for instance `"CONNECTED"` or `"RECONNECTING"`.
+        """
+        answer = self.command("state")
+        if not answer:
+            raise ConnectionError("Empty answer to the state command")
+        return parse_state(answer[-1])
+
+
+    def bytecount(self, interval):
+        """Ask `OpenVPN` to report the byte counters of the tunnel every `interval` seconds.
+
+        Args:
+            interval (int): seconds between two `BYTECOUNT` notifications. `0` turns the reports off.
+        """
+        self.command(f"bytecount {int(interval)}")
+
+
+    def signal(self, signal_name):
+        """Send a signal to the `OpenVPN` process.
+
+        Args:
+            signal_name (str): one of `"SIGHUP"`, `"SIGTERM"`, `"SIGUSR1"` or `"SIGUSR2"`.
+        """
+        self.command(f"signal {signal_name}")
+
+
+    def _read_lines(self):
+        "Read from the socket and dispatch real-time notifications and command answers."
+        buffer = b""
+        while True:
+            try:
+                data = self._socket.recv(4096)
+            except (OSError, AttributeError):
+                data = b""
+            if not data:
+                self._responses.put(None)
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line = line.decode(errors="replace").rstrip("\r")
+                if line.startswith(">"):
+                    self._dispatch(line)
+                else:
+                    self._responses.put(line)
+
+
+    def _dispatch(self, line):
+        "Store a real-time notification and pass it on to the registered handlers."
+        notification_type, _, payload = line[1:].partition(":")
+        self.notifications[notification_type] = payload
+        if notification_type == "BYTECOUNT":
+            bytes_in, bytes_out = payload.split(",")[:2]
+            self.bytes_in = int(bytes_in)
+            self.bytes_out = int(bytes_out)
+            self.bytecount_time = time.time()
+        for handler in self._handlers.get(notification_type, []):
+            try:
+                handler(payload)
+            except Exception as e: #pylint: disable=broad-except
+                logging.info("Handler for %s notification failed: %s", notification_type, e)
+
+
+def parse_state(line):
+    """Parse a line of the answer to the `state` command of the management interface.
+
+    Args:
+        line (str): comma-separated line, for instance `"1700000000,CONNECTED,SUCCESS,10.8.0.2,185.1.2.3,1194,,"`.
+
+    Returns:
+        dict: with the keys `time`, `state`, `description`, `local_ip`, `remote_ip` and `remote_port`.
+
+    Example:
+        >>> from sirup.ManagementInterface import parse_state
+        >>> parse_state("1700000000,CONNECTED,SUCCESS,10.8.0.2,185.1.2.3,1194,,")["local_ip"]
+        '10.8.0.2'
+    """
+    keys = ["time", "state", "description", "local_ip", "remote_ip", "remote_port"]
+    values = line.split(",")
+    values = values + [""] * (len(keys) - len(values))
+    return dict(zip(keys, values))
@@ -0,0 +1,293 @@
+"Rotate across the servers of several VPN providers, each with its own account"
+
+import getpass
+import logging
+import os
+import threading
+from random import Random
+import requests
+from .IPRotator import IPRotator
+from .ServerSelection import ServerSelection
+from .TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+from .utils import check_password
+from .utils import kill_all_connections
+from .utils import percentile
+
+
+class Provider():
+    """A VPN provider account: its credentials, its configuration files and how much of the rotation it gets.
+
+    Args:
+        name (str): Name of the provider.
+        auth_file (str): File with the credentials of the account.
+        config_location (str): Directory with the configuration files of the provider.
+        weight (float, optional): Share of the rotation the provider gets when all providers are equally healthy and
+            fast, for instance in proportion to the quota of the account.
+        max_sessions (int, optional): Maximum number of concurrent sessions of the account. Enforced across a fleet
+            through the `lease_registry` of `MultiProviderRotator`, for the `account` of the provider.
+        config_file_rule (str, optional): Rule to filter the configuration files, as in `sirup.IPRotator.IPRotator`.
+        rotator_kwargs (dict, optional): Further arguments of the `sirup.IPRotator.IPRotator` of the provider, for
+            instance its own `history_file`, `tunnel_options` or `selection`. The `lease_registry` of
+            `MultiProviderRotator` replaces the one of `selection`.
+
+    Attributes:
+        account (str): The name of the directory `config_location`, which identifies the account in a
+            `sirup.LeaseRegistry.LeaseRegistry` (see `sirup.LeaseRegistry.server_key`).
+    """
+
+    def __init__(self, name, auth_file, config_location, weight=1.0, max_sessions=None, # pylint: disable=too-many-arguments
+                 config_file_rule=None, rotator_kwargs=None):
+        self.name = name
+        self.auth_file = auth_file
+        self.config_location = config_location
+        self.weight = weight
+        self.max_sessions = max_sessions
+        self.config_file_rule = config_file_rule
+        self.rotator_kwargs = dict(rotator_kwargs) if rotator_kwargs is not None else {}
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name!r}, weight={self.weight!r}, max_sessions={self.max_sessions!r})"
+
+
+    @property
+    def account(self):
+        "str: The account of the provider in a lease registry."
+        return os.path.basename(os.path.abspath(self.config_location))
+
+
+class MultiProviderRotator():
+    """Rotate the IP address across several providers, each served by its own `sirup.IPRotator.IPRotator`.
+
+    At each connection, a provider is drawn at random with probability proportional to its score,
+    `weight * health / latency`: `health` is the smoothed share of successful connection attempts of the provider and
+    `latency` the median connect time of its servers (`default_latency` before the first success). The provider then
+    tries at most `max_trials` of its servers, without waiting between them. If all fail, the provider backs off for
+    `backoff` seconds, doubling with each further failure up to `max_backoff`, and another provider is drawn. A
+    provider with an outage thus drops out of the rotation for a while instead of stalling it.
+
+    Only one tunnel is up at a time, so the rotators share one session directory, and the running `OpenVPN` processes
+    are killed once for all of them. Call `close` when the rotator is not needed anymore, or use it as a context
+    manager.
+
+    Args:
+        providers (list): The `Provider`s.
+        pwd (str, optional): Sudo password. If not provided, the user is asked to provide it at instantiation.
+        seed (int, optional): Seed of the random draws of the providers and of their configuration files.
+        max_trials (int, optional): Number of servers of a provider tried before it backs off.
+        backoff (float, optional): Seconds a provider is left out after its first failure.
+        max_backoff (float, optional): Longest time in seconds a provider is left out.
+        default_latency (float, optional): Connect time in seconds assumed for providers without successful connections.
+        lease_registry (sirup.LeaseRegistry.LeaseRegistry, optional): Registry shared with the other rotators of a
+            fleet. The `max_sessions` of the providers become its `limits`, by `Provider.account`, so the
+            configuration directories of the providers must have different names.
+        **kwargs: Passed to the `sirup.IPRotator.IPRotator` of each provider, for instance `track_ip` or `backend`.
+
+    Attributes:
+        providers (dict): The `Provider`s by name.
+        rotators (dict): The `sirup.IPRotator.IPRotator` of each provider, by name.
+        active (None or str): Name of the provider of the current tunnel.
+        backoff_until (dict): For each provider that is backing off, the time until which it is left out.
+        lock (threading.RLock): Held while the rotator connects, disconnects or rotates.
+        session_dir (sirup.TemporaryDirectoryWithRootPermission.TemporaryDirectoryWithRootPermission): Directory for
+            the files written by `OpenVPN`, shared by the rotators and removed by `close`.
+    """
+
+    def __init__(self, providers, pwd=None, seed=None, max_trials=3, backoff=30.0, max_backoff=900.0, # pylint: disable=too-many-arguments
+                 default_latency=10.0, lease_registry=None, **kwargs):
+        if not providers:
+            raise ValueError("At least one provider is needed")
+        self.providers = {provider.name: provider for provider in providers}
+        if len(self.providers) != len(providers):
+            raise ValueError("The names of the providers must be unique")
+        self.randomizer = Random(seed)
+        self.max_trials = max_trials
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.default_latency = default_latency
+        self.lease_registry = lease_registry
+        if lease_registry is not None:
+            if len({provider.account for provider in providers}) != len(providers):
+                raise ValueError("The configuration directories of the providers must have different names")
+            lease_registry.limits.update({provider.account: provider.max_sessions for provider in providers
+                                          if provider.max_sessions is not None})
+        requires_root = getattr(kwargs.get("backend"), "requires_root", True)
+        if pwd is None and requires_root:
+            pwd = getpass.getpass("Please enter your sudo password: ")
+            assert check_password(pwd), "Wrong sudo password provided"
+        if requires_root:
+            kill_all_connections(pwd)
+        self.session_dir = TemporaryDirectoryWithRootPermission(password=pwd)
+        self._scores = {} # name -> (number of attempts, score)
+        self.rotators = {}
+        for provider in providers:
+            rotator_kwargs = dict(kwargs, **provider.rotator_kwargs)
+            rotator_kwargs["selection"] = self._selection(rotator_kwargs.get("selection"))
+            self.rotators[provider.name] = IPRotator(provider.auth_file, provider.config_location, pwd=pwd,
+                                                     seed=self.randomizer.random(),
+                                                     config_file_rule=provider.config_file_rule,
+                                                     session_dir=self.session_dir, **rotator_kwargs)
+        self.clock = next(iter(self.rotators.values())).clock
+        self.active = None
+        self.backoff_until = {}
+        self.lock = threading.RLock()
+        self._failures = {}
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self.providers.values())!r}, max_trials={self.max_trials!r})"
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+    def _selection(self, selection):
+        "The server selection of a rotator, with the lease registry of the fleet."
+        if selection is None:
+            return ServerSelection(lease_registry=self.lease_registry)
+        if self.lease_registry is not None:
+            selection.lease_registry = self.lease_registry
+        return selection
+
+
+    @property
+    def connector(self):
+        "None or sirup.Backend.Backend: The connector of the current tunnel."
+        if self.active is None:
+            return None
+        return self.rotators[self.active].connector
+
+
+    def score(self, name):
+        """The score of a provider, from the connection attempts of its rotator.
+
+        The score is only computed anew when the rotator has made further connection attempts since.
+
+        Args:
+            name (str): the name of the provider.
+
+        Returns:
+            float: `weight * health / latency`.
+        """
+        history = self.rotators[name].history
+        n_attempts = len(history)
+        cached = self._scores.get(name)
+        if cached is not None and cached[0] == n_attempts:
+            return cached[1]
+        summaries = history.summarize().values()
+        attempts = sum(summary["attempts"] for summary in summaries)
+        successes = sum(summary["successes"] for summary in summaries)
+        health = (successes + 1) / (attempts + 2)
+        medians = [summary["p50"] for summary in summaries if summary["p50"] is not None]
+        latency = max(percentile(medians, 50), 0.1) if medians else self.default_latency
+        score = self.providers[name].weight * health / latency
+        self._scores[name] = (n_attempts, score)
+        return score
+
+
+    def available(self):
+        """The providers that are not backing off.
+
+        Returns:
+            list: names of the providers.
+        """
+        now = self.clock.time()
+        return [name for name in self.providers if self.backoff_until.get(name, 0.0) <= now]
+
+
+    def choose(self):
+        """Draw a provider among those that are not backing off, with probability proportional to its score.
+
+        Returns:
+            None or str: the name of the provider, or `None` if all providers are backing off.
+        """
+        names = self.available()
+        if not names:
+            return None
+        return self.randomizer.choices(names, weights=[self.score(name) for name in names])[0]
+
+
+    def connect(self, max_rounds=100):
+        """Connect to a server of a provider drawn with `choose`.
+
+        Args:
+            max_rounds (int, optional): Maximum number of providers tried before raising an exception.
+
+        Raises:
+            TimeoutError: when `max_rounds` providers failed in a row.
+        """
+        with self.lock:
+            for _ in range(max_rounds):
+                name = self.choose()
+                if name is None:
+                    wait = min(self.backoff_until.values()) - self.clock.time()
+                    logging.info("All providers are backing off; waiting %.0f seconds.", wait)
+                    self.clock.sleep(max(wait, 0.0))
+                    name = self.choose()
+                try:
+                    self.rotators[name].connect(max_trials=self.max_trials, waiting_time=0)
+                except (TimeoutError, requests.ConnectionError) as e:
+                    self._back_off(name, e)
+                    continue
+                self._failures[name] = 0
+                self.backoff_until.pop(name, None)
+                self.active = name
+                return
+            raise TimeoutError(f"Failed to connect to {max_rounds} providers in a row.")
+
+
+    def _back_off(self, name, exception):
+        "Leave a provider out for longer with each failure in a row."
+        failures = self._failures.get(name, 0) + 1
+        self._failures[name] = failures
+        wait = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+        self.backoff_until[name] = self.clock.time() + wait
+        logging.info("Provider %s failed (%r); leaving it out for %.0f seconds.", name, exception, wait)
+
+
+    def disconnect(self):
+        """Disconnect from the current server.
+        """
+        with self.lock:
+            if self.active is not None:
+                rotator = self.rotators[self.active]
+                self.active = None
+                rotator.disconnect()
+
+
+    def rotate(self):
+        """Rotate to a server of a provider drawn anew.
+        """
+        with self.lock:
+            self.disconnect()
+            self.connect()
+
+
+    def status(self):
+        """Summarize the providers.
+
+        Returns:
+            dict: for each provider, its `score`, whether it is `active` and the number of seconds it still
+              `backs_off`.
+        """
+        now = self.clock.time()
+        return {name: {"score": self.score(name), "active": name == self.active,
+                       "backs_off": max(self.backoff_until.get(name, now) - now, 0.0)} for name in self.providers}
+
+
+    def close(self):
+        """Disconnect and close the rotators of all providers, and remove their session directory.
+        """
+        with self.lock:
+            self.disconnect()
+            for rotator in self.rotators.values():
+                rotator.selection.lease_registry = None # closed once, below
+                rotator.close()
+            if self.lease_registry is not None:
+                self.lease_registry.close()
+            self.session_dir.cleanup()
@@ -0,0 +1,505 @@
+"Local SOCKS5 and HTTP proxy that spreads client connections across several tunnels"
+
+import asyncio
+import ctypes
+import ipaddress
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from .DNSCache import DNSCache
+
+
+POLICIES = ("round-robin", "least-loaded", "sticky")
+
+_CLONE_NEWNET = 0x40000000
+_BUFFER_SIZE = 65536
+_SOCKS_VERSION = 5
+# SOCKS5 reply codes
+_SUCCEEDED, _GENERAL_FAILURE, _HOST_UNREACHABLE, _CONNECTION_REFUSED, _COMMAND_NOT_SUPPORTED = 0, 1, 4, 5, 7
+
+
+class DirectExit():
+    """Open connections from the network namespace of the proxy itself.
+
+    Args:
+        name (str, optional): Name of the exit in `ProxyServer.stats`.
+        connect_timeout (float, optional): Maximum number of seconds to open a connection.
+    """
+
+    def __init__(self, name="direct", connect_timeout=10):
+        self.name = name
+        self.connect_timeout = connect_timeout
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name!r})"
+
+
+    async def open_connection(self, host, port):
+        """Open a TCP connection.
+
+        Args:
+            host (str): host name or IP address.
+            port (int): port.
+
+        Returns:
+            tuple: `(asyncio.StreamReader, asyncio.StreamWriter)`.
+        """
+        return await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+
+
+def namespace_nameservers(netns):
+    """Read the nameservers of a network namespace from `/etc/netns/<netns>/resolv.conf`, which `ip netns exec`
+    puts in place of `/etc/resolv.conf` (see `sirup.HealthCheck.HealthCheck`).
+
+    Args:
+        netns (str): Name of the network namespace.
+
+    Returns:
+        list: IP addresses; empty if the file does not exist or names no nameserver.
+    """
+    try:
+        with open(os.path.join("/etc/netns", netns, "resolv.conf"), encoding="utf-8") as file:
+            return [line.split()[1] for line in file if line.startswith("nameserver") and len(line.split()) > 1]
+    except OSError:
+        return []
+
+
+def _enter_namespace(netns):
+    "Move the calling thread into a network namespace created with `ip netns add`."
+    libc = ctypes.CDLL(None, use_errno=True)
+    with open(os.path.join("/var/run/netns", netns), "rb") as file:
+        if libc.setns(file.fileno(), _CLONE_NEWNET) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Cannot enter the network namespace {netns}: {os.strerror(errno)}")
+
+
+class NamespaceExit():
+    """Open connections from inside a network namespace, for instance one in which `OpenVPN` runs with
+    `sirup.VPNConnector.VPNConnector(netns=...)`.
+
+    Host names are resolved and sockets are connected by worker threads that have entered the namespace, so traffic
+    and DNS queries go through the tunnel of the namespace. The proxy itself stays in its own namespace. Entering a
+    namespace requires root permission (`CAP_SYS_ADMIN`).
+
+    `setns` changes only the network namespace, so `getaddrinfo` in the workers would still use the host's
+    `/etc/resolv.conf`, whose nameserver (often `127.0.0.53`) is not reachable from the namespace. Host names are
+    therefore resolved by a `sirup.DNSCache.DNSCache` with the nameservers of the namespace, queried from the workers.
+
+    Args:
+        netns (str): Name of the network namespace.
+        connect_timeout (float, optional): Maximum number of seconds to open a connection.
+        max_workers (int, optional): Number of connections that can be opened at the same time.
+        nameservers (list, optional): Nameservers to query from inside the namespace, for instance those pushed by
+            the VPN server. Defaults to those of `namespace_nameservers`, or to those of `DNSCache`.
+
+    Attributes:
+        dns_cache (sirup.DNSCache.DNSCache): The resolver of the host names.
+    """
+
+    def __init__(self, netns, connect_timeout=10, max_workers=16, nameservers=None):
+        self.netns = netns
+        self.name = netns
+        self.connect_timeout = connect_timeout
+        nameservers = nameservers or namespace_nameservers(netns)
+        self.dns_cache = DNSCache(nameservers) if nameservers else DNSCache()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"sirup-{netns}",
+                                            initializer=_enter_namespace, initargs=(netns,))
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.netns!r})"
+
+
+    async def open_connection(self, host, port):
+        """Open a TCP connection from inside the namespace.
+
+        Args:
+            host (str): host name or IP address.
+            port (int): port.
+
+        Returns:
+            tuple: `(asyncio.StreamReader, asyncio.StreamWriter)`.
+
+        Raises:
+            ConnectionError: if the namespace cannot be entered.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            sock = await loop.run_in_executor(self._executor, self._connect, host, port)
+        except RuntimeError as e: # the worker threads could not enter the namespace
+            raise ConnectionError(f"Cannot open connections in {self.netns}: {e}") from e
+        return await asyncio.open_connection(sock=sock)
+
+
+    def _connect(self, host, port):
+        "Resolve and connect; runs in a worker thread inside the namespace."
+        return socket.create_connection((self.dns_cache.resolve(host), port), self.connect_timeout)
+
+
+    def close(self):
+        "Stop the worker threads."
+        self._executor.shutdown(wait=False)
+
+
+class ProxyServer():
+    """A SOCKS5 and HTTP proxy on one local port that forwards each client connection through one of several exits.
+
+    Clients speak SOCKS5 (without authentication, `CONNECT` only) or HTTP (`CONNECT` tunnels, and plain requests
+    with an absolute URL); the protocol is recognized from the first byte. Each connection is assigned to an exit
+    when it is opened, according to `policy`:
+
+    - `round-robin`: the exits take turns.
+    - `least-loaded`: the exit with the fewest open connections.
+    - `sticky`: the same target host always goes through the same exit, as long as the exit is available. Exits are
+      chosen by rendezvous hashing, so adding or draining an exit only moves the hosts of that exit.
+
+    Tunnels are rotated underneath without dropping connections: `replace_exit` adds the new exit and drains the old
+    one, which gets no new connections but keeps its open connections until they close.
+
+    The server runs in an asyncio event loop; `start_in_thread` runs it in a background thread for programs that
+    are not asynchronous, and `call` runs a coroutine of the server from another thread.
+
+    Args:
+        exits (list): Objects with a `name` and a coroutine `open_connection(host, port)`, for instance `DirectExit`
+            and `NamespaceExit`.
+        host (str, optional): Address on which the proxy listens.
+        port (int, optional): Port on which the proxy listens; 0 picks a free port.
+        policy (str, optional): One of `POLICIES`.
+
+    Attributes:
+        exits (list): The exits that take new connections.
+        active (dict): Number of open connections per exit, including exits that are draining.
+        total (dict): Number of connections per exit since it was added.
+        port (int): The port, once the server is started.
+    """
+
+    def __init__(self, exits, host="127.0.0.1", port=1080, policy="round-robin"):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        self.exits = []
+        self.active = {}
+        self.total = {}
+        self.host = host
+        self.port = port
+        self.policy = policy
+        self._counter = itertools.count()
+        self._drained = {} # exit -> asyncio.Event, set when a draining exit has no connections left
+        self._server = None
+        self._loop = None
+        self._thread = None
+        for exit_ in exits:
+            self.add_exit(exit_)
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.exits!r}, host={self.host!r}, port={self.port!r}, " \
+            f"policy={self.policy!r})"
+
+
+    def add_exit(self, exit_):
+        """Start assigning connections to an exit. Call it from the event loop of the server, or before `start`.
+
+        Args:
+            exit_ (object): the exit.
+        """
+        self.exits.append(exit_)
+        self.active.setdefault(exit_, 0)
+        self.total.setdefault(exit_, 0)
+
+
+    def choose_exit(self, host):
+        """Choose the exit of a new connection according to `self.policy`.
+
+        Args:
+            host (str): the target host of the connection.
+
+        Returns:
+            object: the exit.
+
+        Raises:
+            ConnectionError: if there is no exit.
+        """
+        if not self.exits:
+            raise ConnectionError("No exit is available")
+        if self.policy == "sticky":
+            return max(self.exits, key=lambda exit_: zlib.crc32(f"{exit_.name}|{host}".encode()))
+        start = next(self._counter) % len(self.exits)
+        candidates = self.exits[start:] + self.exits[:start]
+        if self.policy == "least-loaded":
+            return min(candidates, key=lambda exit_: self.active[exit_])
+        return candidates[0]
+
+
+    async def drain(self, exit_, timeout=None):
+        """Stop assigning connections to an exit and wait until its open connections are closed.
+
+        Args:
+            exit_ (object): the exit.
+            timeout (float, optional): Maximum number of seconds to wait. Connections still open then are left to
+                fail with the exit. By default, waits as long as connections are open.
+
+        Returns:
+            bool: False if connections were still open after `timeout`.
+        """
+        if exit_ in self.exits:
+            self.exits.remove(exit_)
+        if self.active.get(exit_, 0) > 0:
+            drained = self._drained.setdefault(exit_, asyncio.Event())
+            try:
+                await asyncio.wait_for(drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.info("%d connections through %s are still open after %s seconds.", self.active[exit_],
+                             exit_.name, timeout)
+                self._drained.pop(exit_, None)
+                return False # `_release` forgets the exit after its last connection
+        self._drained.pop(exit_, None)
+        self.active.pop(exit_, None)
+        self.total.pop(exit_, None)
+        return True
+
+
+    async def replace_exit(self, old, new, timeout=None):
+        """Rotate an exit: assign new connections to `new` and wait until the connections of `old` are closed.
+
+        Args:
+            old (object): the exit that is drained.
+            new (object): the exit that takes its place.
+            timeout (float, optional): Maximum number of seconds to wait for the connections of `old`, as in `drain`.
+
+        Returns:
+            bool: False if connections of `old` were still open after `timeout`.
+        """
+        self.add_exit(new)
+        return await self.drain(old, timeout)
+
+
+    def stats(self):
+        """Summarize the exits.
+
+        Returns:
+            dict: maps the name of each exit to its number of `active` connections, its `total` number of connections
+              and whether it is `draining`.
+        """
+        return {exit_.name: {"active": active, "total": self.total[exit_], "draining": exit_ not in self.exits}
+                for exit_, active in self.active.items()}
+
+
+    async def start(self):
+        "Listen for clients."
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Proxy listening on %s:%d", self.host, self.port)
+
+
+    async def close(self):
+        "Stop listening. Open connections are not interrupted."
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+    def start_in_thread(self):
+        "Run the server in an event loop in a background thread, and return once it listens."
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as e: #pylint: disable=broad-except
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="sirup-proxy", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+
+    def call(self, coroutine, timeout=None):
+        """Run a coroutine in the event loop of a server started with `start_in_thread`, and wait for its result.
+
+        Args:
+            coroutine (coroutine): for instance `server.replace_exit(old, new)`.
+            timeout (float, optional): maximum number of seconds to wait.
+
+        Returns:
+            object: the result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+
+    def stop_thread(self):
+        "Stop a server started with `start_in_thread`."
+        if self._thread is None:
+            return
+        self.call(self.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+
+    async def _handle_client(self, reader, writer):
+        try:
+            first = await reader.readexactly(1)
+            if first[0] == _SOCKS_VERSION:
+                await self._handle_socks(reader, writer)
+            else:
+                await self._handle_http(first, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logging.info("Proxy client failed: %r", e)
+        finally:
+            writer.close()
+
+
+    async def _open(self, host, port):
+        "Open a connection to the target through an exit; returns the exit and the streams."
+        exit_ = self.choose_exit(host)
+        self.active[exit_] += 1
+        self.total[exit_] += 1
+        try:
+            streams = await exit_.open_connection(host, port)
+        except BaseException:
+            self._release(exit_)
+            raise
+        return exit_, streams
+
+
+    def _release(self, exit_):
+        self.active[exit_] -= 1
+        if self.active[exit_] > 0:
+            return
+        if exit_ in self._drained:
+            self._drained[exit_].set()
+        elif exit_ not in self.exits: # its drain timed out
+            self.active.pop(exit_)
+            self.total.pop(exit_)
+
+
+    async def _handle_socks(self, reader, writer):
+        n_methods = (await reader.readexactly(1))[0]
+        methods = await reader.readexactly(n_methods)
+        if 0 not in methods:
+            writer.write(bytes([_SOCKS_VERSION, 0xFF]))
+            return
+        writer.write(bytes([_SOCKS_VERSION, 0]))
+        version, command, _, address_type = await reader.readexactly(4)
+        if version != _SOCKS_VERSION:
+            raise ValueError(f"Unsupported SOCKS version {version}")
+        if address_type == 1:
+            host = str(ipaddress.IPv4Address(await reader.readexactly(4)))
+        elif address_type == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        elif address_type == 4:
+            host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+        else:
+            raise ValueError(f"Unsupported SOCKS address type {address_type}")
+        port = struct.unpack("!H", await reader.readexactly(2))[0]
+        if command != 1:
+            writer.write(self._socks_reply(_COMMAND_NOT_SUPPORTED))
+            return
+        try:
+            exit_, (remote_reader, remote_writer) = await self._open(host, port)
+        except ConnectionRefusedError:
+            writer.write(self._socks_reply(_CONNECTION_REFUSED))
+            return
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.info("Cannot connect to %s:%d: %r", host, port, e)
+            writer.write(self._socks_reply(_HOST_UNREACHABLE if isinstance(e, (socket.gaierror, asyncio.TimeoutError))
+                                           else _GENERAL_FAILURE))
+            return
+        writer.write(self._socks_reply(_SUCCEEDED))
+        await self._relay(exit_, reader, writer, remote_reader, remote_writer)
+
+
+    @staticmethod
+    def _socks_reply(code):
+        return bytes([_SOCKS_VERSION, code, 0, 1, 0, 0, 0, 0, 0, 0])
+
+
+    @staticmethod
+    def _parse_http_head(head):
+        "The method, target host and port of an HTTP proxy request, and the bytes to send to the target first."
+        request_line, *headers = head.decode("latin-1").split("\r\n")[:-2]
+        method, target, version = request_line.split(" ", 2)
+        if method == "CONNECT":
+            host, port = target.rsplit(":", 1)
+            return method, host.strip("[]"), port, b""
+        if not target.startswith("http://"):
+            raise ValueError(f"Not a proxy request: {request_line}")
+        authority, _, path = target[len("http://"):].partition("/")
+        host, _, port = authority.partition(":")
+        # the request goes to the server without the proxy headers, and the connection is not reused
+        headers = [header for header in headers
+                   if header.split(":", 1)[0].lower() not in ("proxy-connection", "connection", "keep-alive")]
+        initial = "\r\n".join([f"{method} /{path} {version}"] + headers + ["Connection: close", "", ""])
+        return method, host.strip("[]"), port or "80", initial.encode("latin-1")
+
+
+    @staticmethod
+    def _http_error(writer, status):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+
+
+    async def _handle_http(self, first, reader, writer):
+        try:
+            head = first + await reader.readuntil(b"\r\n\r\n")
+            method, host, port, initial = self._parse_http_head(head)
+            port = int(port)
+        except asyncio.LimitOverrunError:
+            self._http_error(writer, "431 Request Header Fields Too Large")
+            return
+        except (asyncio.IncompleteReadError, ValueError) as e:
+            logging.info("Invalid proxy request: %r", e)
+            self._http_error(writer, "400 Bad Request")
+            return
+        try:
+            exit_, (remote_reader, remote_writer) = await self._open(host, port)
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.info("Cannot connect to %s:%s: %r", host, port, e)
+            self._http_error(writer, "502 Bad Gateway")
+            return
+        if method == "CONNECT":
+            writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        else:
+            remote_writer.write(initial)
+        await self._relay(exit_, reader, writer, remote_reader, remote_writer)
+
+
+    async def _relay(self, exit_, reader, writer, remote_reader, remote_writer): # pylint: disable=too-many-arguments
+        "Copy data in both directions until both sides are done, then release the exit."
+        try:
+            await asyncio.gather(self._copy(reader, remote_writer), self._copy(remote_reader, writer))
+        finally:
+            remote_writer.close()
+            self._release(exit_)
+
+
+    @staticmethod
+    async def _copy(reader, writer):
+        try:
+            while True:
+                data = await reader.read(_BUFFER_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            writer.close()
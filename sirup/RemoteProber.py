@@ -0,0 +1,192 @@
+"Measure the round-trip time to the remote servers of OpenVPN configuration files"
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .ovpn_config import read_remotes
+
+
+# First byte of the first packet of an OpenVPN handshake: the opcode in the high 5 bits, key id 0 in the low 3 bits
+_HARD_RESET_CLIENT_V2 = 0x38
+_HARD_RESET_SERVER_V2 = 0x40
+
+
+def tcp_rtt(address, port, timeout):
+    """Measure the time it takes to open a TCP connection.
+
+    Args:
+        address (str): IP address of the server.
+        port (int): port of the server.
+        timeout (float): number of seconds after which the server is considered unreachable.
+
+    Returns:
+        None or float: the round-trip time in seconds, or `None` if the connection fails.
+    """
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        start_time = time.perf_counter()
+        try:
+            sock.connect((address, int(port)))
+        except OSError:
+            return None
+        return time.perf_counter() - start_time
+
+
+def udp_rtt(address, port, timeout):
+    """Measure the time it takes an `OpenVPN` server to answer the first packet of a handshake over UDP.
+
+    The probe sends a `P_CONTROL_HARD_RESET_CLIENT_V2` packet and waits for the `P_CONTROL_HARD_RESET_SERVER_V2`
+    answer. No tunnel is established. Servers that use `tls-auth` or `tls-crypt` drop packets without a valid
+    signature, so they never answer and are reported as unreachable.
+
+    Args:
+        address (str): IP address of the server.
+        port (int): port of the server.
+        timeout (float): number of seconds after which the server is considered unreachable.
+
+    Returns:
+        None or float: the round-trip time in seconds, or `None` if the server does not answer.
+    """
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    packet = bytes([_HARD_RESET_CLIENT_V2]) + os.urandom(8) + b"\x00" + b"\x00\x00\x00\x00"
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        start_time = time.perf_counter()
+        try:
+            sock.sendto(packet, (address, int(port)))
+            while True:
+                data, _ = sock.recvfrom(2048)
+                if data and data[0] >> 3 == _HARD_RESET_SERVER_V2 >> 3:
+                    return time.perf_counter() - start_time
+        except OSError:
+            return None
+
+
+class RemoteProber():
+    """Measure reachability and round-trip time (RTT) of the remote servers in `OpenVPN` configuration files,
+    without establishing a tunnel.
+
+    TCP remotes are probed by opening a TCP connection, UDP remotes with the first packet of an `OpenVPN` handshake
+    (see `udp_rtt`). Many remotes are probed concurrently. Results are cached for `ttl` seconds, and can be kept in
+    a JSON file across sessions.
+
+    Args:
+        timeout (float, optional): Number of seconds after which a remote is considered unreachable.
+        max_workers (int, optional): Maximum number of concurrent probes.
+        ttl (float, optional): Number of seconds for which a result is reused.
+        cache_file (str, optional): JSON file in which the results are stored. Existing results are loaded at instantiation.
+
+    Attributes:
+        cache (dict): Maps `"host:port/proto"` to a list `[time of the probe, RTT in seconds or None]`.
+    """
+
+    def __init__(self, timeout=2, max_workers=64, ttl=3600, cache_file=None):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self.cache = {}
+        self._cache_lock = threading.Lock()
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, encoding="utf-8") as file:
+                self.cache = json.load(file)
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(timeout={self.timeout!r}, max_workers={self.max_workers!r}, "\
+            f"ttl={self.ttl!r}, cache_file={self.cache_file!r})"
+
+
+    @staticmethod
+    def _key(remote):
+        host, port, proto = remote
+        return f"{host}:{port}/{proto}"
+
+
+    def cached_rtt(self, remote):
+        """Look up a remote in the cache.
+
+        Args:
+            remote (tuple): `(host, port, proto)`, as returned by `sirup.ovpn_config.read_remotes`.
+
+        Returns:
+            tuple: `(found, rtt)`. `found` is `False` if the remote has not been probed within the last `ttl` seconds.
+        """
+        entry = self.cache.get(self._key(remote))
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return False, None
+        return True, entry[1]
+
+
+    def probe(self, remote):
+        """Probe a single remote, or return the cached result.
+
+        Args:
+            remote (tuple): `(host, port, proto)`.
+
+        Returns:
+            None or float: the RTT in seconds, or `None` if the remote is unreachable.
+        """
+        found, rtt = self.cached_rtt(remote)
+        if found:
+            return rtt
+        host, port, proto = remote
+        try:
+            address = socket.getaddrinfo(host, port)[0][4][0] # resolve first so that DNS is not part of the RTT
+        except (OSError, IndexError) as e:
+            logging.info("Cannot resolve %s: %s", host, e)
+            rtt = None
+        else:
+            measure = tcp_rtt if proto == "tcp" else udp_rtt
+            rtt = measure(address, port, self.timeout)
+        with self._cache_lock:
+            self.cache[self._key(remote)] = [time.time(), rtt]
+        return rtt
+
+
+    def probe_configs(self, config_files):
+        """Probe the remotes of many configuration files concurrently.
+
+        Args:
+            config_files (list): paths to `OpenVPN` configuration files.
+
+        Returns:
+            dict: maps each configuration file to the lowest RTT of its remotes in seconds, or to `None` if
+              none of its remotes is reachable.
+        """
+        remotes_by_config = {}
+        for config_file in config_files:
+            try:
+                remotes_by_config[config_file] = read_remotes(config_file)
+            except OSError as e:
+                logging.info("Cannot read %s: %s", config_file, e)
+                remotes_by_config[config_file] = []
+
+        unique_remotes = {remote for remotes in remotes_by_config.values() for remote in remotes}
+        to_probe = [remote for remote in unique_remotes if not self.cached_rtt(remote)[0]]
+        if to_probe:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_probe))) as executor:
+                list(executor.map(self.probe, to_probe))
+        if self.cache_file is not None:
+            self.save()
+
+        result = {}
+        for config_file, remotes in remotes_by_config.items():
+            rtts = [self.cache.get(self._key(remote), [None, None])[1] for remote in remotes]
+            rtts = [rtt for rtt in rtts if rtt is not None]
+            result[config_file] = min(rtts) if rtts else None
+        return result
+
+
+    def save(self):
+        "Write the cache to `self.cache_file`."
+        with self._cache_lock:
+            tmp_path = f"{self.cache_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.cache, file)
+            os.replace(tmp_path, self.cache_file)
@@ -0,0 +1,166 @@
+"Place the OpenVPN daemons and their workers on CPUs, and set their priorities"
+
+import os
+import subprocess
+
+
+IONICE_CLASSES = {"realtime": "1", "best-effort": "2", "idle": "3"}
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _cpu_list(cpus):
+    return ",".join(str(cpu) for cpu in cpus)
+
+
+def available_cpus():
+    """The CPUs that this process may run on.
+
+    Returns:
+        list: the CPU numbers, from the affinity mask of the process where the system has one (Linux), otherwise all
+          CPUs of the machine.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class SchedulingPolicy():
+    """Where and with which priority the processes of each tunnel run.
+
+    The data channel of `OpenVPN` runs in one thread, so a daemon never uses more than one core. With many tunnels on
+    one host, pinning each daemon to its own core (`per_tunnel=True`) keeps them from competing with each other and
+    with the workers. Tunnels are numbered by slot; slot `i` gets the `i`-th CPU of `cpus`, wrapping around.
+
+    `prefix` returns a command prefix (`taskset`, `nice`, `ionice`) for processes that are started, which the
+    `OpenVPN` daemon inherits when it forks. `apply` sets the same on a running process, for instance a worker
+    paired with a tunnel. With `cgroup`, processes are also moved to the cgroup v2 `cgroup/tunnel<slot>` under
+    `/sys/fs/cgroup`, with `cpu_weight`; the parent cgroup must exist and have the `cpu` controller enabled for its
+    children.
+
+    Args:
+        cpus (list, optional): The CPUs that tunnels may use. Defaults to all CPUs available to this process.
+        per_tunnel (bool, optional): If True, each tunnel gets one CPU of `cpus`; otherwise all of them.
+        nice (int, optional): Niceness of the processes, from -20 (highest priority) to 19.
+        ionice_class (str, optional): I/O scheduling class, one of `IONICE_CLASSES`.
+        ionice_level (int, optional): I/O priority within the class, from 0 (highest) to 7.
+        cgroup (str, optional): Path of the parent cgroup relative to `/sys/fs/cgroup`, for instance `"sirup"`.
+        cpu_weight (int, optional): `cpu.weight` of the cgroup of each tunnel, from 1 to 10000 (default of the
+            kernel: 100).
+    """
+
+    def __init__(self, cpus=None, per_tunnel=True, nice=None, ionice_class=None, ionice_level=None, # pylint: disable=too-many-arguments
+                 cgroup=None, cpu_weight=None):
+        if ionice_class is not None and ionice_class not in IONICE_CLASSES:
+            raise ValueError(f"ionice_class must be one of {sorted(IONICE_CLASSES)}, not {ionice_class!r}")
+        self.cpus = sorted(cpus) if cpus is not None else available_cpus()
+        self.per_tunnel = per_tunnel
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.cgroup = cgroup
+        self.cpu_weight = cpu_weight
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cpus={self.cpus!r}, per_tunnel={self.per_tunnel!r}, nice={self.nice!r}, "\
+            f"cgroup={self.cgroup!r})"
+
+
+    def cpus_for(self, slot):
+        """The CPUs of a tunnel.
+
+        Args:
+            slot (int): the slot of the tunnel.
+
+        Returns:
+            list: the CPU numbers.
+        """
+        if self.per_tunnel:
+            return [self.cpus[slot % len(self.cpus)]]
+        return list(self.cpus)
+
+
+    def _ionice_args(self):
+        args = []
+        if self.ionice_class is not None:
+            args.extend(["-c", IONICE_CLASSES[self.ionice_class]])
+        if self.ionice_level is not None:
+            args.extend(["-n", str(self.ionice_level)])
+        return args
+
+
+    def prefix(self, slot=0):
+        """The command prefix that starts a process of a tunnel under the policy.
+
+        Args:
+            slot (int, optional): the slot of the tunnel.
+
+        Returns:
+            list: the arguments to put before the command.
+        """
+        cmd = ["taskset", "-c", _cpu_list(self.cpus_for(slot))]
+        if self.nice is not None:
+            cmd.extend(["nice", "-n", str(self.nice)])
+        ionice_args = self._ionice_args()
+        if ionice_args:
+            cmd.extend(["ionice"] + ionice_args)
+        return cmd
+
+
+    def cgroup_path(self, slot=0):
+        """The cgroup of a tunnel.
+
+        Args:
+            slot (int, optional): the slot of the tunnel.
+
+        Returns:
+            None or str: the full path, or `None` without `cgroup`.
+        """
+        if self.cgroup is None:
+            return None
+        return os.path.join(CGROUP_ROOT, self.cgroup, f"tunnel{slot}")
+
+
+    def place(self, pid, slot=0, pwd=None):
+        """Move a process to the cgroup of its tunnel, creating it if necessary. Does nothing without `cgroup`.
+
+        Args:
+            pid (str or int): the process ID.
+            slot (int, optional): the slot of the tunnel.
+            pwd (str, optional): User root password. Without it, the commands run without `sudo`.
+        """
+        path = self.cgroup_path(slot)
+        if path is None:
+            return
+        script = 'mkdir -p "$1" && echo "$2" > "$1/cgroup.procs"'
+        args = [path, str(pid)]
+        if self.cpu_weight is not None:
+            script += ' && echo "$3" > "$1/cpu.weight"'
+            args.append(str(self.cpu_weight))
+        self._run(["sh", "-c", script, "sh"] + args, pwd)
+
+
+    def apply(self, pid, slot=0, pwd=None):
+        """Put a running process under the policy of a tunnel: CPU affinity, niceness, I/O priority and cgroup.
+
+        Args:
+            pid (str or int): the process ID, for instance `os.getpid()` in a worker.
+            slot (int, optional): the slot of the tunnel.
+            pwd (str, optional): User root password, needed to raise priorities or to move processes of other users.
+        """
+        pid = str(pid)
+        self._run(["taskset", "-p", "-c", _cpu_list(self.cpus_for(slot)), pid], pwd)
+        if self.nice is not None:
+            self._run(["renice", "-n", str(self.nice), "-p", pid], pwd)
+        ionice_args = self._ionice_args()
+        if ionice_args:
+            self._run(["ionice"] + ionice_args + ["-p", pid], pwd)
+        self.place(pid, slot, pwd)
+
+
+    @staticmethod
+    def _run(cmd, pwd):
+        if pwd is None:
+            subprocess.run(cmd, check=True, capture_output=True)
+        else:
+            subprocess.run(["sudo", "-S"] + cmd, input=pwd.encode(), check=True, capture_output=True)
@@ -0,0 +1,166 @@
+"Choose the server of each connection attempt of an IPRotator: variants, leases and server loads"
+
+import logging
+import requests
+
+
+class ServerSelection():
+    """Decide which configuration file an `sirup.IPRotator.IPRotator` tries next, on top of the order of its
+    `config_queue`.
+
+    Each part is optional. The variant selector replaces the file taken from the queue by the variant of its server
+    that works best from the current network, and skips the server of the previous connection when rotating. The
+    lease registry keeps the rotators of a fleet off each other's servers and within the limits of their accounts.
+    The load feed reorders the queue whenever it has new loads (see `sirup.IPRotator.IPRotator.rank_by_load`).
+
+    Args:
+        lease_registry (sirup.LeaseRegistry.LeaseRegistry, optional): Registry shared with the other rotators of a
+            fleet. The rotator leases each server before connecting to it, skips servers leased by other nodes and
+            servers whose account is at its limit of concurrent sessions, and waits when no server is available.
+            `close` releases the leases of the rotator and closes the registry.
+        load_feed (sirup.LoadFeed.LoadFeed, optional): Server loads published by the provider. Whenever the feed has
+            new loads, `connect` reorders `config_queue` with `rank_by_load` first.
+        variant_selector (sirup.VariantSelector.VariantSelector, optional): Groups the configuration files of the
+            same server that differ in protocol or port. `connect` then tries the variant of each server whose
+            transport worked best from the current network, falls back to the other variants of a server only after
+            the preferred one failed, and moves on to another server when rotating. The selector learns from every
+            connection attempt, and from the history of the rotator at instantiation.
+    """
+
+    def __init__(self, lease_registry=None, load_feed=None, variant_selector=None):
+        self.lease_registry = lease_registry
+        self.load_feed = load_feed
+        self.variant_selector = variant_selector
+        self._previous_server = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(lease_registry={self.lease_registry!r}, load_feed={self.load_feed!r}, "\
+            f"variant_selector={self.variant_selector!r})"
+
+
+    def learn_from(self, config_files, history):
+        """Group the configuration files of a rotator into servers and learn from its past connection attempts.
+
+        Args:
+            config_files (iterable): the configuration files.
+            history (sirup.ConnectionHistory.ConnectionHistory): the connection attempts of the rotator.
+        """
+        if self.variant_selector is None:
+            return
+        for config_file in config_files:
+            self.variant_selector.add(config_file)
+        self.variant_selector.learn_from(history)
+
+
+    def add(self, config_file):
+        "Take a new or edited configuration file into account."
+        if self.variant_selector is not None:
+            self.variant_selector.add(config_file)
+
+
+    def remove(self, config_file):
+        "Forget a configuration file that was taken out of the rotation."
+        if self.variant_selector is not None:
+            self.variant_selector.remove(config_file)
+
+
+    def modified(self, config_file):
+        "Forget what is known about the previous version of an edited configuration file."
+        if self.load_feed is not None:
+            self.load_feed.forget(config_file)
+        self.add(config_file) # the remotes may have changed
+
+
+    def is_previous_server(self, config_file):
+        """Whether a configuration file is a variant of the server of the previous connection.
+
+        Args:
+            config_file (str): the configuration file.
+
+        Returns:
+            bool: False without a variant selector.
+        """
+        if self.variant_selector is None:
+            return False
+        server = self.variant_selector.server_of(config_file)
+        return server is not None and server == self._previous_server
+
+
+    def choose(self, config_file, available, exclude):
+        """The variant of the server of a configuration file to connect with.
+
+        Args:
+            config_file (str): the configuration file taken from the queue.
+            available (container): The configuration files that may be chosen.
+            exclude (container): Configuration files not to choose.
+
+        Returns:
+            str: the variant, or `config_file` without a variant selector or if all variants are excluded.
+        """
+        if self.variant_selector is None:
+            return config_file
+        return self.variant_selector.choose(config_file, available=available, exclude=exclude) or config_file
+
+
+    def acquire(self, config_file):
+        """Lease a server with the lease registry.
+
+        Args:
+            config_file (str): the configuration file of the server.
+
+        Returns:
+            bool: False if the server is leased by another node or its account is at its limit. True without a
+              registry, or if the registry cannot be used.
+        """
+        if self.lease_registry is None:
+            return True
+        try:
+            return self.lease_registry.acquire(config_file)
+        # do not stop rotating because the registry is down, hangs, fails or answers nonsense
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.info("Cannot lease %s: %s", config_file, e)
+            return True
+
+
+    def release(self, config_file):
+        """End the lease of a server, if any.
+
+        Args:
+            config_file (str): the configuration file of the server.
+        """
+        if self.lease_registry is None:
+            return
+        try:
+            self.lease_registry.release(config_file)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.info("Cannot release %s: %s", config_file, e)
+
+
+    def record(self, config_file, outcome):
+        """Add a connection attempt to the variant selector.
+
+        Args:
+            config_file (str): the configuration file of the attempt.
+            outcome (str): as in `sirup.ConnectionHistory.ConnectionHistory.record`.
+        """
+        if self.variant_selector is not None and outcome in ("success", "timeout", "connection_error"):
+            self.variant_selector.record(config_file, outcome != "timeout")
+
+
+    def connected(self, config_file):
+        """Remember the server of a new connection, so that the next rotation moves on to another server.
+
+        Args:
+            config_file (str): the configuration file of the connection.
+        """
+        if self.variant_selector is not None:
+            self._previous_server = self.variant_selector.server_of(config_file)
+
+
+    def close(self):
+        "Stop the load feed and close the lease registry, which releases the leases of the rotator."
+        if self.load_feed is not None:
+            self.load_feed.stop()
+        if self.lease_registry is not None:
+            self.lease_registry.close()
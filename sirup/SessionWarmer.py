@@ -0,0 +1,133 @@
+"Open connections to target hosts ahead of the first requests on a new tunnel"
+
+import logging
+import threading
+import time
+import requests
+
+
+class SessionWarmer():
+    """Fill the connection pools of a `requests.Session` with connections to target hosts.
+
+    On a fresh tunnel, the first request to each host pays for the DNS lookup, the TCP handshake and, for HTTPS,
+    the TLS handshake. The warmer pays for them ahead of time, in a background thread, and leaves the established
+    connections in the pools of the session, where the next requests to the same host pick them up. No HTTP
+    request is sent.
+
+    Args:
+        targets (list): URLs of the target hosts, for instance `["https://example.org"]`. Only the scheme, host and
+            port matter.
+        connections (int, optional): Number of connections opened to each target; at most the pool size of the
+            session (10 by default).
+        timeout (float, optional): Maximum number of seconds to open one connection.
+
+    Attributes:
+        results (dict): For each target of the latest warm-up, the number of seconds until its connections were
+            established, or `None` if they could not be.
+    """
+
+    def __init__(self, targets, connections=1, timeout=10.0):
+        self.targets = list(targets)
+        self.connections = connections
+        self.timeout = timeout
+        self.results = {}
+        self._thread = None
+        self._cancelled = None # set to abandon the warm-up of `_thread`
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.targets!r}, connections={self.connections!r})"
+
+
+    def warm(self, session, cancelled=None):
+        """Open the connections to all targets, one target after the other.
+
+        Args:
+            session (requests.Session): the session whose pools receive the connections.
+            cancelled (threading.Event, optional): When set, the remaining targets are skipped, the connections
+                opened so far are closed and `results` is left unchanged.
+
+        Returns:
+            dict: the results of this warm-up.
+        """
+        results = {}
+        for target in self.targets:
+            if cancelled is not None and cancelled.is_set():
+                return results
+            start = time.monotonic()
+            try:
+                self._open_connections(session, target, cancelled)
+            except Exception as e: #pylint: disable=broad-except
+                logging.info("Cannot warm up %s: %s", target, e)
+                results[target] = None
+            else:
+                results[target] = time.monotonic() - start
+        if cancelled is None or not cancelled.is_set():
+            self.results = results
+        return results
+
+
+    def _open_connections(self, session, target, cancelled=None):
+        "Open `self.connections` connections to `target` and put them into the pool of the session."
+        adapter = session.get_adapter(target)
+        request = session.prepare_request(requests.Request("GET", target))
+        # the same settings as `session.request`, so that the connections land in the pool that requests use
+        settings = session.merge_environment_settings(target, {}, None, None, None)
+        if hasattr(adapter, "get_connection_with_tls_context"):
+            pool = adapter.get_connection_with_tls_context(request, settings["verify"], cert=settings["cert"])
+        else: # requests < 2.32
+            pool = adapter.get_connection(target)
+            adapter.cert_verify(pool, target, settings["verify"], settings["cert"])
+        connections = [pool._get_conn() for _ in range(self.connections)] # pylint: disable=protected-access
+        try:
+            for connection in connections:
+                if connection.sock is None:
+                    connection.timeout = self.timeout
+                    connection.connect()
+        finally:
+            for connection in connections:
+                if cancelled is not None and cancelled.is_set(): # opened through a tunnel that is gone
+                    connection.close()
+                pool._put_conn(connection) # pylint: disable=protected-access
+
+
+    def start(self, session):
+        """Warm up in a background thread. A warm-up that is still running is abandoned, without waiting for it.
+
+        Args:
+            session (requests.Session): the session whose pools receive the connections.
+        """
+        self.cancel()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self.warm, args=(session, self._cancelled),
+                                        name="sirup-session-warmer", daemon=True)
+        self._thread.start()
+
+
+    def cancel(self):
+        """Abandon the background warm-up, if one is running.
+
+        Its thread skips the remaining targets and closes the connections it opened, without being waited for.
+        """
+        if self._cancelled is not None:
+            self._cancelled.set()
+        self._thread = None
+        self._cancelled = None
+
+
+    def wait(self, timeout=None):
+        """Block until the background warm-up is done.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if no warm-up is running anymore.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+            self._thread = None
+            self._cancelled = None
+        return True
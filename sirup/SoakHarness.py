@@ -0,0 +1,161 @@
+"Run a rotator for many cycles and check that it does not leak processes, files or memory"
+
+import gc
+import os
+import shutil
+import tempfile
+import time
+
+
+RESOURCES = ("fds", "children", "daemons", "temp_files", "rss")
+
+
+def _count_entries(directory):
+    "Count the files and directories under a directory, at any depth."
+    count = 0
+    for _, directories, files in os.walk(directory):
+        count += len(directories) + len(files)
+    return count
+
+
+def resource_usage(temp_dirs=None, daemon_names=("openvpn",)):
+    """Measure the resources held by the current process. Linux only: the counts are read from `/proc`.
+
+    Args:
+        temp_dirs (list, optional): Directories whose entries are counted, at any depth. Defaults to
+            `[tempfile.gettempdir()]`.
+        daemon_names (tuple, optional): Names of processes that are counted wherever they run, because daemons
+            are not children of the process that started them.
+
+    Returns:
+        dict: `fds` (open file descriptors), `children` (child processes, including zombies), `daemons` (processes
+          with one of `daemon_names`), `temp_files` (entries under `temp_dirs`) and `rss` (resident memory in bytes).
+    """
+    if temp_dirs is None:
+        temp_dirs = [tempfile.gettempdir()]
+    pid = str(os.getpid())
+    children = daemons = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8", errors="replace") as file:
+                stat = file.read()
+        except OSError: # the process exited
+            continue
+        # the name is in parentheses and may contain spaces; the parent process ID is the second field after it
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        if stat[stat.rindex(")") + 2:].split()[1] == pid:
+            children += 1
+        if name in daemon_names:
+            daemons += 1
+    with open("/proc/self/statm", encoding="utf-8") as file:
+        rss = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return {"fds": len(os.listdir("/proc/self/fd")),
+            "children": children,
+            "daemons": daemons,
+            "temp_files": sum(_count_entries(directory) for directory in temp_dirs),
+            "rss": rss}
+
+
+class SoakHarness():
+    """Drive a rotator through many `connect`, `rotate` and `disconnect` cycles and track its resources over time.
+
+    Every `sample_every` cycles, the harness records the open file descriptors, the child processes, the `OpenVPN`
+    daemons, the temporary files and the resident memory (see `resource_usage`). The temporary files are those in
+    the session directories of `rotator.session_dir` and its siblings, usually under `/dev/shm`, where `OpenVPN`
+    writes, and those in `tempfile.gettempdir()`, which points to a private directory during the run.
+
+    A rotator does not leak if, after the warm-up, none of the counts grows and the memory grows by less than
+    `rss_tolerance`. The warm-up covers the first cycles, in which caches and bounded buffers such as the connect
+    times of `sirup.ConnectionHistory.ConnectionHistory` fill up.
+
+    Run it against a `sirup.FakeBackend.FakeNetwork` to soak the rotator itself in seconds, or against real tunnels.
+
+    Args:
+        rotator (sirup.IPRotator.IPRotator): The rotator, not connected.
+        cycles (int, optional): Number of cycles.
+        sample_every (int, optional): Number of cycles between two samples.
+        warmup (float, optional): Share of the cycles before the reference sample.
+        rss_tolerance (int, optional): Bytes by which the resident memory may grow after the warm-up.
+
+    Attributes:
+        samples (list): One dict per sample with the `cycle`, the `time` and the values of `resource_usage`.
+    """
+
+    def __init__(self, rotator, cycles=10000, sample_every=500, warmup=0.2, rss_tolerance=4 * 2**20): # pylint: disable=too-many-arguments
+        self.rotator = rotator
+        self.cycles = cycles
+        self.sample_every = sample_every
+        self.warmup = warmup
+        self.rss_tolerance = rss_tolerance
+        self.samples = []
+        self._temp_dir = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.rotator!r}, cycles={self.cycles!r}, " \
+            f"sample_every={self.sample_every!r})"
+
+
+    def sample(self, cycle):
+        """Record the resources after a cycle.
+
+        Args:
+            cycle (int): the number of cycles so far.
+
+        Returns:
+            dict: the sample, see `samples`.
+        """
+        gc.collect() # garbage that has not been collected yet is not a leak
+        sample = {"cycle": cycle, "time": time.time()}
+        temp_dirs = [self._temp_dir] if self._temp_dir is not None else []
+        session_dir = getattr(self.rotator, "session_dir", None)
+        if session_dir is not None:
+            temp_dirs.extend(session_dir.siblings())
+        sample.update(resource_usage(temp_dirs))
+        self.samples.append(sample)
+        return sample
+
+
+    def run(self):
+        """Run the cycles.
+
+        Returns:
+            list: the leaks, see `check`.
+        """
+        self._temp_dir = tempfile.mkdtemp(prefix="sirup-soak-")
+        previous_temp_dir, tempfile.tempdir = tempfile.tempdir, self._temp_dir
+        try:
+            self.sample(0)
+            for cycle in range(1, self.cycles + 1):
+                self.rotator.connect()
+                self.rotator.rotate()
+                self.rotator.disconnect()
+                if cycle % self.sample_every == 0:
+                    self.sample(cycle)
+        finally:
+            tempfile.tempdir = previous_temp_dir
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+        return self.check()
+
+
+    def check(self):
+        """Compare the last sample with the first sample after the warm-up.
+
+        Returns:
+            list: a description of each resource that grew, for instance `"fds grew from 12 to 40"`. Empty if
+              there is no leak.
+        """
+        after_warmup = [sample for sample in self.samples if sample["cycle"] >= self.warmup * self.cycles]
+        if len(after_warmup) < 2:
+            raise ValueError("Not enough samples after the warm-up; decrease sample_every or warmup")
+        reference, last = after_warmup[0], after_warmup[-1]
+        leaks = []
+        for resource in RESOURCES:
+            tolerance = self.rss_tolerance if resource == "rss" else 0
+            if last[resource] - reference[resource] > tolerance:
+                leaks.append(f"{resource} grew from {reference[resource]} to {last[resource]} "
+                             f"between cycles {reference['cycle']} and {last['cycle']}")
+        return leaks
@@ -0,0 +1,157 @@
+"Publish the state of a rotator in shared memory"
+
+import mmap
+import os
+import struct
+import time
+
+
+STATES = ("disconnected", "connecting", "connected", "disconnecting")
+
+_MAGIC = b"SIRUPST1"
+# magic, sequence, generation, state, config index, exit IP, time of the update, time of the latest connection
+_LAYOUT = struct.Struct("<8sQQii48sdd")
+_SEQUENCE = struct.Struct("<Q")
+_SEQUENCE_OFFSET = 8
+SIZE = mmap.PAGESIZE
+MAX_RETRIES = 100000
+
+
+class StatusBlock():
+    """A fixed-layout status record in shared memory, written by one process and read by many without locks.
+
+    The record holds a generation counter that increases with each new connection, the state (one of `STATES`),
+    the index of the current configuration file, the exit IP address and two timestamps. It is protected by a
+    sequence lock: the writer makes the sequence number odd before it changes the record and even again afterwards,
+    and a reader retries until it reads the same even sequence number before and after copying the record.
+    Readers never block the writer.
+
+    Without `path`, the record lives in an anonymous shared mapping, which processes forked after the block was
+    created share. With `path`, it lives in a file (preferably on `/dev/shm`) that unrelated processes can open
+    with `StatusBlock.open`.
+
+    Args:
+        path (str, optional): File that backs the record. It is created or overwritten.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._writable = True
+        if path is None:
+            self._map = mmap.mmap(-1, SIZE)
+        else:
+            with open(path, "wb+") as file:
+                file.truncate(SIZE)
+                self._map = mmap.mmap(file.fileno(), SIZE)
+        self._sequence = 0
+        self._fields = [0, STATES.index("disconnected"), -1, b"", 0.0, 0.0]
+        _LAYOUT.pack_into(self._map, 0, _MAGIC, 0, *self._fields)
+
+
+    @classmethod
+    def open(cls, path):
+        """Open the record that another process publishes in `path`, for reading.
+
+        Args:
+            path (str): the file that backs the record.
+
+        Returns:
+            StatusBlock: a read-only view of the record.
+
+        Raises:
+            ValueError: if the file does not contain a status record.
+        """
+        block = cls.__new__(cls)
+        block.path = path
+        block._writable = False #pylint: disable=protected-access
+        with open(path, "rb") as file:
+            block._map = mmap.mmap(file.fileno(), SIZE, access=mmap.ACCESS_READ) #pylint: disable=protected-access
+        if block._map[:len(_MAGIC)] != _MAGIC: #pylint: disable=protected-access
+            block.close()
+            raise ValueError(f"{path} does not contain a sirup status record")
+        return block
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r})"
+
+
+    def update(self, state=None, config_index=None, exit_ip=None, new_generation=False, now=None): # pylint: disable=too-many-arguments
+        """Change the record. Arguments that are `None` keep their value.
+
+        Only one process may write to a record.
+
+        Args:
+            state (str, optional): one of `STATES`.
+            config_index (int, optional): index of the current configuration file, -1 if none.
+            exit_ip (str, optional): the exit IP address; `""` if unknown. Other values, such as the placeholder
+                `1234` of `sirup.utils.get_ip`, are converted to strings.
+            new_generation (bool, optional): If True, increase the generation and set the time of the latest
+                connection to `now`.
+            now (float, optional): the time of the update, in seconds since the epoch. Defaults to the current time.
+        """
+        if not self._writable:
+            raise PermissionError("The status record was opened for reading")
+        if now is None:
+            now = time.time()
+        generation, state_code, index, ip, _, connected_at = self._fields
+        if state is not None:
+            state_code = STATES.index(state)
+        if config_index is not None:
+            index = config_index
+        if exit_ip is not None:
+            ip = str(exit_ip).encode()[:48]
+        if new_generation:
+            generation += 1
+            connected_at = now
+        self._fields = [generation, state_code, index, ip, now, connected_at]
+
+        self._sequence += 1 # odd: readers retry
+        _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, self._sequence)
+        _LAYOUT.pack_into(self._map, 0, _MAGIC, self._sequence, *self._fields)
+        self._sequence += 1
+        _SEQUENCE.pack_into(self._map, _SEQUENCE_OFFSET, self._sequence)
+
+
+    def read(self, max_retries=MAX_RETRIES):
+        """Read a consistent copy of the record.
+
+        Args:
+            max_retries (int, optional): Number of times to retry while the writer changes the record.
+
+        Returns:
+            dict: with `generation`, `state`, `config_index`, `exit_ip` (`None` if unknown), `updated_at` and
+              `connected_at` (seconds since the epoch, 0 if never).
+
+        Raises:
+            RuntimeError: if the record was still being changed after `max_retries` retries, for instance because
+                the writer died in the middle of an update.
+        """
+        for _ in range(max_retries + 1):
+            before = _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0]
+            if before % 2:
+                continue
+            _, _, generation, state_code, index, ip, updated_at, connected_at = _LAYOUT.unpack_from(self._map, 0)
+            if _SEQUENCE.unpack_from(self._map, _SEQUENCE_OFFSET)[0] == before:
+                break
+        else:
+            raise RuntimeError("The status record is still being changed; did its writer die during an update?")
+        ip = ip.rstrip(b"\0").decode()
+        return {"generation": generation,
+                "state": STATES[state_code],
+                "config_index": index,
+                "exit_ip": ip or None,
+                "updated_at": updated_at,
+                "connected_at": connected_at}
+
+
+    def close(self):
+        "Unmap the record. The file in `path` is kept; remove it with `unlink`."
+        if not self._map.closed:
+            self._map.close()
+
+
+    def unlink(self):
+        "Remove the file that backs the record, if there is one."
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
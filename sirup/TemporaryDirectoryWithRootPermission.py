@@ -0,0 +1,96 @@
+import glob
+import os
+import subprocess
+import tempfile
+
+
+def _default_parent_directory():
+    "Prefer the tmpfs mounted at /dev/shm, fall back to the default temp directory."
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        return shm
+    return tempfile.gettempdir()
+
+
+class TemporaryDirectoryWithRootPermission:
+    """Session-scoped temporary directory for files written by the `OpenVPN` command-line interface (CLI).
+
+    The directory is created once, by the user, and each tunnel gets its own sub-directory. `OpenVPN`
+    truncates its `--log` file and overwrites its `--writepid` file when it starts, so the same file
+    names can be reused across connections without removing them first. Because some of the files
+    in the directory are owned by root, removing the directory requires root permission; this happens
+    once, in `cleanup`.
+
+    When used as a context manager, the directory is created on `__enter__` and removed on `__exit__`.
+
+    Args:
+        password (str): Password for the user with root access.
+        parent (str, optional): Directory in which the session directory is created. Defaults to `/dev/shm`
+            if it is available, and to the default temporary directory otherwise.
+        prefix (str, optional): Prefix of the session directory name.
+
+    Attributes:
+        path (None or str): Full path of the session directory, or `None` if it has not been created.
+    """
+    def __init__(self, password, parent=None, prefix="sirup-"):
+        self._pwd = password
+        self._parent = parent
+        self._prefix = prefix
+        self.path = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r})"
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    def create(self):
+        """Create the session directory if it does not exist yet.
+
+        Returns:
+            str: full path of the session directory.
+        """
+        if self.path is None:
+            parent = self._parent if self._parent is not None else _default_parent_directory()
+            self.path = tempfile.mkdtemp(prefix=self._prefix, dir=parent)
+        return self.path
+
+    def siblings(self):
+        """List the session directories with the same prefix in the same parent directory, including this one.
+
+        Session directories that were not cleaned up, for instance of crashed processes, show up here.
+
+        Returns:
+            list: full paths of the directories.
+        """
+        if self.path is not None:
+            parent = os.path.dirname(self.path)
+        else:
+            parent = self._parent if self._parent is not None else _default_parent_directory()
+        return sorted(path for path in glob.glob(os.path.join(parent, f"{glob.escape(self._prefix)}*"))
+                      if os.path.isdir(path))
+
+    def tunnel_dir(self, name):
+        """Return the working directory of a tunnel, creating it if necessary.
+
+        Args:
+            name (str): name of the tunnel, for instance `"tunnel0"`.
+
+        Returns:
+            str: full path of the tunnel directory.
+        """
+        tunnel_path = os.path.join(self.create(), name)
+        os.makedirs(tunnel_path, mode=0o700, exist_ok=True)
+        return tunnel_path
+
+    def cleanup(self):
+        "Remove the session directory and everything in it."
+        if self.path is None:
+            return
+        if os.path.exists(self.path):
+            cmd = ["sudo", "-S", "rm", "-rf", self.path]
+            subprocess.run(cmd, input=self._pwd.encode(), check=True)
+        self.path = None
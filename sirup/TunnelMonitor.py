@@ -0,0 +1,203 @@
+"Watch the tunnel of an IPRotator and recover when it fails"
+
+import logging
+import threading
+import time
+
+
+class TunnelMonitor():
+    """Check the health of the tunnel of an `IPRotator` in a background thread, and reconnect or rotate when it fails.
+
+    A tunnel is considered failed when
+
+    - the `OpenVPN` process does not exist anymore,
+    - the management interface does not answer, or reports a state other than `CONNECTED` for `stall_timeout` seconds,
+    - the received byte counter of the tunnel has not increased for `stall_timeout` seconds, and `probe` (if given)
+      does not succeed either.
+
+    Most providers push a keepalive to their clients, so the received byte counter increases every few seconds
+    even when the tunnel is idle. The checks are cheap: no subprocess is started and no request leaves the
+    machine unless the byte counter stalls and a `probe` is given.
+
+    Checks are skipped while the rotator is connecting, disconnecting or rotating.
+
+    Args:
+        rotator (sirup.IPRotator.IPRotator): The rotator whose tunnel is watched.
+        interval (float, optional): Number of seconds between two checks.
+        stall_timeout (float, optional): Number of seconds without received bytes, or in a state other than `CONNECTED`,
+            after which the tunnel is considered failed.
+        probe (callable, optional): Function without arguments that returns `True` if a request through the tunnel
+            succeeds. It is only called when the byte counter stalls.
+        action (str, optional): What to do when the tunnel failed. `"reconnect"` reconnects to the same server and
+            falls back to the next server if that fails; `"rotate"` connects to the next server.
+        on_failure (callable, optional): Called with the rotator and the reason of the failure (str) before recovering.
+        on_recovery (callable, optional): Called with the rotator and the reason of the failure (str) after recovering.
+        bytecount_interval (int, optional): Seconds between two reports of the byte counters that the monitor asks
+            `OpenVPN` for. By default, the `bytecount_interval` of the connector is kept; if the connector has none,
+            the reports come every `interval` seconds.
+
+    Attributes:
+        last_failure (None or str): Reason of the most recent failure.
+        n_recoveries (int): Number of successful recoveries.
+    """
+
+    def __init__(self, # pylint: disable=too-many-arguments
+                 rotator,
+                 interval=2,
+                 stall_timeout=20,
+                 probe=None,
+                 action="reconnect",
+                 on_failure=None,
+                 on_recovery=None,
+                 bytecount_interval=None):
+        if action not in ("reconnect", "rotate"):
+            raise ValueError(f"action must be 'reconnect' or 'rotate', not {action!r}")
+        self.rotator = rotator
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.probe = probe
+        self.action = action
+        self.on_failure = on_failure
+        self.on_recovery = on_recovery
+        self.bytecount_interval = bytecount_interval
+        self.last_failure = None
+        self.n_recoveries = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._connector = None
+        self._management = None
+        self._last_bytes_in = None
+        self._last_traffic = None
+        self._not_connected_since = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(interval={self.interval!r}, stall_timeout={self.stall_timeout!r}, "\
+            f"action={self.action!r})"
+
+
+    def is_running(self):
+        """Indicates whether the monitor thread is running.
+
+        Returns:
+            bool: True if the thread is running.
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def start(self):
+        "Start watching the tunnel in a background thread."
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sirup-tunnel-monitor", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        "Stop watching the tunnel."
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+
+    def check(self):
+        """Run the health checks once.
+
+        Returns:
+            None or str: `None` if the tunnel is healthy or no tunnel is active, otherwise the reason of the failure.
+        """
+        connector = self.rotator.connector
+        if connector is None:
+            return None
+        now = time.time()
+        if connector is not self._connector:
+            self._watch(connector, now)
+
+        if not connector.is_alive():
+            return "openvpn process died"
+
+        if self._management is not None:
+            try:
+                state = self._management.state()["state"]
+            except (ConnectionError, RuntimeError) as e:
+                return f"management interface not responding: {e}"
+            if state == "CONNECTED":
+                self._not_connected_since = None
+            elif self._not_connected_since is None:
+                self._not_connected_since = now
+            elif now - self._not_connected_since >= self.stall_timeout:
+                return f"tunnel in state {state}"
+            bytes_in = self._management.bytes_in
+            if bytes_in is not None and bytes_in != self._last_bytes_in:
+                self._last_bytes_in = bytes_in
+                self._last_traffic = now
+        elif self.probe is None:
+            return None # nothing left to check
+
+        if now - self._last_traffic >= self.stall_timeout:
+            if self.probe is None or not self._run_probe():
+                return "no traffic through the tunnel"
+            self._last_traffic = now
+        return None
+
+
+    def _watch(self, connector, now):
+        "Reset the state of the checks for a new connection and subscribe to its byte counters."
+        self._connector = connector
+        self._last_bytes_in = None
+        self._last_traffic = now
+        self._not_connected_since = None
+        try:
+            self._management = connector.open_management()
+            if self._management is None: # for instance WireGuard; the process and the probe are checked
+                return
+            if self.bytecount_interval is not None:
+                self._management.bytecount(self.bytecount_interval)
+            elif getattr(connector, "bytecount_interval", None) is None: # otherwise the counters are reported already
+                self._management.bytecount(max(1, int(round(self.interval))))
+        except (ConnectionError, RuntimeError, OSError) as e:
+            logging.info("Cannot use the management interface of %s: %s", connector.config_file, e)
+            self._management = None
+
+
+    def _run_probe(self):
+        "Run the probe and treat exceptions as failures."
+        try:
+            return bool(self.probe())
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Probe through the tunnel failed: %s", e)
+            return False
+
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self.rotator.lock.acquire(blocking=False): # the rotator is busy changing the connection
+                continue
+            try:
+                reason = self.check()
+                if reason is not None:
+                    self._recover(reason)
+            finally:
+                self.rotator.lock.release()
+
+
+    def _recover(self, reason):
+        "Notify the callbacks and reconnect or rotate."
+        logging.info("Tunnel with %s failed: %s", self.rotator.connector.config_file, reason)
+        self.last_failure = reason
+        if self.on_failure is not None:
+            self.on_failure(self.rotator, reason)
+        try:
+            if self.action == "rotate":
+                self.rotator.rotate()
+            else:
+                self.rotator.reconnect()
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Recovering the tunnel failed: %s", e)
+            return
+        self._connector = None
+        self.n_recoveries += 1
+        if self.on_recovery is not None:
+            self.on_recovery(self.rotator, reason)
@@ -0,0 +1,79 @@
+"Options of the tunnels that an IPRotator opens"
+
+from .TunnelTuner import provider_of
+from .TunnelTuner import read_tuning
+
+
+class TunnelOptions():
+    """How an `sirup.IPRotator.IPRotator` opens, verifies and accounts each of its tunnels.
+
+    Args:
+        connect_timeout (None, float or sirup.ConnectionHistory.AdaptiveTimeout, optional): Maximum number of seconds
+            until a tunnel is up. `None` uses the default of the connector (30 seconds for `OpenVPN`). An
+            `AdaptiveTimeout` derives the timeout of each server from its connect times in the history of the rotator,
+            so that hung attempts to fast servers are abandoned early and slow servers get enough time.
+        verify_routes (bool, optional): If True, each connection is verified locally from the kernel's routing table
+            and interfaces, without a network round trip. See `sirup.Backend.Backend.check_routes`.
+        ip_check_rate (float, optional): Share of the IP address checks that are carried out when the rotator tracks
+            the IP address. Together with `verify_routes`, a low rate, for instance 0.05, keeps the IP address API as a
+            sampled cross-check while staying well below its query limits.
+        track_throughput (bool, optional): If True, the byte counters of each tunnel are recorded and summarized
+            per configuration file in the `throughput` of the rotator when the tunnel is closed.
+        tuning_file (str, optional): JSON file with `OpenVPN` options per provider, written by `sirup tune`. The options
+            of the directory of a configuration file are added to each `OpenVPN` connection to it.
+        switch_in_place (bool, optional): If True, `rotate` moves the running `OpenVPN` process to the next server
+            when the two configuration files are compatible (see `sirup.ovpn_config.config_fingerprint`), instead of
+            starting a new process. Incompatible files and failed switches fall back to a new process.
+        log_max_bytes (int, optional): Size in bytes above which the log of `OpenVPN` is rotated, for tunnels that stay
+            up for a long time. See `sirup.VPNConnector.VPNConnector`.
+        verb_when_up (int, optional): Verbosity of `OpenVPN` once a tunnel is established, for instance 1.
+        scheduling (sirup.SchedulingPolicy.SchedulingPolicy, optional): CPU affinity, priorities and cgroup of the
+            `OpenVPN` daemons.
+
+    Attributes:
+        tuning (dict): Maps each provider, that is each directory of configuration files, to its `OpenVPN` options.
+    """
+
+    def __init__(self, connect_timeout=None, verify_routes=False, ip_check_rate=1.0, # pylint: disable=too-many-arguments
+                 track_throughput=False, tuning_file=None, switch_in_place=False, log_max_bytes=None,
+                 verb_when_up=None, scheduling=None):
+        self.connect_timeout = connect_timeout
+        self.verify_routes = verify_routes
+        self.ip_check_rate = ip_check_rate
+        self.track_throughput = track_throughput
+        self.tuning = read_tuning(tuning_file) if tuning_file is not None else {}
+        self.switch_in_place = switch_in_place
+        self.log_max_bytes = log_max_bytes
+        self.verb_when_up = verb_when_up
+        self.scheduling = scheduling
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(connect_timeout={self.connect_timeout!r}, "\
+            f"verify_routes={self.verify_routes!r}, switch_in_place={self.switch_in_place!r})"
+
+
+    def verification(self):
+        """The arguments of every connector that select how its tunnel is verified.
+
+        Returns:
+            dict: `verify_routes` and `ip_check_rate`.
+        """
+        return {"verify_routes": self.verify_routes, "ip_check_rate": self.ip_check_rate}
+
+
+    def openvpn_arguments(self, config_file):
+        """The further arguments of a `sirup.VPNConnector.VPNConnector` for a configuration file.
+
+        Args:
+            config_file (str): the configuration file.
+
+        Returns:
+            dict: the keyword arguments.
+        """
+        return {"bytecount_interval": 1 if self.track_throughput else None,
+                "options": self.tuning.get(provider_of(config_file)),
+                "in_place": self.switch_in_place,
+                "log_max_bytes": self.log_max_bytes,
+                "verb_when_up": self.verb_when_up,
+                "scheduling": self.scheduling}
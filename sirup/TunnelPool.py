@@ -0,0 +1,179 @@
+"Keep several tunnels up at once, each in its own network namespace, and rotate them behind a proxy"
+
+import logging
+import time
+import requests
+from .HealthCheck import HealthCheck
+from .ProxyServer import NamespaceExit
+from .utils import RotationList
+from .VPNConnector import VPNConnector
+
+
+class TunnelPool(HealthCheck):
+    """Tunnels to `size` servers at the same time, each in its own network namespace, as exits of a
+    `sirup.ProxyServer.ProxyServer`.
+
+    The pool has twice as many namespaces as tunnels. To rotate a tunnel, the pool connects a spare namespace to the
+    next server, lets the proxy send new connections through it while the connections of the old tunnel finish, and
+    only then closes the old tunnel, whose namespace becomes a spare. Clients of the proxy never see a dropped
+    connection.
+
+    The namespaces are managed as by `sirup.HealthCheck.HealthCheck`; use the pool as a context manager.
+
+    Args:
+        auth_file (str): Full path and file name of the file with the authentication credentials for VPN connections.
+        config_files (list): The `OpenVPN` configuration files, in the order in which they are used.
+        pwd (str): User root password.
+        size (int, optional): Number of tunnels that are up at the same time.
+        timeout (float, optional): Maximum number of seconds until a tunnel is established.
+        nameserver (str, optional): DNS server used inside the namespaces.
+        scheduling (sirup.SchedulingPolicy.SchedulingPolicy, optional): CPUs, priorities and cgroups of the `OpenVPN`
+            daemons. With `per_tunnel`, the daemon of each open tunnel gets a CPU that no other open tunnel uses, as
+            long as there are enough CPUs.
+
+    Attributes:
+        config_queue (sirup.utils.RotationList): The configuration files; each new tunnel takes the first one.
+        tunnels (dict): Maps the slot of each open tunnel to a tuple `(connector, exit)`.
+    """
+
+    def __init__(self, auth_file, config_files, pwd, size=2, timeout=30, nameserver="1.1.1.1", # pylint: disable=too-many-arguments
+                 scheduling=None):
+        super().__init__(auth_file, pwd, parallelism=2 * size, timeout=timeout, nameserver=nameserver,
+                         prefix="siruppx")
+        self.size = size
+        self.scheduling = scheduling
+        self.config_queue = RotationList(config_files)
+        self.tunnels = {}
+        self._scheduling_slots = {} # slot of each open tunnel -> its slot in `scheduling`
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.auth_file!r}, pwd=<SECRET>, size={self.size!r})"
+
+
+    def open_tunnel(self, max_trials=20):
+        """Connect a spare namespace to the next server that works.
+
+        Args:
+            max_trials (int, optional): Maximum number of servers to try.
+
+        Returns:
+            int: the slot of the tunnel in `tunnels`.
+
+        Raises:
+            TimeoutError: if no server could be connected to.
+        """
+        slot = self._slots.get()
+        scheduling_slot = self._free_scheduling_slot()
+        for _ in range(max_trials):
+            config_file = self.config_queue.pop_append()
+            connector = VPNConnector(config_file, self.auth_file, track_ip=False,
+                                     work_dir=self._session_dir.tunnel_dir(f"proxy{slot}"),
+                                     netns=self.namespace(slot), scheduling=self.scheduling, slot=scheduling_slot)
+            try:
+                connector.connect(self.pwd, timeout=self.timeout)
+            except (TimeoutError, requests.ConnectionError) as e:
+                logging.info("Cannot connect to %s: %r", config_file, e)
+                self._close_slot(slot, connector)
+                continue
+            self.tunnels[slot] = (connector, NamespaceExit(self.namespace(slot),
+                                                           nameservers=self._nameservers(connector)))
+            self._scheduling_slots[slot] = scheduling_slot
+            return slot
+        self._slots.put(slot)
+        raise TimeoutError(f"Failed to connect to {max_trials} different servers.")
+
+
+    def _free_scheduling_slot(self):
+        "The slot in `scheduling` whose CPU the fewest open tunnels use, the lowest among equals."
+        n_cpus = len(self.scheduling.cpus) if self.scheduling is not None else 1
+        used = [scheduling_slot % n_cpus for scheduling_slot in self._scheduling_slots.values()]
+        return min(range(n_cpus), key=lambda scheduling_slot: (used.count(scheduling_slot), scheduling_slot))
+
+
+    def _nameservers(self, connector):
+        "The nameservers pushed by the server of a tunnel, or `nameserver`."
+        try:
+            return connector.nameservers(self.pwd) or [self.nameserver]
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Cannot read the nameservers of %s: %s", connector.config_file, e)
+            return [self.nameserver]
+
+
+    def close_tunnel(self, slot):
+        """Close a tunnel and make its namespace a spare.
+
+        Args:
+            slot (int): the slot of the tunnel.
+        """
+        connector, exit_ = self.tunnels.pop(slot)
+        self._scheduling_slots.pop(slot, None)
+        exit_.close()
+        self._close_slot(slot, connector)
+        self._slots.put(slot)
+
+
+    def _close_slot(self, slot, connector):
+        try:
+            connector.disconnect(self.pwd)
+        except Exception as e: #pylint: disable=broad-except
+            logging.info("Disconnecting from %s failed: %s", connector.config_file, e)
+        self._run_as_root(f"ip netns pids {self.namespace(slot)} | xargs -r kill 2>/dev/null || true")
+
+
+    def cpu_usage(self, seconds=1.0):
+        """Measure the CPU usage of the `OpenVPN` daemon of each tunnel, to size how many tunnels a host can carry.
+
+        Args:
+            seconds (float, optional): Length of the measurement.
+
+        Returns:
+            dict: maps the slot of each tunnel to the share of one CPU its daemon used, for instance 0.35, or to `None`
+              if the daemon exited.
+        """
+        before = {slot: connector.cpu_seconds() for slot, (connector, _) in self.tunnels.items()}
+        time.sleep(seconds)
+        usage = {}
+        for slot, start in before.items():
+            end = self.tunnels[slot][0].cpu_seconds() if slot in self.tunnels else None
+            usage[slot] = None if start is None or end is None else (end - start) / seconds
+        return usage
+
+
+    def start(self, proxy):
+        """Open `size` tunnels and add them to a proxy. Call `setup` first.
+
+        Args:
+            proxy (sirup.ProxyServer.ProxyServer): the proxy, not started yet.
+        """
+        for _ in range(self.size):
+            slot = self.open_tunnel()
+            proxy.add_exit(self.tunnels[slot][1])
+
+
+    def rotate(self, proxy, slot, drain_timeout=300):
+        """Replace a tunnel of a proxy started with `start_in_thread` by a tunnel to the next server.
+
+        Blocks until the connections through the old tunnel are closed, or for at most `drain_timeout` seconds;
+        connections that are still open then are cut when the old tunnel is closed.
+
+        Args:
+            proxy (sirup.ProxyServer.ProxyServer): the proxy.
+            slot (int): the slot of the tunnel to replace.
+            drain_timeout (float, optional): Maximum number of seconds to wait for the connections through the old
+                tunnel. `None` waits until they are all closed.
+
+        Returns:
+            int: the slot of the new tunnel.
+        """
+        new_slot = self.open_tunnel()
+        proxy.call(proxy.replace_exit(self.tunnels[slot][1], self.tunnels[new_slot][1], timeout=drain_timeout))
+        self.close_tunnel(slot)
+        return new_slot
+
+
+    def teardown(self):
+        "Close the tunnels and remove the namespaces."
+        for slot in list(self.tunnels):
+            self.close_tunnel(slot)
+        super().teardown()
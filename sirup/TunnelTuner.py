@@ -0,0 +1,213 @@
+"Find the OpenVPN options with the highest throughput for the servers of a provider"
+
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+from subprocess import PIPE
+from .HealthCheck import HealthCheck
+from .ovpn_config import option_args
+from .VPNConnector import VPNConnector
+
+
+# each candidate maps `OpenVPN` options to their arguments; the empty candidate keeps the settings of the config files
+CANDIDATES = [
+    {},
+    {"tun-mtu": ["1400"], "mssfix": ["1360"]},
+    {"sndbuf": ["524288"], "rcvbuf": ["524288"]},
+    {"fast-io": []},
+    {"data-ciphers": ["AES-128-GCM:AES-256-GCM:CHACHA20-POLY1305"]},
+    {"tun-mtu": ["1400"], "mssfix": ["1360"], "sndbuf": ["524288"], "rcvbuf": ["524288"], "fast-io": []},
+]
+
+_MEASURE = """
+import json, socket, sys, time, urllib.parse, urllib.request
+url = sys.argv[1]
+parts = urllib.parse.urlsplit(url)
+port = parts.port or (443 if parts.scheme == "https" else 80)
+latencies = []
+for _ in range(5):
+    start = time.monotonic()
+    socket.create_connection((parts.hostname, port), timeout=5).close()
+    latencies.append(time.monotonic() - start)
+start = time.monotonic()
+size = 0
+with urllib.request.urlopen(url, timeout=60) as response:
+    chunk = response.read(65536)
+    while chunk:
+        size += len(chunk)
+        chunk = response.read(65536)
+print(json.dumps({"bytes": size, "seconds": time.monotonic() - start, "latency": sorted(latencies)[2]}))
+"""
+
+
+def provider_of(config_file):
+    """The provider of a configuration file, which is the directory that contains it.
+
+    Args:
+        config_file (str): path to the configuration file.
+
+    Returns:
+        str: the absolute path of the directory.
+    """
+    return os.path.dirname(os.path.abspath(config_file))
+
+
+def read_tuning(path):
+    """Read the options saved by `TunnelTuner.save`.
+
+    Args:
+        path (str): the JSON file.
+
+    Returns:
+        dict: maps each provider (see `provider_of`) to its options. Empty if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as file:
+        return {provider: entry["options"] for provider, entry in json.load(file).items()}
+
+
+class TunnelTuner(HealthCheck):
+    """Try candidate `OpenVPN` options on a few servers and find those with the highest throughput.
+
+    For each candidate, the tuner connects to each server in a network namespace with the options added to the
+    command line of `OpenVPN` (which overrides the configuration file), downloads `url` through the tunnel and
+    measures the throughput and the latency of a TCP connection to the host of `url`. A candidate that fails to connect
+    counts as zero throughput. The empty candidate, which keeps the settings of the configuration files, is always
+    tried, so the best candidate is never worse than the provider's defaults on the measured servers.
+
+    To tune against a local test server instead of the provider, pass the client configuration of an `OpenVPN`
+    server that runs on the host and a `url` served behind it.
+
+    The namespaces are managed as by `sirup.HealthCheck.HealthCheck`; use the tuner as a context manager. Servers
+    are measured one at a time, so that the measurements do not compete for bandwidth.
+
+    Args:
+        auth_file (str): Full path and file name of the file with the authentication credentials for VPN connections.
+        pwd (str): User root password.
+        url (str): File that is downloaded through the tunnel; a few megabytes are enough.
+        candidates (list, optional): Dicts of options to try, see `CANDIDATES`.
+        rounds (int, optional): Number of measurements of each candidate on each server.
+        timeout (float, optional): Maximum number of seconds until a tunnel is established.
+        nameserver (str, optional): DNS server used inside the namespace.
+
+    Attributes:
+        trials (list): One dict per measurement with `config_file`, `options`, `success`, `throughput` (bytes per
+            second), `latency` (seconds) and `error`.
+        best (None or dict): The best candidate of the latest `tune`, with `options`, `throughput` and `latency`.
+    """
+
+    def __init__(self, auth_file, pwd, url, candidates=None, rounds=1, timeout=30, nameserver="1.1.1.1"): # pylint: disable=too-many-arguments
+        super().__init__(auth_file, pwd, parallelism=1, timeout=timeout, nameserver=nameserver, prefix="siruptune")
+        self.url = url
+        self.candidates = list(candidates if candidates is not None else CANDIDATES)
+        if {} not in self.candidates:
+            self.candidates.insert(0, {})
+        self.rounds = rounds
+        self.trials = []
+        self.best = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.auth_file!r}, pwd=<SECRET>, url={self.url!r}, rounds={self.rounds!r})"
+
+
+    def measure(self, slot=0):
+        """Download `url` inside the namespace of a slot.
+
+        Args:
+            slot (int, optional): the number of the slot.
+
+        Returns:
+            dict: `throughput` in bytes per second and `latency` in seconds.
+
+        Raises:
+            RuntimeError: when the download fails.
+        """
+        cmd = ["sudo", "-S", "ip", "netns", "exec", self.namespace(slot), sys.executable, "-c", _MEASURE, self.url]
+        result = subprocess.run(cmd, input=self.pwd.encode(), stdout=PIPE, stderr=PIPE, check=False)
+        if result.returncode != 0:
+            error = result.stderr.decode().strip().splitlines()
+            raise RuntimeError(f"Cannot download {self.url}: {error[-1] if error else result.returncode}")
+        measurement = json.loads(result.stdout.decode())
+        return {"throughput": measurement["bytes"] / max(measurement["seconds"], 1e-6),
+                "latency": measurement["latency"]}
+
+
+    def trial(self, config_file, options, slot=0):
+        """Connect to a server with some options, measure the tunnel and disconnect.
+
+        Args:
+            config_file (str): the configuration file of the server.
+            options (dict): the options to try.
+            slot (int, optional): the number of the slot.
+
+        Returns:
+            dict: the measurement, see `trials`.
+        """
+        trial = {"config_file": config_file, "options": options, "success": False, "throughput": 0.0,
+                 "latency": None, "error": None}
+        connector = VPNConnector(config_file, self.auth_file, track_ip=False,
+                                 work_dir=self._session_dir.tunnel_dir(f"tune{slot}"),
+                                 netns=self.namespace(slot), options=options)
+        try:
+            connector.connect(self.pwd, timeout=self.timeout)
+            trial.update(self.measure(slot))
+            trial["success"] = True
+        except Exception as e: #pylint: disable=broad-except
+            trial["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            try:
+                connector.disconnect(self.pwd)
+            except Exception as e: #pylint: disable=broad-except
+                logging.info("Disconnecting from %s failed: %s", config_file, e)
+            self._run_as_root(f"ip netns pids {self.namespace(slot)} | xargs -r kill 2>/dev/null || true")
+        self.trials.append(trial)
+        return trial
+
+
+    def tune(self, config_files):
+        """Measure every candidate on every server `rounds` times and choose the best candidate. Call `setup` first.
+
+        Candidates are compared by the median throughput of their measurements, then by the median latency of the
+        successful ones.
+
+        Args:
+            config_files (list): the configuration files of the servers to measure, usually a few of one provider.
+
+        Returns:
+            dict: `best`.
+        """
+        scores = []
+        for index, options in enumerate(self.candidates):
+            trials = [self.trial(config_file, options)
+                      for _ in range(self.rounds) for config_file in config_files]
+            throughput = statistics.median(trial["throughput"] for trial in trials)
+            latencies = [trial["latency"] for trial in trials if trial["success"]]
+            latency = statistics.median(latencies) if latencies else None
+            logging.info("%s: %.0f bytes/s, latency %s", option_args(options), throughput, latency)
+            scores.append(((throughput, -latency if latency is not None else float("-inf"), -index),
+                           {"options": options, "throughput": throughput, "latency": latency}))
+        self.best = max(scores, key=lambda score: score[0])[1]
+        return self.best
+
+
+    def save(self, path, provider):
+        """Save the options of `best` for a provider in a JSON file, keeping those of other providers.
+
+        Args:
+            path (str): the JSON file; see `read_tuning`.
+            provider (str): the provider, see `provider_of`.
+        """
+        tuning = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                tuning = json.load(file)
+        tuning[provider] = self.best
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(tuning, file, indent=1)
+        os.replace(tmp_path, path)
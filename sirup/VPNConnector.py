@@ -1,22 +1,38 @@
 "Connect to a server with OpenVPN"
 
 # import logging # TODO: add logging properly
+import getpass
 import logging
 import os
 import subprocess
+import threading
 import time
+from collections import deque
 from subprocess import PIPE
-import requests
+from .Backend import Backend
+from .ManagementInterface import ManagementInterface
+from .ovpn_config import option_args
+from .ovpn_config import pushed_nameservers
+from .ovpn_config import read_remotes
 from .raise_ovpn_exceptions import raise_ovpn_exceptions
-from .TemporaryFileWithRootPermission import TemporaryFileWithRootPermission
+from .route_check import check_tunnel
+from .TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
 from .utils import check_connection
 from .utils import get_ip
 from .utils import get_vpn_pids
+from .utils import process_cpu_seconds
+from .utils import process_exists
 from .utils import sudo_read_file
 
 
-class VPNConnector():
-    """Class to connect and disconnect to a single VPN server.
+LOG_TAIL_LINES = 200 # lines of the log read to explain a failure or find the pushed options
+
+
+class VPNConnector(Backend):
+    """Class to connect and disconnect to a single VPN server with `OpenVPN`.
+
+    Implements `sirup.Backend.Backend`: `start` launches the `OpenVPN` daemon, `wait_ready` watches its log until
+    the tunnel is established, and `stop` kills the daemon.
 
     Args:
         config_file (str): Full path and file name of the `OpenVPN` configuration file to connect to a server. 
@@ -24,6 +40,34 @@ class VPNConnector():
         track_ip (bool, optional): If True, the IP address is queried after each `connect` and `disconnect`. 
             For long-running programs, it is better to set track_ip=False in order to respect the query limits 
             of the IP address API.
+        work_dir (str, optional): Directory for the files written by `OpenVPN` (log and process ID).
+            If not provided, a temporary directory is created when the connection is started and removed
+            when it is closed. Pass a directory from `sirup.TemporaryDirectoryWithRootPermission` to reuse
+            it across connections.
+        bytecount_interval (int, optional): If given, `OpenVPN` reports the byte counters of the tunnel every
+            `bytecount_interval` seconds after the connection is established, and the connector keeps throughput samples.
+        max_samples (int, optional): Maximum number of throughput samples kept in memory.
+        verify_routes (bool, optional): If True, `connect` checks that the interface with the address pushed by the
+            server is up and that the routing table sends internet traffic through it. See `check_routes`.
+        ip_check_rate (float, optional): Share of the IP address checks that are carried out when `track_ip` is True.
+            With `verify_routes`, a low rate keeps the IP address API as an occasional cross-check.
+        netns (str, optional): Name of a network namespace in which `OpenVPN` runs, so that the tunnel does not
+            change the routes of the host. `exit_ip` and `check_routes` look at the host, not at the namespace.
+        in_place (bool, optional): If True, `OpenVPN` is started so that `switch` can move it to another server
+            without a new process: it waits on the management interface before connecting, asks there which remote to
+            use, and keeps the tun device and keys across restarts.
+        options (dict, optional): Additional `OpenVPN` options, which override those of the configuration file. Maps
+            option names without the leading dashes to lists of arguments, as found by `sirup.TunnelTuner.TunnelTuner`.
+        log_max_bytes (int, optional): If given, the log is rotated once it is larger: its content moves to
+            `openvpn.log.1`, replacing the previous one, and the log starts empty. The size is checked every
+            `log_check_interval` seconds while the tunnel is up, so the log files take at most about twice this size.
+        verb (int, optional): Verbosity of `OpenVPN` (`--verb`) while it connects. Defaults to that of the
+            configuration file.
+        verb_when_up (int, optional): Verbosity once the tunnel is established, set through the management interface,
+            for instance 1 to only log errors and reconnections on tunnels that stay up for days.
+        scheduling (sirup.SchedulingPolicy.SchedulingPolicy, optional): CPUs, priorities and cgroup of the daemon.
+        slot (int, optional): Number of the tunnel among those that run at the same time, which selects its CPU and
+            cgroup under `scheduling`.
 
     Attributes:
         config_file (str): Full path and file name of the `OpenVPN` configuration file to connect to a server. 
@@ -31,19 +75,56 @@ class VPNConnector():
         current_ip (None or str): If `track_ip` is `True`, the IP address of the machine that is currently visible.
         base_ip (None or str): If `track_ip` is `True`, the IP address when no VPN tunnel is active.
         track_ip (bool): If `True`, queries the IP address of the machine after each connect and disconnect.
+        work_dir (None or str): Directory for the files written by `OpenVPN`.
+        log_file (None or str): Full path of the `OpenVPN` log file.
+        pid_file (None or str): Full path of the file to which `OpenVPN` writes its process ID.
+        log_max_bytes (None or int): Size above which the log is rotated.
+        management_socket (None or str): Full path of the unix domain socket of the `OpenVPN` management interface.
+        management (None or sirup.ManagementInterface.ManagementInterface): Client of the management interface,
+            once it has been opened with `open_management`.
+        bytecount_interval (None or int): Seconds between two reports of the byte counters.
+        throughput_samples (collections.deque): Tuples `(time, bytes_in_per_second, bytes_out_per_second)`, one for each
+            report of the byte counters. Only the most recent `max_samples` are kept.
+        traffic_summary (None or dict): Summary of the traffic through the tunnel, set by `disconnect`. See `summarize_traffic`.
+        phase_times (dict): Times (seconds since the epoch) at which the latest `connect` reached each phase: `start`,
+            `vpn_started` (the `OpenVPN` daemon runs), `tunnel_up` (the tunnel is established) and `verified` (the
+            IP address was checked).
     """
 
-    def __init__(self, config_file, auth_file, track_ip=True):
-        self.config_file = config_file
+    log_check_interval = 60
+
+    def __init__(self, config_file, auth_file, track_ip=True, work_dir=None, # pylint: disable=too-many-arguments
+                 bytecount_interval=None, max_samples=3600, verify_routes=False, ip_check_rate=1.0, netns=None, options=None,
+                 in_place=False, log_max_bytes=None, verb=None, verb_when_up=None, scheduling=None, slot=0):
+        super().__init__(config_file, track_ip=track_ip, verify_routes=verify_routes, ip_check_rate=ip_check_rate)
         self.auth_file = auth_file
-        self.current_ip = None 
-        self.base_ip = None 
-        self.track_ip = track_ip
-        if track_ip:
-            ip = get_ip()
-            self.current_ip = ip 
-            self.base_ip = ip
+        self.netns = netns
+        self.options = options or {}
+        self.in_place = in_place
+        self.log_max_bytes = log_max_bytes
+        self.verb = verb
+        self.verb_when_up = verb_when_up
+        self.scheduling = scheduling
+        self.slot = slot
+        self._nameservers = None # read from the log once per connection
+        self._log_stop_event = threading.Event()
+        self._log_thread = None
+        self._remote = None # (host, port) that the process uses instead of the remotes of its config file
         self._vpn_process_id = None # if not connected, this should be None
+        self.work_dir = work_dir
+        self.log_file = None
+        self.pid_file = None
+        self.management_socket = None
+        self.management = None
+        self._session_dir = None # only set if the connector creates its own work_dir
+        self.bytecount_interval = bytecount_interval
+        self.throughput_samples = deque(maxlen=max_samples)
+        self._bytes_in = None
+        self._bytes_out = None
+        self._first_bytecount = None # (time, bytes_in, bytes_out) of the first report
+        self._last_bytecount = None
+        self._peak_rates = (0.0, 0.0)
+        self._accounting_management = None # the management client that reports to `_record_bytecount`
 
 
     def __repr__(self):
@@ -56,14 +137,142 @@ class VPNConnector():
         Returns:
             bool: True if a VPN connection is running.        
         """
-        return self._vpn_process_id is not None
+        return self._vpn_process_id is not None and self.is_alive()
+
+
+    def is_alive(self):
+        """Indicates whether the `OpenVPN` process of the connection still exists.
+
+        Unlike `get_vpn_pids`, this does not start a subprocess, so it is cheap enough to call every few seconds.
+
+        Returns:
+            bool: True if the process exists.
+        """
+        if self._vpn_process_id is None:
+            return False
+        return process_exists(self._vpn_process_id)
+
+
+    def open_management(self):
+        """Open the management interface of the running `OpenVPN` process.
+
+        `OpenVPN` accepts only one client on the management interface, so the client is created once and reused.
+
+        Returns:
+            sirup.ManagementInterface.ManagementInterface: the client, connected to the management interface.
+        """
+        if self.management is None:
+            self.management = ManagementInterface(self.management_socket)
+        self.management.open()
+        return self.management
+
+
+    @property
+    def bytes_in(self):
+        "None or int: Bytes received through the tunnel, as of the latest report of the byte counters."
+        return self._bytes_in
+
+
+    @property
+    def bytes_out(self):
+        "None or int: Bytes sent through the tunnel, as of the latest report of the byte counters."
+        return self._bytes_out
+
+
+    def start_traffic_accounting(self, interval=1):
+        """Ask `OpenVPN` to report the byte counters of the tunnel and record throughput samples.
+
+        Args:
+            interval (int, optional): seconds between two reports.
+        """
+        management = self.open_management()
+        if management is not self._accounting_management:
+            management.add_handler("BYTECOUNT", self._record_bytecount)
+            self._accounting_management = management
+        self.bytecount_interval = interval
+        management.bytecount(interval)
+
+
+    def _record_bytecount(self, payload):
+        "Update the byte counters and the throughput samples from a `BYTECOUNT` notification."
+        now = time.time()
+        bytes_in, bytes_out = (int(x) for x in payload.split(",")[:2])
+        if self._last_bytecount is None:
+            self._first_bytecount = (now, bytes_in, bytes_out)
+        else:
+            last_time, last_in, last_out = self._last_bytecount
+            elapsed = now - last_time
+            if elapsed > 0:
+                rate_in = (bytes_in - last_in) / elapsed
+                rate_out = (bytes_out - last_out) / elapsed
+                self.throughput_samples.append((now, rate_in, rate_out))
+                self._peak_rates = (max(self._peak_rates[0], rate_in), max(self._peak_rates[1], rate_out))
+        self._last_bytecount = (now, bytes_in, bytes_out)
+        self._bytes_in = bytes_in
+        self._bytes_out = bytes_out
+
+
+    def cpu_seconds(self):
+        """CPU time used by the `OpenVPN` daemon of the tunnel so far.
+
+        Returns:
+            None or float: the CPU time in seconds, or `None` if no daemon runs.
+        """
+        if self._vpn_process_id is None:
+            return None
+        try:
+            return process_cpu_seconds(self._vpn_process_id)
+        except OSError:
+            return None
+
+
+    def summarize_traffic(self):
+        """Summarize the traffic through the tunnel since the byte counters were first reported.
+
+        Returns:
+            None or dict: `None` if there are fewer than two reports of the byte counters. Otherwise a dict with
+              `config_file`, `seconds` (time between the first and the last report), `bytes_in`, `bytes_out`,
+              `mean_rate_in`, `mean_rate_out`, `peak_rate_in` and `peak_rate_out`. Rates are in bytes per second.
+        """
+        if self._first_bytecount is None or self._last_bytecount is self._first_bytecount:
+            return None
+        first_time, first_in, first_out = self._first_bytecount
+        last_time, last_in, last_out = self._last_bytecount
+        seconds = last_time - first_time
+        if seconds <= 0:
+            return None
+        return {
+            "config_file": self.config_file,
+            "seconds": seconds,
+            "bytes_in": last_in,
+            "bytes_out": last_out,
+            "mean_rate_in": (last_in - first_in) / seconds,
+            "mean_rate_out": (last_out - first_out) / seconds,
+            "peak_rate_in": self._peak_rates[0],
+            "peak_rate_out": self._peak_rates[1],
+        }
+
+
+    def _prepare_work_dir(self, pwd):
+        "Set the paths of the files written by `OpenVPN`, creating a temporary work_dir if necessary."
+        if self.work_dir is None:
+            self._session_dir = TemporaryDirectoryWithRootPermission(password=pwd)
+            self.work_dir = self._session_dir.create()
+        self.log_file = os.path.join(self.work_dir, "openvpn.log")
+        self.pid_file = os.path.join(self.work_dir, "openvpn.pid")
+        self.management_socket = os.path.join(self.work_dir, "management.sock")
 
     def start_vpn(self, pwd, proc_id=None):
         """Start an `OpenVPN` connection.
 
-        Starts an `OpenVPN` process. The log is written to a temporary file.
+        Starts an `OpenVPN` process. The log is written to `openvpn.log` in `self.work_dir`;
+        `OpenVPN` truncates the file if it exists already. The management interface listens on
+        `management.sock` in `self.work_dir` and only accepts connections from the current user.
+        The options in `self.options` are appended to the command line. With `self.log_max_bytes`, the log is
+        emptied here and `OpenVPN` appends to it, so that `rotate_log` can empty it again while the process runs.
         The process is opened as a daemon: This means that the process runs in the background and 
-        releases the terminal after start-up.
+        releases the terminal after start-up. With `self.scheduling`, it starts with the CPU affinity and priorities
+        of the policy.
 
         Args:
             pwd (str):  The user's root password.
@@ -74,65 +283,304 @@ class VPNConnector():
             Exceptions when opening the connection fails. 
                The exceptions are specified in `sirup.raise_ovpn_exceptions`.
         """
-        self.log_file = TemporaryFileWithRootPermission(password=pwd, suffix=".log")
-        self.log_file.create_path(file_name="openvpn")
-        cmd = ["sudo", "-S", "openvpn",
+        self._prepare_work_dir(pwd)
+        cmd = ["sudo", "-S"]
+        if self.netns is not None:
+            cmd.extend(["ip", "netns", "exec", self.netns])
+        if self.scheduling is not None:
+            cmd.extend(self.scheduling.prefix(self.slot))
+        cmd.extend(["openvpn",
             "--config", self.config_file,
             "--auth-user-pass", self.auth_file,
-            "--log", self.log_file.file_name,
-            "--daemon"]
+            "--log" if self.log_max_bytes is None else "--log-append", self.log_file,
+            "--management", self.management_socket, "unix",
+            "--management-client-user", getpass.getuser(),
+            "--daemon"])
+        if self.verb is not None:
+            cmd.extend(["--verb", str(self.verb)])
+        cmd.extend(option_args(self.options))
+        if self.in_place:
+            cmd.extend(["--management-hold", "--management-query-remote", "--persist-tun", "--persist-key"])
         
         if proc_id is not None:
             cmd.extend(["--writepid", proc_id])
+        if self.log_max_bytes is not None and os.path.exists(self.log_file):
+            subprocess.run(["sudo", "-S", "truncate", "-s", "0", self.log_file], input=pwd.encode(), check=True)
+        self._nameservers = None
         with subprocess.Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE) as proc:
             stdout, stderr = proc.communicate(pwd.encode()) 
             if proc.returncode != 0: 
                 log = None 
-                if os.path.exists(self.log_file.file_name):
-                    log = sudo_read_file(file=self.log_file.file_name, pwd=pwd) # what happens if the log file does not exist?
+                if os.path.exists(self.log_file):
+                    log = sudo_read_file(file=self.log_file, pwd=pwd, max_lines=LOG_TAIL_LINES)
                 raise_ovpn_exceptions(stdout.decode(), stderr.decode(), log)
 
 
-    def connect(self, pwd):
-        """Connect to a server.
+    def start(self, pwd):
+        """Start the `OpenVPN` daemon. See `start_vpn`.
 
         Args:
             pwd (str): User root password. This is necessary for `OpenVPN`.
         """
-        with TemporaryFileWithRootPermission(suffix=".txt", password=pwd) as file_with_process_id:
-            self.start_vpn(pwd=pwd, proc_id=file_with_process_id) 
-            connected = check_connection(self.log_file, timeout=30, pwd=pwd) 
-            if connected:
-                logging.info("Connected with %s.", self.config_file)
-                vpn_pid = sudo_read_file(file_with_process_id, pwd=pwd)
-                self._vpn_process_id = vpn_pid[0].strip()
-                if self.track_ip:
-                    try:
-                        self.current_ip = get_ip(config_file=self.config_file)
-                    except requests.ConnectionError as exc: # TODO: use special exception here? 
-                        raise requests.ConnectionError("Cannot get IP address") from exc
-            else: 
-                raise TimeoutError("Could not connect to vpn") 
+        self._prepare_work_dir(pwd)
+        self.start_vpn(pwd=pwd, proc_id=self.pid_file)
+        if self.in_place:
+            management = self.open_management()
+            management.add_handler("REMOTE", self._answer_remote)
+            management.command("hold off") # restarts do not wait
+            management.command("hold release")
 
 
-    def disconnect(self, pwd):
-        """Disconnect from the current server. 
-        If `self.track_ip` is True, also get back the base IP. 
+    def _answer_remote(self, payload): # pylint: disable=unused-argument
+        "Answer a `>REMOTE` query: use the server chosen by `switch`, or the remote of the configuration file."
+        cmd = "remote ACCEPT" if self._remote is None else f"remote MOD {self._remote[0]} {self._remote[1]}"
+        # handlers run in the thread that reads the answers, so the command is sent from another thread
+        threading.Thread(target=self._send_command, args=(cmd,), daemon=True).start()
+
+
+    def _send_command(self, cmd):
+        try:
+            self.management.command(cmd)
+        except (ConnectionError, RuntimeError, AttributeError) as e:
+            logging.info("Management command %r failed: %s", cmd, e)
+
+
+    def switch(self, config_file, timeout=None, waiting_time=0.1):
+        """Move the running `OpenVPN` process to the server of another configuration file, keeping the tun device.
+
+        The process is restarted with `SIGUSR1` and connects to the first remote of `config_file` instead of its own.
+        The configuration files must be compatible (see `sirup.ovpn_config.config_fingerprint`), and the connector
+        must have been started with `in_place=True`. The traffic of the previous server is summarized in
+        `self.traffic_summary`, and the routes and exit IP address are verified as after `connect`.
+
+        Args:
+            config_file (str): the configuration file of the next server.
+            timeout (float, optional): Maximum number of seconds until the tunnel to the next server is established.
+                Defaults to `self.connect_timeout`.
+            waiting_time (float, optional): Seconds between two queries of the state of the process.
+
+        Raises:
+            ValueError: when `config_file` has no remote. The process is left as it is.
+            TimeoutError: when the tunnel is not established within `timeout` seconds.
+            requests.ConnectionError: when the tunnel cannot be verified.
+        """
+        if timeout is None:
+            timeout = self.connect_timeout
+        remotes = read_remotes(config_file)
+        if not remotes:
+            raise ValueError(f"{config_file} has no remote")
+        management = self.open_management()
+        previous = management.state()
+        self.traffic_summary = self.summarize_traffic()
+        self._first_bytecount = self._last_bytecount = None
+        self._peak_rates = (0.0, 0.0)
+
+        host, port, _ = remotes[0]
+        self._remote = (host, port)
+        self.config_file = config_file
+        self._nameservers = None
+        self.phase_times = {"start": self.clock.time()}
+        management.signal("SIGUSR1")
+        self.phase_times["vpn_started"] = self.clock.time()
+        deadline = self.clock.time() + timeout
+        restarted = False
+        while True:
+            state = management.state()
+            restarted = restarted or state["state"] != "CONNECTED" or state["time"] != previous["time"]
+            if restarted and state["state"] == "CONNECTED":
+                break
+            if self.clock.time() >= deadline:
+                raise TimeoutError(f"Could not switch to {config_file}")
+            self.clock.sleep(waiting_time)
+        self.phase_times["tunnel_up"] = self.clock.time()
+        logging.info("Switched to %s.", config_file)
+        self._verify()
+
+
+    def wait_ready(self, pwd, timeout):
+        """Wait until the log shows that the tunnel is established, then start the traffic accounting
+        if `self.bytecount_interval` is set.
+
+        Args:
+            pwd (str): User root password. This is necessary for `OpenVPN`.
+            timeout (float): Maximum number of seconds to wait.
+
+        Raises:
+            TimeoutError: when the tunnel is not established within `timeout` seconds. The `OpenVPN` daemon of the
+                attempt is killed, so that it does not bring the tunnel up later.
+        """
+        if not check_connection(self.log_file, timeout=timeout, pwd=pwd):
+            self._abandon(pwd)
+            raise TimeoutError("Could not connect to vpn")
+        vpn_pid = sudo_read_file(self.pid_file, pwd=pwd)
+        self._vpn_process_id = vpn_pid[0].strip()
+        if self.scheduling is not None:
+            try:
+                self.scheduling.place(self._vpn_process_id, self.slot, pwd)
+            except subprocess.CalledProcessError as e:
+                logging.info("Cannot move %s to its cgroup: %s", self.config_file, e.stderr)
+        if self.bytecount_interval is not None:
+            try:
+                self.start_traffic_accounting(self.bytecount_interval)
+            except (ConnectionError, RuntimeError) as e:
+                logging.info("Cannot record the traffic of %s: %s", self.config_file, e)
+        if self.verb_when_up is not None:
+            try:
+                self.open_management().command(f"verb {self.verb_when_up}")
+            except (ConnectionError, RuntimeError) as e:
+                logging.info("Cannot change the verbosity of %s: %s", self.config_file, e)
+        if self.log_max_bytes is not None:
+            self._start_log_rotation(pwd)
+
+
+    def rotate_log(self, pwd):
+        """Rotate the log if it is larger than `self.log_max_bytes`. `OpenVPN` keeps writing to the emptied file.
+
+        Args:
+            pwd (str): User root password. This is necessary to change the log written by `OpenVPN`.
+
+        Returns:
+            bool: True if the log was rotated.
+        """
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            return False
+        if self.log_max_bytes is None or size <= self.log_max_bytes:
+            return False
+        cmd = ["sudo", "-S", "sh", "-c", 'cp "$1" "$1.1" && truncate -s 0 "$1"', "sh", self.log_file]
+        subprocess.run(cmd, input=pwd.encode(), check=True, capture_output=True)
+        return True
+
+
+    def _start_log_rotation(self, pwd):
+        "Check the size of the log every `log_check_interval` seconds in a background thread, until `stop`."
+        self._stop_log_rotation()
+        self._log_stop_event.clear()
+        self._log_thread = threading.Thread(target=self._rotate_log_periodically, args=(pwd,),
+                                            name="sirup-log-rotation", daemon=True)
+        self._log_thread.start()
+
+
+    def _rotate_log_periodically(self, pwd):
+        while not self._log_stop_event.wait(self.log_check_interval):
+            try:
+                self.rotate_log(pwd)
+            except subprocess.CalledProcessError as e:
+                logging.info("Cannot rotate the log of %s: %s", self.config_file, e)
+
+
+    def _stop_log_rotation(self):
+        self._log_stop_event.set()
+        if self._log_thread is not None and self._log_thread is not threading.current_thread():
+            self._log_thread.join()
+        self._log_thread = None
+
+
+    def _abandon(self, pwd):
+        "Kill the daemon of an attempt that timed out, without waiting for it to exit."
+        try:
+            vpn_pid = sudo_read_file(self.pid_file, pwd=pwd)[0].strip()
+        except (IndexError, OSError, subprocess.CalledProcessError) as e:
+            logging.info("Cannot read the process ID of the attempt to %s: %s", self.config_file, e)
+            return
+        if vpn_pid in get_vpn_pids():
+            subprocess.run(["sudo", "-S", "kill", vpn_pid], input=pwd.encode(), check=False)
+
+
+    def stop(self, pwd):
+        """Summarize the traffic in `self.traffic_summary`, close the management interface and kill the `OpenVPN` daemon.
 
         Args:
             pwd (str): User root password. This is necessary for `OpenVPN`.
         """
+        self.traffic_summary = self.summarize_traffic()
+        self._stop_log_rotation()
+        if self.management is not None:
+            self.management.close()
+            self.management = None
+
         openvpn_pids = get_vpn_pids()
 
         if self._vpn_process_id in openvpn_pids:
             cmd = ["sudo", "-S", "kill", self._vpn_process_id]
             subprocess.run(cmd, input=pwd.encode(), check=True)
-            self.log_file.remove() 
             time.sleep(5)
+        self._vpn_process_id = None
+        self._remote = None
+
+
+    def state(self):
+        """Report the state of the tunnel.
+
+        Returns:
+            str: `"up"` if the `OpenVPN` process of the connection runs, `"failed"` if it died, otherwise `"down"`.
+        """
+        if self._vpn_process_id is None:
+            return "down"
+        return "up" if self.is_alive() else "failed"
+
+
+    def check_routes(self):
+        """Check that the tun interface with the address pushed by the server is up, and that the routing
+        table sends internet traffic through it.
+
+        The address is taken from the state of the management interface; see `sirup.route_check.check_tunnel`.
+
+        Returns:
+            None or str: `None` if the tunnel is in use, otherwise the reason why not.
+        """
+        try:
+            local_ip = self.open_management().state()["local_ip"]
+        except (ConnectionError, RuntimeError, OSError) as e:
+            return f"management interface not responding: {e}"
+        if not local_ip:
+            return "no address was pushed by the server"
+        return check_tunnel(local_ip=local_ip)
+
+
+    def nameservers(self, pwd):
+        """The DNS servers that the server pushed, read from the end of the log once per connection.
+
+        Args:
+            pwd (str): User root password. This is necessary to read the log written by `OpenVPN`.
+
+        Returns:
+            list: IP addresses; empty if the server pushed none.
+        """
+        if self._nameservers is None:
+            self._nameservers = pushed_nameservers(sudo_read_file(self.log_file, pwd=pwd, max_lines=LOG_TAIL_LINES))
+        return self._nameservers
+
+
+    def exit_ip(self):
+        """Query the IP address that is visible from the internet with `sirup.utils.get_ip`.
+
+        Returns:
+            str: the IP address.
+        """
+        return get_ip()
+
+
+    def disconnect(self, pwd):
+        """Disconnect from the current server. 
+        If `self.track_ip` is True, also get back the base IP. 
+        If the connector created its own temporary `work_dir`, it is removed.
+        The traffic through the tunnel is summarized in `self.traffic_summary`.
+
+        Args:
+            pwd (str): User root password. This is necessary for `OpenVPN`.
+        """
+        self.stop(pwd)
+
+        if self._session_dir is not None:
+            self._session_dir.cleanup()
+            self._session_dir = None
+            self.work_dir = None
         
-        if self.track_ip:
+        self.current_ip = None
+        if self._check_ip():
             self.current_ip = get_ip()
-            if self.current_ip != self.base_ip: 
+            if self.base_ip is not None and self.current_ip != self.base_ip: 
                 # is informative, but could be a problem with dynamic IPs (like eduroam). so only raise warning.
                 raise RuntimeWarning("Expected to go back to base IP address, but did not")
-        self._vpn_process_id = None
@@ -0,0 +1,204 @@
+"Group the protocol and port variants of each server, and learn which variant gets through from the current network"
+
+import logging
+from .ovpn_config import variant_of
+
+
+def _transport_name(transport):
+    return f"{transport[0]}/{transport[1]}"
+
+
+class VariantSelector():
+    """Choose among the configuration files of the same server the one whose transport works from here.
+
+    Providers ship each server in several configuration files, one for each protocol and port (see
+    `sirup.ovpn_config.variant_of`). On networks that block UDP, or all ports but a few, every attempt with a blocked
+    transport runs into the connect timeout. The selector learns for each transport, that is each protocol and port,
+    how often the server was reached with it: attempts that time out count as blocked, attempts where the tunnel came
+    up count as reached, even if the exit IP could not be verified afterwards. Transports without attempts inherit the
+    rate of their protocol, so one blocked UDP port makes the other UDP ports less likely too.
+
+    `choose` replaces a configuration file by the variant of its server with the highest smoothed rate. Ties keep
+    the given file, so all variants are tried in rotation order as long as nothing is known. Older attempts count
+    less with each new attempt with the same transport (`decay`), so the selector notices when a transport is
+    unblocked. The rates are kept separately for each network returned by `network`, for instance
+    `sirup.route_check.default_gateway`, so that a laptop that moves between networks does not mix them up.
+
+    Args:
+        decay (float, optional): Weight of the previous attempts with a transport when a new one is added, between
+            0 and 1.
+        network (callable, optional): Returns an identifier of the current network. Defaults to a single network.
+
+    Attributes:
+        stats (dict): For each network, maps each transport `(proto, port)` and each protocol to a list
+            `[reached, attempts]` of decayed counts.
+    """
+
+    def __init__(self, decay=0.9, network=None):
+        self.decay = decay
+        self.network = network
+        self.stats = {}
+        self._variants = {} # config file -> (server, transport) or None
+        self._groups = {} # server -> config files
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(decay={self.decay!r}, servers={len(self._groups)!r})"
+
+
+    def add(self, config_file):
+        """Read the server and transport of a configuration file and add it to the group of its server.
+
+        Args:
+            config_file (str): path to the configuration file.
+        """
+        self.remove(config_file)
+        try:
+            variant = variant_of(config_file)
+        except OSError as e:
+            logging.info("Cannot read %s: %s", config_file, e)
+            variant = None
+        self._variants[config_file] = variant
+        if variant is not None:
+            self._groups.setdefault(variant[0], []).append(config_file)
+
+
+    def remove(self, config_file):
+        """Take a configuration file out of the group of its server.
+
+        Args:
+            config_file (str): path to the configuration file.
+        """
+        variant = self._variants.pop(config_file, None)
+        if variant is None:
+            return
+        group = self._groups[variant[0]]
+        group.remove(config_file)
+        if not group:
+            del self._groups[variant[0]]
+
+
+    def server_of(self, config_file):
+        """The server of a configuration file.
+
+        Args:
+            config_file (str): path to the configuration file.
+
+        Returns:
+            None or str: the server, or `None` if the file was not added or has no remotes.
+        """
+        variant = self._variants.get(config_file)
+        return variant[0] if variant is not None else None
+
+
+    def variants(self, config_file):
+        """All configuration files of the server of a configuration file.
+
+        Args:
+            config_file (str): path to the configuration file.
+
+        Returns:
+            list: the configuration files, including `config_file`.
+        """
+        server = self.server_of(config_file)
+        if server is None:
+            return [config_file]
+        return list(self._groups[server])
+
+
+    def _network_stats(self):
+        network = self.network() if self.network is not None else None
+        return self.stats.setdefault(network, {})
+
+
+    def _update(self, key, reached, attempts, decay):
+        counts = self._network_stats().setdefault(key, [0.0, 0.0])
+        counts[0] = counts[0] * decay + reached
+        counts[1] = counts[1] * decay + attempts
+
+
+    def record(self, config_file, reached):
+        """Add a connection attempt.
+
+        Args:
+            config_file (str): the configuration file of the attempt.
+            reached (bool): True if the tunnel came up, False if the attempt timed out.
+        """
+        variant = self._variants.get(config_file)
+        if variant is None:
+            return
+        transport = variant[1]
+        for key in (transport, transport[0]):
+            self._update(key, int(reached), 1, self.decay)
+
+
+    def learn_from(self, history):
+        """Add the attempts of a `sirup.ConnectionHistory.ConnectionHistory`, for instance one preloaded from a file.
+
+        Attempts that failed with a `TimeoutError` count as blocked, all others as reached.
+
+        Args:
+            history (sirup.ConnectionHistory.ConnectionHistory): the connection attempts.
+        """
+        for config_file, record in history.servers.items():
+            variant = self._variants.get(config_file)
+            if variant is None or record.attempts == 0:
+                continue
+            timeouts = record.exceptions.get("TimeoutError", 0)
+            transport = variant[1]
+            for key in (transport, transport[0]):
+                self._update(key, record.attempts - timeouts, record.attempts, 1.0)
+
+
+    def rate(self, transport):
+        """The smoothed share of attempts with a transport that reached the server, on the current network.
+
+        Args:
+            transport (tuple): `(proto, port)`.
+
+        Returns:
+            float: the rate between 0 and 1; 0.5 for protocols without attempts.
+        """
+        stats = self._network_stats()
+        reached, attempts = stats.get(transport[0], (0.0, 0.0))
+        proto_rate = (reached + 1) / (attempts + 2)
+        reached, attempts = stats.get(transport, (0.0, 0.0))
+        return (reached + 2 * proto_rate) / (attempts + 2)
+
+
+    def rates(self):
+        """The rate of each transport with attempts on the current network.
+
+        Returns:
+            dict: maps `"<proto>/<port>"` to the rate of `rate`.
+        """
+        return {_transport_name(key): self.rate(key) for key in self._network_stats() if isinstance(key, tuple)}
+
+
+    def choose(self, config_file, available=None, exclude=()):
+        """The variant of the server of a configuration file to connect with.
+
+        Args:
+            config_file (str): the configuration file taken from the rotation.
+            available (container, optional): The configuration files that may be chosen, for instance those that
+                are not disabled. Defaults to all variants.
+            exclude (container, optional): Configuration files not to choose, for instance those that failed during
+                the current connection.
+
+        Returns:
+            None or str: the variant with the highest `rate`, `config_file` among equals, or `None` if all variants
+              are excluded or not available.
+        """
+        candidates = [variant for variant in self.variants(config_file)
+                      if variant not in exclude and (available is None or variant in available)]
+        if not candidates:
+            return None
+
+        def key(variant):
+            transport = self._variants[variant][1] if self._variants.get(variant) is not None else None
+            rate = self.rate(transport) if transport is not None else 0.5
+            return rate, variant == config_file
+        chosen = max(candidates, key=key)
+        if chosen != config_file:
+            logging.info("Using %s instead of %s for the same server.", chosen, config_file)
+        return chosen
@@ -0,0 +1,411 @@
+"Connect to a server with WireGuard"
+
+import ipaddress
+import logging
+import os
+import shlex
+import socket
+import subprocess
+import time
+from subprocess import PIPE
+from .Backend import Backend
+from .route_check import check_tunnel
+from .TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+from .utils import get_ip
+
+
+FWMARK = "51820" # the routing table and firewall mark wg-quick uses for full tunnels
+
+# keys of the [Interface] section that `wg setconf` does not understand
+_WG_QUICK_KEYS = {"address", "dns", "mtu", "table", "preup", "postup", "predown", "postdown", "saveconfig"}
+
+
+def read_wireguard_config(config_file):
+    """Read a WireGuard configuration file in the format used by `wg-quick`.
+
+    Args:
+        config_file (str): path to the configuration file.
+
+    Returns:
+        dict: with `interface`, a dict of the keys in the `[Interface]` section, and `peers`, a list with a dict for
+          each `[Peer]` section. Keys are lower case. Keys that can be repeated (`Address`, `DNS`, `AllowedIPs`) map
+          to a list of the comma-separated values.
+    """
+    config = {"interface": {}, "peers": []}
+    section = None
+    with open(config_file, encoding="utf-8") as file:
+        for line in file:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if line.lower() == "[interface]":
+                section = config["interface"]
+                continue
+            if line.lower() == "[peer]":
+                section = {}
+                config["peers"].append(section)
+                continue
+            if section is None or "=" not in line:
+                continue
+            key, value = (part.strip() for part in line.split("=", 1))
+            key = key.lower()
+            if key in ("address", "dns", "allowedips"):
+                section.setdefault(key, []).extend(v.strip() for v in value.split(",") if v.strip())
+            else:
+                section[key] = value
+    return config
+
+
+def make_setconf(config):
+    """Write the part of a `wg-quick` configuration that `wg setconf` understands.
+
+    Args:
+        config (dict): as returned by `read_wireguard_config`.
+
+    Returns:
+        str: the configuration for `wg setconf`.
+    """
+    names = {"privatekey": "PrivateKey", "listenport": "ListenPort", "fwmark": "FwMark",
+             "publickey": "PublicKey", "presharedkey": "PresharedKey", "endpoint": "Endpoint",
+             "allowedips": "AllowedIPs", "persistentkeepalive": "PersistentKeepalive"}
+    lines = ["[Interface]"]
+    for key, value in config["interface"].items():
+        if key not in _WG_QUICK_KEYS:
+            lines.append(f"{names.get(key, key)} = {value}")
+    for peer in config["peers"]:
+        lines.append("[Peer]")
+        for key, value in peer.items():
+            if isinstance(value, list):
+                value = ", ".join(value)
+            lines.append(f"{names.get(key, key)} = {value}")
+    return "\n".join(lines) + "\n"
+
+
+def handshake_target(config):
+    """Choose an address inside the `AllowedIPs` of the peers, so that a packet sent to it goes through the tunnel.
+
+    A DNS server of the configuration is preferred. For a full tunnel, a public DNS server is used.
+
+    Args:
+        config (dict): as returned by `read_wireguard_config`.
+
+    Returns:
+        None or str: the IP address, or `None` if the peers allow no addresses.
+    """
+    networks = []
+    for peer in config["peers"]:
+        for allowed_ip in peer.get("allowedips", []):
+            try:
+                networks.append(ipaddress.ip_network(allowed_ip, strict=False))
+            except ValueError:
+                logging.info("Ignoring invalid AllowedIPs entry %s", allowed_ip)
+    for server in config["interface"].get("dns", []):
+        try:
+            address = ipaddress.ip_address(server)
+        except ValueError: # a search domain
+            continue
+        if any(address in network for network in networks):
+            return str(address)
+    for network in networks:
+        if network.prefixlen == 0:
+            return "1.1.1.1" if network.version == 4 else "2606:4700:4700::1111"
+        return str(next(iter(network.hosts()), network.network_address))
+    return None
+
+
+class WireGuardConnector(Backend):
+    """Class to connect and disconnect to a single WireGuard server.
+
+    The interface is set up directly with `ip` and `wg`, in a single `sudo` call: the interface is created and
+    configured, the addresses are assigned, and routes are added for the allowed IPs of the peers. If the peers
+    allow all addresses (`0.0.0.0/0` or `::/0`), all traffic is routed through the tunnel with the same policy
+    routing as `wg-quick`. DNS servers are applied with `resolvectl` if it is available.
+
+    Implements `sirup.Backend.Backend`. A WireGuard tunnel has no connection phase: the handshake happens when the
+    first packet is sent. `wait_ready` sends a packet through the tunnel and waits until the handshake with the peer
+    is completed, which usually takes a few milliseconds.
+
+    Args:
+        config_file (str): Full path and file name of the WireGuard configuration file (`.conf`).
+        auth_file (str, optional): Not used; WireGuard configuration files contain the key. Accepted for compatibility
+            with `sirup.VPNConnector.VPNConnector`.
+        track_ip (bool, optional): If True, the IP address is queried after each `connect` and `disconnect`.
+        work_dir (str, optional): Directory for the configuration passed to `wg setconf`. If not provided,
+            a temporary directory is created when the connection is started and removed when it is closed.
+        interface (str, optional): Name of the network interface.
+        verify_routes (bool, optional): If True, `connect` checks that the interface is up. See `check_routes`.
+        ip_check_rate (float, optional): Share of the IP address checks that are carried out when `track_ip` is True.
+
+    Attributes:
+        config_file (str): Full path and file name of the WireGuard configuration file.
+        current_ip (None or str): If `track_ip` is `True`, the IP address of the machine that is currently visible.
+        base_ip (None or str): If `track_ip` is `True`, the IP address when no VPN tunnel is active.
+        interface (str): Name of the network interface.
+        phase_times (dict): Times at which the latest `connect` reached each phase: `start`, `vpn_started`
+            (the interface is configured), `tunnel_up` (the handshake completed) and `verified`.
+        traffic_summary (None): Traffic accounting is not available for WireGuard tunnels.
+    """
+
+    connect_timeout = 10
+
+    def __init__(self, config_file, auth_file=None, track_ip=True, work_dir=None, # pylint: disable=too-many-arguments
+                 interface="sirupwg0", verify_routes=False, ip_check_rate=1.0):
+        super().__init__(config_file, track_ip=track_ip, verify_routes=verify_routes, ip_check_rate=ip_check_rate)
+        self.auth_file = auth_file
+        self.work_dir = work_dir
+        self.interface = interface
+        self._config = None # the configuration of the tunnel that was started
+        self._connected = False
+        self._full_tunnel = {"4": False, "6": False}
+        self._session_dir = None
+
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.config_file!r}, track_ip={self.track_ip!r}, interface={self.interface!r})"
+
+
+    def is_alive(self):
+        """Indicates whether the network interface of the tunnel exists.
+
+        Returns:
+            bool: True if the interface exists.
+        """
+        return os.path.exists(os.path.join("/sys/class/net", self.interface))
+
+
+    def _run_as_root(self, script, pwd, check=True):
+        "Run a shell script with root permission in a single `sudo` call."
+        cmd = ["sudo", "-S", "sh", "-c", script]
+        return subprocess.run(cmd, input=pwd.encode(), stdout=PIPE, stderr=PIPE, check=check)
+
+
+    def make_up_script(self, config, setconf_file):
+        """Compose the shell commands that create and configure the interface.
+
+        Args:
+            config (dict): as returned by `read_wireguard_config`.
+            setconf_file (str): path of the configuration for `wg setconf`.
+
+        Returns:
+            str: the commands, one per line, to be run with `sh -e`.
+        """
+        interface = shlex.quote(self.interface)
+        commands = ["set -e",
+                    f"ip link del dev {interface} 2>/dev/null || true"] # left behind by a crash, like the rules
+        for family in ("4", "6"):
+            commands.extend([f"while ip -{family} rule del not fwmark {FWMARK} table {FWMARK} 2>/dev/null; do :; done",
+                             f"while ip -{family} rule del table main suppress_prefixlength 0 2>/dev/null; do :; done"])
+        commands.extend([f"ip link add dev {interface} type wireguard",
+                    f"wg setconf {interface} {shlex.quote(setconf_file)}"])
+        for address in config["interface"].get("address", []):
+            family = "-6" if ":" in address else "-4"
+            commands.append(f"ip {family} address add {shlex.quote(address)} dev {interface}")
+        mtu = config["interface"].get("mtu")
+        if mtu is not None:
+            commands.append(f"ip link set mtu {int(mtu)} dev {interface}")
+        commands.append(f"ip link set up dev {interface}")
+
+        self._full_tunnel = {"4": False, "6": False}
+        for peer in config["peers"]:
+            for allowed_ip in peer.get("allowedips", []):
+                family = "6" if ":" in allowed_ip else "4"
+                if allowed_ip.endswith("/0"):
+                    self._full_tunnel[family] = True
+                else:
+                    commands.append(f"ip -{family} route add {shlex.quote(allowed_ip)} dev {interface}")
+        for family, full_tunnel in self._full_tunnel.items():
+            if full_tunnel:
+                default = "::/0" if family == "6" else "0.0.0.0/0"
+                commands.extend([f"wg set {interface} fwmark {FWMARK}",
+                                 f"ip -{family} route add {default} dev {interface} table {FWMARK}",
+                                 f"ip -{family} rule add not fwmark {FWMARK} table {FWMARK}",
+                                 f"ip -{family} rule add table main suppress_prefixlength 0"])
+        if self._full_tunnel["4"]:
+            # as wg-quick: let the reverse path filter accept the answers, which arrive with the firewall mark
+            commands.append("sysctl -qw net.ipv4.conf.all.src_valid_mark=1")
+        dns = config["interface"].get("dns", [])
+        if dns:
+            servers = " ".join(shlex.quote(server) for server in dns)
+            commands.append(f"if command -v resolvectl >/dev/null; then resolvectl dns {interface} {servers}; "
+                            f"resolvectl domain {interface} '~.'; fi")
+        return "\n".join(commands)
+
+
+    def make_down_script(self):
+        """Compose the shell commands that remove the interface and its routing rules.
+
+        Returns:
+            str: the commands, one per line. Failures are ignored.
+        """
+        interface = shlex.quote(self.interface)
+        commands = [f"ip link del dev {interface}"]
+        for family, full_tunnel in self._full_tunnel.items():
+            if full_tunnel:
+                commands.extend([f"ip -{family} rule del not fwmark {FWMARK} table {FWMARK}",
+                                 f"ip -{family} rule del table main suppress_prefixlength 0"])
+        return "\n".join(f"{command} 2>/dev/null || true" for command in commands)
+
+
+    def _prepare_work_dir(self, pwd):
+        if self.work_dir is None:
+            self._session_dir = TemporaryDirectoryWithRootPermission(password=pwd)
+            self.work_dir = self._session_dir.create()
+
+
+    def latest_handshake(self, pwd):
+        """Query the time of the latest handshake with the peers.
+
+        Args:
+            pwd (str): User root password.
+
+        Returns:
+            int: seconds since the epoch of the most recent handshake, 0 if there was none.
+        """
+        output = self._run_as_root(f"wg show {shlex.quote(self.interface)} latest-handshakes", pwd, check=False)
+        handshakes = [int(line.split()[-1]) for line in output.stdout.decode().splitlines() if line.split()]
+        return max(handshakes, default=0)
+
+
+    def _trigger_handshake(self, config):
+        "Send a packet into the tunnel, which makes WireGuard start the handshake."
+        target = handshake_target(config)
+        if target is None:
+            logging.info("The peers of %s allow no addresses.", self.interface)
+            return
+        family = socket.AF_INET6 if ":" in target else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            try:
+                sock.sendto(b"\0", (target, 53))
+            except OSError as e:
+                logging.info("Cannot send a packet through %s: %s", self.interface, e)
+
+
+    def start(self, pwd):
+        """Create and configure the interface.
+
+        The private key is written to a file that only the user can read, and removed as soon as `wg setconf` has
+        read it.
+
+        Args:
+            pwd (str): User root password.
+
+        Raises:
+            RuntimeError: when the interface cannot be set up.
+        """
+        self._config = read_wireguard_config(self.config_file)
+        self._prepare_work_dir(pwd)
+        setconf_file = os.path.join(self.work_dir, "wg.conf")
+        fd = os.open(setconf_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) # contains the private key
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(make_setconf(self._config))
+
+        try:
+            result = self._run_as_root(self.make_up_script(self._config, setconf_file), pwd, check=False)
+        finally:
+            os.remove(setconf_file)
+        if result.returncode != 0:
+            self._run_as_root(self.make_down_script(), pwd, check=False)
+            raise RuntimeError(f"Cannot set up {self.interface}: {result.stderr.decode()}")
+
+
+    def wait_ready(self, pwd, timeout, waiting_time=0.05, max_waiting_time=1.0):
+        """Wait until the handshake with the peer is completed.
+
+        Each check of the handshake runs `wg` with `sudo`, so the time between two checks doubles after each check.
+
+        Args:
+            pwd (str): User root password.
+            timeout (float): Maximum number of seconds to wait for the handshake.
+            waiting_time (float, optional): Number of seconds before the second check of the handshake.
+            max_waiting_time (float, optional): Maximum number of seconds between two checks.
+
+        Raises:
+            TimeoutError: when the handshake does not complete within `timeout` seconds. The interface is removed.
+        """
+        start_time = time.time()
+        self._trigger_handshake(self._config)
+        while self.latest_handshake(pwd) == 0:
+            if time.time() - start_time >= timeout:
+                self._run_as_root(self.make_down_script(), pwd, check=False)
+                raise TimeoutError("Could not connect to vpn")
+            time.sleep(waiting_time)
+            waiting_time = min(2 * waiting_time, max_waiting_time)
+        self._connected = True
+
+
+    def stop(self, pwd):
+        """Remove the interface and its routing rules.
+
+        Args:
+            pwd (str): User root password.
+        """
+        self._run_as_root(self.make_down_script(), pwd, check=False)
+        self._connected = False
+
+
+    def state(self):
+        """Report the state of the tunnel.
+
+        Returns:
+            str: `"up"` after the handshake, `"failed"` if the interface disappeared since, `"starting"` while
+              waiting for the handshake, otherwise `"down"`.
+        """
+        alive = self.is_alive()
+        if self._connected:
+            return "up" if alive else "failed"
+        return "starting" if alive else "down"
+
+
+    def check_routes(self):
+        """Check that the interface is up.
+
+        The route is not checked: full tunnels route through a separate table selected by policy rules, which
+        `/proc/net/route` does not show, and split tunnels do not carry internet traffic.
+
+        Returns:
+            None or str: `None` if the interface is up, otherwise the reason why not.
+        """
+        return check_tunnel(interface=self.interface, probe_address=None)
+
+
+    def nameservers(self, pwd): # pylint: disable=unused-argument
+        """The DNS servers in the `DNS` key of the configuration file.
+
+        Args:
+            pwd (str): User root password; not needed.
+
+        Returns:
+            list: IP addresses. Search domains in `DNS` are left out.
+        """
+        servers = []
+        for server in read_wireguard_config(self.config_file)["interface"].get("dns", []):
+            try:
+                servers.append(str(ipaddress.ip_address(server)))
+            except ValueError: # a search domain
+                pass
+        return servers
+
+
+    def exit_ip(self):
+        """Query the IP address that is visible from the internet with `sirup.utils.get_ip`.
+
+        Returns:
+            str: the IP address.
+        """
+        return get_ip()
+
+
+    def disconnect(self, pwd):
+        """Remove the interface and, if the connector created its own `work_dir`, remove it.
+        If `self.track_ip` is True, also get back the base IP.
+
+        Args:
+            pwd (str): User root password.
+        """
+        try:
+            super().disconnect(pwd)
+        finally:
+            if self._session_dir is not None:
+                self._session_dir.cleanup()
+                self._session_dir = None
+                self.work_dir = None
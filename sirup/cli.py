@@ -0,0 +1,278 @@
+"Command-line interface of sirup"
+
+import argparse
+import getpass
+import os
+import tempfile
+import time
+from .ConnectionHistory import ConnectionHistory
+from .FakeBackend import FakeNetwork
+from .HealthCheck import HealthCheck
+from .IPRotator import IPRotator
+from .LeaseRegistry import LeaseServer
+from .LeaseRegistry import SQLiteLeaseRegistry
+from .ProxyServer import POLICIES
+from .ProxyServer import ProxyServer
+from .SchedulingPolicy import SchedulingPolicy
+from .SoakHarness import RESOURCES
+from .SoakHarness import SoakHarness
+from .TunnelPool import TunnelPool
+from .TunnelTuner import TunnelTuner
+from .TunnelTuner import provider_of
+from .utils import check_password
+from .utils import list_files_with_full_path
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def _parse_cpus(value):
+    "Parse a CPU list such as `0,2-5`."
+    cpus = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _ask_password():
+    "Ask for the sudo password and check it. Returns `None` if it is wrong."
+    pwd = getpass.getpass("Please enter your sudo password: ")
+    try:
+        check_password(pwd)
+    except RuntimeError:
+        print("Wrong sudo password provided")
+        return None
+    return pwd
+
+
+def stats(args):
+    """Print a summary of a connection history file per server. The percentiles cover the most recent connect
+    times of each server, as in `sirup.ConnectionHistory.ServerRecord`, so that memory stays bounded for long
+    histories.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments of the `stats` command.
+    """
+    history = ConnectionHistory(args.history_file)
+    summaries = history.summarize()
+    # descending, servers without a value last
+    rows = sorted(summaries.items(), key=lambda item: (item[1][args.sort] is not None, item[1][args.sort] or 0),
+                  reverse=True)
+    if args.top is not None:
+        rows = rows[:args.top]
+
+    name_width = max([len("server")] + [len(os.path.basename(config_file)) for config_file, _ in rows])
+    print(f"{'server':<{name_width}}  {'attempts':>8}  {'failures':>8}  {'p50 (s)':>8}  {'p95 (s)':>8}  {'backoff (s)':>11}")
+    for config_file, summary in rows:
+        print(f"{os.path.basename(config_file):<{name_width}}  {summary['attempts']:>8}  "
+              f"{summary['failure_rate']:>8.1%}  {_format_seconds(summary['p50']):>8}  "
+              f"{_format_seconds(summary['p95']):>8}  {_format_seconds(summary['backoff']):>11}")
+
+    attempts = sum(summary["attempts"] for summary in summaries.values())
+    successes = sum(summary["successes"] for summary in summaries.values())
+    backoff = sum(summary["backoff"] for summary in summaries.values())
+    print(f"\n{len(summaries)} servers, {attempts} attempts, {attempts - successes} failed, "
+          f"{backoff / 3600:.2f} hours in backoff")
+    return 0
+
+
+def probe(args):
+    """Connect to every server in a directory once and write a JSON report.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments of the `probe` command.
+    """
+    config_files = list_files_with_full_path(args.config_location)
+    pwd = _ask_password()
+    if pwd is None:
+        return 1
+    with HealthCheck(args.auth_file, pwd, parallelism=args.parallel, timeout=args.timeout) as health_check:
+        results = health_check.run(config_files)
+        health_check.write_report(args.report)
+
+    failed = sorted(config_file for config_file, result in results.items() if not result["success"])
+    for config_file in failed:
+        print(f"{os.path.basename(config_file)}: {results[config_file]['error']}")
+    print(f"{len(results)} servers, {len(results) - len(failed)} ok, {len(failed)} failed; report in {args.report}")
+    return 0
+
+
+def tune(args):
+    """Find the `OpenVPN` options with the highest throughput on a few servers in a directory and save them.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments of the `tune` command.
+    """
+    config_files = sorted(list_files_with_full_path(args.config_location))[:args.servers]
+    if not config_files:
+        print(f"No configuration files in {args.config_location}")
+        return 1
+    pwd = _ask_password()
+    if pwd is None:
+        return 1
+    with TunnelTuner(args.auth_file, pwd, args.url, rounds=args.rounds, timeout=args.timeout) as tuner:
+        best = tuner.tune(config_files)
+        tuner.save(args.tuning_file, provider_of(config_files[0]))
+
+    options = " ".join(f"--{name} {' '.join(values)}".strip() for name, values in sorted(best["options"].items()))
+    print(f"best options: {options or '(those of the configuration files)'}")
+    print(f"{best['throughput'] / 1e6:.2f} MB/s; saved in {args.tuning_file}")
+    return 0
+
+
+def soak(args):
+    """Run a rotator on simulated tunnels for many cycles and report resources that leak.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments of the `soak` command.
+    """
+    with tempfile.TemporaryDirectory(prefix="sirup-soak-configs-") as config_location:
+        for i in range(args.servers):
+            with open(os.path.join(config_location, f"server{i}.ovpn"), "w", encoding="utf-8"):
+                pass
+        network = FakeNetwork(seed=args.seed, timeout_rate=args.timeout_rate)
+        with IPRotator("auth_file", config_location, track_ip=False, backend=network) as rotator:
+            harness = SoakHarness(rotator, cycles=args.cycles, sample_every=args.sample_every)
+            leaks = harness.run()
+
+    print(f"{'cycle':>8}  " + "  ".join(f"{resource:>10}" for resource in RESOURCES))
+    for sample in harness.samples:
+        print(f"{sample['cycle']:>8}  " + "  ".join(f"{sample[resource]:>10}" for resource in RESOURCES))
+    for leak in leaks:
+        print(f"leak: {leak}")
+    print(f"{args.cycles} cycles, {len(leaks)} leaks")
+    return 1 if leaks else 0
+
+
+def proxy(args):
+    """Serve a local SOCKS5 and HTTP proxy through several tunnels and rotate them until interrupted.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments of the `proxy` command.
+    """
+    config_files = list_files_with_full_path(args.config_location)
+    pwd = _ask_password()
+    if pwd is None:
+        return 1
+    server = ProxyServer([], host=args.host, port=args.port, policy=args.policy)
+    scheduling = SchedulingPolicy(cpus=args.cpus) if args.cpus is not None else None
+    with TunnelPool(args.auth_file, config_files, pwd, size=args.tunnels, timeout=args.timeout,
+                    scheduling=scheduling) as pool:
+        pool.start(server)
+        server.start_in_thread()
+        print(f"SOCKS5 and HTTP proxy on {args.host}:{server.port} through {args.tunnels} tunnels; Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(args.rotate_every or 3600)
+                if args.rotate_every:
+                    pool.rotate(server, next(iter(pool.tunnels))) # the oldest tunnel
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop_thread()
+    return 0
+
+
+def leases(args):
+    """Serve a lease registry for the rotators of a fleet until interrupted, or list the current leases.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments of the `leases` command.
+    """
+    registry = SQLiteLeaseRegistry(args.database)
+    if args.list:
+        for lease in registry.leases():
+            print(f"{lease['server']:<40} {lease['node']:<30} {_format_seconds(lease['expires']):>10}")
+        return 0
+    server = LeaseServer(registry, host=args.host, port=args.port)
+    server.start()
+    print(f"Lease registry on {server.url}; Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+def main(argv=None):
+    """Run the `sirup` command.
+
+    Args:
+        argv (list, optional): the command-line arguments. Defaults to `sys.argv[1:]`.
+
+    Returns:
+        int: the exit status.
+    """
+    parser = argparse.ArgumentParser(prog="sirup", description="Simple IP rotation using python.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    stats_parser = subparsers.add_parser("stats", help="summarize a connection history file per server")
+    stats_parser.add_argument("history_file", help="CSV file written by IPRotator(history_file=...)")
+    stats_parser.add_argument("--sort", default="attempts",
+                              choices=["attempts", "failure_rate", "p50", "p95", "backoff"],
+                              help="column by which the servers are sorted, in descending order")
+    stats_parser.add_argument("--top", type=int, help="only show the first TOP servers")
+    stats_parser.set_defaults(func=stats)
+
+    probe_parser = subparsers.add_parser("probe", help="connect to every server once and write a health report")
+    probe_parser.add_argument("config_location", help="directory with the OpenVPN configuration files")
+    probe_parser.add_argument("--auth-file", required=True, help="file with the credentials for the VPN connections")
+    probe_parser.add_argument("--report", default="sirup-probe.json", help="JSON file to which the report is written")
+    probe_parser.add_argument("--parallel", type=int, default=4, help="number of servers checked at the same time")
+    probe_parser.add_argument("--timeout", type=float, default=30,
+                              help="seconds after which a connection attempt fails")
+    probe_parser.set_defaults(func=probe)
+
+    tune_parser = subparsers.add_parser("tune", help="find the OpenVPN options with the highest throughput")
+    tune_parser.add_argument("config_location", help="directory with the OpenVPN configuration files of one provider")
+    tune_parser.add_argument("--auth-file", required=True, help="file with the credentials for the VPN connections")
+    tune_parser.add_argument("--url", required=True, help="file that is downloaded through each tunnel")
+    tune_parser.add_argument("--tuning-file", default="sirup-tuning.json",
+                             help="JSON file in which the options are saved, for TunnelOptions(tuning_file=...)")
+    tune_parser.add_argument("--servers", type=int, default=3, help="number of servers on which the options are tried")
+    tune_parser.add_argument("--rounds", type=int, default=1, help="measurements of each option on each server")
+    tune_parser.add_argument("--timeout", type=float, default=30,
+                             help="seconds after which a connection attempt fails")
+    tune_parser.set_defaults(func=tune)
+
+    proxy_parser = subparsers.add_parser("proxy", help="serve a local proxy through several tunnels (run as root)")
+    proxy_parser.add_argument("config_location", help="directory with the OpenVPN configuration files")
+    proxy_parser.add_argument("--auth-file", required=True, help="file with the credentials for the VPN connections")
+    proxy_parser.add_argument("--host", default="127.0.0.1", help="address on which the proxy listens")
+    proxy_parser.add_argument("--port", type=int, default=1080, help="port on which the proxy listens")
+    proxy_parser.add_argument("--tunnels", type=int, default=2, help="number of tunnels that are up at the same time")
+    proxy_parser.add_argument("--policy", default="round-robin", choices=POLICIES,
+                              help="how client connections are assigned to tunnels")
+    proxy_parser.add_argument("--rotate-every", type=float, default=600,
+                              help="seconds between two rotations of a tunnel; 0 never rotates")
+    proxy_parser.add_argument("--timeout", type=float, default=30,
+                              help="seconds after which a connection attempt fails")
+    proxy_parser.add_argument("--cpus", type=_parse_cpus,
+                              help="CPUs for the OpenVPN daemons, one per tunnel, for instance 2-5 or 2,4")
+    proxy_parser.set_defaults(func=proxy)
+
+    soak_parser = subparsers.add_parser("soak", help="rotate through simulated tunnels and check for leaks")
+    soak_parser.add_argument("--cycles", type=int, default=20000, help="number of connect, rotate, disconnect cycles")
+    soak_parser.add_argument("--sample-every", type=int, default=1000, help="cycles between two samples")
+    soak_parser.add_argument("--servers", type=int, default=10, help="number of simulated servers")
+    soak_parser.add_argument("--timeout-rate", type=float, default=0.05,
+                             help="probability that a simulated tunnel does not come up")
+    soak_parser.add_argument("--seed", type=int, default=0, help="seed of the simulation")
+    soak_parser.set_defaults(func=soak)
+
+    leases_parser = subparsers.add_parser("leases", help="serve the lease registry of a fleet of rotators")
+    leases_parser.add_argument("--database", default="sirup-leases.sqlite",
+                               help="SQLite file in which the leases are kept")
+    leases_parser.add_argument("--host", default="127.0.0.1", help="address on which the registry listens")
+    leases_parser.add_argument("--port", type=int, default=8700, help="port on which the registry listens")
+    leases_parser.add_argument("--list", action="store_true", help="print the current leases and exit")
+    leases_parser.set_defaults(func=leases)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,152 @@
+"Read OpenVPN configuration files"
+
+import hashlib
+
+
+DEFAULT_PORT = "1194"
+DEFAULT_PROTO = "udp"
+# directives that only choose the server, which `remote MOD` on the management interface can change
+_REMOTE_DIRECTIVES = {"remote", "remote-random", "remote-random-hostname", "port", "rport", "proto",
+                      "server-poll-timeout", "connect-retry", "connect-retry-max", "resolv-retry"}
+
+
+def _normalize_proto(proto):
+    "Map the `OpenVPN` protocol names (udp4, tcp-client, ...) to `udp` or `tcp`."
+    return "tcp" if proto.lower().startswith("tcp") else "udp"
+
+
+def read_config_lines(config_file):
+    """Read the directives of an `OpenVPN` configuration file.
+
+    Comments, empty lines and inline blocks such as `<ca>...</ca>` are skipped.
+
+    Args:
+        config_file (str): path to the configuration file.
+
+    Returns:
+        list: one list of tokens for each directive, for instance `["remote", "nl-01.example.net", "1194"]`.
+    """
+    directives = []
+    inline_block = None
+    with open(config_file, encoding="utf-8", errors="replace") as file:
+        for line in file:
+            line = line.strip()
+            if inline_block is not None:
+                if line == f"</{inline_block}>":
+                    inline_block = None
+                continue
+            if line.startswith("<") and line.endswith(">") and not line.startswith("</"):
+                inline_block = line[1:-1]
+                continue
+            if not line or line[0] in "#;":
+                continue
+            directives.append(line.split())
+    return directives
+
+
+def read_remotes(config_file):
+    """Read the remote servers of an `OpenVPN` configuration file.
+
+    Args:
+        config_file (str): path to the configuration file.
+
+    Returns:
+        list: tuples `(host, port, proto)` in the order of the `remote` directives. `port` is a string and `proto`
+          is `"udp"` or `"tcp"`. Missing values are taken from the `port` and `proto` directives, or the `OpenVPN` defaults.
+    """
+    directives = read_config_lines(config_file)
+    default_port = DEFAULT_PORT
+    default_proto = DEFAULT_PROTO
+    for tokens in directives:
+        if tokens[0] in ("port", "rport") and len(tokens) > 1:
+            default_port = tokens[1]
+        elif tokens[0] == "proto" and len(tokens) > 1:
+            default_proto = _normalize_proto(tokens[1])
+
+    remotes = []
+    for tokens in directives:
+        if tokens[0] != "remote" or len(tokens) < 2:
+            continue
+        port = tokens[2] if len(tokens) > 2 else default_port
+        proto = _normalize_proto(tokens[3]) if len(tokens) > 3 else default_proto
+        remotes.append((tokens[1], port, proto))
+    return remotes
+
+
+def variant_of(config_file):
+    """The server of an `OpenVPN` configuration file and the transport it reaches the server with.
+
+    Providers ship the same server in several files, one for each protocol and port, for instance
+    `nl-01.udp1194.ovpn` and `nl-01.tcp443.ovpn`. These files have the same server and differ in the transport.
+
+    Args:
+        config_file (str): path to the configuration file.
+
+    Returns:
+        None or tuple: `(server, transport)`, where `server` is the lower-case host names of the remotes, joined by
+          commas, and `transport` the tuple `(proto, port)` of the first remote; `None` without remotes.
+    """
+    remotes = read_remotes(config_file)
+    if not remotes:
+        return None
+    server = ",".join(sorted({host.lower() for host, _, _ in remotes}))
+    _, port, proto = remotes[0]
+    return server, (proto, port)
+
+
+def config_fingerprint(config_file):
+    """Digest of everything in an `OpenVPN` configuration file except the choice of the server.
+
+    Two files with the same fingerprint share the certificate authority, keys, authentication, cipher and device
+    settings, so a running `OpenVPN` process can move from the server of one to the server of the other with
+    `sirup.VPNConnector.VPNConnector.switch`. Inline blocks such as `<ca>` are part of the digest. The protocol of the
+    first remote is too, because it cannot be changed in place.
+
+    Args:
+        config_file (str): path to the configuration file.
+
+    Returns:
+        str: the hexadecimal digest.
+    """
+    lines = []
+    with open(config_file, encoding="utf-8", errors="replace") as file:
+        for line in file:
+            line = line.strip()
+            if line and line[0] not in "#;" and line.split()[0] not in _REMOTE_DIRECTIVES:
+                lines.append(line)
+    remotes = read_remotes(config_file)
+    lines.append(f"proto {remotes[0][2] if remotes else DEFAULT_PROTO}")
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+def pushed_nameservers(log_lines):
+    """Find the DNS servers that the server pushed, in an `OpenVPN` log.
+
+    Args:
+        log_lines (list): the lines of the log.
+
+    Returns:
+        list: the addresses of the `dhcp-option DNS` and `DNS6` options of the latest `PUSH_REPLY`.
+    """
+    for line in reversed(log_lines):
+        if "PUSH_REPLY" in line:
+            options = [option.split() for option in line.split("PUSH_REPLY", 1)[1].split(",")]
+            return [option[2].rstrip("'") for option in options
+                    if len(option) == 3 and option[0] == "dhcp-option" and option[1] in ("DNS", "DNS6")]
+    return []
+
+
+def option_args(options):
+    """Turn `OpenVPN` options into command-line arguments.
+
+    Args:
+        options (dict): maps option names without the leading dashes to lists of arguments.
+
+    Returns:
+        list: the arguments, for instance `["--sndbuf", "524288", "--fast-io"]`.
+    """
+    args = []
+    for name in sorted(options):
+        args.append(f"--{name}")
+        args.extend(options[name])
+    return args
@@ -0,0 +1,168 @@
+"Check from the kernel's routing table and interfaces that traffic goes through a tunnel"
+
+import ipaddress
+import os
+import socket
+import struct
+
+
+ROUTE_FILE = "/proc/net/route"
+RTF_UP = 0x0001
+SIOCGIFADDR = 0x8915
+
+
+def _hex_to_address(value):
+    "Convert an address in the little-endian hex format of /proc/net/route."
+    return ipaddress.IPv4Address(struct.pack("<I", int(value, 16)))
+
+
+def read_routes(route_file=ROUTE_FILE):
+    """Read the IPv4 routes of the main routing table.
+
+    Args:
+        route_file (str, optional): the routing table in the format of `/proc/net/route`.
+
+    Returns:
+        list: a dict for each route that is up, with `interface`, `network` (`ipaddress.IPv4Network`),
+          `gateway` (`ipaddress.IPv4Address`) and `metric`.
+    """
+    routes = []
+    with open(route_file, encoding="utf-8") as file:
+        next(file, None) # header
+        for line in file:
+            fields = line.split()
+            if len(fields) < 8 or not int(fields[3], 16) & RTF_UP:
+                continue
+            destination = _hex_to_address(fields[1])
+            mask = _hex_to_address(fields[7])
+            routes.append({"interface": fields[0],
+                           "network": ipaddress.IPv4Network(f"{destination}/{mask}", strict=False),
+                           "gateway": _hex_to_address(fields[2]),
+                           "metric": int(fields[6])})
+    return routes
+
+
+def default_gateway(route_file=ROUTE_FILE):
+    """Identify the network the host is on by its default route.
+
+    `OpenVPN`'s `redirect-gateway def1` adds two `/1` routes and leaves the default route alone, so the result does
+    not change while a tunnel is up.
+
+    Args:
+        route_file (str, optional): the routing table in the format of `/proc/net/route`.
+
+    Returns:
+        None or str: `"<interface> via <gateway>"` for the default route with the lowest metric, or `None` without
+          a default route.
+    """
+    defaults = [route for route in read_routes(route_file) if route["network"].prefixlen == 0]
+    if not defaults:
+        return None
+    route = min(defaults, key=lambda route: route["metric"])
+    return f"{route['interface']} via {route['gateway']}"
+
+
+def route_interface(address, route_file=ROUTE_FILE):
+    """Find the interface through which the main routing table sends traffic to an address.
+
+    The most specific route wins, and among equally specific routes the one with the lowest metric.
+    This is how `OpenVPN`'s `redirect-gateway def1` takes precedence over the default route with
+    `0.0.0.0/1` and `128.0.0.0/1`.
+
+    Args:
+        address (str): an IPv4 address.
+        route_file (str, optional): the routing table in the format of `/proc/net/route`.
+
+    Returns:
+        None or str: the name of the interface, or `None` if no route matches.
+    """
+    address = ipaddress.IPv4Address(address)
+    matches = [route for route in read_routes(route_file) if address in route["network"]]
+    if not matches:
+        return None
+    best = min(matches, key=lambda route: (-route["network"].prefixlen, route["metric"]))
+    return best["interface"]
+
+
+def interface_state(interface):
+    """Read the operational state of a network interface from `/sys/class/net`.
+
+    Args:
+        interface (str): the name of the interface.
+
+    Returns:
+        None or str: `None` if the interface does not exist, otherwise the state, for instance `"up"`, `"down"`,
+          or `"unknown"` (which tun and WireGuard interfaces report while they are up).
+    """
+    try:
+        with open(os.path.join("/sys/class/net", interface, "operstate"), encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def interface_address(interface):
+    """Query the IPv4 address of a network interface.
+
+    Args:
+        interface (str): the name of the interface.
+
+    Returns:
+        None or str: the address, or `None` if the interface does not exist or has no IPv4 address.
+    """
+    # fcntl does not exist on Windows, where `sirup` must still import
+    import fcntl  # pylint: disable=import-outside-toplevel
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            request = struct.pack("256s", interface.encode()[:15])
+            result = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+        except OSError:
+            return None
+    return socket.inet_ntoa(result[20:24])
+
+
+def find_interface(address):
+    """Find the network interface that has an IPv4 address.
+
+    Args:
+        address (str): the address, for instance the one `OpenVPN` reports on its management interface.
+
+    Returns:
+        None or str: the name of the interface.
+    """
+    for _, name in socket.if_nameindex():
+        if interface_address(name) == address:
+            return name
+    return None
+
+
+def check_tunnel(local_ip=None, interface=None, probe_address="1.1.1.1", route_file=ROUTE_FILE):
+    """Check that a tunnel interface is up and that traffic to the internet is routed through it.
+
+    No traffic is sent; only the kernel's state is read.
+
+    Args:
+        local_ip (str, optional): the address of the tunnel interface. Used to find the interface if `interface`
+            is not given.
+        interface (str, optional): the name of the tunnel interface.
+        probe_address (None or str, optional): a public address whose route must go through the tunnel.
+            If `None`, the route is not checked.
+        route_file (str, optional): the routing table in the format of `/proc/net/route`.
+
+    Returns:
+        None or str: `None` if the tunnel is in use, otherwise the reason why not.
+    """
+    if interface is None:
+        interface = find_interface(local_ip)
+        if interface is None:
+            return f"no interface has the address {local_ip}"
+    state = interface_state(interface)
+    if state is None:
+        return f"interface {interface} does not exist"
+    if state == "down":
+        return f"interface {interface} is down"
+    if probe_address is not None:
+        via = route_interface(probe_address, route_file)
+        if via != interface:
+            return f"traffic to {probe_address} goes through {via}, not {interface}"
+    return None
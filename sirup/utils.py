@@ -1,13 +1,15 @@
+import ctypes
 import logging
 import os
 import subprocess
 import time
 import warnings
+from collections import OrderedDict
+from itertools import islice
 from subprocess import PIPE
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from .TemporaryFileWithRootPermission import TemporaryFileWithRootPermission
 
 
 def get_ip(echo=False, config_file=None):
@@ -66,6 +68,28 @@ def lookup_strings_in_list(strings_to_check, list_of_strings):
     return any(elements_contain_two_strings)
 
 
+def percentile(values, q):
+    """Compute a percentile with linear interpolation between the closest ranks.
+
+    Args:
+        values (iterable): numbers; must not be empty.
+        q (float): the percentile, between 0 and 100.
+
+    Returns:
+        float: the `q`-th percentile of `values`.
+
+    Example:
+        >>> from sirup.utils import percentile
+        >>> percentile([1, 2, 3, 4], 50)
+        2.5
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
 def check_connection(log_file, timeout, pwd, waiting_time=2):
     """Wait and test for established connection until `timeout`.
 
@@ -86,28 +110,24 @@ def check_connection(log_file, timeout, pwd, waiting_time=2):
     connected = False
     while time.time() - start_time < timeout and not connected:
         time.sleep(waiting_time)
-        log = sudo_read_file(file=log_file, pwd=pwd)
-        connected = "Initialization Sequence Completed" in log[-1]
+        log = sudo_read_file(file=log_file, pwd=pwd, max_lines=1)
+        connected = bool(log) and "Initialization Sequence Completed" in log[-1]
 
     return connected 
 
-def sudo_read_file(file, pwd=None):
+def sudo_read_file(file, pwd=None, max_lines=None):
     """Read a file with root permission to a list.
     
     Args:
-        file (str or TemporaryFileWithRootPermission): the file to read
-        pwd (str, optional): root password for the file. If file is 
-            a `TemporaryFileWithRootPermission` and no password is provided, the password 
-            is taken from the `TemporaryFileWithRootPermission` object.
+        file (str): the file to read
+        pwd (str, optional): root password for the file. Without a password, the file is read as the user.
+        max_lines (int, optional): If given, only the last `max_lines` lines are read, so that reading a long log
+            takes bounded memory.
 
     Returns:
         list: Content of the file, each line is one element in the list. 
     """ 
-    if isinstance(file, TemporaryFileWithRootPermission):
-        file = file.file_name
-        if pwd is None:
-            pwd = file.password
-    cmd = ["cat", file]
+    cmd = ["cat", file] if max_lines is None else ["tail", "-n", str(max_lines), file]
     if pwd is None:
         output = subprocess.run(cmd, capture_output=True, check=True)
     else:
@@ -146,27 +166,254 @@ def list_files_with_full_path(directory, rule=None):
     return files_with_full_path 
 
 
-class RotationList(list):
-    "Custom list for IP rotation."
-    def __init__(self, *args):
-        super().__init__(*args)
+class _FenwickTree():
+    "Binary indexed tree over non-negative weights, for O(log n) prefix sums and weighted sampling."
+    def __init__(self, weights=()):
+        self._weights = []
+        self._tree = [0.0]
+        self.rebuild(list(weights))
+
+    def __len__(self):
+        return len(self._weights)
+
+    def rebuild(self, weights):
+        "Replace all weights, in O(n)."
+        self._weights = list(weights)
+        n = len(self._weights)
+        self._tree = [0.0] + self._weights[:]
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self._tree[parent] += self._tree[i]
+
+    def append(self, weight):
+        "Add a slot at the end, in O(log n)."
+        self._weights.append(weight)
+        i = len(self._weights)
+        # the new node covers the range (i - lowbit(i), i]: its own weight plus the sub-ranges below it
+        total = weight
+        step = 1
+        while step < (i & -i):
+            total += self._tree[i - step]
+            step <<= 1
+        self._tree.append(total)
+
+    def set(self, index, weight):
+        "Set the weight of slot `index`, in O(log n)."
+        delta = weight - self._weights[index]
+        self._weights[index] = weight
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def weight(self, index):
+        return self._weights[index]
+
+    def total(self):
+        "Sum of all weights, in O(log n)."
+        i = len(self._weights)
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, value):
+        "Index of the slot whose cumulative weight range contains `value`, in O(log n)."
+        position = 0
+        step = 1 << len(self._weights).bit_length()
+        while step > 0:
+            nxt = position + step
+            if nxt < len(self._tree) and self._tree[nxt] <= value:
+                position = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        return min(position, len(self._weights) - 1)
+
+
+_MISSING = object()
+
+
+class RotationList():
+    """Queue of items (`OpenVPN` configuration files) for IP rotation.
+
+    The items are unique and kept in rotation order. Getting the next item (`pop_append`) is O(1); inserting,
+    removing, disabling and enabling items, changing a weight and weighted sampling (`sample`) are O(log n).
+    Disabled items keep their weight, but are skipped by `pop_append` and `sample` until they are enabled again.
+    Iterating over the list and `len` only consider the enabled items. Indexing is O(1) for the first and the last
+    item, and O(n) for the other positions, which are only reached by walking the rotation order: the weights are
+    kept by slot, not in rotation order, so the tree cannot look up positions.
+
+    Args:
+        items (iterable, optional): Initial items, in rotation order.
+        weights (iterable, optional): Sampling weight of each item. Defaults to 1 for all items.
+    """
+    def __init__(self, items=(), weights=None):
+        items = list(items)
+        if weights is None:
+            weights = [1.0] * len(items)
+        weights = [float(w) for w in weights]
+        if len(weights) != len(items):
+            raise ValueError("items and weights have different lengths")
+        self._order = OrderedDict() # enabled items in rotation order
+        self._disabled = OrderedDict()
+        self._slots = {} # item -> index in self._tree
+        self._weights = dict(zip(items, weights)) # the tree holds 0 for disabled items
+        self._free_slots = []
+        for item in items:
+            if item in self._slots:
+                raise ValueError(f"duplicate item {item!r}")
+            self._slots[item] = len(self._slots)
+            self._order[item] = None
+        self._tree = _FenwickTree(weights)
+        self._slot_items = list(items)
 
     def __repr__(self):
-        return f"{self.__class__.__name__}({super().__repr__()})"
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(list(self._order))
+
+    def __contains__(self, item):
+        return item in self._order
+
+    def __eq__(self, other):
+        if isinstance(other, RotationList):
+            return list(self) == list(other) and self.disabled == other.disabled
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __getitem__(self, index):
+        "The first and last items are looked up in O(1), other positions in O(n) and slices are copied."
+        if isinstance(index, slice):
+            return list(self._order)[index]
+        if index >= 0:
+            items = islice(self._order, index, None)
+        else:
+            items = islice(reversed(self._order), -index - 1, None)
+        item = next(items, _MISSING)
+        if item is _MISSING:
+            raise IndexError("RotationList index out of range")
+        return item
+
+    @property
+    def disabled(self):
+        "list: The disabled items."
+        return list(self._disabled)
 
     def pop_append(self):
-        "Pop first element and append it at the end."
-        el = self.pop(0)
-        self.append(el)
-        return el
-    
+        "Return the first enabled item and move it to the end of the rotation."
+        if not self._order:
+            raise IndexError("pop from empty RotationList")
+        item = next(iter(self._order))
+        self._order.move_to_end(item)
+        return item
+
+    def append(self, item, weight=1.0):
+        """Add an item at the end of the rotation.
+
+        Args:
+            item (hashable): the item.
+            weight (float, optional): sampling weight.
+        """
+        if item in self._slots:
+            raise ValueError(f"{item!r} is already in the list")
+        self._weights[item] = float(weight)
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_items[slot] = item
+            self._tree.set(slot, float(weight))
+        else:
+            slot = len(self._slot_items)
+            self._slot_items.append(item)
+            self._tree.append(float(weight))
+        self._slots[item] = slot
+        self._order[item] = None
+
+    def remove(self, item):
+        "Remove an enabled or disabled item."
+        slot = self._slots.pop(item)
+        del self._weights[item]
+        self._order.pop(item, None)
+        self._disabled.pop(item, None)
+        self._tree.set(slot, 0.0)
+        self._slot_items[slot] = None
+        self._free_slots.append(slot)
+
+    def disable(self, item):
+        "Skip an item in the rotation and in sampling until it is enabled again."
+        if item in self._order:
+            del self._order[item]
+            self._disabled[item] = None
+            self._tree.set(self._slots[item], 0.0)
+
+    def enable(self, item):
+        "Put a disabled item back at the end of the rotation."
+        if item in self._disabled:
+            del self._disabled[item]
+            self._order[item] = None
+            self._tree.set(self._slots[item], self._weights[item])
+
+    def move_to_front(self, item):
+        "Make an enabled item the next one returned by `pop_append`."
+        if item not in self._order:
+            if item in self._disabled:
+                raise ValueError(f"{item!r} is disabled; enable it first")
+            raise ValueError(f"{item!r} is not in the list")
+        self._order.move_to_end(item, last=False)
+
+    def weight(self, item):
+        "Return the sampling weight of an item."
+        return self._weights[item]
+
+    def set_weight(self, item, weight):
+        "Set the sampling weight of an item."
+        self._weights[item] = float(weight)
+        if item in self._order:
+            self._tree.set(self._slots[item], float(weight))
+
+    def sample(self, randomizer):
+        """Draw an enabled item with probability proportional to its weight. This does not change the rotation order.
+
+        Args:
+            randomizer (random.Random): pseudo-random number generator.
+        """
+        if not self._order:
+            raise IndexError("sample from empty RotationList")
+        total = self._tree.total()
+        if total <= 0:
+            raise ValueError("all enabled items have zero weight")
+        value = randomizer.random() * total
+        slot = self._tree.find(value)
+        if self._tree.weight(slot) <= 0: # rounding errors accumulated in the tree; rebuild it
+            self._tree.rebuild([self._tree.weight(i) for i in range(len(self._tree))])
+            slot = self._tree.find(value)
+        return self._slot_items[slot]
+
     def shuffle(self, randomizer):
         """Randomly shuffle the list of proxies. This changes the order by which we iterate through them.
 
         Args:
             randomizer (random.Random): pseudo-random number generator.        
         """
-        randomizer.shuffle(self)
+        items = list(self._order)
+        randomizer.shuffle(items)
+        self._order = OrderedDict.fromkeys(items)
+
+    def sort(self, key=None, reverse=False):
+        """Sort the enabled items in place. The sort is stable.
+
+        Args:
+            key (callable, optional): function of one item that returns the sort key.
+            reverse (bool, optional): if True, sort in descending order.
+        """
+        items = sorted(self._order, key=key, reverse=reverse)
+        self._order = OrderedDict.fromkeys(items)
 
 
 def get_vpn_pids():
@@ -183,6 +430,69 @@ def get_vpn_pids():
     return openvpn_pids
 
 
+def _windows_process_exists(pid):
+    "Check whether a process exists on Windows, from the exit code of the process."
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return kernel32.GetLastError() == 5 # ERROR_ACCESS_DENIED: the process exists
+    try:
+        exit_code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == 259 # STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def process_exists(pid):
+    """Check whether a process exists, without starting a subprocess.
+
+    Sends the null signal to the process on Linux and macOS. Processes of other users, such as the `OpenVPN`
+    daemon that runs as root, exist even though the signal is not permitted. On Windows, where `os.kill` would
+    terminate the process, the process is opened with `OpenProcess` instead.
+
+    Args:
+        pid (str or int): the process ID.
+
+    Returns:
+        bool: `True` if the process exists.
+    """
+    try:
+        pid = int(pid)
+    except (TypeError, ValueError):
+        return False
+    if pid <= 0: # 0 and negative numbers address process groups
+        return False
+    if os.name == "nt":
+        return _windows_process_exists(pid)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def process_cpu_seconds(pid):
+    """CPU time used by a process so far, in user and kernel mode, read from `/proc`. Only available on Linux.
+
+    Args:
+        pid (str or int): the process ID.
+
+    Returns:
+        float: the CPU time in seconds.
+
+    Raises:
+        OSError: if the process does not exist, or on systems without `/proc`.
+    """
+    with open(os.path.join("/proc", str(pid), "stat"), encoding="utf-8", errors="replace") as file:
+        fields = file.read().rsplit(")", 1)[1].split() # the command name may contain spaces
+    # fields[0] is the state, field 3; utime and stime are fields 14 and 15
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
 def kill_all_connections(pwd):
     """Kill all openvpn connections on the machine
     
@@ -2,6 +2,7 @@
 from unittest import mock
 import pytest
 from sirup.IPRotator import IPRotator
+from sirup.TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
 
 
 @pytest.fixture
@@ -20,4 +21,7 @@ def iprotator_instance(mock_getpass, mock_kill, mock_check_pw, tmp_path): #pylin
     mock_getpass.return_value = "my_password"
     mock_check_pw.return_value = True
     instance = IPRotator("path/to/auth/file", tmp_path)
-    return instance
\ No newline at end of file
+    session_parent = tmp_path / "session" # created after listing the config files
+    session_parent.mkdir()
+    instance.session_dir = TemporaryDirectoryWithRootPermission("my_password", parent=str(session_parent))
+    return instance
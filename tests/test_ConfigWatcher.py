@@ -0,0 +1,114 @@
+import os
+import queue
+import shutil
+import struct
+import sys
+from unittest import mock
+import pytest
+from sirup import ConfigWatcher as config_watcher
+from sirup.ConfigWatcher import ConfigWatcher
+
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is specific to Linux")
+
+
+@pytest.fixture
+def events():
+    return queue.Queue()
+
+
+@pytest.fixture
+def watcher(tmp_path, events):
+    (tmp_path / "existing.ovpn").write_text("remote 1.2.3.4\n", encoding="utf-8")
+    instance = ConfigWatcher(tmp_path,
+                             on_added=lambda path: events.put(("added", path)),
+                             on_removed=lambda path: events.put(("removed", path)),
+                             on_modified=lambda path: events.put(("modified", path)),
+                             rule=lambda f: f if f.endswith(".ovpn") else False,
+                             known_files=[os.path.join(tmp_path, "existing.ovpn")])
+    yield instance
+    instance.stop()
+
+
+def test_parse_events():
+    buffer = struct.pack("iIII", 1, config_watcher.IN_CLOSE_WRITE, 0, 8) + b"a.ovpn\0\0"
+    buffer += struct.pack("iIII", 1, config_watcher.IN_DELETE, 0, 0)
+    assert config_watcher.parse_events(buffer) == [(config_watcher.IN_CLOSE_WRITE, "a.ovpn"), (config_watcher.IN_DELETE, "")]
+
+
+def test_handle_event(watcher, events, tmp_path):
+    watcher.handle_event(config_watcher.IN_CLOSE_WRITE, "new.ovpn")
+    assert events.get_nowait() == ("added", os.path.join(tmp_path, "new.ovpn"))
+    watcher.handle_event(config_watcher.IN_CLOSE_WRITE, "new.ovpn")
+    assert events.get_nowait() == ("modified", os.path.join(tmp_path, "new.ovpn"))
+    watcher.handle_event(config_watcher.IN_MOVED_FROM, "existing.ovpn")
+    assert events.get_nowait() == ("removed", os.path.join(tmp_path, "existing.ovpn"))
+    watcher.handle_event(config_watcher.IN_DELETE, "unknown.ovpn")
+    watcher.handle_event(config_watcher.IN_CLOSE_WRITE, "notes.txt")
+    assert events.empty(), "reports unknown or filtered files"
+
+
+def test_rescan(watcher, events, tmp_path):
+    (tmp_path / "new.ovpn").write_text("remote 5.6.7.8\n", encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("not a config\n", encoding="utf-8")
+    watcher.handle_event(config_watcher.IN_CLOSE_WRITE, "gone.ovpn")
+    assert events.get_nowait()[0] == "added"
+    watcher.rescan()
+    assert [events.get_nowait() for _ in range(3)] == [
+        ("removed", os.path.join(tmp_path, "gone.ovpn")),
+        ("modified", os.path.join(tmp_path, "existing.ovpn")),
+        ("added", os.path.join(tmp_path, "new.ovpn")),
+    ]
+    assert events.empty()
+
+
+@linux_only
+def test_watch_directory(watcher, events, tmp_path):
+    watcher.start()
+    assert watcher.is_running()
+    (tmp_path / "new.ovpn").write_text("remote 5.6.7.8\n", encoding="utf-8")
+    assert events.get(timeout=2) == ("added", os.path.join(tmp_path, "new.ovpn"))
+    (tmp_path / "existing.ovpn").write_text("remote 1.2.3.5\n", encoding="utf-8")
+    assert events.get(timeout=2) == ("modified", os.path.join(tmp_path, "existing.ovpn"))
+    os.remove(tmp_path / "new.ovpn")
+    assert events.get(timeout=2) == ("removed", os.path.join(tmp_path, "new.ovpn"))
+    watcher.stop()
+    assert not watcher.is_running()
+
+
+@linux_only
+def test_watch_missing_directory(tmp_path):
+    instance = ConfigWatcher(tmp_path / "missing", on_added=print, on_removed=print)
+    with pytest.raises(OSError):
+        instance.start()
+
+
+@linux_only
+def test_watch_directory_removed_and_created_again(tmp_path, events):
+    directory = tmp_path / "configs"
+    directory.mkdir()
+    (directory / "existing.ovpn").write_text("remote 1.2.3.4\n", encoding="utf-8")
+    instance = ConfigWatcher(directory,
+                             on_added=lambda path: events.put(("added", path)),
+                             on_removed=lambda path: events.put(("removed", path)),
+                             known_files=[os.path.join(directory, "existing.ovpn")])
+    instance.retry_interval = 0.05
+    instance.start()
+    try:
+        shutil.rmtree(directory)
+        assert events.get(timeout=2) == ("removed", os.path.join(directory, "existing.ovpn"))
+        directory.mkdir()
+        (directory / "new.ovpn").write_text("remote 5.6.7.8\n", encoding="utf-8")
+        assert events.get(timeout=2) == ("added", os.path.join(directory, "new.ovpn"))
+        (directory / "other.ovpn").write_text("remote 5.6.7.9\n", encoding="utf-8")
+        assert events.get(timeout=2) == ("added", os.path.join(directory, "other.ovpn"))
+    finally:
+        instance.stop()
+
+
+def test_start_without_inotify(tmp_path):
+    instance = ConfigWatcher(tmp_path, on_added=print, on_removed=print)
+    with mock.patch("ctypes.CDLL", return_value=object()):
+        with pytest.raises(OSError, match="inotify is not available"):
+            instance.start()
+    assert not instance.is_running()
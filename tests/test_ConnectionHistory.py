@@ -0,0 +1,88 @@
+import pytest
+from sirup.ConnectionHistory import AdaptiveTimeout
+from sirup.ConnectionHistory import ConnectionHistory
+from sirup.ConnectionHistory import ServerRecord
+from sirup.ConnectionHistory import read_history
+
+
+@pytest.fixture
+def history_file(tmp_path):
+    return str(tmp_path / "history.csv")
+
+
+def record_attempts(history):
+    history.record("server1", 100.0, {"start": 100.0, "vpn_started": 100.5, "tunnel_up": 103.0,
+                                      "verified": 103.5, "end": 103.6}, "success", exit_ip="1.2.3.4")
+    history.record("server1", 200.0, {"start": 200.0, "vpn_started": 200.5, "tunnel_up": 205.0, "end": 205.0}, "success")
+    history.record("server2", 300.0, {"start": 300.0, "vpn_started": 300.5, "end": 330.5}, "timeout",
+                   exception="TimeoutError", backoff=10)
+
+
+def test_record_and_read(history_file):
+    history = ConnectionHistory(history_file)
+    record_attempts(history)
+    assert len(history) == 3
+    attempts = list(read_history(history_file))
+    assert len(attempts) == 3
+    assert attempts[0] == {"config_file": "server1", "start": 100.0, "vpn_started": 0.5, "tunnel_up": 3.0,
+                           "verified": 3.5, "end": 3.6, "outcome": "success", "exception": None,
+                           "exit_ip": "1.2.3.4", "backoff": 0.0}
+    assert attempts[2]["tunnel_up"] is None, "missing phase not empty"
+    assert attempts[2]["exception"] == "TimeoutError"
+    with open(history_file, encoding="utf-8") as file:
+        assert file.readline().startswith("config_file,start"), "no header"
+        assert sum(1 for _ in file) == 3, "header written twice"
+
+
+def test_close_and_append(history_file):
+    history = ConnectionHistory(history_file)
+    record_attempts(history)
+    history.close()
+    history.close()
+    record_attempts(history)
+    history.close()
+    appended = ConnectionHistory(history_file)
+    assert len(appended) == 6
+    record_attempts(appended)
+    appended.close()
+    with open(history_file, encoding="utf-8") as file:
+        assert sum(line.startswith("config_file,start") for line in file) == 1, "header written twice"
+
+
+def test_summarize(history_file):
+    history = ConnectionHistory(history_file)
+    record_attempts(history)
+    summaries = history.summarize()
+    assert summaries["server1"]["attempts"] == 2
+    assert summaries["server1"]["failure_rate"] == 0
+    assert summaries["server1"]["p50"] == pytest.approx(4.0)
+    assert summaries["server1"]["p95"] == pytest.approx(4.9)
+    assert summaries["server2"] == {"attempts": 1, "successes": 0, "failure_rate": 1.0, "p50": None, "p95": None,
+                                    "backoff": 10.0}
+    assert history.servers["server2"].exceptions == {"TimeoutError": 1}
+
+    # Preload from file
+    preloaded = ConnectionHistory(history_file)
+    assert preloaded.summarize() == summaries
+
+
+def test_memory_only():
+    history = ConnectionHistory()
+    record_attempts(history)
+    assert history.summarize()["server1"]["successes"] == 2
+
+
+def test_adaptive_timeout():
+    policy = AdaptiveTimeout(multiple=3, floor=5, ceiling=60, fallback=30, min_samples=3)
+    record = ServerRecord()
+    assert policy.timeout(None) == 30
+    for connect_time in [1.0, 1.0]:
+        record.add({"outcome": "success", "tunnel_up": connect_time})
+    assert policy.timeout(record) == 30, "not enough observations"
+    record.add({"outcome": "success", "tunnel_up": 1.0})
+    assert policy.timeout(record) == 5, "floor"
+    for _ in range(3):
+        record.add({"outcome": "success", "tunnel_up": 40.0})
+    assert policy.timeout(record) == 60, "ceiling"
+    with pytest.raises(ValueError):
+        AdaptiveTimeout(floor=10, fallback=5)
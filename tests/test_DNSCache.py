@@ -0,0 +1,170 @@
+"""Tests for the sirup.DNSCache module.
+"""
+
+import socket
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from unittest import mock
+import pytest
+import requests
+from sirup.DNSCache import TYPE_A
+from sirup.DNSCache import TYPE_AAAA
+from sirup.DNSCache import DNSCache
+from sirup.DNSCache import build_query
+from sirup.DNSCache import make_session
+from sirup.DNSCache import parse_response
+from sirup.FakeBackend import VirtualClock
+
+
+def encode_name(name):
+    return b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\0"
+
+
+def make_response(query, records, rcode=0):
+    "Answer a query with records `(rtype, ttl, rdata)`, all for the name of the question."
+    header = query[:2] + struct.pack("!HHHHH", 0x8180 | rcode, 1, len(records), 0, 0)
+    answers = b"".join(struct.pack("!HHHIH", 0xC00C, rtype, 1, ttl, len(rdata)) + rdata
+                       for rtype, ttl, rdata in records)
+    return header + query[12:] + answers
+
+
+class FakeNameserver():
+    "Answers A queries from a table on a local UDP port; other names do not exist."
+
+    def __init__(self, table):
+        self.table = table
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+
+    def _serve(self):
+        while True:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except OSError:
+                return
+            labels, offset = [], 12
+            while query[offset]:
+                labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+                offset += query[offset] + 1
+            name = ".".join(labels)
+            rtype = struct.unpack_from("!H", query, offset + 1)[0]
+            self.queries.append((name, rtype))
+            if name not in self.table:
+                response = make_response(query, [], rcode=3)
+            elif rtype != TYPE_A:
+                response = make_response(query, [])
+            else:
+                response = make_response(query, [(TYPE_A, 300, socket.inet_aton(self.table[name]))])
+            self.sock.sendto(response, client)
+
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def nameserver():
+    server = FakeNameserver({"example.org": "93.184.216.34", "localtest.sirup": "127.0.0.1"})
+    yield server
+    server.close()
+
+
+def test_parse_cname_chain():
+    query = build_query("www.example.org", TYPE_A, 7)
+    assert query[12:] == encode_name("www.example.org") + b"\x00\x01\x00\x01"
+    response = make_response(query, [(5, 3600, encode_name("cdn.example.net")),
+                                      (TYPE_A, 60, socket.inet_aton("192.0.2.7"))])
+    rcode, truncated, records = parse_response(response, 7)
+    assert (rcode, truncated) == (0, False)
+    assert records == [(5, 3600, None), (TYPE_A, 60, "192.0.2.7")]
+    with pytest.raises(ValueError):
+        parse_response(response, 8)
+
+
+def test_lookup_and_ttl(nameserver):
+    clock = VirtualClock(1000.0)
+    cache = DNSCache(["127.0.0.1"], port=nameserver.port, max_ttl=120, clock=clock)
+    assert cache.resolve("example.org") == "93.184.216.34"
+    assert cache.resolve("Example.org.") == "93.184.216.34"
+    assert (cache.hits, cache.misses) == (1, 1)
+    clock.sleep(121) # the TTL of 300 s is clamped to 120 s
+    cache.resolve("example.org")
+    assert cache.misses == 2
+
+    with pytest.raises(socket.gaierror):
+        cache.resolve("missing.example.org")
+    with pytest.raises(socket.gaierror):
+        cache.resolve("missing.example.org")
+    assert nameserver.queries.count(("missing.example.org", TYPE_A)) == 1, "names that do not exist are cached"
+    assert nameserver.queries.count(("missing.example.org", TYPE_AAAA)) == 1
+    assert cache.resolve("198.51.100.3") == "198.51.100.3"
+
+    unreachable = DNSCache(["127.0.0.1"], port=1, timeout=0.2)
+    with pytest.raises(socket.gaierror):
+        unreachable.resolve("example.org")
+
+
+def test_rotate_keeps_hot_entries(nameserver):
+    clock = VirtualClock(1000.0)
+    cache = DNSCache(["127.0.0.1"], port=nameserver.port, hot_hits=2, carry_over_ttl=30, clock=clock)
+    for _ in range(3):
+        cache.lookup("example.org")
+    cache.lookup("localtest.sirup")
+    cache.rotate(["127.0.0.1"])
+    assert len(cache) == 2, "the same nameservers give the same answers"
+
+    cache.rotate(["127.0.0.2"])
+    assert cache.nameservers == ["127.0.0.2"]
+    assert cache.generation == 2
+    assert len(cache) == 1, "only hot entries are carried over"
+    cache.lookup("example.org")
+    assert cache.hits == 3
+    clock.sleep(31)
+    cache.nameservers = ["127.0.0.1"]
+    cache.lookup("example.org")
+    assert cache.misses == 3, "carried-over entries are refreshed soon"
+
+    cache.rotate([])
+    assert cache.nameservers == ["127.0.0.1"], "tunnels without nameservers use the default"
+
+
+def test_session(nameserver):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self): # pylint: disable=invalid-name
+            body = self.headers["Host"].encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): # pylint: disable=arguments-differ
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    cache = DNSCache(["127.0.0.1"], port=nameserver.port)
+    session = make_session(cache)
+    try:
+        response = session.get(f"http://localtest.sirup:{port}/", timeout=5)
+        assert response.text == f"localtest.sirup:{port}", "the host name is kept in the request"
+        assert cache.misses == 1
+        adapter = session.get_adapter("http://")
+        assert len(adapter.poolmanager.pools) == 1
+        cache.rotate(["127.0.0.1"])
+        session.get(f"http://localtest.sirup:{port}/", timeout=5)
+        assert adapter._generation == 1 #pylint: disable=protected-access
+        assert cache.hits == 1
+        with mock.patch.object(cache, "resolve", side_effect=socket.gaierror(socket.EAI_NONAME, "unknown")):
+            with pytest.raises(requests.ConnectionError, match="unknown"):
+                session.get(f"http://unknown.sirup:{port}/", timeout=5)
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,136 @@
+"""Tests for the sirup.FakeBackend module.
+"""
+
+from unittest import mock
+import pytest
+import requests
+from sirup.FakeBackend import FakeNetwork
+from sirup.FakeBackend import VirtualClock
+from sirup.IPRotator import IPRotator
+from sirup.TunnelOptions import TunnelOptions
+
+
+def constant_connect_time(seconds):
+    return lambda randomizer, config_file: seconds
+
+
+@pytest.fixture
+def config_location(tmp_path):
+    for f in ["file1", "file2", "file3"]:
+        (tmp_path / f).touch()
+    return tmp_path
+
+
+def test_virtual_clock():
+    clock = VirtualClock(start=10.0)
+    clock.sleep(2.5)
+    assert clock.time() == 12.5
+
+
+def test_connect_disconnect():
+    network = FakeNetwork(seed=1, connect_time=constant_connect_time(3.0), stop_time=1.0)
+    backend = network("server1")
+    assert backend.current_ip == network.base_ip
+    assert backend.state() == "down"
+
+    backend.connect(pwd=None)
+    assert backend.is_connected()
+    assert backend.current_ip == network.exit_ip("server1") != network.base_ip
+    assert backend.phase_times == {"start": 0.0, "vpn_started": 0.0, "tunnel_up": 3.0, "verified": 3.0}
+    assert network.n_active == 1
+
+    backend.disconnect(pwd=None)
+    assert backend.state() == "down"
+    assert backend.current_ip == network.base_ip
+    assert network.clock.time() == 4.0
+    assert network.n_active == 0
+
+
+def test_failures():
+    network = FakeNetwork(timeout_rate={"slow": 1.0}, connection_error_rate={"broken": 1.0},
+                          connect_time=constant_connect_time(5.0))
+    backend = network("slow")
+    with pytest.raises(TimeoutError):
+        backend.connect(pwd=None, timeout=10)
+    assert backend.state() == "failed"
+    assert network.clock.time() == 10.0, "a timeout takes the full timeout"
+    assert network.n_active == 0
+
+    backend = network("broken")
+    with pytest.raises(requests.ConnectionError, match="Cannot get IP address"):
+        backend.connect(pwd=None)
+    assert backend.is_connected()
+
+    backend = network("fine")
+    with pytest.raises(TimeoutError):
+        backend.connect(pwd=None, timeout=4)
+
+
+def test_deterministic():
+    outcomes = []
+    for _ in range(2):
+        network = FakeNetwork(seed=42, timeout_rate=0.3, connection_error_rate=0.1)
+        outcomes.append([network.draw_outcome(f"server{i}") for i in range(100)])
+    assert outcomes[0] == outcomes[1]
+
+
+@mock.patch("sirup.IPRotator.kill_all_connections")
+@mock.patch("getpass.getpass")
+def test_rotator_with_fake_network(mock_getpass, mock_kill, config_location):
+    network = FakeNetwork(seed=3, timeout_rate={str(config_location / "file2"): 1.0},
+                          connect_time=constant_connect_time(2.0))
+    rotator = IPRotator("auth_file", config_location, backend=network)
+    mock_getpass.assert_not_called()
+    mock_kill.assert_not_called()
+    assert rotator.clock is network.clock
+
+    rotator.connect()
+    for _ in range(999):
+        rotator.rotate()
+    rotator.close()
+
+    assert len(rotator.history) == 1500, "every second attempt hits the dead server"
+    summaries = rotator.history.summarize()
+    assert summaries[str(config_location / "file2")]["successes"] == 0
+    assert summaries[str(config_location / "file1")]["p50"] == 2.0
+    assert network.n_active == 0, "all tunnels are closed"
+    # 1000 connections of 2 s, and 500 timeouts of 30 s followed by 10 s backoff
+    assert network.clock.time() == 1000 * 2 + 500 * (30 + 10)
+
+
+def test_verify_routes_and_sampled_ip_checks():
+    network = FakeNetwork(connection_error_rate={"broken": 1.0}, connect_time=constant_connect_time(1.0))
+    backend = network("fine", verify_routes=True, ip_check_rate=0.0)
+    assert backend.base_ip is None, "the IP address check is skipped"
+    backend.connect(pwd=None)
+    assert backend.current_ip is None
+    assert "verified" in backend.phase_times
+    backend.disconnect(pwd=None)
+
+    backend = network("broken", verify_routes=True, ip_check_rate=0.0)
+    with pytest.raises(requests.ConnectionError, match="not in use: traffic does not go through the tunnel"):
+        backend.connect(pwd=None)
+
+    with mock.patch("sirup.Backend.random.random", side_effect=[0.1, 0.9]):
+        backend = network("fine", ip_check_rate=0.5)
+        assert backend.base_ip == network.base_ip
+        backend.connect(pwd=None)
+        assert backend.current_ip is None
+        assert "verified" not in backend.phase_times
+
+
+def test_rotator_gives_up_after_max_trials(config_location):
+    network = FakeNetwork(connection_error_rate=1.0, connect_time=constant_connect_time(1.0))
+    rotator = IPRotator("auth_file", config_location, backend=network,
+                        tunnel_options=TunnelOptions(verify_routes=True))
+    with pytest.raises(requests.ConnectionError, match="3 different servers"):
+        rotator.connect(max_trials=3)
+    assert network.clock.time() == 3 * 1 + 2 * 5, "no backoff after the last attempt"
+
+    network.connection_error_rate = 0.0
+    network.timeout_rate = 1.0
+    start = network.clock.time()
+    with pytest.raises(TimeoutError):
+        rotator.connect(max_trials=2, waiting_time=0)
+    assert network.clock.time() - start == 2 * 30
+    rotator.close()
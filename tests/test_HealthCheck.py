@@ -0,0 +1,101 @@
+"""Tests for the sirup.HealthCheck module.
+"""
+
+import threading
+from unittest import mock
+import pytest
+from sirup.HealthCheck import HealthCheck
+from sirup.HealthCheck import read_report
+
+
+@pytest.fixture
+def health_check(tmp_path):
+    instance = HealthCheck("auth_file", "my_password", parallelism=2, timeout=15)
+    instance._session_dir.parent = str(tmp_path) #pylint: disable=protected-access
+    return instance
+
+
+def test_scripts(health_check):
+    setup = health_check.make_setup_script(1).splitlines()
+    assert "ip netns add sirup-ns1" in setup
+    assert "ip address add 10.231.0.5/30 dev sirup-v1h" in setup
+    assert "ip netns exec sirup-ns1 ip route add default via 10.231.0.5" in setup
+    assert "iptables -t nat -A POSTROUTING -s 10.231.0.4/30 -j MASQUERADE" in setup
+    assert "iptables -I FORWARD -s 10.231.0.4/30 -j ACCEPT" in setup
+    teardown = health_check.make_teardown_script(1).splitlines()
+    assert "ip netns del sirup-ns1 2>/dev/null || true" in teardown
+    assert "iptables -D FORWARD -s 10.231.0.4/30 -j ACCEPT 2>/dev/null || true" in teardown
+    forward_rules = [line for line in setup if "FORWARD" in line]
+    assert len(forward_rules) == 2
+    for rule in forward_rules:
+        assert rule.replace("-I FORWARD", "-D FORWARD") + " 2>/dev/null || true" in teardown, "every rule is removed"
+    with pytest.raises(ValueError):
+        HealthCheck("auth_file", "my_password", parallelism=0)
+
+
+@pytest.mark.parametrize("before", ["0", "1"])
+@mock.patch("sirup.HealthCheck.get_ip", return_value="192.0.2.1")
+@mock.patch.object(HealthCheck, "_run_as_root", return_value=mock.Mock(returncode=0))
+def test_setup_teardown_restore_ip_forward(mock_run, mock_get_ip, health_check, tmp_path, before): #pylint: disable=unused-argument
+    ip_forward_file = tmp_path / "ip_forward"
+    ip_forward_file.write_text(before + "\n")
+    with mock.patch("sirup.HealthCheck.IP_FORWARD_FILE", str(ip_forward_file)):
+        health_check.setup()
+    with mock.patch.object(health_check._session_dir, "cleanup"): #pylint: disable=protected-access
+        health_check.teardown()
+    restored = mock.call("sysctl -qw net.ipv4.ip_forward=0") in mock_run.call_args_list
+    assert restored == (before == "0"), "forwarding is turned off again only if it was off"
+
+
+@mock.patch.object(HealthCheck, "_run_as_root")
+@mock.patch.object(HealthCheck, "exit_ip")
+@mock.patch("sirup.HealthCheck.VPNConnector")
+def test_check(mock_connector, mock_exit_ip, mock_run, health_check): #pylint: disable=unused-argument
+    connector = mock_connector.return_value
+    connector.phase_times = {"start": 100.0, "vpn_started": 100.5, "tunnel_up": 104.0}
+    health_check.base_ip = "192.0.2.1"
+    mock_exit_ip.return_value = "198.51.100.7"
+
+    result = health_check.check("server.ovpn", 1)
+    assert result["success"]
+    assert result["connect_time"] == 4.0
+    assert result["exit_ip"] == "198.51.100.7"
+    assert mock_connector.call_args[1]["netns"] == "sirup-ns1"
+    connector.connect.assert_called_once_with("my_password", timeout=15)
+    connector.disconnect.assert_called_once_with("my_password")
+
+    mock_exit_ip.return_value = "192.0.2.1"
+    assert health_check.check("server.ovpn", 1)["error"] == "Traffic does not go through the tunnel"
+
+    connector.connect.side_effect = TimeoutError("Could not connect to vpn")
+    result = health_check.check("server.ovpn", 1)
+    assert not result["success"]
+    assert result["error"] == "TimeoutError: Could not connect to vpn"
+    assert "xargs -r kill" in mock_run.call_args[0][0]
+
+
+def test_run_and_report(health_check, tmp_path):
+    running, max_running = set(), []
+    lock = threading.Lock()
+
+    def fake_check(config_file, slot):
+        with lock:
+            assert slot not in running, "a slot is used by one check at a time"
+            running.add(slot)
+            max_running.append(len(running))
+        with lock:
+            running.discard(slot)
+        return {"success": config_file != "bad.ovpn", "connect_time": 3.0, "exit_ip": None, "error": None,
+                "checked_at": 0.0}
+
+    for slot in range(health_check.parallelism):
+        health_check._slots.put(slot) #pylint: disable=protected-access
+    with mock.patch.object(health_check, "check", side_effect=fake_check):
+        results = health_check.run([f"server{i}.ovpn" for i in range(10)] + ["bad.ovpn"])
+    assert len(results) == 11
+    assert max(max_running) <= 2
+    assert not results["bad.ovpn"]["success"]
+
+    report = str(tmp_path / "report.json")
+    health_check.write_report(report)
+    assert read_report(report) == results
@@ -1,11 +1,28 @@
 """Tests for the sirup.IPRotator module.
 """
 
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 from unittest import mock
 import pytest
 import requests
+from sirup.ConnectionHistory import AdaptiveTimeout
+from sirup.DNSCache import DNSCache
+from sirup.DNSCache import ResolvingAdapter
+from sirup.FakeBackend import FakeNetwork
 from sirup.IPRotator import IPRotator
+from sirup.LeaseRegistry import HTTPLeaseRegistry
+from sirup.LeaseRegistry import SQLiteLeaseRegistry
+from sirup.LeaseRegistry import server_key
+from sirup.ServerSelection import ServerSelection
+from sirup.TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+from sirup.TunnelTuner import read_tuning
 from sirup.utils import RotationList
+from sirup.VariantSelector import VariantSelector
 
 
 @mock.patch("sirup.IPRotator.check_password")
@@ -30,6 +47,19 @@ def test_instantiate(mock_getpass, mock_kill, mock_check_pw, tmp_path):
     mock_kill.assert_called_once_with("my_password")
 
 
+@mock.patch("sirup.IPRotator.check_password", return_value=True)
+@mock.patch("sirup.IPRotator.kill_all_connections")
+def test_shared_session_dir(mock_kill, mock_check_pw, tmp_path): #pylint: disable=unused-argument
+    (tmp_path / "file1").touch()
+    session_dir = TemporaryDirectoryWithRootPermission("my_password", parent=str(tmp_path))
+    instance = IPRotator("path/to/auth/file", tmp_path, pwd="my_password", session_dir=session_dir)
+    assert instance.session_dir is session_dir
+    mock_kill.assert_not_called()
+    path = session_dir.tunnel_dir("tunnel0")
+    instance.close()
+    assert os.path.isdir(path)
+
+
 def test_repr(iprotator_instance):
     repr_output = repr(iprotator_instance)
     #pylint: disable=protected-access
@@ -48,11 +78,12 @@ def test_connect(mock_kill, mock_connector, mock_sleep, mock_rotation_list, ipro
    
     # We'll be using the return value of the mock_connector: (1) for the connect() fct; (2) for the assertion below
     mock_connector = mock_connector.return_value
+    mock_connector.current_ip = "new_ip"
 
     # Test without errors
     mock_connect = mock_connector.connect 
     iprotator_instance.connect(shuffle=True)
-    mock_connect.assert_called_once_with(pwd="my_password")
+    mock_connect.assert_called_once_with(pwd="my_password", timeout=None)
     # pylint: disable=protected-access
     assert iprotator_instance.connector._extract_mock_name() == mock_connector._extract_mock_name(), \
         "iprotator_instance has uncorrect `connector` attribute"
@@ -84,6 +115,7 @@ def test_connect(mock_kill, mock_connector, mock_sleep, mock_rotation_list, ipro
 def test_disconnect(mock_connector, iprotator_instance):
 
     iprotator_instance.connector = mock_connector.return_value
+    iprotator_instance.connector.traffic_summary = None
     mock_disconnect = iprotator_instance.connector.disconnect 
 
     iprotator_instance.disconnect()
@@ -98,4 +130,452 @@ def test_rotate(mock_connect, mock_disconnect, iprotator_instance):
     iprotator_instance.rotate()
     # Assert 
     mock_disconnect.assert_called_once_with()
-    mock_connect.assert_called_once_with()
\ No newline at end of file
+    mock_connect.assert_called_once_with()
+
+@mock.patch("subprocess.run")
+@mock.patch.object(IPRotator, "disconnect")
+def test_close(mock_disconnect, mock_run, iprotator_instance):
+    iprotator_instance.session_dir.tunnel_dir("tunnel0")
+    iprotator_instance.close()
+    mock_disconnect.assert_not_called()
+    mock_run.assert_called_once()
+    assert iprotator_instance.session_dir.path is None
+
+    mock_run.reset_mock()
+    iprotator_instance.connector = "active connector"
+    with iprotator_instance:
+        pass
+    mock_disconnect.assert_called_once_with()
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_reconnect(mock_connector, iprotator_instance):
+    old_connector = mock.Mock()
+    old_connector.config_file = "file2"
+    old_connector.traffic_summary = None
+    old_connector.disconnect.side_effect = RuntimeWarning("Expected to go back to base IP address")
+    iprotator_instance.connector = old_connector
+    mock_connector.return_value.traffic_summary = None
+    mock_connector.return_value.config_file = "file2"
+
+    iprotator_instance.reconnect()
+    old_connector.disconnect.assert_called_once_with("my_password")
+    assert mock_connector.call_args[0][0] == "file2", "does not reconnect to the same server"
+    assert iprotator_instance.connector is mock_connector.return_value
+
+    # Falls back to the next server
+    mock_connector.reset_mock()
+    mock_connector.return_value.connect.side_effect = [TimeoutError, None]
+    with mock.patch.object(IPRotator, "connect") as mock_connect:
+        iprotator_instance.reconnect()
+        mock_connect.assert_called_once_with()
+
+
+@mock.patch("sirup.IPRotator.TunnelMonitor")
+def test_start_stop_monitor(mock_monitor, iprotator_instance):
+    monitor = iprotator_instance.start_monitor(stall_timeout=5, action="rotate")
+    mock_monitor.assert_called_once_with(iprotator_instance, stall_timeout=5, action="rotate")
+    monitor.start.assert_called_once_with()
+    assert iprotator_instance.monitor is monitor
+
+    iprotator_instance.stop_monitor()
+    monitor.stop.assert_called_once_with()
+    assert iprotator_instance.monitor is None
+
+
+def test_throughput(iprotator_instance):
+    config_location = iprotator_instance._other_inputs["config_location"] #pylint: disable=protected-access
+    file1, file2, file3 = [os.path.join(config_location, f) for f in ["file1", "file2", "file3"]]
+    iprotator_instance.config_queue = RotationList([file1, file2, file3])
+    summary = {"config_file": file3, "seconds": 10.0, "bytes_in": 1000, "mean_rate_in": 100.0, "peak_rate_in": 200.0}
+    iprotator_instance._record_traffic(summary) #pylint: disable=protected-access
+    iprotator_instance._record_traffic(dict(summary, seconds=30.0, mean_rate_in=20.0, peak_rate_in=100.0)) #pylint: disable=protected-access
+    # a burst at the start of an otherwise slow connection
+    iprotator_instance._record_traffic(dict(summary, config_file=file2, mean_rate_in=10.0, peak_rate_in=300.0)) #pylint: disable=protected-access
+    iprotator_instance._record_traffic(None) #pylint: disable=protected-access
+    assert iprotator_instance.throughput[file3] == {"connections": 2, "seconds": 40.0, "bytes_in": 2000,
+                                                    "mean_rate_in": 40.0, "peak_rate_in": 200.0}
+
+    iprotator_instance.rank_by_throughput()
+    assert list(iprotator_instance.config_queue) == [file3, file2, file1]
+
+
+def test_rank_by_rtt(iprotator_instance):
+    iprotator_instance.config_queue = RotationList(["file1", "file2", "file3", "file4"])
+    prober = mock.Mock()
+    prober.probe_configs.return_value = {"file1": None, "file2": 0.2, "file3": 0.05, "file4": None}
+    iprotator_instance.rank_by_rtt(prober)
+    prober.probe_configs.assert_called_once_with(["file1", "file2", "file3", "file4"])
+    assert list(iprotator_instance.config_queue) == ["file3", "file2", "file1", "file4"]
+    assert iprotator_instance.rtt["file3"] == 0.05
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_connect_weighted(mock_connector, iprotator_instance):
+    iprotator_instance.config_queue = RotationList(["file1", "file2", "file3"], weights=[0, 0, 1])
+    mock_connector.return_value.current_ip = None
+    iprotator_instance.connect(weighted=True)
+    assert mock_connector.call_args[0][0] == "file3"
+    assert iprotator_instance.config_queue == ["file1", "file2", "file3"], "weighted draw changes the rotation"
+
+
+def test_config_changes(iprotator_instance):
+    config_location = str(iprotator_instance._other_inputs["config_location"]) #pylint: disable=protected-access
+    file1, file4 = os.path.join(config_location, "file1"), os.path.join(config_location, "file4")
+    iprotator_instance.config_queue.disable(file1)
+    iprotator_instance._add_config_file(file4) #pylint: disable=protected-access
+    iprotator_instance._add_config_file(file1) #pylint: disable=protected-access
+    assert list(iprotator_instance.config_queue)[-1] == file4
+    assert iprotator_instance.config_queue.disabled == [file1], "disabled config re-enabled"
+    iprotator_instance._remove_config_file(file1) #pylint: disable=protected-access
+    assert iprotator_instance.config_queue.disabled == []
+    assert len(iprotator_instance.config_queue) == 3
+
+
+def test_config_changes_wait_for_the_lock(iprotator_instance):
+    config_location = str(iprotator_instance._other_inputs["config_location"]) #pylint: disable=protected-access
+    file4 = os.path.join(config_location, "file4")
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with iprotator_instance.lock:
+            locked.set()
+            release.wait(5)
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait(5)
+    iprotator_instance._queue_config_change("added", file4) #pylint: disable=protected-access
+    assert file4 not in iprotator_instance.config_queue, "the watcher does not wait while the rotator holds the lock"
+    release.set()
+    holder.join()
+
+    with iprotator_instance.lock:
+        iprotator_instance._apply_config_changes() #pylint: disable=protected-access
+    assert list(iprotator_instance.config_queue)[-1] == file4
+    iprotator_instance._queue_config_change("removed", file4) #pylint: disable=protected-access
+    assert file4 not in iprotator_instance.config_queue, "applied right away when the lock is free"
+
+
+@mock.patch("sirup.IPRotator.ConfigWatcher")
+def test_watch_config_location(mock_watcher, iprotator_instance):
+    watcher = iprotator_instance.watch_config_location()
+    watcher.start.assert_called_once_with()
+    kwargs = mock_watcher.call_args[1]
+    assert sorted(kwargs["known_files"]) == sorted(iprotator_instance.config_queue)
+    iprotator_instance.close()
+    watcher.stop.assert_called_once_with()
+    assert iprotator_instance.config_watcher is None
+
+
+@mock.patch("sirup.IPRotator.time.sleep")
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_connect_records_history(mock_connector, mock_sleep, iprotator_instance):
+    connector = mock_connector.return_value
+    connector.config_file = "file1"
+    connector.phase_times = {"start": 1.0, "vpn_started": 2.0}
+    connector.connect.side_effect = [TimeoutError, None]
+    connector.is_connected.side_effect = [False, True]
+    connector.current_ip = "1.2.3.4"
+    iprotator_instance.connect(max_trials=5)
+    record = iprotator_instance.history.servers["file1"]
+    assert record.attempts == 2
+    assert record.successes == 1
+    assert record.backoff == 10
+    assert record.exceptions == {"TimeoutError": 1}
+    mock_sleep.assert_called_once_with(10)
+
+
+def test_rank_by_history(iprotator_instance):
+    iprotator_instance.config_queue = RotationList(["new", "flaky", "slow", "fast"])
+    history = iprotator_instance.history
+    history.record("flaky", 0.0, {"end": 30.0}, "timeout")
+    history.record("slow", 0.0, {"tunnel_up": 12.0}, "success")
+    history.record("fast", 0.0, {"tunnel_up": 3.0}, "success")
+    iprotator_instance.rank_by_history()
+    assert list(iprotator_instance.config_queue) == ["fast", "slow", "new", "flaky"]
+
+
+@mock.patch("sirup.IPRotator.WireGuardConnector")
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_make_connector_by_extension(mock_openvpn, mock_wireguard, iprotator_instance):
+    #pylint: disable=protected-access
+    assert iprotator_instance._make_connector("server.conf") is mock_wireguard.return_value
+    assert iprotator_instance._make_connector("server.ovpn") is mock_openvpn.return_value
+    assert mock_wireguard.call_args[1]["work_dir"] == mock_openvpn.call_args[1]["work_dir"]
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_status(mock_connector, iprotator_instance):
+    config_file = list(iprotator_instance.config_queue)[1]
+    iprotator_instance.config_queue.move_to_front(config_file)
+    connector = mock_connector.return_value
+    connector.config_file = config_file
+    connector.current_ip = "198.51.100.7"
+    connector.traffic_summary = None
+
+    iprotator_instance.connect()
+    status = iprotator_instance.status.read()
+    assert status["state"] == "connected"
+    assert status["generation"] == 1
+    assert status["config_index"] == iprotator_instance.config_ids[config_file] == 1
+    assert status["exit_ip"] == "198.51.100.7"
+
+    iprotator_instance.disconnect()
+    status = iprotator_instance.status.read()
+    assert status["state"] == "disconnected"
+    assert status["generation"] == 1
+    assert status["exit_ip"] is None
+
+    connector.connect.side_effect = ValueError
+    with pytest.raises(ValueError):
+        iprotator_instance.connect()
+    assert iprotator_instance.status.read()["state"] == "disconnected"
+
+
+def test_load_probe_report(iprotator_instance, tmp_path):
+    file1, file2, file3 = list(iprotator_instance.config_queue)
+    report = tmp_path / "report.json"
+    report.write_text(json.dumps({"created": 0, "results": {
+        file1: {"success": False, "connect_time": None, "exit_ip": None, "error": "TimeoutError: ", "checked_at": 0},
+        file3: {"success": True, "connect_time": 2.5, "exit_ip": "198.51.100.7", "error": None, "checked_at": 0},
+    }}))
+    iprotator_instance.load_probe_report(str(report))
+    assert list(iprotator_instance.config_queue) == [file3, file2]
+    assert iprotator_instance.config_queue.disabled == [file1]
+
+    iprotator_instance.config_queue.enable(file1)
+    iprotator_instance.load_probe_report(str(report), disable_failed=False)
+    assert list(iprotator_instance.config_queue) == [file3, file2, file1]
+
+
+def test_adaptive_timeout(iprotator_instance):
+    file1, file2, _ = list(iprotator_instance.config_queue)
+    for i in range(10):
+        iprotator_instance.history.record(file1, 0.0, {"tunnel_up": 2.0 + i / 10}, "success")
+    assert iprotator_instance.timeout_for(file1) is None, "default of the connector"
+
+    iprotator_instance.tunnel_options.connect_timeout = 20
+    assert iprotator_instance.timeout_for(file1) == 20
+
+    iprotator_instance.tunnel_options.connect_timeout = AdaptiveTimeout(multiple=2, floor=5, ceiling=60, fallback=30)
+    assert iprotator_instance.timeout_for(file1) == pytest.approx(2 * 2.855)
+    assert iprotator_instance.timeout_for(file2) == 30, "not enough observations"
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_make_connector_applies_tuning(mock_connector, iprotator_instance, tmp_path):
+    tuning_file = tmp_path / "tuning.json"
+    options = {"sndbuf": ["524288"], "rcvbuf": ["524288"]}
+    tuning_file.write_text(json.dumps({str(tmp_path): {"options": options, "throughput": 1e6, "latency": 0.03}}))
+    iprotator_instance.tunnel_options.tuning = read_tuning(str(tuning_file))
+    config_file = list(iprotator_instance.config_queue)[0]
+    iprotator_instance._make_connector(config_file) #pylint: disable=protected-access
+    assert mock_connector.call_args[1]["options"] == options
+    iprotator_instance._make_connector("/elsewhere/server.ovpn") #pylint: disable=protected-access
+    assert mock_connector.call_args[1]["options"] is None
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_dns_cache_follows_the_tunnel(mock_connector, iprotator_instance):
+    connector = mock_connector.return_value
+    connector.config_file = list(iprotator_instance.config_queue)[0]
+    connector.current_ip = None
+    connector.nameservers.return_value = ["10.8.0.1"]
+    iprotator_instance.dns_cache = DNSCache(["1.1.1.1"])
+    iprotator_instance.connect()
+    connector.nameservers.assert_called_once_with("my_password")
+    assert iprotator_instance.dns_cache.nameservers == ["10.8.0.1"]
+    assert isinstance(iprotator_instance.session().get_adapter("https://"), ResolvingAdapter)
+
+    connector.nameservers.side_effect = OSError("Cannot read the log")
+    iprotator_instance.connect()
+    assert iprotator_instance.dns_cache.nameservers == ["1.1.1.1"]
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_rotate_in_place(mock_connector, iprotator_instance):
+    connector = mock_connector.return_value
+    connector.in_place = True
+    connector.current_ip = None
+    connector.traffic_summary = None
+    iprotator_instance.tunnel_options.switch_in_place = True
+    iprotator_instance.connect()
+    connector.config_file = iprotator_instance.config_queue[-1]
+    iprotator_instance.rotate()
+    connector.switch.assert_called_once()
+    connector.disconnect.assert_not_called()
+    assert mock_connector.call_args[1]["in_place"] is True
+    assert mock_connector.call_args[1]["log_max_bytes"] is None
+
+    connector.switch.side_effect = TimeoutError
+    with mock.patch.object(iprotator_instance, "connect") as mock_connect:
+        iprotator_instance.rotate()
+    connector.disconnect.assert_called_once()
+    mock_connect.assert_called_once()
+
+
+@pytest.mark.parametrize("failure", ["500", "timeout", "json"])
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_connect_despite_failing_registry(mock_connector, iprotator_instance, failure):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self): # pylint: disable=invalid-name
+            if failure == "timeout":
+                time.sleep(1)
+            body = b"not json"
+            self.send_response(500 if failure == "500" else 200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): # pylint: disable=arguments-differ
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        iprotator_instance.selection.lease_registry = HTTPLeaseRegistry(f"http://127.0.0.1:{server.server_address[1]}",
+                                                              timeout=0.2)
+        connector = mock_connector.return_value
+        connector.config_file = iprotator_instance.config_queue[0]
+        connector.current_ip = None
+        connector.traffic_summary = None
+        iprotator_instance.connect()
+        connector.connect.assert_called_once()
+        iprotator_instance.disconnect()
+        connector.disconnect.assert_called_once()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_connect_skips_leased_servers(mock_connector, iprotator_instance, tmp_path):
+    database = str(tmp_path / "leases.sqlite")
+    other_node = SQLiteLeaseRegistry(database, node="other")
+    config_files = list(iprotator_instance.config_queue)
+    assert other_node.acquire(config_files[0])
+    iprotator_instance.selection.lease_registry = SQLiteLeaseRegistry(database, node="this")
+    connector = mock_connector.return_value
+    connector.config_file = config_files[1]
+    connector.current_ip = None
+    connector.traffic_summary = None
+
+    iprotator_instance.connect()
+    assert mock_connector.call_args[0][0] == config_files[1]
+    assert iprotator_instance.selection.lease_registry.held == {server_key(config_files[1])[0]}
+    iprotator_instance.disconnect()
+    assert iprotator_instance.selection.lease_registry.held == set()
+
+    assert other_node.acquire(config_files[1])
+    assert other_node.acquire(config_files[2])
+    with mock.patch.object(iprotator_instance.clock, "sleep") as mock_sleep:
+        with pytest.raises(TimeoutError):
+            iprotator_instance.connect(max_trials=2)
+    mock_sleep.assert_called_once_with(10)
+    other_node.close()
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_warm_up_after_connect(mock_connector, iprotator_instance):
+    connector = mock_connector.return_value
+    connector.config_file = list(iprotator_instance.config_queue)[0]
+    connector.current_ip = None
+    iprotator_instance.warmer = mock.Mock()
+    session = iprotator_instance.session()
+    assert iprotator_instance.session() is session
+    with mock.patch.object(session.get_adapter("https://"), "close") as mock_close:
+        iprotator_instance.connect()
+    mock_close.assert_called_once()
+    iprotator_instance.warmer.start.assert_called_once_with(session)
+
+
+def test_rank_by_load(iprotator_instance):
+    config_files = list(iprotator_instance.config_queue)
+    feed = mock.Mock(generation=1)
+    feed.load_of.side_effect = {config_files[0]: 0.95, config_files[1]: None, config_files[2]: 0.4}.get
+    iprotator_instance.selection.load_feed = feed
+    iprotator_instance.connector = mock.Mock(config_file=config_files[2], current_ip=None)
+    with mock.patch.object(iprotator_instance, "_connect"):
+        iprotator_instance.connect()
+        iprotator_instance.connect() # the loads did not change
+    assert list(iprotator_instance.config_queue) == [config_files[2], config_files[1], config_files[0]]
+    assert iprotator_instance.server_load[config_files[0]] == 0.95
+    assert feed.load_of.call_count == 3
+
+
+@mock.patch("getpass.getpass")
+def test_variant_selector_on_udp_blocking_network(mock_getpass, tmp_path): #pylint: disable=unused-argument
+    blocked = {}
+    for i in range(6):
+        for proto, port in [("udp", "1194"), ("udp", "53"), ("tcp", "443")]:
+            path = tmp_path / f"server{i}.{proto}{port}.ovpn"
+            path.write_text(f"client\nremote server{i}.example.net {port} {proto}\n", encoding="utf-8")
+            if proto == "udp":
+                blocked[str(path)] = 1.0
+
+    def count_timeouts(variant_selector):
+        network = FakeNetwork(seed=1, timeout_rate=blocked)
+        with IPRotator("auth_file", str(tmp_path), track_ip=False, backend=network,
+                       selection=ServerSelection(variant_selector=variant_selector)) as rotator:
+            servers = []
+            rotator.connect(waiting_time=0)
+            for _ in range(10):
+                servers.append(rotator.connector.config_file.split(".")[0])
+                rotator.disconnect()
+                rotator.connect(waiting_time=0)
+            summaries = rotator.history.summarize().values()
+        return sum(summary["attempts"] - summary["successes"] for summary in summaries), servers
+
+    timeouts, _ = count_timeouts(None)
+    learned_timeouts, servers = count_timeouts(VariantSelector())
+    assert timeouts >= 20
+    assert learned_timeouts <= 2
+    assert all(previous != server for previous, server in zip(servers, servers[1:])), \
+        "rotating moves on to another server, not to another variant of the same server"
+
+
+@mock.patch("getpass.getpass")
+def test_connect_publishes_exit_ip_that_is_not_a_string(mock_getpass, tmp_path): #pylint: disable=unused-argument
+    class PlaceholderIPNetwork(FakeNetwork):
+        def exit_ip(self, config_file):
+            return 1234 # what `get_ip` returns on a non-200 answer
+
+    (tmp_path / "server.ovpn").touch()
+    with IPRotator("auth_file", str(tmp_path), backend=PlaceholderIPNetwork()) as rotator:
+        rotator.connect(waiting_time=0)
+        assert rotator.status.read()["exit_ip"] == "1234"
+        assert rotator.status.read()["state"] == "connected"
+
+
+@mock.patch("getpass.getpass")
+def test_failed_connect_releases_leases(mock_getpass, tmp_path): #pylint: disable=unused-argument
+    for name in ["a.ovpn", "b.ovpn"]:
+        (tmp_path / name).touch()
+    registry = SQLiteLeaseRegistry(str(tmp_path / "leases.sqlite"))
+    with IPRotator("auth_file", str(tmp_path), track_ip=False, backend=FakeNetwork(timeout_rate=1.0),
+                   selection=ServerSelection(lease_registry=registry)) as rotator:
+        with pytest.raises(TimeoutError):
+            rotator.connect(max_trials=2, waiting_time=0)
+        assert registry.held == set()
+        assert registry.leases() == []
+
+
+@mock.patch("sirup.IPRotator.VPNConnector")
+def test_failed_switch_releases_leases(mock_connector, iprotator_instance, tmp_path):
+    iprotator_instance.selection.lease_registry = SQLiteLeaseRegistry(str(tmp_path / "leases.sqlite"))
+    connector = mock_connector.return_value
+    connector.in_place = True
+    connector.current_ip = None
+    connector.traffic_summary = None
+    iprotator_instance.tunnel_options.switch_in_place = True
+    iprotator_instance.connect()
+    connector.config_file = mock_connector.call_args[0][0]
+
+    def switch_and_time_out(config_file, timeout=None): #pylint: disable=unused-argument
+        connector.config_file = config_file
+        raise TimeoutError
+    connector.switch.side_effect = switch_and_time_out
+    with mock.patch.object(iprotator_instance, "connect"):
+        iprotator_instance.rotate()
+    assert iprotator_instance.selection.lease_registry.held == set()
@@ -0,0 +1,73 @@
+"""Tests for the sirup.LeaseRegistry module.
+"""
+
+import pytest
+from sirup.LeaseRegistry import HTTPLeaseRegistry
+from sirup.LeaseRegistry import LeaseServer
+from sirup.LeaseRegistry import SQLiteLeaseRegistry
+from sirup.LeaseRegistry import server_key
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+## Fixtures
+@pytest.fixture
+def lease_server():
+    server = LeaseServer(port=0)
+    server.start()
+    yield server
+    server.close()
+
+
+## Tests
+def test_server_key():
+    assert server_key("/configs/provider/ch-12.ovpn") == ("provider/ch-12.ovpn", "provider")
+
+
+def test_sqlite_leases(tmp_path):
+    clock = Clock()
+    database = str(tmp_path / "leases.sqlite")
+    node_a = SQLiteLeaseRegistry(database, clock=clock, node="a", ttl=60, limits={"provider": 2})
+    node_b = SQLiteLeaseRegistry(database, clock=clock, node="b", ttl=60, limits={"provider": 2})
+
+    assert node_a.acquire("/configs/provider/1.ovpn")
+    assert node_a.acquire("/configs/provider/1.ovpn") # held already
+    assert not node_b.acquire("/elsewhere/provider/1.ovpn") # same server on another host
+    assert node_b.held_elsewhere() == {"provider/1.ovpn"}
+    assert node_b.acquire("/configs/provider/2.ovpn")
+    assert not node_b.acquire("/configs/provider/3.ovpn") # the account is at its limit
+    assert node_b.acquire("/configs/other/3.ovpn")
+    assert [lease["node"] for lease in node_a.leases()] == ["b", "a", "b"]
+
+    node_b.release("/configs/provider/2.ovpn")
+    assert node_a.acquire("/configs/provider/3.ovpn")
+
+    clock.now += 61 # the leases of a crashed node run out
+    node_b.renew()
+    assert node_b.held == set()
+    assert node_b.acquire("/configs/provider/1.ovpn")
+    node_a.close()
+    node_b.close()
+    assert node_a.leases() == []
+
+
+def test_http_leases(lease_server):
+    node_a = HTTPLeaseRegistry(lease_server.url, node="a", ttl=60)
+    node_b = HTTPLeaseRegistry(lease_server.url, node="b", ttl=60, limits={"provider": 1})
+    assert node_a.acquire("/configs/provider/1.ovpn")
+    assert not node_b.acquire("/configs/provider/1.ovpn")
+    assert not node_b.acquire("/configs/provider/2.ovpn")
+    assert node_b.held_elsewhere() == {"provider/1.ovpn"}
+    node_a.renew()
+    assert node_a.held == {"provider/1.ovpn"}
+    assert 0 < node_a.leases()[0]["expires"] <= 60
+    node_a.close()
+    assert node_b.acquire("/configs/provider/2.ovpn")
+    node_b.close()
+    assert lease_server.registry.leases() == []
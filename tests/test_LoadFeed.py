@@ -0,0 +1,89 @@
+"""Tests for the sirup.LoadFeed module.
+"""
+
+import json
+from unittest import mock
+import pytest
+from sirup.FakeBackend import VirtualClock
+from sirup.LoadFeed import FileLoadSource
+from sirup.LoadFeed import HTTPLoadSource
+from sirup.LoadFeed import LoadFeed
+from sirup.LoadFeed import parse_loads
+
+
+## Fixtures
+@pytest.fixture
+def feed_file(tmp_path):
+    path = tmp_path / "loads.json"
+    path.write_text(json.dumps({"servers": [
+        {"hostname": "NL-01.example.net", "load": 85},
+        {"hostname": "nl-02.example.net", "load": 20},
+        {"host": "de-01.example.net", "sessions": 30, "capacity": 100},
+        {"hostname": "broken.example.net"},
+    ]}), encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def config_files(tmp_path):
+    paths = {}
+    for name, remotes in [("nl-01", ["nl-01.example.net"]), ("de-01", ["gone.example.net", "de-01.example.net"]),
+                          ("fr-01", ["fr-01.example.net"])]:
+        path = tmp_path / f"{name}.ovpn"
+        path.write_text("client\n" + "".join(f"remote {remote} 1194\n" for remote in remotes), encoding="utf-8")
+        paths[name] = str(path)
+    return paths
+
+
+## Tests
+def test_parse_loads():
+    assert parse_loads({"A.example.net": 50, "b.example.net": "1", "c": None}) == \
+        {"a.example.net": 0.5, "b.example.net": 0.01}, "1 is 1 %, not 100 %"
+    assert parse_loads([{"name": "x", "utilization": 0.7}, {"ip": "10.0.0.1", "users": 1, "max_sessions": 0},
+                        {"name": "y", "load_percent": 40}, {"name": "z", "sessions": 3, "capacity": 4}],
+                       percent=False) == {"x": 0.7, "y": 0.4, "z": 0.75}
+
+
+def test_load_of(feed_file, config_files):
+    clock = VirtualClock()
+    feed = LoadFeed(FileLoadSource(str(feed_file)), interval=60, clock=clock)
+    assert feed.load_of(config_files["nl-01"]) == 0.85
+    assert feed.load_of(config_files["de-01"]) == 0.3 # the first remote is not in the feed
+    assert feed.load_of(config_files["fr-01"]) is None
+    assert feed.load_of("missing.ovpn") is None
+    assert feed.generation == 1
+
+    feed_file.write_text(json.dumps({"nl-01.example.net": 10}), encoding="utf-8")
+    assert feed.load_of(config_files["nl-01"]) == 0.85 # cached
+    clock.sleep(60)
+    assert feed.load_of(config_files["nl-01"]) == 0.1
+    assert feed.generation == 2
+
+    feed_file.write_text("not json", encoding="utf-8")
+    clock.sleep(60)
+    assert feed.load_of(config_files["nl-01"]) == 0.1 # the previous loads are kept
+    assert feed.generation == 2
+
+
+def test_fractions(tmp_path, config_files):
+    path = tmp_path / "fractions.json"
+    path.write_text(json.dumps({"nl-01.example.net": 1, "fr-01.example.net": 0.25}), encoding="utf-8")
+    feed = LoadFeed(FileLoadSource(str(path)), percent=False)
+    assert feed.load_of(config_files["nl-01"]) == 1.0
+    assert feed.load_of(config_files["fr-01"]) == 0.25
+
+
+def test_start_stop(feed_file):
+    feed = LoadFeed(FileLoadSource(str(feed_file)), interval=0.01)
+    feed.start()
+    assert feed.generation >= 1
+    feed.stop()
+    assert feed.loads()["nl-02.example.net"] == 0.2
+
+
+@mock.patch("sirup.LoadFeed.requests.get")
+def test_http_source(mock_get):
+    mock_get.return_value.json.return_value = {"a": 1}
+    source = HTTPLoadSource("https://example.org/loads", headers={"Authorization": "token"})
+    assert source.fetch() == {"a": 1}
+    mock_get.assert_called_once_with("https://example.org/loads", timeout=10.0, headers={"Authorization": "token"})
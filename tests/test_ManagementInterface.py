@@ -0,0 +1,118 @@
+import os
+import socket
+import threading
+import time
+import pytest
+from sirup.ManagementInterface import ManagementInterface
+from sirup.ManagementInterface import parse_state
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs unix domain sockets")
+
+
+class FakeManagementServer:
+    "Answer management commands on a unix socket like `OpenVPN` does."
+    def __init__(self, path, answers, delays=None):
+        self.answers = answers
+        self.delays = delays if delays is not None else {}
+        self.received = []
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(1)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        conn, _ = self._server.accept()
+        conn.sendall(b">INFO:OpenVPN Management Interface Version 3 -- type 'help' for more info\r\n")
+        with conn:
+            buffer = b""
+            while True:
+                data = conn.recv(1024)
+                if not data:
+                    return
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    cmd = line.decode()
+                    self.received.append(cmd)
+                    time.sleep(self.delays.get(cmd, 0))
+                    conn.sendall(self.answers.get(cmd, b"ERROR: unknown command\r\n"))
+
+    def close(self):
+        self._server.close()
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return os.path.join(tmp_path, "management.sock")
+
+
+def test_parse_state():
+    result = parse_state("1700000000,CONNECTED,SUCCESS,10.8.0.2,185.1.2.3,1194,,")
+    assert result == {"time": "1700000000", "state": "CONNECTED", "description": "SUCCESS",
+                      "local_ip": "10.8.0.2", "remote_ip": "185.1.2.3", "remote_port": "1194"}
+    result = parse_state("1700000000,WAIT")
+    assert result["state"] == "WAIT"
+    assert result["local_ip"] == "", "missing fields not filled"
+
+
+def test_open_fails(socket_path):
+    management = ManagementInterface(socket_path)
+    with pytest.raises(ConnectionError, match="Cannot connect"):
+        management.open(wait=0.05, waiting_time=0.01)
+    with pytest.raises(ConnectionError, match="not open"):
+        management.command("state")
+
+
+def test_commands_and_notifications(socket_path):
+    answers = {
+        "state": b"1700000000,CONNECTED,SUCCESS,10.8.0.2,185.1.2.3,1194,,\r\nEND\r\n",
+        "bytecount 1": b"SUCCESS: bytecount interval changed\r\n>BYTECOUNT:2048,1024\r\n",
+        "signal SIGUSR1": b"SUCCESS: signal SIGUSR1 thrown\r\n",
+    }
+    server = FakeManagementServer(socket_path, answers)
+    management = ManagementInterface(socket_path, timeout=2)
+    received = []
+    management.add_handler("BYTECOUNT", received.append)
+    management.open(wait=1)
+    assert management.is_open()
+
+    assert management.state()["state"] == "CONNECTED"
+    management.bytecount(1)
+    management.signal("SIGUSR1")
+    with pytest.raises(RuntimeError, match="ERROR"):
+        management.command("nonsense")
+    assert management.command("state")[0].startswith("1700000000"), "END included in the answer"
+
+    assert "INFO" in management.notifications
+    assert received == ["2048,1024"]
+    assert management.bytes_in == 2048
+    assert management.bytes_out == 1024
+    assert management.bytecount_time is not None
+    assert server.received == ["state", "bytecount 1", "signal SIGUSR1", "nonsense", "state"]
+
+    management.close()
+    assert not management.is_open()
+    server.close()
+
+
+def test_late_answer_is_not_taken_for_the_next(socket_path):
+    answers = {
+        "state": b"1700000000,CONNECTED,SUCCESS,10.8.0.2,185.1.2.3,1194,,\r\nEND\r\n",
+        "bytecount 1": b"SUCCESS: bytecount interval changed\r\n",
+        "status 3": b"END\r\n",
+    }
+    server = FakeManagementServer(socket_path, answers, delays={"state": 0.3})
+    management = ManagementInterface(socket_path, timeout=0.1)
+    management.open(wait=1)
+    with pytest.raises(ConnectionError, match="No answer"):
+        management.state()
+    management.timeout = 2
+    assert management.command("bytecount 1") == ["SUCCESS: bytecount interval changed"]
+
+    server.answers["state"] = b"END\r\n"
+    with pytest.raises(ConnectionError, match="Empty answer"):
+        management.state()
+    management.close()
+    server.close()
@@ -0,0 +1,105 @@
+"""Tests for the sirup.MultiProviderRotator module.
+"""
+
+import os
+from unittest import mock
+import pytest
+from sirup.FakeBackend import FakeNetwork
+from sirup.LeaseRegistry import SQLiteLeaseRegistry
+from sirup.MultiProviderRotator import MultiProviderRotator
+from sirup.MultiProviderRotator import Provider
+
+
+## Fixtures
+@pytest.fixture
+def provider_dirs(tmp_path):
+    for name in ["alpha", "beta"]:
+        (tmp_path / name).mkdir()
+        for i in range(3):
+            (tmp_path / name / f"{name}-{i}.ovpn").touch()
+    return tmp_path
+
+
+## Tests
+def test_provider_outage(provider_dirs):
+    outage = {str(provider_dirs / "alpha" / f"alpha-{i}.ovpn"): 1.0 for i in range(3)}
+    network = FakeNetwork(seed=0, timeout_rate=outage)
+    providers = [Provider("alpha", "auth-alpha", str(provider_dirs / "alpha"), weight=3.0),
+                 Provider("beta", "auth-beta", str(provider_dirs / "beta"))]
+    with MultiProviderRotator(providers, seed=1, max_trials=2, backoff=60, backend=network, track_ip=False) as rotator:
+        rotator.connect()
+        assert rotator.active == "beta"
+        assert rotator.connector.config_file.startswith(str(provider_dirs / "beta"))
+        for _ in range(20):
+            rotator.rotate()
+            assert rotator.active == "beta" # alpha keeps failing and is left out in between
+        status = rotator.status()
+        assert status["beta"]["score"] > status["alpha"]["score"]
+        assert "alpha" in rotator.backoff_until
+
+        network.clock.sleep(rotator.max_backoff)
+        assert rotator.available() == ["alpha", "beta"]
+    assert rotator.active is None
+    assert network.n_active == 0
+
+
+def test_all_providers_back_off(provider_dirs):
+    network = FakeNetwork(seed=0, timeout_rate=1.0)
+    providers = [Provider(name, "auth", str(provider_dirs / name)) for name in ["alpha", "beta"]]
+    rotator = MultiProviderRotator(providers, seed=1, max_trials=1, backoff=10, max_backoff=40, backend=network,
+                                   track_ip=False)
+    with pytest.raises(TimeoutError, match="4 providers"):
+        rotator.connect(max_rounds=4)
+    assert sorted(rotator.backoff_until) == ["alpha", "beta"]
+    assert sum(rotator._failures.values()) == 4 # pylint: disable=protected-access
+    rotator.close()
+
+
+def test_unique_names(provider_dirs):
+    provider = Provider("alpha", "auth", str(provider_dirs / "alpha"))
+    with pytest.raises(ValueError):
+        MultiProviderRotator([provider, provider], backend=FakeNetwork())
+
+
+def test_lease_limits_by_account(provider_dirs, tmp_path):
+    registry = SQLiteLeaseRegistry(node="node-1")
+    providers = [Provider("Alpha VPN", "auth", str(provider_dirs / "alpha") + "/", max_sessions=1),
+                 Provider("beta", "auth", str(provider_dirs / "beta"))]
+    rotator = MultiProviderRotator(providers, backend=FakeNetwork(), track_ip=False, lease_registry=registry)
+    assert registry.limits == {"alpha": 1}
+    assert registry.acquire(str(provider_dirs / "alpha" / "alpha-0.ovpn"))
+    assert not registry.acquire(str(provider_dirs / "alpha" / "alpha-1.ovpn"))
+    rotator.close()
+
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "alpha").mkdir()
+    providers.append(Provider("gamma", "auth", str(tmp_path / "other" / "alpha")))
+    with pytest.raises(ValueError):
+        MultiProviderRotator(providers, backend=FakeNetwork(), lease_registry=SQLiteLeaseRegistry())
+
+
+def test_shared_session_directory(provider_dirs, tmp_path):
+    providers = [Provider(name, "auth", str(provider_dirs / name)) for name in ["alpha", "beta"]]
+    rotator = MultiProviderRotator(providers, seed=1, backend=FakeNetwork(seed=0), track_ip=False)
+    rotator.session_dir._parent = str(tmp_path) #pylint: disable=protected-access
+    assert all(child.session_dir is rotator.session_dir for child in rotator.rotators.values())
+    path = rotator.session_dir.tunnel_dir("tunnel0")
+    rotator.rotators["alpha"].close()
+    assert os.path.isdir(path) # the other rotators still use it
+    with mock.patch.object(rotator.session_dir, "cleanup") as cleanup:
+        rotator.close()
+    cleanup.assert_called_once_with()
+
+
+def test_scores_are_cached(provider_dirs):
+    providers = [Provider(name, "auth", str(provider_dirs / name)) for name in ["alpha", "beta"]]
+    with MultiProviderRotator(providers, seed=1, backend=FakeNetwork(seed=0), track_ip=False) as rotator:
+        with mock.patch.object(rotator.rotators["alpha"].history, "summarize",
+                               wraps=rotator.rotators["alpha"].history.summarize) as summarize:
+            for _ in range(3):
+                rotator.choose()
+            assert summarize.call_count == 1
+            rotator.rotators["alpha"].connect()
+            rotator.choose()
+            assert summarize.call_count == 2
+            rotator.rotators["alpha"].disconnect()
@@ -0,0 +1,220 @@
+"""Tests for the sirup.ProxyServer module.
+"""
+
+import asyncio
+import os
+import socket
+import struct
+from unittest import mock
+import pytest
+from sirup.ProxyServer import DirectExit
+from sirup.ProxyServer import NamespaceExit
+from sirup.ProxyServer import ProxyServer
+from sirup.ProxyServer import namespace_nameservers
+
+
+class NamedExit(DirectExit):
+    "A direct exit that records the hosts it connected to."
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.hosts = []
+
+
+    async def open_connection(self, host, port):
+        self.hosts.append(host)
+        return await super().open_connection("127.0.0.1", port)
+
+
+async def start_echo_server():
+    async def echo(reader, writer):
+        data = await reader.read(65536)
+        while data:
+            writer.write(data)
+            data = await reader.read(65536)
+        writer.close()
+    server = await asyncio.start_server(echo, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def socks_connect(proxy_port, host, port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", proxy_port)
+    writer.write(b"\x05\x01\x00")
+    assert await reader.readexactly(2) == b"\x05\x00"
+    writer.write(b"\x05\x01\x00\x03" + bytes([len(host)]) + host.encode() + struct.pack("!H", port))
+    reply = await reader.readexactly(10)
+    return reply[1], reader, writer
+
+
+def test_socks_and_http():
+    async def scenario():
+        echo_server, echo_port = await start_echo_server()
+        proxy = ProxyServer([DirectExit()], port=0)
+        await proxy.start()
+
+        code, reader, writer = await socks_connect(proxy.port, "127.0.0.1", echo_port)
+        assert code == 0
+        writer.write(b"hello")
+        assert await reader.readexactly(5) == b"hello"
+        writer.close()
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+        writer.write(f"CONNECT 127.0.0.1:{echo_port} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        assert await reader.readuntil(b"\r\n\r\n") == b"HTTP/1.1 200 Connection established\r\n\r\n"
+        writer.write(b"ping")
+        assert await reader.readexactly(4) == b"ping"
+        writer.close()
+
+        # the echo server returns the request as the server receives it
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+        writer.write(f"GET http://127.0.0.1:{echo_port}/path?q=1 HTTP/1.1\r\nProxy-Connection: keep-alive\r\n"
+                     "Accept: */*\r\n\r\n".encode())
+        forwarded = await reader.readuntil(b"\r\n\r\n")
+        assert forwarded == b"GET /path?q=1 HTTP/1.1\r\nAccept: */*\r\nConnection: close\r\n\r\n"
+        writer.close()
+
+        code, _, writer = await socks_connect(proxy.port, "127.0.0.1", 1) # nothing listens on port 1
+        assert code == 5
+        writer.close()
+
+        await proxy.close()
+        echo_server.close()
+        assert proxy.stats()["direct"]["total"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_policies():
+    exits = [NamedExit("a"), NamedExit("b"), NamedExit("c")]
+    proxy = ProxyServer(exits, policy="round-robin")
+    assert [proxy.choose_exit("example.org").name for _ in range(4)] == ["a", "b", "c", "a"]
+
+    proxy = ProxyServer(exits, policy="least-loaded")
+    proxy.active[exits[0]] = 2
+    proxy.active[exits[2]] = 1
+    assert proxy.choose_exit("example.org").name == "b"
+
+    proxy = ProxyServer(exits, policy="sticky")
+    chosen = {host: proxy.choose_exit(host) for host in [f"host{i}.example.org" for i in range(30)]}
+    assert all(proxy.choose_exit(host) is exit_ for host, exit_ in chosen.items())
+    assert len(set(chosen.values())) == 3
+    proxy.exits.remove(exits[0])
+    assert all(proxy.choose_exit(host) is exit_ for host, exit_ in chosen.items() if exit_ is not exits[0]), \
+        "only the hosts of a removed exit move"
+
+    with pytest.raises(ValueError):
+        ProxyServer(exits, policy="random")
+    with pytest.raises(ConnectionError):
+        ProxyServer([]).choose_exit("example.org")
+
+
+def test_replace_exit_keeps_connections():
+    async def scenario():
+        echo_server, echo_port = await start_echo_server()
+        old, new = NamedExit("old"), NamedExit("new")
+        proxy = ProxyServer([old], port=0)
+        await proxy.start()
+
+        _, reader, writer = await socks_connect(proxy.port, "first.example.org", echo_port)
+        replaced = asyncio.ensure_future(proxy.replace_exit(old, new))
+        await asyncio.sleep(0.05)
+        assert not replaced.done(), "the old exit is drained, not closed"
+        assert proxy.stats()["old"] == {"active": 1, "total": 1, "draining": True}
+
+        _, _, writer2 = await socks_connect(proxy.port, "second.example.org", echo_port)
+        assert new.hosts == ["second.example.org"]
+        writer.write(b"still open")
+        assert await reader.readexactly(10) == b"still open"
+        writer.close()
+        await asyncio.wait_for(replaced, 1)
+        assert list(proxy.stats()) == ["new"]
+
+        writer2.close()
+        await proxy.close()
+        echo_server.close()
+
+    asyncio.run(scenario())
+
+
+def test_drain_timeout():
+    async def scenario():
+        echo_server, echo_port = await start_echo_server()
+        old, new = NamedExit("old"), NamedExit("new")
+        proxy = ProxyServer([old], port=0)
+        await proxy.start()
+
+        _, reader, writer = await socks_connect(proxy.port, "first.example.org", echo_port)
+        assert not await proxy.replace_exit(old, new, timeout=0.05), "the connection is still open"
+        assert proxy.stats()["old"] == {"active": 1, "total": 1, "draining": True}
+        writer.write(b"still open")
+        assert await reader.readexactly(10) == b"still open"
+        writer.close()
+        await asyncio.sleep(0.05)
+        assert list(proxy.stats()) == ["new"], "the exit is forgotten after its last connection"
+
+        await proxy.close()
+        echo_server.close()
+
+    asyncio.run(scenario())
+
+
+def test_invalid_http_requests():
+    async def request(proxy, data, close=False):
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+        writer.write(data)
+        if close:
+            writer.write_eof()
+        status_line = await reader.readline()
+        writer.close()
+        return status_line
+
+    async def scenario():
+        proxy = ProxyServer([DirectExit()], port=0)
+        await proxy.start()
+        too_large = b"GET http://example.org/ HTTP/1.1\r\nCookie: " + b"x" * 100000 + b"\r\n\r\n"
+        assert await request(proxy, too_large) == b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+        assert await request(proxy, b"GET http://example.org/ HTTP/1.1\r\n", close=True) == \
+            b"HTTP/1.1 400 Bad Request\r\n"
+        assert await request(proxy, b"GET /index.html HTTP/1.1\r\n\r\n") == b"HTTP/1.1 400 Bad Request\r\n"
+        assert await request(proxy, b"CONNECT example.org:https HTTP/1.1\r\n\r\n") == b"HTTP/1.1 400 Bad Request\r\n"
+        await proxy.close()
+
+    asyncio.run(scenario())
+
+
+def test_start_in_thread():
+    proxy = ProxyServer([DirectExit()], port=0)
+    proxy.start_in_thread()
+    assert proxy.port != 0
+    new = NamedExit("new")
+    proxy.call(proxy.replace_exit(proxy.exits[0], new), timeout=1)
+    assert proxy.exits == [new]
+    proxy.stop_thread()
+
+
+def test_namespace_exit_without_namespace():
+    exit_ = NamespaceExit("sirup-does-not-exist")
+    with pytest.raises(ConnectionError):
+        asyncio.run(exit_.open_connection("127.0.0.1", 80))
+    exit_.close()
+
+
+def test_namespace_exit_resolves_with_the_nameservers_of_the_namespace():
+    exit_ = NamespaceExit("sirup-does-not-exist", nameservers=["10.8.0.1"])
+    assert exit_.dns_cache.nameservers == ["10.8.0.1"]
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        with mock.patch.object(exit_.dns_cache, "resolve", return_value="127.0.0.1") as mock_resolve:
+            sock = exit_._connect("target.example.org", server.getsockname()[1]) #pylint: disable=protected-access
+        sock.close()
+    mock_resolve.assert_called_once_with("target.example.org")
+    exit_.close()
+
+
+def test_namespace_nameservers():
+    resolv_conf = "# written by sirup\nnameserver 10.8.0.1\nnameserver\nsearch example.org\nnameserver fd00::1\n"
+    with mock.patch("builtins.open", mock.mock_open(read_data=resolv_conf)) as mock_file:
+        assert namespace_nameservers("ns0") == ["10.8.0.1", "fd00::1"]
+    assert mock_file.call_args[0][0] == os.path.join("/etc/netns", "ns0", "resolv.conf")
+    assert namespace_nameservers("sirup-does-not-exist") == []
@@ -0,0 +1,109 @@
+import json
+import os
+import socket
+import threading
+from unittest import mock
+import pytest
+from sirup import RemoteProber as remote_prober
+
+
+@pytest.fixture
+def tcp_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def udp_server():
+    "Answer handshake packets like an OpenVPN server without tls-auth."
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+
+    def serve():
+        try:
+            while True:
+                data, address = server.recvfrom(2048)
+                if data[0] == 0x38:
+                    server.sendto(b"\x40" + os.urandom(13), address)
+        except OSError:
+            pass # the socket was closed at the end of the test
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_tcp_rtt(tcp_server, closed_port):
+    rtt = remote_prober.tcp_rtt("127.0.0.1", tcp_server, timeout=1)
+    assert rtt is not None and rtt >= 0
+    assert remote_prober.tcp_rtt("127.0.0.1", closed_port, timeout=1) is None
+
+
+def test_udp_rtt(udp_server, closed_port):
+    rtt = remote_prober.udp_rtt("127.0.0.1", udp_server, timeout=1)
+    assert rtt is not None and rtt >= 0
+    assert remote_prober.udp_rtt("127.0.0.1", closed_port, timeout=0.1) is None
+
+
+def test_probe_configs(tmp_path, tcp_server, udp_server, closed_port):
+    configs = {
+        "tcp.ovpn": f"remote 127.0.0.1 {tcp_server} tcp\n",
+        "udp.ovpn": f"remote 127.0.0.1 {udp_server} udp\n",
+        "dead.ovpn": f"remote 127.0.0.1 {closed_port} tcp\n",
+        "fallback.ovpn": f"remote 127.0.0.1 {closed_port} tcp\nremote 127.0.0.1 {tcp_server} tcp\n",
+    }
+    for name, content in configs.items():
+        (tmp_path / name).write_text(content, encoding="utf-8")
+    config_files = [str(tmp_path / name) for name in configs]
+    cache_file = str(tmp_path / "rtt.json")
+
+    prober = remote_prober.RemoteProber(timeout=0.5, cache_file=cache_file)
+    result = prober.probe_configs(config_files)
+    assert prober.probe_configs([str(tmp_path / "missing.ovpn")]) == {str(tmp_path / "missing.ovpn"): None}
+    assert result[str(tmp_path / "tcp.ovpn")] is not None
+    assert result[str(tmp_path / "udp.ovpn")] is not None
+    assert result[str(tmp_path / "dead.ovpn")] is None
+    assert result[str(tmp_path / "fallback.ovpn")] is not None, "does not use the best remote"
+    assert len(prober.cache) == 3, "remotes shared by configs probed twice"
+    with open(cache_file, encoding="utf-8") as file:
+        assert json.load(file) == prober.cache
+    assert not os.path.exists(cache_file + ".tmp"), "the cache is replaced in one step"
+
+    # Cached results are reused, also by a new prober that reads the cache file
+    new_prober = remote_prober.RemoteProber(cache_file=cache_file)
+    with mock.patch("sirup.RemoteProber.tcp_rtt") as mock_tcp_rtt:
+        assert new_prober.probe_configs(config_files) == result
+        mock_tcp_rtt.assert_not_called()
+
+
+@mock.patch("sirup.RemoteProber.time.time")
+def test_cache_ttl(mock_time):
+    prober = remote_prober.RemoteProber(ttl=10)
+    remote = ("127.0.0.1", "1194", "tcp")
+    mock_time.return_value = 100
+    with mock.patch("sirup.RemoteProber.tcp_rtt", return_value=0.05) as mock_tcp_rtt:
+        assert prober.probe(remote) == 0.05
+        assert prober.probe(remote) == 0.05
+        mock_tcp_rtt.assert_called_once_with("127.0.0.1", "1194", 2)
+        mock_time.return_value = 111
+        assert prober.cached_rtt(remote) == (False, None)
+        prober.probe(remote)
+        assert mock_tcp_rtt.call_count == 2, "expired result reused"
+
+
+@mock.patch("sirup.RemoteProber.socket.getaddrinfo")
+def test_probe_unresolvable(mock_getaddrinfo):
+    mock_getaddrinfo.side_effect = socket.gaierror
+    prober = remote_prober.RemoteProber()
+    assert prober.probe(("does.not.exist", "1194", "udp")) is None
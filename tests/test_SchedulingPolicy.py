@@ -0,0 +1,43 @@
+"""Tests for the sirup.SchedulingPolicy module.
+"""
+
+from unittest import mock
+import pytest
+from sirup.SchedulingPolicy import SchedulingPolicy
+from sirup.SchedulingPolicy import available_cpus
+
+
+def test_prefix():
+    policy = SchedulingPolicy(cpus=[5, 2, 3], nice=-5, ionice_class="best-effort", ionice_level=0)
+    assert [policy.cpus_for(slot) for slot in range(4)] == [[2], [3], [5], [2]]
+    assert policy.prefix(1) == ["taskset", "-c", "3", "nice", "-n", "-5", "ionice", "-c", "2", "-n", "0"]
+    assert SchedulingPolicy(cpus=[0, 1], per_tunnel=False).prefix(7) == ["taskset", "-c", "0,1"]
+    assert SchedulingPolicy().cpus, "defaults to the CPUs of this process"
+    with pytest.raises(ValueError):
+        SchedulingPolicy(ionice_class="fast")
+
+
+def test_available_cpus_without_affinity():
+    with mock.patch("sirup.SchedulingPolicy.os", spec=["cpu_count"]) as mock_os:
+        mock_os.cpu_count.return_value = 4
+        assert SchedulingPolicy().cpus == [0, 1, 2, 3], "macOS and Windows have no affinity mask"
+        mock_os.cpu_count.return_value = None
+        assert available_cpus() == [0]
+
+
+@mock.patch("sirup.SchedulingPolicy.subprocess.run")
+def test_apply(mock_run):
+    policy = SchedulingPolicy(cpus=[0, 1], nice=10, cgroup="sirup", cpu_weight=50)
+    policy.apply(1234, slot=1, pwd="my_password")
+    commands = [call[0][0] for call in mock_run.call_args_list]
+    assert commands[0] == ["sudo", "-S", "taskset", "-p", "-c", "1", "1234"]
+    assert commands[1] == ["sudo", "-S", "renice", "-n", "10", "-p", "1234"]
+    assert commands[2][-3:] == ["/sys/fs/cgroup/sirup/tunnel1", "1234", "50"]
+    assert "cpu.weight" in commands[2][4]
+    mock_run.assert_called_with(commands[2], input=b"my_password", check=True, capture_output=True)
+
+    mock_run.reset_mock()
+    SchedulingPolicy(cpus=[0]).apply(1234)
+    mock_run.assert_called_once_with(["taskset", "-p", "-c", "0", "1234"], check=True, capture_output=True)
+    SchedulingPolicy(cpus=[0]).place(1234) # no cgroup
+    mock_run.assert_called_once()
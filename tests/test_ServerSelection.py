@@ -0,0 +1,66 @@
+"""Tests for the sirup.ServerSelection module.
+"""
+
+from unittest import mock
+import pytest
+import requests
+from sirup.ConnectionHistory import ConnectionHistory
+from sirup.ServerSelection import ServerSelection
+from sirup.VariantSelector import VariantSelector
+
+
+## Fixtures
+@pytest.fixture
+def config_files(tmp_path):
+    paths = {}
+    for server in ["nl-01", "de-01"]:
+        for proto, port in [("udp", "1194"), ("tcp", "443")]:
+            path = tmp_path / f"{server}.{proto}{port}.ovpn"
+            path.write_text(f"client\nproto {proto}\nremote {server}.example.net {port}\n", encoding="utf-8")
+            paths[f"{server}.{proto}{port}"] = str(path)
+    return paths
+
+
+## Tests
+def test_without_parts(config_files):
+    selection = ServerSelection()
+    config_file = config_files["nl-01.udp1194"]
+    selection.learn_from(config_files.values(), None)
+    assert selection.choose(config_file, available=config_files.values(), exclude=set()) == config_file
+    assert selection.acquire(config_file)
+    selection.connected(config_file)
+    assert not selection.is_previous_server(config_file)
+    selection.release(config_file)
+    selection.close()
+
+
+def test_previous_server(config_files):
+    selection = ServerSelection(variant_selector=VariantSelector())
+    selection.learn_from(config_files.values(), ConnectionHistory())
+    selection.connected(config_files["nl-01.udp1194"])
+    assert selection.is_previous_server(config_files["nl-01.tcp443"])
+    assert not selection.is_previous_server(config_files["de-01.tcp443"])
+
+    selection.remove(config_files["nl-01.tcp443"])
+    assert not selection.is_previous_server(config_files["nl-01.tcp443"])
+
+
+@pytest.mark.parametrize("error", [requests.ConnectionError("down"), ValueError("no JSON"), KeyError("held")])
+def test_failing_registry(error):
+    registry = mock.Mock()
+    registry.acquire.side_effect = error
+    registry.release.side_effect = error
+    selection = ServerSelection(lease_registry=registry)
+    assert selection.acquire("server.ovpn"), "the rotation goes on without the registry"
+    selection.release("server.ovpn")
+
+
+def test_modified_and_close():
+    load_feed = mock.Mock()
+    registry = mock.Mock()
+    selection = ServerSelection(lease_registry=registry, load_feed=load_feed)
+    selection.modified("server.ovpn")
+    load_feed.forget.assert_called_once_with("server.ovpn")
+    selection.close()
+    load_feed.stop.assert_called_once()
+    registry.close.assert_called_once()
@@ -0,0 +1,94 @@
+"""Tests for the sirup.SessionWarmer module.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from unittest import mock
+import pytest
+import requests
+from sirup.SessionWarmer import SessionWarmer
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class CountingServer(ThreadingHTTPServer):
+    "An HTTP server that counts the connections it accepted."
+    daemon_threads = True
+    n_connections = 0
+
+    def get_request(self):
+        self.n_connections += 1
+        return super().get_request()
+
+
+## Fixtures
+@pytest.fixture
+def http_server():
+    server = CountingServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+## Tests
+def test_warm(http_server):
+    url = f"http://127.0.0.1:{http_server.server_address[1]}"
+    warmer = SessionWarmer([url, "http://127.0.0.1:1"], connections=2, timeout=2)
+    session = requests.Session()
+    results = warmer.warm(session)
+    assert results[url] >= 0
+    assert results["http://127.0.0.1:1"] is None # nothing listens there
+
+    for _ in range(3):
+        assert session.get(url + "/path", timeout=2).text == "ok"
+    assert http_server.n_connections == 2 # the requests used the warm connections
+
+
+def test_start_wait(http_server):
+    url = f"http://127.0.0.1:{http_server.server_address[1]}"
+    warmer = SessionWarmer([url])
+    warmer.start(requests.Session())
+    assert warmer.wait(5)
+    assert warmer.results[url] is not None
+
+
+def test_start_abandons_running_warm_up(http_server):
+    url = f"http://127.0.0.1:{http_server.server_address[1]}"
+    warmer = SessionWarmer([url, url + "/other"])
+    release = threading.Event()
+    blocked = threading.Event()
+    original = warmer._open_connections # pylint: disable=protected-access
+
+    def slow_open(session, target, cancelled=None):
+        blocked.set()
+        release.wait(5)
+        original(session, target, cancelled)
+
+    with mock.patch.object(warmer, "_open_connections", side_effect=slow_open):
+        stale_session = requests.Session()
+        warmer.start(stale_session)
+        assert blocked.wait(5)
+        stale_thread = warmer._thread # pylint: disable=protected-access
+        warmer.start(requests.Session()) # does not wait for the stale warm-up
+        assert stale_thread.is_alive()
+        release.set()
+        assert warmer.wait(5)
+        stale_thread.join(5)
+    assert not stale_thread.is_alive()
+    assert warmer.results == {url: mock.ANY, url + "/other": mock.ANY}
+    pool = stale_session.get_adapter(url).poolmanager.connection_from_url(url)
+    assert all(conn is None or conn.sock is None for conn in list(pool.pool.queue)), "stale connections are closed"
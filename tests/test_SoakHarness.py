@@ -0,0 +1,104 @@
+"""Tests for the sirup.SoakHarness module.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+import pytest
+from sirup.FakeBackend import FakeNetwork
+from sirup.IPRotator import IPRotator
+from sirup.SoakHarness import SoakHarness
+from sirup.SoakHarness import resource_usage
+from sirup.TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="resource_usage reads /proc")
+
+
+class LeakyRotator():
+    "Leaves a temporary file open after each disconnect."
+
+    def __init__(self):
+        self.fds = []
+
+
+    def connect(self):
+        pass
+
+
+    def rotate(self):
+        pass
+
+
+    def disconnect(self):
+        self.fds.append(tempfile.mkstemp()[0])
+
+
+class FileLeakingRotator(LeakyRotator):
+    "Leaves a file in the directory of its tunnel after each disconnect, as a daemon that is never cleaned up would."
+
+    def __init__(self, session_dir):
+        super().__init__()
+        self.session_dir = session_dir
+        self.n_disconnects = 0
+
+
+    def disconnect(self):
+        self.n_disconnects += 1
+        path = os.path.join(self.session_dir.tunnel_dir("tunnel0"), f"openvpn{self.n_disconnects}.log")
+        with open(path, "w", encoding="utf-8"):
+            pass
+
+
+def test_resource_usage(tmp_path):
+    before = resource_usage([str(tmp_path)])
+    (tmp_path / "tunnel0").mkdir()
+    with open(tmp_path / "tunnel0" / "file", "w", encoding="utf-8"):
+        with subprocess.Popen(["sleep", "5"]) as process:
+            during = resource_usage([str(tmp_path)])
+            process.kill()
+    assert during["fds"] > before["fds"]
+    assert during["children"] == before["children"] + 1
+    assert during["temp_files"] == before["temp_files"] + 2, "files in sub-directories are counted"
+    assert before["rss"] > 0
+
+
+@mock.patch("getpass.getpass")
+def test_fake_rotator_does_not_leak(mock_getpass, tmp_path): #pylint: disable=unused-argument
+    for i in range(5):
+        (tmp_path / f"server{i}.ovpn").touch()
+    network = FakeNetwork(seed=1, timeout_rate=0.05)
+    with IPRotator("auth_file", str(tmp_path), track_ip=False, backend=network) as rotator:
+        harness = SoakHarness(rotator, cycles=3000, sample_every=500)
+        assert not harness.run(), "no resource grew"
+    assert [sample["cycle"] for sample in harness.samples] == list(range(0, 3001, 500))
+    assert network.n_active == 0
+
+
+def test_detects_leak():
+    rotator = LeakyRotator()
+    harness = SoakHarness(rotator, cycles=100, sample_every=10)
+    temp_dir = tempfile.gettempdir()
+    leaks = harness.run()
+    assert tempfile.gettempdir() == temp_dir, "the temporary directory is restored"
+    for fd in rotator.fds:
+        os.close(fd)
+    assert [leak.split()[0] for leak in leaks] == ["fds", "temp_files"]
+    assert leaks[0].endswith("between cycles 20 and 100")
+
+    with pytest.raises(ValueError):
+        SoakHarness(rotator, cycles=100, sample_every=100).check()
+
+
+def test_detects_files_left_in_the_session_directory(tmp_path):
+    session_dir = TemporaryDirectoryWithRootPermission("my_password", parent=str(tmp_path))
+    session_dir.create()
+    (tmp_path / "sirup-crashed").mkdir() # the session directory of a process that did not clean up
+    (tmp_path / "sirup-crashed" / "openvpn.log").touch()
+    rotator = FileLeakingRotator(session_dir)
+    harness = SoakHarness(rotator, cycles=20, sample_every=5)
+    leaks = harness.run()
+    assert [leak.split()[0] for leak in leaks] == ["temp_files"]
+    assert harness.samples[0]["temp_files"] == 1, "sibling session directories are counted"
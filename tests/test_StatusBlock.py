@@ -0,0 +1,72 @@
+"""Tests for the sirup.StatusBlock module.
+"""
+
+import os
+import struct
+import pytest
+from sirup.StatusBlock import StatusBlock
+
+
+def test_update_and_read():
+    block = StatusBlock()
+    assert block.read() == {"generation": 0, "state": "disconnected", "config_index": -1, "exit_ip": None,
+                            "updated_at": 0.0, "connected_at": 0.0}
+    block.update(state="connecting", now=10.0)
+    block.update(state="connected", config_index=4, exit_ip="198.51.100.7", new_generation=True, now=12.0)
+    assert block.read() == {"generation": 1, "state": "connected", "config_index": 4, "exit_ip": "198.51.100.7",
+                            "updated_at": 12.0, "connected_at": 12.0}
+    block.update(state="disconnecting", now=20.0)
+    assert block.read()["exit_ip"] == "198.51.100.7", "fields that are not given keep their value"
+    block.close()
+
+
+def test_exit_ip_that_is_not_a_string():
+    block = StatusBlock()
+    block.update(state="connected", exit_ip=1234, now=1.0) # what `get_ip` returns on a non-200 answer
+    assert block.read()["exit_ip"] == "1234"
+    block.close()
+
+
+def test_read_gives_up_on_unfinished_update():
+    block = StatusBlock()
+    struct.pack_into("<Q", block._map, 8, 7) #pylint: disable=protected-access # writer died with an odd sequence
+    with pytest.raises(RuntimeError):
+        block.read(max_retries=10)
+    block.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_shared_with_forked_process():
+    block = StatusBlock()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0: # child: wait for the parent to publish, then report what it sees
+        os.close(write_end)
+        os.read(read_end, 1)
+        status = block.read()
+        os._exit(0 if status["generation"] == 3 and status["exit_ip"] == "203.0.113.9" else 1) #pylint: disable=protected-access
+    os.close(read_end)
+    for _ in range(3):
+        block.update(state="connected", exit_ip="203.0.113.9", new_generation=True)
+    os.write(write_end, b"x")
+    os.close(write_end)
+    _, exit_status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(exit_status) == 0
+
+
+def test_file_backed(tmp_path):
+    path = str(tmp_path / "status")
+    writer = StatusBlock(path)
+    reader = StatusBlock.open(path)
+    writer.update(state="connected", config_index=2, new_generation=True, now=5.0)
+    assert reader.read()["config_index"] == 2
+    with pytest.raises(PermissionError):
+        reader.update(state="connecting")
+    reader.close()
+    writer.close()
+    writer.unlink()
+    assert not os.path.exists(path)
+
+    (tmp_path / "other").write_bytes(b"\0" * 4096)
+    with pytest.raises(ValueError):
+        StatusBlock.open(str(tmp_path / "other"))
@@ -0,0 +1,43 @@
+import os
+from unittest import mock
+from sirup.TemporaryDirectoryWithRootPermission import TemporaryDirectoryWithRootPermission
+
+
+def test_create_once(tmp_path):
+    instance = TemporaryDirectoryWithRootPermission("my_password", parent=str(tmp_path))
+    assert instance.path is None, "directory created at instantiation"
+    path = instance.create()
+    assert os.path.isdir(path)
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path).startswith("sirup-")
+    assert instance.create() == path, "directory created twice"
+
+
+def test_tunnel_dir(tmp_path):
+    instance = TemporaryDirectoryWithRootPermission("my_password", parent=str(tmp_path))
+    tunnel0 = instance.tunnel_dir("tunnel0")
+    tunnel1 = instance.tunnel_dir("tunnel1")
+    assert tunnel0 != tunnel1, "tunnels share a directory"
+    assert os.path.isdir(tunnel0) and os.path.isdir(tunnel1)
+    assert instance.tunnel_dir("tunnel0") == tunnel0, "tunnel directory not reused"
+
+
+@mock.patch("subprocess.run")
+def test_cleanup(mock_run, tmp_path):
+    instance = TemporaryDirectoryWithRootPermission("my_password", parent=str(tmp_path))
+    instance.cleanup()
+    mock_run.assert_not_called()
+
+    path = instance.create()
+    instance.cleanup()
+    expected_cmd = ["sudo", "-S", "rm", "-rf", path]
+    mock_run.assert_called_once_with(expected_cmd, input="my_password".encode(), check=True)
+    assert instance.path is None
+
+
+@mock.patch("subprocess.run")
+def test_context_manager(mock_run, tmp_path):
+    with TemporaryDirectoryWithRootPermission("my_password", parent=str(tmp_path)) as path:
+        assert os.path.isdir(path)
+    expected_cmd = ["sudo", "-S", "rm", "-rf", path]
+    mock_run.assert_called_once_with(expected_cmd, input="my_password".encode(), check=True)
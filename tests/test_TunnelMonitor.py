@@ -0,0 +1,161 @@
+import threading
+import time
+from unittest import mock
+import pytest
+from sirup.TunnelMonitor import TunnelMonitor
+
+
+@pytest.fixture
+def rotator():
+    rotator = mock.Mock()
+    rotator.lock = threading.RLock()
+    connector = rotator.connector
+    connector.is_alive.return_value = True
+    connector.bytecount_interval = None
+    management = connector.open_management.return_value
+    management.state.return_value = {"state": "CONNECTED"}
+    management.bytes_in = 100
+    return rotator
+
+
+def test_invalid_action(rotator):
+    with pytest.raises(ValueError, match="action must be"):
+        TunnelMonitor(rotator, action="restart")
+
+
+def test_check_healthy(rotator):
+    monitor = TunnelMonitor(rotator)
+    assert monitor.check() is None
+    rotator.connector.open_management.return_value.bytecount.assert_called_once_with(2)
+
+    rotator.connector = None
+    assert monitor.check() is None, "fails without active connection"
+
+
+def test_bytecount_interval(rotator):
+    rotator.connector.bytecount_interval = 5
+    TunnelMonitor(rotator).check()
+    management = rotator.connector.open_management.return_value
+    management.bytecount.assert_not_called() # the interval of the connector is kept
+    TunnelMonitor(rotator, bytecount_interval=10).check()
+    management.bytecount.assert_called_once_with(10)
+
+
+def test_check_process_died(rotator):
+    monitor = TunnelMonitor(rotator)
+    rotator.connector.is_alive.return_value = False
+    assert monitor.check() == "openvpn process died"
+
+
+def test_check_management_not_responding(rotator):
+    monitor = TunnelMonitor(rotator)
+    rotator.connector.open_management.return_value.state.side_effect = ConnectionError("no answer")
+    assert monitor.check().startswith("management interface not responding")
+
+
+@mock.patch("sirup.TunnelMonitor.time.time")
+def test_check_state_not_connected(mock_time, rotator):
+    monitor = TunnelMonitor(rotator, stall_timeout=10)
+    management = rotator.connector.open_management.return_value
+    management.state.return_value = {"state": "RECONNECTING"}
+    mock_time.return_value = 0
+    assert monitor.check() is None
+    management.bytes_in = 200 # traffic does not help when not connected
+    mock_time.return_value = 5
+    assert monitor.check() is None, "stall_timeout not respected"
+    mock_time.return_value = 10
+    assert monitor.check() == "tunnel in state RECONNECTING"
+
+
+@mock.patch("sirup.TunnelMonitor.time.time")
+def test_check_no_traffic(mock_time, rotator):
+    probe = mock.Mock(return_value=True)
+    monitor = TunnelMonitor(rotator, stall_timeout=10, probe=probe)
+    management = rotator.connector.open_management.return_value
+    mock_time.return_value = 0
+    assert monitor.check() is None
+    mock_time.return_value = 9
+    management.bytes_in = 150
+    assert monitor.check() is None
+    mock_time.return_value = 18
+    assert monitor.check() is None, "traffic not taken into account"
+    probe.assert_not_called()
+
+    mock_time.return_value = 19
+    assert monitor.check() is None, "successful probe not taken into account"
+    probe.assert_called_once_with()
+
+    probe.return_value = False
+    mock_time.return_value = 29
+    assert monitor.check() == "no traffic through the tunnel"
+
+    probe.side_effect = ConnectionError
+    assert monitor.check() == "no traffic through the tunnel"
+
+
+def test_check_without_management(rotator):
+    rotator.connector.open_management.side_effect = ConnectionError("no socket")
+    monitor = TunnelMonitor(rotator, stall_timeout=0)
+    assert monitor.check() is None, "fails without management interface and probe"
+    monitor = TunnelMonitor(rotator, stall_timeout=0, probe=lambda: False)
+    assert monitor.check() == "no traffic through the tunnel"
+
+    rotator.connector.open_management.side_effect = None
+    rotator.connector.open_management.return_value = None # a backend without management interface
+    monitor = TunnelMonitor(rotator, stall_timeout=0)
+    assert monitor.check() is None
+    monitor = TunnelMonitor(rotator, stall_timeout=0, probe=lambda: False)
+    assert monitor.check() == "no traffic through the tunnel"
+
+
+def test_recover(rotator):
+    on_failure = mock.Mock()
+    on_recovery = mock.Mock()
+    monitor = TunnelMonitor(rotator, on_failure=on_failure, on_recovery=on_recovery)
+    monitor._recover("openvpn process died") #pylint: disable=protected-access
+    rotator.reconnect.assert_called_once_with()
+    rotator.rotate.assert_not_called()
+    on_failure.assert_called_once_with(rotator, "openvpn process died")
+    on_recovery.assert_called_once_with(rotator, "openvpn process died")
+    assert monitor.n_recoveries == 1
+    assert monitor.last_failure == "openvpn process died"
+
+    monitor.action = "rotate"
+    rotator.rotate.side_effect = TimeoutError
+    monitor._recover("no traffic through the tunnel") #pylint: disable=protected-access
+    rotator.rotate.assert_called_once_with()
+    assert monitor.n_recoveries == 1, "failed recovery counted"
+    assert on_recovery.call_count == 1
+
+
+def test_background_thread(rotator):
+    recovered = threading.Event()
+    rotator.connector.is_alive.return_value = False
+    rotator.reconnect.side_effect = lambda: rotator.connector.is_alive.configure_mock(return_value=True)
+    monitor = TunnelMonitor(rotator, interval=0.01, on_recovery=lambda r, reason: recovered.set())
+    monitor.start()
+    assert monitor.is_running()
+    assert recovered.wait(timeout=2), "monitor did not recover the tunnel"
+    monitor.stop()
+    assert not monitor.is_running()
+    rotator.reconnect.assert_called_once_with()
+
+
+def test_skips_checks_while_rotator_is_busy(rotator):
+    monitor = TunnelMonitor(rotator, interval=0.01)
+    holder_ready = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with rotator.lock:
+            holder_ready.set()
+            release.wait()
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    holder_ready.wait()
+    monitor.start()
+    time.sleep(0.05)
+    monitor.stop()
+    release.set()
+    holder.join()
+    rotator.connector.is_alive.assert_not_called()
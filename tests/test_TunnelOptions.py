@@ -0,0 +1,26 @@
+"""Tests for the sirup.TunnelOptions module.
+"""
+
+import json
+from sirup.TunnelOptions import TunnelOptions
+
+
+def test_defaults():
+    options = TunnelOptions()
+    assert options.verification() == {"verify_routes": False, "ip_check_rate": 1.0}
+    arguments = options.openvpn_arguments("/providers/a/server.ovpn")
+    assert arguments["bytecount_interval"] is None
+    assert arguments["options"] is None
+    assert arguments["in_place"] is False
+
+
+def test_openvpn_arguments(tmp_path):
+    tuning_file = tmp_path / "tuning.json"
+    tuned = {"fast-io": []}
+    tuning_file.write_text(json.dumps({str(tmp_path): {"options": tuned, "throughput": 1e6, "latency": 0.03}}))
+    options = TunnelOptions(track_throughput=True, tuning_file=str(tuning_file), log_max_bytes=1000, verb_when_up=1)
+    arguments = options.openvpn_arguments(str(tmp_path / "server.ovpn"))
+    assert arguments["bytecount_interval"] == 1
+    assert arguments["options"] == tuned
+    assert arguments["log_max_bytes"] == 1000
+    assert arguments["verb_when_up"] == 1
@@ -0,0 +1,92 @@
+"""Tests for the sirup.TunnelPool module.
+"""
+
+from unittest import mock
+import pytest
+from sirup.ProxyServer import ProxyServer
+from sirup.SchedulingPolicy import SchedulingPolicy
+from sirup.TunnelPool import TunnelPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    instance = TunnelPool("auth_file", ["a.ovpn", "b.ovpn", "c.ovpn"], "my_password", size=2, timeout=15)
+    instance._session_dir.parent = str(tmp_path) #pylint: disable=protected-access
+    for slot in range(instance.parallelism):
+        instance._slots.put(slot) #pylint: disable=protected-access
+    return instance
+
+
+@mock.patch.object(TunnelPool, "_run_as_root")
+@mock.patch("sirup.TunnelPool.VPNConnector")
+def test_start_and_rotate(mock_connector, mock_run, pool): #pylint: disable=unused-argument
+    mock_connector.side_effect = lambda config_file, *args, **kwargs: mock.Mock(
+        config_file=config_file, **{"nameservers.return_value": ["10.8.0.1"] if config_file == "a.ovpn" else []})
+    proxy = ProxyServer([])
+    pool.start(proxy)
+    assert pool.parallelism == 4, "a spare namespace for each tunnel"
+    assert [exit_.name for exit_ in proxy.exits] == ["siruppx-ns0", "siruppx-ns1"]
+    assert [connector.config_file for connector, _ in pool.tunnels.values()] == ["a.ovpn", "b.ovpn"]
+    assert mock_connector.call_args[1]["netns"] == "siruppx-ns1"
+    assert [exit_.dns_cache.nameservers for exit_ in proxy.exits] == [["10.8.0.1"], ["1.1.1.1"]], \
+        "the nameservers pushed by the server, or those of the namespaces"
+
+    with mock.patch.object(proxy, "call") as mock_call:
+        new_slot = pool.rotate(proxy, 0)
+    assert new_slot == 2
+    mock_call.assert_called_once()
+    mock_call.call_args[0][0].close() # the coroutine passed to the proxy
+    assert sorted(pool.tunnels) == [1, 2]
+    assert pool.tunnels[2][0].config_file == "c.ovpn"
+
+    with mock.patch.object(pool._session_dir, "cleanup"): #pylint: disable=protected-access
+        pool.teardown()
+    assert pool.tunnels == {}
+    assert pool._slots.qsize() == 4 #pylint: disable=protected-access
+
+
+@mock.patch.object(TunnelPool, "_run_as_root")
+@mock.patch("sirup.TunnelPool.VPNConnector")
+def test_open_tunnel_skips_failing_servers(mock_connector, mock_run, pool): #pylint: disable=unused-argument
+    connectors = [mock.Mock(config_file=name, **{"nameservers.side_effect": OSError})
+                  for name in ["a.ovpn", "b.ovpn", "c.ovpn"]]
+    connectors[0].connect.side_effect = TimeoutError("Could not connect to vpn")
+    mock_connector.side_effect = connectors
+    slot = pool.open_tunnel()
+    assert pool.tunnels[slot][0] is connectors[1]
+    assert pool.tunnels[slot][1].dns_cache.nameservers == ["1.1.1.1"]
+    connectors[0].disconnect.assert_called_once_with("my_password")
+
+    mock_connector.side_effect = None
+    mock_connector.return_value.connect.side_effect = TimeoutError("Could not connect to vpn")
+    with pytest.raises(TimeoutError):
+        pool.open_tunnel(max_trials=3)
+    assert pool._slots.qsize() == 3, "the namespace of a failed tunnel is a spare again" #pylint: disable=protected-access
+
+
+@mock.patch.object(TunnelPool, "_run_as_root")
+@mock.patch("sirup.TunnelPool.VPNConnector")
+def test_each_open_tunnel_gets_its_own_cpu(mock_connector, mock_run, pool): #pylint: disable=unused-argument
+    mock_connector.return_value.nameservers.return_value = []
+    pool.scheduling = SchedulingPolicy(cpus=[4, 5, 6])
+    proxy = ProxyServer([])
+    pool.start(proxy)
+    assert [call[1]["slot"] for call in mock_connector.call_args_list] == [0, 1]
+
+    with mock.patch.object(proxy, "call") as mock_call:
+        new_slot = pool.rotate(proxy, 1) # not the oldest tunnel
+        mock_call.call_args[0][0].close()
+        assert mock_connector.call_args[1]["slot"] == 2, "the CPU of neither open tunnel"
+        pool.rotate(proxy, new_slot)
+        mock_call.call_args[0][0].close()
+    assert mock_connector.call_args[1]["slot"] == 1, "the CPU of the closed tunnel is free again"
+
+
+@mock.patch("sirup.TunnelPool.time.sleep")
+def test_cpu_usage(mock_sleep, pool): #pylint: disable=unused-argument
+    busy = mock.Mock()
+    busy.cpu_seconds.side_effect = [10.0, 10.5]
+    gone = mock.Mock()
+    gone.cpu_seconds.side_effect = [3.0, None]
+    pool.tunnels = {0: (busy, None), 1: (gone, None)}
+    assert pool.cpu_usage(seconds=2.0) == {0: 0.25, 1: None}
@@ -0,0 +1,69 @@
+"""Tests for the sirup.TunnelTuner module.
+"""
+
+from unittest import mock
+import pytest
+from sirup.TunnelTuner import TunnelTuner
+from sirup.TunnelTuner import provider_of
+from sirup.TunnelTuner import read_tuning
+
+
+FAST = {"sndbuf": ["524288"], "rcvbuf": ["524288"]}
+BROKEN = {"tun-mtu": ["9000"]}
+
+
+@pytest.fixture
+def tuner(tmp_path):
+    instance = TunnelTuner("auth_file", "my_password", "http://198.51.100.1/10MB.bin", candidates=[FAST, BROKEN],
+                           rounds=2, timeout=15)
+    instance._session_dir.parent = str(tmp_path) #pylint: disable=protected-access
+    return instance
+
+
+def test_candidates(tuner):
+    assert tuner.candidates == [{}, FAST, BROKEN], "the settings of the configuration files are always tried"
+    assert tuner.parallelism == 1
+    assert tuner.namespace(0) == "siruptune-ns0"
+
+
+@mock.patch.object(TunnelTuner, "_run_as_root")
+@mock.patch.object(TunnelTuner, "measure")
+@mock.patch("sirup.TunnelTuner.VPNConnector")
+def test_trial(mock_connector, mock_measure, mock_run, tuner): #pylint: disable=unused-argument
+    mock_measure.return_value = {"throughput": 2e6, "latency": 0.03}
+    trial = tuner.trial("server.ovpn", FAST)
+    assert trial["success"]
+    assert trial["throughput"] == 2e6
+    assert mock_connector.call_args[1]["options"] == FAST
+    assert mock_connector.call_args[1]["netns"] == "siruptune-ns0"
+    mock_connector.return_value.connect.assert_called_once_with("my_password", timeout=15)
+    mock_connector.return_value.disconnect.assert_called_once_with("my_password")
+
+    mock_connector.return_value.connect.side_effect = TimeoutError("Could not connect to vpn")
+    trial = tuner.trial("server.ovpn", BROKEN)
+    assert not trial["success"]
+    assert trial["throughput"] == 0.0
+    assert trial["error"] == "TimeoutError: Could not connect to vpn"
+    assert len(tuner.trials) == 2
+
+
+def test_tune_and_save(tuner, tmp_path):
+    throughputs = {"{}": 1e6, str(FAST): 3e6, str(BROKEN): 0.0}
+
+    def fake_trial(config_file, options):
+        success = options != BROKEN
+        return {"config_file": config_file, "options": options, "success": success,
+                "throughput": throughputs[str(options)], "latency": 0.05 if success else None, "error": None}
+
+    with mock.patch.object(tuner, "trial", side_effect=fake_trial) as mock_trial:
+        best = tuner.tune(["a.ovpn", "b.ovpn"])
+    assert mock_trial.call_count == 3 * 2 * 2
+    assert best == {"options": FAST, "throughput": 3e6, "latency": 0.05}
+
+    path = str(tmp_path / "tuning.json")
+    tuner.save(path, "/configs/provider1")
+    tuner.best = {"options": {}, "throughput": 1e6, "latency": 0.05}
+    tuner.save(path, "/configs/provider2")
+    assert read_tuning(path) == {"/configs/provider1": FAST, "/configs/provider2": {}}
+    assert read_tuning(str(tmp_path / "missing.json")) == {}
+    assert provider_of("/configs/provider1/a.ovpn") == "/configs/provider1"
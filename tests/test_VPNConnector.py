@@ -1,52 +1,53 @@
 
+import getpass
+import itertools
 import os
-import tempfile
+import time
 from subprocess import PIPE
 from unittest import mock
 import pytest
 import requests
+from sirup.SchedulingPolicy import SchedulingPolicy
+from sirup.VPNConnector import LOG_TAIL_LINES
 from sirup.VPNConnector import VPNConnector
 
 
 ## Fixtures
 @pytest.fixture
-def connect_command():
-    temp_dir = tempfile.gettempdir()
+def work_dir(tmp_path):
+    return str(tmp_path)
+
+@pytest.fixture
+def connect_command(work_dir):
     return ["sudo", "-S", "openvpn",
            "--config", "config_file",
            "--auth-user-pass", "auth_file",
-           "--log", os.path.join(temp_dir, "openvpn.log"),
+           "--log", os.path.join(work_dir, "openvpn.log"),
+           "--management", os.path.join(work_dir, "management.sock"), "unix",
+           "--management-client-user", getpass.getuser(),
            "--daemon"]
 
 ## Tests
 
 
-@mock.patch("sirup.VPNConnector.TemporaryFileWithRootPermission")
 @mock.patch("sirup.VPNConnector.get_ip") 
 @mock.patch("subprocess.Popen")
-def test_start_vpn(mock_popen, mock_get_ip, mock_temp_file, connect_command):
+def test_start_vpn(mock_popen, mock_get_ip, work_dir, connect_command):
     """Test that OpenVPN is started with the right arguments.
 
     Comment
     -------
-    We need to mock 3 things
+    We need to mock 2 things
     - subprocess.Popen, which we expect to be called with certain arguments by the connector.start_vpn value
     - sirup.VPNConnector.get_ip, which requires an internet connection and makes an API call for each test run 
-    - TemporaryFileWithRootPermission, because it does `subprocess.run`, which calls Popen.__init__
-    (see https://github.com/python/cpython/blob/main/Lib/subprocess.py). Without the mock, this interferes 
-    with the test because Popen.__init__() is called twice.
 
     Note also that we patch the objects and functions from sirup.VPNConnector, and not from
     their source files. See also https://docs.python.org/3/library/unittest.mock.html#where-to-patch
     """
     ## Instantiate the class
-    connector = VPNConnector("config_file", "auth_file")
-    temp_dir = tempfile.gettempdir()
+    connector = VPNConnector("config_file", "auth_file", work_dir=work_dir)
 
     ## Instantiate mocks and define properties 
-    # The temp file used as log
-    mock_temp_file_instance = mock_temp_file.return_value
-    mock_temp_file_instance.file_name = os.path.join(temp_dir, "openvpn.log")
     # The Popen context manager that calls `cmd`
     process = mock_popen.return_value.__enter__.return_value 
     process.returncode = 0
@@ -75,18 +76,13 @@ def test_start_vpn(mock_popen, mock_get_ip, mock_temp_file, connect_command):
 @mock.patch("os.path.exists")
 @mock.patch("sirup.VPNConnector.sudo_read_file")
 @mock.patch("sirup.VPNConnector.raise_ovpn_exceptions") 
-@mock.patch("sirup.VPNConnector.TemporaryFileWithRootPermission")
 @mock.patch("subprocess.Popen")
-def test_start_vpn_fails(mock_popen, mock_temp_file, mock_raise_exc, mock_read_file, mock_path_exists):
+def test_start_vpn_fails(mock_popen, mock_raise_exc, mock_read_file, mock_path_exists, work_dir):
     """Mock a failing connection, test that raise_ovpn_exceptions and sudo_read_file are called."""
     ## Instantiate the class
-    connector = VPNConnector("config_file", "auth_file", track_ip=False)
-    temp_dir = tempfile.gettempdir()
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir)
 
     ## Instantiate mocks and define properties 
-    # The temp file used as log
-    mock_temp_file_instance = mock_temp_file.return_value
-    mock_temp_file_instance.file_name = os.path.join(temp_dir, "openvpn.log")
     # The Popen context manager that calls `cmd`
     process = mock_popen.return_value.__enter__.return_value 
     process.returncode = 1
@@ -97,38 +93,31 @@ def test_start_vpn_fails(mock_popen, mock_temp_file, mock_raise_exc, mock_read_f
 
     connector.start_vpn(pwd="my_password") 
     mock_raise_exc.assert_called_once()
-    mock_read_file.assert_called_once_with(file=mock_temp_file_instance.file_name, pwd="my_password")
+    mock_read_file.assert_called_once_with(file=os.path.join(work_dir, "openvpn.log"), pwd="my_password",
+                                           max_lines=LOG_TAIL_LINES)
 
 
 @mock.patch("sirup.VPNConnector.get_ip")
 @mock.patch("sirup.VPNConnector.sudo_read_file")
 @mock.patch.object(VPNConnector, "start_vpn")
 @mock.patch("sirup.VPNConnector.check_connection")
-@mock.patch("sirup.VPNConnector.TemporaryFileWithRootPermission")
-def test_connect(mock_temp_file, mock_check_connection, mock_start_vpn, mock_read_file, mock_get_ip):
+def test_connect(mock_check_connection, mock_start_vpn, mock_read_file, mock_get_ip, work_dir):
     "Test sequential execution of functions"
     ## Instantiate the class
     mock_get_ip.return_value = "old_ip"
-    connector = VPNConnector("config_file", "auth_file", track_ip=True)
+    connector = VPNConnector("config_file", "auth_file", track_ip=True, work_dir=work_dir)
     assert connector.base_ip == "old_ip"
     mock_get_ip.reset_mock()
-    temp_dir = tempfile.gettempdir()
-
-    ## Instantiate mocks and define properties 
-    # The temp file used as log
-    mock_temp_file_instance = mock_temp_file.return_value
-    mock_temp_file_instance.file_name = os.path.join(temp_dir, "openvpn.log")
 
     ## Main call
-    connector.log_file = "my_log" # necessary for check_connection. Could this bee assigned to connector as a side effect 
     mock_check_connection.return_value = True
     mock_get_ip.return_value = "new_ip"
     connector.connect(pwd="my_password") # Popen.__enter__ is also called when the log file is opened/created
 
     ## Assert
-    mock_start_vpn.assert_called_once()
-    mock_check_connection.assert_called_once()
-    mock_read_file.assert_called_once()
+    mock_start_vpn.assert_called_once_with(pwd="my_password", proc_id=os.path.join(work_dir, "openvpn.pid"))
+    mock_check_connection.assert_called_once_with(os.path.join(work_dir, "openvpn.log"), timeout=30, pwd="my_password")
+    mock_read_file.assert_called_once_with(os.path.join(work_dir, "openvpn.pid"), pwd="my_password")
     mock_get_ip.assert_called_once()
     assert connector.current_ip == "new_ip"
 
@@ -146,24 +135,18 @@ def test_connect(mock_temp_file, mock_check_connection, mock_start_vpn, mock_rea
 
 
 @mock.patch("sirup.VPNConnector.get_vpn_pids")
-@mock.patch("sirup.VPNConnector.TemporaryFileWithRootPermission")
 @mock.patch("time.sleep")
 @mock.patch("sirup.VPNConnector.get_ip") 
 @mock.patch("subprocess.run")
-def test_disconnect(mock_run, mock_get_ip, mock_sleep, mock_temp_file, mock_get_pids):
+def test_disconnect(mock_run, mock_get_ip, mock_sleep, mock_get_pids, work_dir):
     mock_get_ip.return_value = "base_ip" 
-    connector = VPNConnector("config_file", "auth_file")
+    connector = VPNConnector("config_file", "auth_file", work_dir=work_dir)
 
     mock_get_ip.assert_called_once_with()
     mock_get_ip.reset_mock()
 
     # Set properties of the connector instance 
-    temp_dir = tempfile.gettempdir()
-    mock_temp_file_instance = mock_temp_file.return_value
-    mock_temp_file_instance.file_name = os.path.join(temp_dir, "openvpn.log")
-
     connector._vpn_process_id = str(1234) #pylint: disable=protected-access
-    connector.log_file = mock_temp_file_instance
 
     mock_get_pids.return_value = ["1234", "5992"]
     mock_get_ip.return_value = "base_ip"
@@ -181,10 +164,281 @@ def test_disconnect(mock_run, mock_get_ip, mock_sleep, mock_temp_file, mock_get_
     mock_get_ip.return_value = "not_base_ip"
     with pytest.raises(RuntimeWarning, match="Expected to go back to base IP address"):
         connector.disconnect("my_password")
+    assert connector.work_dir == work_dir, "work_dir passed by the caller should not be removed"
+
+
+@mock.patch("sirup.VPNConnector.TemporaryDirectoryWithRootPermission")
+@mock.patch("sirup.VPNConnector.get_vpn_pids")
+def test_own_work_dir(mock_get_pids, mock_temp_dir, work_dir):
+    "Without a work_dir, the connector creates a temporary one and removes it on disconnect."
+    mock_temp_dir.return_value.create.return_value = work_dir
+    mock_get_pids.return_value = [""]
+    connector = VPNConnector("config_file", "auth_file", track_ip=False)
+    assert connector.work_dir is None
+
+    connector._prepare_work_dir("my_password") #pylint: disable=protected-access
+    mock_temp_dir.assert_called_once_with(password="my_password")
+    assert connector.log_file == os.path.join(work_dir, "openvpn.log")
+    assert connector.pid_file == os.path.join(work_dir, "openvpn.pid")
+
+    connector.disconnect("my_password")
+    mock_temp_dir.return_value.cleanup.assert_called_once_with()
+    assert connector.work_dir is None
 
 
 def test_repr():
     connector = VPNConnector("config_file", "auth_file", track_ip=False)
     repr_result = repr(connector) 
     repr_expected = "VPNConnector('config_file', 'auth_file', track_ip=False)"
-    assert repr_result == repr_expected, "prints wrong repr"
\ No newline at end of file
+    assert repr_result == repr_expected, "prints wrong repr"
+
+@mock.patch("sirup.VPNConnector.process_exists")
+def test_is_connected(mock_process_exists):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False)
+    assert not connector.is_connected()
+    assert not connector.is_alive()
+    mock_process_exists.assert_not_called()
+
+    connector._vpn_process_id = "1234" #pylint: disable=protected-access
+    mock_process_exists.return_value = True
+    assert connector.is_connected()
+    mock_process_exists.return_value = False
+    assert not connector.is_connected(), "dead openvpn process reported as connected"
+    mock_process_exists.assert_called_with("1234")
+
+
+@mock.patch("sirup.VPNConnector.ManagementInterface")
+def test_open_management(mock_management, work_dir):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir)
+    connector._prepare_work_dir("my_password") #pylint: disable=protected-access
+    first = connector.open_management()
+    second = connector.open_management()
+    mock_management.assert_called_once_with(os.path.join(work_dir, "management.sock"))
+    assert first is second, "management interface opened twice"
+    assert mock_management.return_value.open.call_count == 2
+
+
+@mock.patch("sirup.VPNConnector.time.time")
+@mock.patch("sirup.VPNConnector.ManagementInterface")
+def test_traffic_accounting(mock_management, mock_time, work_dir):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir)
+    connector._prepare_work_dir("my_password") #pylint: disable=protected-access
+    connector.start_traffic_accounting(interval=2)
+    management = mock_management.return_value
+    management.bytecount.assert_called_once_with(2)
+    handler = management.add_handler.call_args[0][1]
+    connector.start_traffic_accounting(interval=2)
+    management.add_handler.assert_called_once() # handler registered only once
+    assert connector.summarize_traffic() is None
+    assert connector.bytes_in is None
+
+    mock_time.return_value = 100.0
+    handler("1000,500")
+    assert connector.summarize_traffic() is None, "summary with a single report"
+    mock_time.return_value = 102.0
+    handler("5000,1500")
+    mock_time.return_value = 104.0
+    handler("7000,2500")
+
+    assert connector.bytes_in == 7000
+    assert connector.bytes_out == 2500
+    assert list(connector.throughput_samples) == [(102.0, 2000.0, 500.0), (104.0, 1000.0, 500.0)]
+    summary = connector.summarize_traffic()
+    assert summary == {"config_file": "config_file", "seconds": 4.0, "bytes_in": 7000, "bytes_out": 2500,
+                       "mean_rate_in": 1500.0, "mean_rate_out": 500.0, "peak_rate_in": 2000.0, "peak_rate_out": 500.0}
+
+    with mock.patch("sirup.VPNConnector.get_vpn_pids") as mock_get_pids:
+        mock_get_pids.return_value = [""]
+        connector.disconnect("my_password")
+    assert connector.traffic_summary == summary
+    management.close.assert_called_once_with()
+
+
+@mock.patch("sirup.VPNConnector.check_tunnel")
+@mock.patch.object(VPNConnector, "open_management")
+def test_check_routes(mock_open_management, mock_check_tunnel, work_dir):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, verify_routes=True)
+    mock_open_management.return_value.state.return_value = {"state": "CONNECTED", "local_ip": "10.8.0.6"}
+    mock_check_tunnel.return_value = None
+    assert connector.check_routes() is None
+    mock_check_tunnel.assert_called_once_with(local_ip="10.8.0.6")
+
+    mock_open_management.side_effect = ConnectionError("Cannot connect")
+    assert connector.check_routes().startswith("management interface not responding")
+
+
+@mock.patch("subprocess.Popen")
+def test_start_vpn_in_namespace(mock_popen, work_dir, connect_command):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, netns="sirup-ns0")
+    process = mock_popen.return_value.__enter__.return_value
+    process.returncode = 0
+    process.communicate.return_value = (b"", b"")
+    connector.start_vpn(pwd="my_password")
+    expected = connect_command[:2] + ["ip", "netns", "exec", "sirup-ns0"] + connect_command[2:]
+    mock_popen.assert_called_once_with(expected, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+
+@mock.patch("sirup.VPNConnector.subprocess.run")
+@mock.patch("sirup.VPNConnector.get_vpn_pids", return_value=["1234"])
+@mock.patch("sirup.VPNConnector.sudo_read_file", return_value=["1234\n"])
+@mock.patch("sirup.VPNConnector.check_connection", return_value=False)
+def test_wait_ready_kills_abandoned_attempt(mock_check_connection, mock_read_file, mock_get_pids, mock_run, work_dir): #pylint: disable=unused-argument
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir)
+    connector._prepare_work_dir("my_password") #pylint: disable=protected-access
+    with pytest.raises(TimeoutError):
+        connector.wait_ready("my_password", timeout=6)
+    mock_check_connection.assert_called_once_with(os.path.join(work_dir, "openvpn.log"), timeout=6, pwd="my_password")
+    mock_run.assert_called_once_with(["sudo", "-S", "kill", "1234"], input=b"my_password", check=False)
+    assert not connector.is_connected()
+
+
+@mock.patch("subprocess.Popen")
+def test_start_vpn_with_options(mock_popen, work_dir, connect_command):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir,
+                             options={"sndbuf": ["524288"], "fast-io": []})
+    process = mock_popen.return_value.__enter__.return_value
+    process.returncode = 0
+    process.communicate.return_value = (b"", b"")
+    connector.start_vpn(pwd="my_password")
+    expected = connect_command + ["--fast-io", "--sndbuf", "524288"]
+    mock_popen.assert_called_once_with(expected, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+
+class ImmediateThread():
+    "Runs the target when the thread is started."
+
+    def __init__(self, target, args=(), daemon=None): #pylint: disable=unused-argument
+        self.target = target
+        self.args = args
+
+
+    def start(self):
+        self.target(*self.args)
+
+
+@mock.patch("sirup.VPNConnector.threading.Thread", ImmediateThread)
+@mock.patch.object(VPNConnector, "open_management")
+@mock.patch.object(VPNConnector, "start_vpn")
+def test_start_in_place(mock_start_vpn, mock_open_management, work_dir): #pylint: disable=unused-argument
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, in_place=True)
+    management = mock_open_management.return_value
+    connector.management = management
+    connector.start("my_password")
+    assert management.command.call_args_list == [mock.call("hold off"), mock.call("hold release")]
+    handler = management.add_handler.call_args[0][1]
+
+    handler("185.1.2.3,1194,udp")
+    management.command.assert_called_with("remote ACCEPT")
+    connector._remote = ("185.9.9.9", "443") #pylint: disable=protected-access
+    handler("185.1.2.3,1194,udp")
+    management.command.assert_called_with("remote MOD 185.9.9.9 443")
+
+
+@mock.patch("subprocess.Popen")
+def test_start_vpn_in_place(mock_popen, work_dir, connect_command):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, in_place=True)
+    process = mock_popen.return_value.__enter__.return_value
+    process.returncode = 0
+    process.communicate.return_value = (b"", b"")
+    connector.start_vpn(pwd="my_password")
+    expected = connect_command + ["--management-hold", "--management-query-remote", "--persist-tun", "--persist-key"]
+    mock_popen.assert_called_once_with(expected, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+
+@mock.patch("sirup.VPNConnector.time.sleep")
+@mock.patch.object(VPNConnector, "open_management")
+def test_switch(mock_open_management, mock_sleep, work_dir, tmp_path): #pylint: disable=unused-argument
+    config_file = tmp_path / "de-02.ovpn"
+    config_file.write_text("client\nremote de-02.example.net 443 tcp\n", encoding="utf-8")
+    connector = VPNConnector("nl-01.ovpn", "auth_file", track_ip=False, work_dir=work_dir, in_place=True)
+    management = mock_open_management.return_value
+    management.state.side_effect = [
+        {"time": "100", "state": "CONNECTED"},
+        {"time": "100", "state": "CONNECTED"}, # SIGUSR1 not handled yet
+        {"time": "130", "state": "RECONNECTING"},
+        {"time": "131", "state": "CONNECTED"},
+    ]
+    connector.switch(str(config_file), timeout=10)
+    management.signal.assert_called_once_with("SIGUSR1")
+    assert connector.config_file == str(config_file)
+    assert connector._remote == ("de-02.example.net", "443") #pylint: disable=protected-access
+    assert set(connector.phase_times) == {"start", "vpn_started", "tunnel_up"}
+
+    management.state.side_effect = None
+    management.state.return_value = {"time": "131", "state": "CONNECTED"}
+    with mock.patch.object(connector, "clock") as mock_clock:
+        mock_clock.time.side_effect = itertools.count(0, 5)
+        with pytest.raises(TimeoutError):
+            connector.switch(str(config_file), timeout=10)
+    mock_clock.sleep.assert_called_with(0.1)
+
+    config_file.write_text("client\n", encoding="utf-8")
+    management.signal.reset_mock()
+    with pytest.raises(ValueError):
+        connector.switch(str(config_file), timeout=10)
+    management.signal.assert_not_called()
+
+
+@mock.patch("subprocess.run")
+@mock.patch("subprocess.Popen")
+def test_start_vpn_bounded_log(mock_popen, mock_run, work_dir, connect_command):
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, log_max_bytes=100, verb=4)
+    process = mock_popen.return_value.__enter__.return_value
+    process.returncode = 0
+    process.communicate.return_value = (b"", b"")
+    log_file = os.path.join(work_dir, "openvpn.log")
+    with open(log_file, "w", encoding="utf-8") as file:
+        file.write("previous connection\n")
+    connector.start_vpn(pwd="my_password")
+    expected = [arg if arg != "--log" else "--log-append" for arg in connect_command] + ["--verb", "4"]
+    mock_popen.assert_called_once_with(expected, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    mock_run.assert_called_once_with(["sudo", "-S", "truncate", "-s", "0", log_file], input=b"my_password", check=True)
+
+    mock_run.reset_mock()
+    assert not connector.rotate_log("my_password") # 20 bytes
+    with open(log_file, "a", encoding="utf-8") as file:
+        file.write("x" * 100)
+    assert connector.rotate_log("my_password")
+    assert mock_run.call_args[0][0][-1] == log_file
+
+
+@mock.patch("sirup.VPNConnector.sudo_read_file", return_value=["1234"])
+@mock.patch("sirup.VPNConnector.check_connection", return_value=True)
+@mock.patch.object(VPNConnector, "open_management")
+def test_wait_ready_log_policy(mock_open_management, mock_check_connection, mock_read_file, work_dir): #pylint: disable=unused-argument
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, log_max_bytes=100,
+                             verb_when_up=1)
+    connector.start_vpn = mock.Mock()
+    connector.log_check_interval = 0.01
+    with mock.patch.object(connector, "rotate_log") as mock_rotate_log:
+        connector.start("my_password")
+        connector.wait_ready("my_password", 10)
+        mock_open_management.return_value.command.assert_called_once_with("verb 1")
+        with mock.patch("sirup.VPNConnector.get_vpn_pids", return_value=[]):
+            while not mock_rotate_log.called:
+                time.sleep(0.01)
+            connector.stop("my_password")
+    assert connector._log_thread is None #pylint: disable=protected-access
+
+    mock_read_file.return_value = ["PUSH: Received control message: 'PUSH_REPLY,dhcp-option DNS 10.8.0.1,ping 10'"]
+    assert connector.nameservers("my_password") == ["10.8.0.1"]
+    assert connector.nameservers("my_password") == ["10.8.0.1"]
+    mock_read_file.assert_called_with(os.path.join(work_dir, "openvpn.log"), pwd="my_password",
+                                      max_lines=LOG_TAIL_LINES)
+    assert mock_read_file.call_count == 2 # the process ID, then the log once
+
+
+@mock.patch("subprocess.Popen")
+def test_start_vpn_with_scheduling(mock_popen, work_dir, connect_command):
+    policy = SchedulingPolicy(cpus=[0, 1, 2], nice=-5)
+    connector = VPNConnector("config_file", "auth_file", track_ip=False, work_dir=work_dir, scheduling=policy, slot=4)
+    process = mock_popen.return_value.__enter__.return_value
+    process.returncode = 0
+    process.communicate.return_value = (b"", b"")
+    connector.start_vpn(pwd="my_password")
+    expected = connect_command[:2] + ["taskset", "-c", "1", "nice", "-n", "-5"] + connect_command[2:]
+    mock_popen.assert_called_once_with(expected, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+    assert connector.cpu_seconds() is None
+    connector._vpn_process_id = str(os.getpid()) #pylint: disable=protected-access
+    assert connector.cpu_seconds() > 0
@@ -0,0 +1,85 @@
+"""Tests for the sirup.VariantSelector module.
+"""
+
+import pytest
+from sirup.ConnectionHistory import ConnectionHistory
+from sirup.VariantSelector import VariantSelector
+
+
+## Fixtures
+@pytest.fixture
+def config_files(tmp_path):
+    paths = {}
+    for server in ["nl-01", "de-01"]:
+        for proto, port in [("udp", "1194"), ("udp", "53"), ("tcp", "443")]:
+            path = tmp_path / f"{server}.{proto}{port}.ovpn"
+            path.write_text(f"client\nproto {proto}\nremote {server}.example.net {port}\n", encoding="utf-8")
+            paths[f"{server}.{proto}{port}"] = str(path)
+    (tmp_path / "empty.ovpn").write_text("client\n", encoding="utf-8")
+    paths["empty"] = str(tmp_path / "empty.ovpn")
+    return paths
+
+
+@pytest.fixture
+def selector(config_files):
+    selector = VariantSelector()
+    for config_file in config_files.values():
+        selector.add(config_file)
+    return selector
+
+
+## Tests
+def test_groups(selector, config_files):
+    assert selector.server_of(config_files["nl-01.tcp443"]) == "nl-01.example.net"
+    assert sorted(selector.variants(config_files["nl-01.udp53"])) == \
+        sorted(config_files[f"nl-01.{variant}"] for variant in ["udp1194", "udp53", "tcp443"])
+    assert selector.variants(config_files["empty"]) == [config_files["empty"]], "files without remotes stand alone"
+
+    selector.remove(config_files["nl-01.udp53"])
+    assert len(selector.variants(config_files["nl-01.udp1194"])) == 2
+    selector.remove(config_files["nl-01.udp53"])
+
+
+def test_learns_blocked_protocol(selector, config_files):
+    nl_udp = config_files["nl-01.udp1194"]
+    assert selector.choose(nl_udp) == nl_udp, "without attempts, the file from the rotation is kept"
+
+    selector.record(nl_udp, reached=False)
+    assert selector.rate(("udp", "1194")) < selector.rate(("udp", "53")) < selector.rate(("tcp", "443")), \
+        "the other UDP ports inherit the failure of the protocol"
+    assert selector.choose(nl_udp) == config_files["nl-01.tcp443"]
+    assert selector.choose(config_files["de-01.udp53"]) == config_files["de-01.tcp443"], "learned across servers"
+    assert selector.choose(nl_udp, exclude={config_files["nl-01.tcp443"]}) == config_files["nl-01.udp53"]
+    assert selector.choose(nl_udp, available=[nl_udp]) == nl_udp
+    assert selector.choose(nl_udp, available=[]) is None
+
+    selector.record(config_files["de-01.tcp443"], reached=True)
+    assert list(selector.rates()) == ["udp/1194", "tcp/443"]
+
+
+def test_decay_and_networks(config_files):
+    network = ["home"]
+    selector = VariantSelector(decay=0.5, network=lambda: network[0])
+    for config_file in config_files.values():
+        selector.add(config_file)
+    nl_udp = config_files["nl-01.udp1194"]
+    for _ in range(3):
+        selector.record(nl_udp, reached=False)
+    assert selector.choose(nl_udp) != nl_udp
+
+    network[0] = "office"
+    assert selector.choose(nl_udp) == nl_udp, "each network is learned separately"
+
+    network[0] = "home"
+    for _ in range(3):
+        selector.record(nl_udp, reached=True)
+    assert selector.rate(("udp", "1194")) > 0.5, "recent attempts count more"
+
+
+def test_learn_from(selector, config_files, tmp_path):
+    history = ConnectionHistory(str(tmp_path / "history.csv"))
+    for _ in range(4):
+        history.record(config_files["nl-01.udp1194"], 0.0, {"end": 30.0}, "timeout", exception="TimeoutError")
+    history.record(config_files["nl-01.tcp443"], 0.0, {"end": 2.0}, "success")
+    selector.learn_from(history)
+    assert selector.choose(config_files["de-01.udp1194"]) == config_files["de-01.tcp443"]
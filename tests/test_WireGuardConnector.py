@@ -0,0 +1,171 @@
+"""Tests for the sirup.WireGuardConnector module.
+"""
+
+import os
+import stat
+from unittest import mock
+import pytest
+from sirup.WireGuardConnector import WireGuardConnector
+from sirup.WireGuardConnector import handshake_target
+from sirup.WireGuardConnector import make_setconf
+from sirup.WireGuardConnector import read_wireguard_config
+
+
+CONFIG = """
+# provider config
+[Interface]
+PrivateKey = cHJpdmF0ZWtleQ==
+Address = 10.2.0.2/32, fd00::2/128
+DNS = 10.2.0.1
+MTU = 1420
+
+[Peer]
+PublicKey = cHVibGlja2V5
+AllowedIPs = 0.0.0.0/0, 192.168.7.0/24
+Endpoint = 198.51.100.7:51820
+PersistentKeepalive = 25
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "server.conf"
+    path.write_text(CONFIG)
+    return str(path)
+
+
+@pytest.fixture
+def connector(config_file, tmp_path):
+    work_dir = tmp_path / "tunnel0"
+    work_dir.mkdir()
+    return WireGuardConnector(config_file, track_ip=False, work_dir=str(work_dir))
+
+
+def test_read_wireguard_config(config_file):
+    config = read_wireguard_config(config_file)
+    assert config["interface"]["privatekey"] == "cHJpdmF0ZWtleQ=="
+    assert config["interface"]["address"] == ["10.2.0.2/32", "fd00::2/128"]
+    assert config["interface"]["dns"] == ["10.2.0.1"]
+    assert len(config["peers"]) == 1
+    assert config["peers"][0]["allowedips"] == ["0.0.0.0/0", "192.168.7.0/24"]
+    assert config["peers"][0]["endpoint"] == "198.51.100.7:51820"
+
+
+def test_make_setconf(config_file):
+    setconf = make_setconf(read_wireguard_config(config_file))
+    assert "PrivateKey = cHJpdmF0ZWtleQ==" in setconf
+    assert "AllowedIPs = 0.0.0.0/0, 192.168.7.0/24" in setconf
+    for wg_quick_key in ("Address", "DNS", "MTU"):
+        assert wg_quick_key not in setconf
+
+
+def test_make_up_and_down_script(connector, config_file):
+    script = connector.make_up_script(read_wireguard_config(config_file), "/dev/shm/wg.conf")
+    lines = script.splitlines()
+    assert lines[1] == "ip link del dev sirupwg0 2>/dev/null || true", "a stale interface is removed first"
+    assert lines[2] == "while ip -4 rule del not fwmark 51820 table 51820 2>/dev/null; do :; done", \
+        "and the rules of a full tunnel"
+    assert "while ip -6 rule del table main suppress_prefixlength 0 2>/dev/null; do :; done" in lines[:6]
+    assert lines[6] == "ip link add dev sirupwg0 type wireguard"
+    assert "wg setconf sirupwg0 /dev/shm/wg.conf" in lines
+    assert "ip -4 address add 10.2.0.2/32 dev sirupwg0" in lines
+    assert "ip -6 address add fd00::2/128 dev sirupwg0" in lines
+    assert "ip link set mtu 1420 dev sirupwg0" in lines
+    assert "ip -4 route add 192.168.7.0/24 dev sirupwg0" in lines
+    assert "ip -4 route add 0.0.0.0/0 dev sirupwg0 table 51820" in lines
+    assert not any(line.startswith("ip -6 rule") for line in lines), "no full tunnel for IPv6"
+    assert "sysctl -qw net.ipv4.conf.all.src_valid_mark=1" in lines
+
+    down = connector.make_down_script().splitlines()
+    assert down[0] == "ip link del dev sirupwg0 2>/dev/null || true"
+    assert "ip -4 rule del not fwmark 51820 table 51820 2>/dev/null || true" in down
+
+
+def test_handshake_target(config_file):
+    config = read_wireguard_config(config_file)
+    assert handshake_target(config) == "10.2.0.1", "the DNS server goes through the full tunnel"
+    config["peers"][0]["allowedips"] = ["192.168.7.0/24"]
+    assert handshake_target(config) == "192.168.7.1", "the DNS server is outside the split tunnel"
+    config["interface"]["dns"] = []
+    config["peers"][0]["allowedips"] = ["::/0"]
+    assert handshake_target(config) == "2606:4700:4700::1111"
+    config["peers"] = []
+    assert handshake_target(config) is None
+
+
+@mock.patch("sirup.WireGuardConnector.time.sleep")
+@mock.patch("sirup.WireGuardConnector.subprocess.run")
+def test_wait_ready_backs_off(mock_run, mock_sleep, connector):
+    no_handshake = mock.Mock(returncode=0, stdout=b"cHVibGlja2V5\t0\n")
+    handshake = mock.Mock(returncode=0, stdout=b"cHVibGlja2V5\t1700000000\n")
+    mock_run.side_effect = [no_handshake] * 7 + [handshake]
+    with mock.patch.object(WireGuardConnector, "_trigger_handshake"):
+        connector.wait_ready("my_password", timeout=10)
+    assert [call[0][0] for call in mock_sleep.call_args_list] == [0.05, 0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+
+
+@mock.patch("sirup.WireGuardConnector.time.sleep")
+@mock.patch.object(WireGuardConnector, "is_alive", return_value=True)
+@mock.patch.object(WireGuardConnector, "_trigger_handshake")
+@mock.patch("sirup.WireGuardConnector.subprocess.run")
+def test_connect(mock_run, mock_trigger, mock_alive, mock_sleep, connector): #pylint: disable=unused-argument
+    no_handshake = mock.Mock(returncode=0, stdout=b"cHVibGlja2V5\t0\n")
+    handshake = mock.Mock(returncode=0, stdout=b"cHVibGlja2V5\t1700000000\n")
+    setconf_file = os.path.join(connector.work_dir, "wg.conf")
+    modes = []
+    handshakes = [no_handshake, handshake]
+
+    def run(cmd, **kwargs): #pylint: disable=unused-argument
+        if "wg setconf" in cmd[4]:
+            modes.append(stat.S_IMODE(os.stat(setconf_file).st_mode))
+            return mock.Mock(returncode=0)
+        return handshakes.pop(0)
+    mock_run.side_effect = run
+
+    connector.connect("my_password")
+
+    assert connector.is_connected()
+    assert set(connector.phase_times) == {"start", "vpn_started", "tunnel_up"}
+    setup_cmd = mock_run.call_args_list[0][0][0]
+    assert setup_cmd[:4] == ["sudo", "-S", "sh", "-c"]
+    assert mock_run.call_args_list[0][1]["input"] == b"my_password"
+    mock_sleep.assert_called_once()
+    assert modes == [0o600], "only the user can read the private key"
+    assert not os.path.exists(setconf_file), "the private key is removed once the interface is configured"
+
+    mock_run.reset_mock(side_effect=True)
+    connector.disconnect("my_password")
+    assert not connector.is_connected()
+    assert mock_run.call_args[0][0][4].startswith("ip link del dev sirupwg0")
+
+
+@mock.patch("sirup.WireGuardConnector.subprocess.run")
+def test_connect_setup_fails(mock_run, connector):
+    mock_run.return_value = mock.Mock(returncode=2, stderr=b"RTNETLINK answers: Operation not supported")
+    with pytest.raises(RuntimeError, match="Operation not supported"):
+        connector.connect("my_password")
+    assert mock_run.call_args[0][0][4].startswith("ip link del"), "partial setup is removed"
+    assert not os.path.exists(os.path.join(connector.work_dir, "wg.conf"))
+    assert not connector.is_connected()
+
+
+@mock.patch("sirup.WireGuardConnector.time.time")
+@mock.patch.object(WireGuardConnector, "_trigger_handshake")
+@mock.patch("sirup.WireGuardConnector.subprocess.run")
+def test_connect_timeout(mock_run, mock_trigger, mock_time, connector): #pylint: disable=unused-argument
+    mock_run.return_value = mock.Mock(returncode=0, stdout=b"")
+    mock_time.side_effect = [0, 0, 0, 11]
+    with pytest.raises(TimeoutError):
+        connector.connect("my_password", timeout=10)
+    assert mock_run.call_args[0][0][4].startswith("ip link del")
+
+
+def test_open_management(connector):
+    assert connector.open_management() is None
+
+
+def test_nameservers(connector, tmp_path):
+    assert connector.nameservers("my_password") == ["10.2.0.1"]
+    path = tmp_path / "search.conf"
+    path.write_text(CONFIG.replace("DNS = 10.2.0.1", "DNS = 10.2.0.1, fd00::1, corp.example"))
+    assert WireGuardConnector(str(path), track_ip=False).nameservers("my_password") == ["10.2.0.1", "fd00::1"]
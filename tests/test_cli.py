@@ -0,0 +1,141 @@
+from unittest import mock
+import pytest
+from sirup.cli import main
+from sirup.ConnectionHistory import ConnectionHistory
+from sirup.LeaseRegistry import SQLiteLeaseRegistry
+
+
+def test_stats(tmp_path, capsys):
+    history_file = str(tmp_path / "history.csv")
+    history = ConnectionHistory(history_file)
+    for i in range(4):
+        history.record("/configs/fast.ovpn", 100.0 * i, {"tunnel_up": 100.0 * i + 2, "end": 100.0 * i + 2}, "success")
+    history.record("/configs/slow.ovpn", 500.0, {"end": 530.0}, "timeout", exception="TimeoutError", backoff=10)
+
+    assert main(["stats", history_file]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split()[0] == "server"
+    assert lines[1].split()[:3] == ["fast.ovpn", "4", "0.0%"]
+    assert lines[2].split()[:5] == ["slow.ovpn", "1", "100.0%", "-", "-"]
+    assert lines[-1] == "2 servers, 5 attempts, 1 failed, 0.00 hours in backoff"
+
+    main(["stats", history_file, "--sort", "failure_rate", "--top", "1"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].startswith("slow.ovpn")
+    assert len(lines) == 4
+
+
+def test_requires_command():
+    with pytest.raises(SystemExit):
+        main([])
+
+
+@mock.patch("sirup.cli.check_password", return_value=True)
+@mock.patch("sirup.cli.getpass.getpass", return_value="my_password")
+@mock.patch("sirup.cli.HealthCheck")
+def test_probe(mock_health_check, mock_getpass, mock_check_password, tmp_path, capsys): #pylint: disable=unused-argument
+    for name in ["a.ovpn", "b.ovpn"]:
+        (tmp_path / name).touch()
+    health_check = mock_health_check.return_value.__enter__.return_value
+    health_check.run.return_value = {
+        str(tmp_path / "a.ovpn"): {"success": True, "error": None},
+        str(tmp_path / "b.ovpn"): {"success": False, "error": "TimeoutError: Could not connect to vpn"},
+    }
+    report = str(tmp_path / "report.json")
+    assert main(["probe", str(tmp_path), "--auth-file", "auth", "--report", report, "--parallel", "8"]) == 0
+    mock_health_check.assert_called_once_with("auth", "my_password", parallelism=8, timeout=30)
+    assert sorted(health_check.run.call_args[0][0]) == [str(tmp_path / "a.ovpn"), str(tmp_path / "b.ovpn")]
+    health_check.write_report.assert_called_once_with(report)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ["b.ovpn: TimeoutError: Could not connect to vpn", f"2 servers, 1 ok, 1 failed; report in {report}"]
+
+
+@mock.patch("sirup.cli.check_password", side_effect=RuntimeError("Wrong password"))
+@mock.patch("sirup.cli.getpass.getpass", return_value="wrong_password")
+@mock.patch("sirup.cli.HealthCheck")
+def test_probe_wrong_password(mock_health_check, mock_getpass, mock_check_password, tmp_path, capsys): #pylint: disable=unused-argument
+    assert main(["probe", str(tmp_path), "--auth-file", "auth"]) == 1
+    assert capsys.readouterr().out == "Wrong sudo password provided\n"
+    mock_health_check.assert_not_called()
+
+
+@mock.patch("sirup.cli.check_password", return_value=True)
+@mock.patch("sirup.cli.getpass.getpass", return_value="my_password")
+@mock.patch("sirup.cli.TunnelTuner")
+def test_tune(mock_tuner, mock_getpass, mock_check_password, tmp_path, capsys): #pylint: disable=unused-argument
+    for name in ["a.ovpn", "b.ovpn", "c.ovpn"]:
+        (tmp_path / name).touch()
+    tuner = mock_tuner.return_value.__enter__.return_value
+    tuner.tune.return_value = {"options": {"fast-io": [], "sndbuf": ["524288"]}, "throughput": 4.2e6, "latency": 0.03}
+    tuning_file = str(tmp_path / "tuning.json")
+    assert main(["tune", str(tmp_path), "--auth-file", "auth", "--url", "http://198.51.100.1/f",
+                 "--tuning-file", tuning_file, "--servers", "2"]) == 0
+    mock_tuner.assert_called_once_with("auth", "my_password", "http://198.51.100.1/f", rounds=1, timeout=30)
+    tuner.tune.assert_called_once_with([str(tmp_path / "a.ovpn"), str(tmp_path / "b.ovpn")])
+    tuner.save.assert_called_once_with(tuning_file, str(tmp_path))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ["best options: --fast-io --sndbuf 524288", f"4.20 MB/s; saved in {tuning_file}"]
+
+
+@mock.patch("sirup.cli.getpass.getpass")
+@mock.patch("sirup.cli.TunnelTuner")
+def test_tune_empty_directory(mock_tuner, mock_getpass, tmp_path, capsys):
+    assert main(["tune", str(tmp_path), "--auth-file", "auth", "--url", "http://198.51.100.1/f"]) == 1
+    assert capsys.readouterr().out == f"No configuration files in {tmp_path}\n"
+    mock_getpass.assert_not_called()
+    mock_tuner.assert_not_called()
+
+
+@mock.patch("sirup.cli.check_password", side_effect=RuntimeError("Wrong password"))
+@mock.patch("sirup.cli.getpass.getpass", return_value="wrong_password")
+@mock.patch("sirup.cli.TunnelTuner")
+def test_tune_wrong_password(mock_tuner, mock_getpass, mock_check_password, tmp_path, capsys): #pylint: disable=unused-argument
+    (tmp_path / "a.ovpn").touch()
+    assert main(["tune", str(tmp_path), "--auth-file", "auth", "--url", "http://198.51.100.1/f"]) == 1
+    assert capsys.readouterr().out == "Wrong sudo password provided\n"
+    mock_tuner.assert_not_called()
+
+
+def test_soak(capsys):
+    assert main(["soak", "--cycles", "200", "--sample-every", "50", "--servers", "3"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ["cycle", "fds", "children", "daemons", "temp_files", "rss"]
+    assert len(lines) == 1 + 5 + 1
+    assert lines[-1] == "200 cycles, 0 leaks"
+
+
+@mock.patch("sirup.cli.time.sleep", side_effect=[None, KeyboardInterrupt])
+@mock.patch("sirup.cli.check_password", return_value=True)
+@mock.patch("sirup.cli.getpass.getpass", return_value="my_password")
+@mock.patch("sirup.cli.ProxyServer")
+@mock.patch("sirup.cli.TunnelPool")
+def test_proxy(mock_pool, mock_proxy, mock_getpass, mock_check_password, mock_sleep, tmp_path, capsys): #pylint: disable=unused-argument,too-many-arguments
+    (tmp_path / "a.ovpn").touch()
+    pool = mock_pool.return_value.__enter__.return_value
+    pool.tunnels = {0: None, 1: None}
+    server = mock_proxy.return_value
+    server.port = 1080
+    assert main(["proxy", str(tmp_path), "--auth-file", "auth", "--policy", "sticky", "--rotate-every", "60",
+                 "--cpus", "2,4-5"]) == 0
+    mock_proxy.assert_called_once_with([], host="127.0.0.1", port=1080, policy="sticky")
+    assert mock_pool.call_args[1]["scheduling"].cpus == [2, 4, 5]
+    pool.start.assert_called_once_with(server)
+    pool.rotate.assert_called_once_with(server, 0)
+    server.stop_thread.assert_called_once()
+    assert capsys.readouterr().out.startswith("SOCKS5 and HTTP proxy on 127.0.0.1:1080 through 2 tunnels")
+
+
+@mock.patch("sirup.cli.check_password", side_effect=RuntimeError("Wrong password"))
+@mock.patch("sirup.cli.getpass.getpass", return_value="wrong_password")
+@mock.patch("sirup.cli.ProxyServer")
+def test_proxy_wrong_password(mock_proxy, mock_getpass, mock_check_password, tmp_path, capsys): #pylint: disable=unused-argument
+    assert main(["proxy", str(tmp_path), "--auth-file", "auth"]) == 1
+    assert capsys.readouterr().out == "Wrong sudo password provided\n"
+    mock_proxy.assert_not_called()
+
+
+def test_leases(tmp_path, capsys):
+    database = str(tmp_path / "leases.sqlite")
+    SQLiteLeaseRegistry(database, node="host:1").acquire("/configs/provider/ch-1.ovpn")
+    assert main(["leases", "--database", database, "--list"]) == 0
+    assert capsys.readouterr().out.split()[:2] == ["provider/ch-1.ovpn", "host:1"]
@@ -0,0 +1,78 @@
+import pytest
+from sirup import ovpn_config
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "nl-01.example.net.udp.ovpn"
+    path.write_text("\n".join([
+        "# comment",
+        "client",
+        "dev tun",
+        "proto udp4",
+        "port 1195",
+        "remote 185.1.2.3",
+        "remote nl-01.example.net 443 tcp-client",
+        "; remote commented.example.net 1194",
+        "<ca>",
+        "remote inside.ca.block 1",
+        "</ca>",
+        "auth-user-pass",
+    ]), encoding="utf-8")
+    return str(path)
+
+
+def test_read_config_lines(config_file):
+    directives = ovpn_config.read_config_lines(config_file)
+    assert directives[0] == ["client"]
+    assert ["remote", "inside.ca.block", "1"] not in directives, "inline block not skipped"
+    assert len(directives) == 7
+
+
+def test_read_remotes(config_file):
+    remotes = ovpn_config.read_remotes(config_file)
+    assert remotes == [("185.1.2.3", "1195", "udp"), ("nl-01.example.net", "443", "tcp")]
+
+
+def test_read_remotes_defaults(tmp_path):
+    path = tmp_path / "config.ovpn"
+    path.write_text("client\nremote 185.1.2.3\n", encoding="utf-8")
+    assert ovpn_config.read_remotes(str(path)) == [("185.1.2.3", "1194", "udp")]
+
+
+def test_variant_of(config_file, tmp_path):
+    assert ovpn_config.variant_of(config_file) == ("185.1.2.3,nl-01.example.net", ("udp", "1195"))
+    other = tmp_path / "nl-01.example.net.tcp.ovpn"
+    other.write_text("client\nremote nl-01.example.net 443 tcp\nremote 185.1.2.3 443 tcp\n", encoding="utf-8")
+    assert ovpn_config.variant_of(str(other)) == ("185.1.2.3,nl-01.example.net", ("tcp", "443"))
+    other.write_text("client\n", encoding="utf-8")
+    assert ovpn_config.variant_of(str(other)) is None
+
+
+def test_option_args():
+    options = {"tun-mtu": ["1400"], "fast-io": [], "data-ciphers": ["AES-128-GCM:AES-256-GCM"]}
+    assert ovpn_config.option_args(options) == ["--data-ciphers", "AES-128-GCM:AES-256-GCM", "--fast-io",
+                                                "--tun-mtu", "1400"]
+    assert not ovpn_config.option_args({})
+
+
+def test_pushed_nameservers():
+    log = ["2024-01-01 PUSH: Received control message: 'PUSH_REPLY,dhcp-option DNS 10.8.0.9,ping 10'",
+           "2024-01-02 PUSH: Received control message: 'PUSH_REPLY,redirect-gateway def1,dhcp-option DNS 10.8.0.1,"
+           "dhcp-option DOMAIN example.net,route-gateway 10.8.0.1,dhcp-option DNS6 fd00::1'",
+           "2024-01-02 Initialization Sequence Completed"]
+    assert ovpn_config.pushed_nameservers(log) == ["10.8.0.1", "fd00::1"], "the latest push counts"
+    assert ovpn_config.pushed_nameservers(log[2:]) == []
+
+
+def test_config_fingerprint(config_file, tmp_path):
+    text = (tmp_path / "nl-01.example.net.udp.ovpn").read_text(encoding="utf-8")
+    other = tmp_path / "de-02.ovpn"
+    other.write_text(text.replace("185.1.2.3", "185.9.9.9").replace("port 1195", "port 1194"), encoding="utf-8")
+    assert ovpn_config.config_fingerprint(str(other)) == ovpn_config.config_fingerprint(config_file)
+
+    other.write_text(text.replace("remote inside.ca.block 1", "another certificate"), encoding="utf-8")
+    assert ovpn_config.config_fingerprint(str(other)) != ovpn_config.config_fingerprint(config_file)
+    other.write_text(text.replace("remote 185.1.2.3", "remote 185.1.2.3 1194 tcp"), encoding="utf-8")
+    assert ovpn_config.config_fingerprint(str(other)) != ovpn_config.config_fingerprint(config_file), \
+        "the protocol cannot change in place"
@@ -0,0 +1,84 @@
+"""Tests for the sirup.route_check module.
+"""
+
+import sys
+from unittest import mock
+import pytest
+from sirup.route_check import check_tunnel
+from sirup.route_check import default_gateway
+from sirup.route_check import interface_state
+from sirup.route_check import read_routes
+from sirup.route_check import route_interface
+
+
+HEADER = "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT\n"
+MAIN_ROUTES = [
+    "eth0\t00000000\t0102A8C0\t0003\t0\t0\t100\t00000000\t0\t0\t0\n", # default via 192.168.2.1
+    "eth0\t0002A8C0\t00000000\t0001\t0\t0\t100\t00FFFFFF\t0\t0\t0\n", # 192.168.2.0/24
+]
+TUNNEL_ROUTES = [ # redirect-gateway def1
+    "tun0\t00000000\t0100080A\t0003\t0\t0\t0\t00000080\t0\t0\t0\n", # 0.0.0.0/1 via 10.8.0.1
+    "tun0\t00000080\t0100080A\t0003\t0\t0\t0\t00000080\t0\t0\t0\n", # 128.0.0.0/1 via 10.8.0.1
+    "tun1\t00000000\t0100090A\t0002\t0\t0\t0\t00000000\t0\t0\t0\n", # not up
+]
+
+
+@pytest.fixture
+def route_file(tmp_path):
+    path = tmp_path / "route"
+    path.write_text(HEADER + "".join(MAIN_ROUTES + TUNNEL_ROUTES))
+    return str(path)
+
+
+@pytest.fixture
+def route_file_without_tunnel(tmp_path):
+    path = tmp_path / "route_without_tunnel"
+    path.write_text(HEADER + "".join(MAIN_ROUTES))
+    return str(path)
+
+
+def test_read_routes(route_file):
+    routes = read_routes(route_file)
+    assert len(routes) == 4, "routes that are not up are skipped"
+    assert str(routes[0]["gateway"]) == "192.168.2.1"
+    assert str(routes[1]["network"]) == "192.168.2.0/24"
+    assert str(routes[3]["network"]) == "128.0.0.0/1"
+
+
+def test_route_interface(route_file, route_file_without_tunnel):
+    assert route_interface("1.1.1.1", route_file) == "tun0"
+    assert route_interface("203.0.113.5", route_file) == "tun0"
+    assert route_interface("192.168.2.20", route_file) == "eth0", "the local network stays on eth0"
+    assert route_interface("1.1.1.1", route_file_without_tunnel) == "eth0"
+
+
+def test_default_gateway(route_file, route_file_without_tunnel, tmp_path):
+    assert default_gateway(route_file) == "eth0 via 192.168.2.1", "redirect-gateway def1 leaves it alone"
+    assert default_gateway(route_file_without_tunnel) == "eth0 via 192.168.2.1"
+    path = tmp_path / "route_without_default"
+    path.write_text(HEADER + MAIN_ROUTES[1])
+    assert default_gateway(str(path)) is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /sys/class/net")
+def test_interface_state():
+    assert interface_state("lo") in ("unknown", "up")
+    assert interface_state("sirup-does-not-exist") is None
+
+
+@mock.patch("sirup.route_check.interface_state")
+@mock.patch("sirup.route_check.find_interface")
+def test_check_tunnel(mock_find, mock_state, route_file, route_file_without_tunnel):
+    mock_find.return_value = "tun0"
+    mock_state.return_value = "unknown"
+    assert check_tunnel(local_ip="10.8.0.6", route_file=route_file) is None
+    mock_find.assert_called_once_with("10.8.0.6")
+
+    reason = check_tunnel(local_ip="10.8.0.6", route_file=route_file_without_tunnel)
+    assert reason == "traffic to 1.1.1.1 goes through eth0, not tun0"
+
+    mock_state.return_value = "down"
+    assert check_tunnel(interface="tun0", route_file=route_file) == "interface tun0 is down"
+
+    mock_find.return_value = None
+    assert check_tunnel(local_ip="10.8.0.6", route_file=route_file) == "no interface has the address 10.8.0.6"
@@ -1,6 +1,7 @@
 
 import os
 import subprocess
+import sys
 import time
 import warnings
 from random import Random
@@ -166,12 +167,117 @@ def test_RotationList_shuffle(list_instance, rotation_list_instance):
     assert sum(x != y for x, y in zip(list_instance, rotation_list_instance)) > 0, "shuffle does not change order"
 
 
+def test_RotationList_pop_append_empty():
+    with pytest.raises(IndexError):
+        utils.RotationList().pop_append()
+
+
+def test_RotationList_insert_remove(rotation_list_instance):
+    rotation_list_instance.append(6, weight=2)
+    assert rotation_list_instance == [1, 2, 3, 4, 5, 6]
+    assert rotation_list_instance.weight(6) == 2
+    with pytest.raises(ValueError, match="already in the list"):
+        rotation_list_instance.append(6)
+    rotation_list_instance.remove(3)
+    assert 3 not in rotation_list_instance
+    rotation_list_instance.append(7) # reuses the slot of the removed item
+    assert rotation_list_instance == [1, 2, 4, 5, 6, 7]
+    assert len(rotation_list_instance) == 6
+    with pytest.raises(ValueError, match="duplicate"):
+        utils.RotationList([1, 1])
+
+
+def test_RotationList_disable_enable(rotation_list_instance):
+    rotation_list_instance.disable(1)
+    rotation_list_instance.disable(2)
+    assert rotation_list_instance.disabled == [1, 2]
+    assert rotation_list_instance.pop_append() == 3, "disabled item not skipped"
+    assert len(rotation_list_instance) == 3
+    rotation_list_instance.enable(1)
+    assert rotation_list_instance == [4, 5, 3, 1]
+    rotation_list_instance.remove(2)
+    assert rotation_list_instance.disabled == []
+    rotation_list_instance.move_to_front(1)
+    assert rotation_list_instance.pop_append() == 1
+    rotation_list_instance.disable(3)
+    with pytest.raises(ValueError, match="disabled"):
+        rotation_list_instance.move_to_front(3)
+    with pytest.raises(ValueError, match="not in the list"):
+        rotation_list_instance.move_to_front(2)
+
+
+def test_RotationList_getitem():
+    rotation_list = utils.RotationList(["a", "b", "c", "d"])
+    rotation_list.disable("b")
+    assert [rotation_list[i] for i in range(3)] == ["a", "c", "d"]
+    assert [rotation_list[i] for i in range(-1, -4, -1)] == ["d", "c", "a"]
+    assert rotation_list[1:] == ["c", "d"]
+    for index in [3, -4]:
+        with pytest.raises(IndexError):
+            _ = rotation_list[index]
+    with pytest.raises(IndexError):
+        _ = utils.RotationList()[0]
+
+
+def test_RotationList_sample():
+    rotation_list = utils.RotationList(["a", "b", "c", "d"], weights=[1, 0, 3, 6])
+    randomizer = Random(1)
+    counts = {"a": 0, "b": 0, "c": 0, "d": 0}
+    for _ in range(10000):
+        counts[rotation_list.sample(randomizer)] += 1
+    assert counts["b"] == 0, "item with zero weight sampled"
+    assert counts["a"] < counts["c"] < counts["d"]
+    assert rotation_list == ["a", "b", "c", "d"], "sampling changes the rotation order"
+
+    # Disabled items and changed weights
+    rotation_list.disable("d")
+    rotation_list.set_weight("b", 5)
+    samples = {rotation_list.sample(randomizer) for _ in range(1000)}
+    assert samples == {"a", "b", "c"}
+    assert rotation_list.weight("d") == 6, "disabling changes the weight"
+    rotation_list.set_weight("a", 0)
+    rotation_list.set_weight("b", 0)
+    rotation_list.set_weight("c", 0)
+    with pytest.raises(ValueError, match="zero weight"):
+        rotation_list.sample(randomizer)
+
+    # Deterministic with a seeded randomizer
+    rotation_list = utils.RotationList(range(100), weights=range(1, 101))
+    randomizer = Random(5)
+    first = [rotation_list.sample(randomizer) for _ in range(20)]
+    randomizer = Random(5)
+    second = [rotation_list.sample(randomizer) for _ in range(20)]
+    assert first == second, "not deterministic"
+
+
+def test_RotationList_sort(rotation_list_instance):
+    rotation_list_instance.sort(key=lambda x: -x)
+    assert rotation_list_instance == [5, 4, 3, 2, 1]
+    assert rotation_list_instance[0] == 5
+    assert rotation_list_instance[2] == 3
+
+
 def test_RotationList_repr(list_instance, rotation_list_instance):
     result = repr(rotation_list_instance)
     expected = f"RotationList({list_instance})"
     assert result == expected, "__repr__ returns incorrect string"
 
 
+def test_process_exists():
+    assert utils.process_exists(os.getpid())
+    assert utils.process_exists(str(os.getpid()))
+    assert not utils.process_exists("not-a-pid")
+    assert not utils.process_exists(0)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="sends signals")
+def test_process_exists_posix():
+    with mock.patch("os.kill", side_effect=PermissionError):
+        assert utils.process_exists(1), "processes of root exist"
+    with mock.patch("os.kill", side_effect=ProcessLookupError):
+        assert not utils.process_exists(os.getpid())
+
+
 @mock.patch("subprocess.run")
 @mock.patch("sirup.utils.get_vpn_pids") #patch the get_vpn_pids here
 def test_kill_all_connections(mock_get_vpn_pids, mock_run):
@@ -232,4 +338,21 @@ def test_check_password(mock_popen):
     process.communicate.return_value = (b"", b"All good!")
     process.returncode = 0
     assert utils.check_password("my_password"), "fails to recognize correct password"
-    process.communicate.assert_called_once_with(input="my_password\n".encode())
\ No newline at end of file
+    process.communicate.assert_called_once_with(input="my_password\n".encode())
+
+def test_sudo_read_file_tail(file_to_read):
+    assert utils.sudo_read_file(file_to_read, max_lines=1) == ["world"]
+
+
+@mock.patch("time.sleep")
+def test_check_connection_empty_log(mock_sleep, tmp_path): #pylint: disable=unused-argument
+    log_file = tmp_path / "empty.log"
+    log_file.touch()
+    assert not utils.check_connection(str(log_file), 0.01, None)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+def test_process_cpu_seconds():
+    assert 0 < utils.process_cpu_seconds(os.getpid()) <= time.process_time() + 0.1
+    with pytest.raises(OSError):
+        utils.process_cpu_seconds("not-a-pid")